@@ -0,0 +1,494 @@
+"""Parsing LLM responses into analysis data.
+
+Shared by the CLI, batch and serve modes and the response cache, which
+only stores responses that parse: JSON extraction, post-processing into
+high- and low-confidence data, and the CI verdict.
+"""
+
+import functools
+import json
+import re
+import sys
+from typing import List, Optional
+
+from .noise_filter import ResourcePatternIndex, reclassify_resource_noise
+from .timings import NULL_RECORDER, Recorder
+
+# Where a JSON object can start: a brace followed by a key or the closing brace.
+# Prose braces such as "{name}" are skipped without a decode attempt, each of
+# which costs time proportional to its offset when it fails.
+_JSON_OBJECT_START = re.compile(r'\{\s*["}]')
+
+# Top-level keys of an analysis response; an object found later in the text
+# without one is a fragment (e.g. one resource of a malformed response)
+_RESPONSE_KEYS = ("resources", "risk_assessment")
+
+
+@functools.lru_cache(maxsize=None)
+def _orjson_loads():
+    """Return ``orjson.loads`` if orjson is installed, else None."""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson.loads
+
+
+def _loads(text: str):
+    """Parse a whole JSON document, with orjson when it is installed.
+
+    orjson is stricter than the standard library (no NaN, 64-bit integers),
+    so a document it rejects is re-parsed with ``json.loads``.
+    """
+    loads = _orjson_loads()
+    if loads is not None:
+        try:
+            return loads(text)
+        except ValueError:
+            pass
+    return json.loads(text)
+
+
+def _code_fences(text: str) -> List[str]:
+    """Return the bodies of markdown code fences, ```json fences first."""
+    tagged, untagged = [], []
+    # Odd-numbered parts lie between an opening and a closing fence
+    for part in text.split("```")[1:-1:2]:
+        info, newline, body = part.partition("\n")
+        if newline:
+            (tagged if info.strip().lower() == "json" else untagged).append(body)
+    return tagged + untagged
+
+
+def extract_json(text: str) -> dict:
+    """Attempt to extract JSON from LLM response.
+
+    The response is parsed as-is first. Otherwise the object is searched
+    for in ```json (then untagged) code fences, then between the first
+    ``{`` and the last ``}``, and finally by decoding from each possible
+    object start with ``json.JSONDecoder.raw_decode``. A failed candidate
+    resumes the search where decoding failed. An object decoded after the
+    first ``{`` is only accepted if it has a response key (``resources`` or
+    ``risk_assessment``), so a fragment of a malformed response (such as one
+    resource of a response with single-quoted keys) is never returned as
+    the whole response.
+
+    Args:
+        text: Raw LLM response text
+
+    Returns:
+        Parsed JSON dict
+
+    Raises:
+        ValueError: If no valid JSON found
+    """
+    # Try parsing as-is first
+    try:
+        return _loads(text)
+    except ValueError:
+        pass
+
+    for fence in _code_fences(text):
+        try:
+            data = _loads(fence)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("Could not extract valid JSON from LLM response")
+
+    # Prose before and after a single object
+    try:
+        data = _loads(text[start : text.rfind("}") + 1])
+        if isinstance(data, dict):
+            return data
+    except ValueError:
+        pass
+
+    first = start
+    decoder = json.JSONDecoder()
+    candidate = _JSON_OBJECT_START.search(text, start)
+    while candidate:
+        start = candidate.start()
+        try:
+            data, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            candidate = _JSON_OBJECT_START.search(text, max(e.pos, start + 1))
+            continue
+        if start == first or any(key in data for key in _RESPONSE_KEYS):
+            return data
+        candidate = _JSON_OBJECT_START.search(text, end)
+
+    # Failed to extract JSON
+    raise ValueError("Could not extract valid JSON from LLM response")
+
+
+def filter_by_confidence(data: dict) -> tuple[dict, dict]:
+    """Filter resources by confidence level.
+
+    Splits resources into high-confidence (medium/high) and low-confidence (low) lists.
+    Low-confidence resources are likely Azure What-If noise and should be excluded
+    from risk analysis but displayed separately.
+
+    Args:
+        data: Parsed LLM response with resources and other fields
+
+    Returns:
+        Tuple of (high_confidence_data, low_confidence_data) dicts with same structure
+    """
+    resources = data.get("resources", [])
+
+    high_confidence_resources = []
+    low_confidence_resources = []
+
+    for resource in resources:
+        confidence = resource.get("confidence_level", "medium").lower()
+
+        if confidence in ("low", "noise"):
+            # Low confidence and noise-matched resources excluded from analysis
+            low_confidence_resources.append(resource)
+        else:
+            # medium and high confidence included in analysis
+            high_confidence_resources.append(resource)
+
+    # Build high-confidence data dict (includes CI fields if present)
+    high_confidence_data = {
+        "resources": high_confidence_resources,
+        "overall_summary": data.get("overall_summary", ""),
+    }
+
+    # Preserve CI mode fields in high-confidence data
+    if "risk_assessment" in data:
+        high_confidence_data["risk_assessment"] = data["risk_assessment"]
+    if "verdict" in data:
+        high_confidence_data["verdict"] = data["verdict"]
+
+    # Build low-confidence data dict (no CI fields - these are excluded from risk analysis)
+    low_confidence_data = {
+        "resources": low_confidence_resources,
+        "overall_summary": "",  # No separate summary for noise
+    }
+
+    return high_confidence_data, low_confidence_data
+
+
+def finalize_analysis(
+    data: dict,
+    pre_filtered_resources: list,
+    resource_index: ResourcePatternIndex,
+    enabled_buckets: Optional[list],
+    llm_skipped: bool,
+    recorder: Recorder = NULL_RECORDER,
+) -> tuple[dict, dict]:
+    """Turn a parsed response into high- and low-confidence data for rendering.
+
+    Fills in missing fields, demotes resource noise, adds the pre-filtered
+    blocks as noise and, in CI mode (``enabled_buckets`` set), re-derives the
+    risk assessment without the low-confidence resources.
+
+    Returns:
+        Tuple of (high_confidence_data, low_confidence_data)
+    """
+    if "resources" not in data:
+        sys.stderr.write("Warning: LLM response missing 'resources' field. Using empty list.\n")
+        data["resources"] = []
+
+    if "overall_summary" not in data:
+        sys.stderr.write("Warning: LLM response missing 'overall_summary' field.\n")
+        data["overall_summary"] = "No summary provided."
+
+    # Add backward compatibility defaults for confidence fields
+    for resource in data.get("resources", []):
+        if "confidence_level" not in resource:
+            resource["confidence_level"] = "medium"  # Default to include in analysis
+        if "confidence_reason" not in resource:
+            resource["confidence_reason"] = "No confidence assessment provided"
+
+    # Post-LLM resource noise reclassification: demote matching resources to low confidence
+    if resource_index:
+        num_reclassified = reclassify_resource_noise(data.get("resources", []), resource_index)
+        recorder.set("noise_reclassified", num_reclassified)
+        if num_reclassified > 0:
+            sys.stderr.write(
+                f"🔕 Reclassified {num_reclassified} resource(s) as low-confidence noise\n"
+            )
+
+    # Inject synthetic low-confidence entries for pre-LLM filtered resource blocks
+    # so they still appear in the "Potential Noise" section
+    if pre_filtered_resources:
+        action_map = {
+            "Create": "Create",
+            "Modify": "Modify",
+            "Delete": "Delete",
+            "Deploy": "Deploy",
+            "NoChange": "NoChange",
+            "Ignore": "Ignore",
+            "Unsupported": "Unsupported",
+        }
+        for removed in pre_filtered_resources:
+            data["resources"].append(
+                {
+                    "resource_name": removed["resource_name"],
+                    "resource_type": removed["resource_type"],
+                    "action": action_map.get(removed["operation"], removed["operation"]),
+                    "summary": "Removed by resource noise pattern",
+                    "confidence_level": "low",
+                    "confidence_reason": "Matched resource noise pattern (pre-LLM filtered)",
+                }
+            )
+
+    # Filter by confidence (always-on behavior)
+    high_confidence_data, low_confidence_data = filter_by_confidence(data)
+    recorder.set("low_confidence_resources", len(low_confidence_data.get("resources", [])))
+
+    # If noise filtering removed resources in CI mode, the LLM's
+    # risk_assessment still includes concerns about them. Re-derive it
+    # locally from the per-resource concern attribution in the response.
+    if enabled_buckets is not None and low_confidence_data.get("resources") and not llm_skipped:
+        num_filtered = len(low_confidence_data["resources"])
+        num_remaining = len(high_confidence_data.get("resources", []))
+
+        sys.stderr.write(
+            f"🔄 Recalculating risk assessment: {num_filtered} low-confidence resources "
+            f"filtered, {num_remaining} high-confidence resources remain\n"
+        )
+
+        # Special case: If ALL resources were filtered as noise, skip LLM recalculation
+        # and set all risk buckets to low with no concerns.
+        # Rationale: if the LLM classified every resource as noise, then drift
+        # detected on those same resources is also noise-driven and unreliable.
+        if num_remaining == 0:
+            sys.stderr.write(
+                "✅ All resources filtered as noise - setting all risk buckets to low\n"
+            )
+
+            # Build a clean risk assessment with no concerns for enabled buckets only
+            from .ci.buckets import active_buckets
+
+            high_confidence_data["risk_assessment"] = {}
+
+            for bucket_id in enabled_buckets:
+                bucket = active_buckets()[bucket_id]
+                high_confidence_data["risk_assessment"][bucket_id] = {
+                    "risk_level": "low",
+                    "concerns": [],
+                    "reasoning": (
+                        f"All detected changes were flagged as"
+                        f" low-confidence noise. No high-confidence"
+                        f" {bucket.display_name.lower()}"
+                        f" concerns to evaluate."
+                    ),
+                }
+
+            # Update verdict
+            high_confidence_data["verdict"] = {
+                "safe": True,
+                "highest_risk_bucket": "none",
+                "overall_risk_level": "low",
+                "reasoning": (
+                    "All detected changes were identified as Azure"
+                    " What-If noise and excluded from risk analysis."
+                    " No meaningful infrastructure changes detected."
+                ),
+            }
+        else:
+            from .ci.risk_buckets import rescore_risk_assessment
+
+            rescored, unattributed = rescore_risk_assessment(
+                high_confidence_data.get("risk_assessment", {}),
+                low_confidence_data["resources"],
+                high_confidence_data.get("resources", []),
+            )
+            if rescored:
+                sys.stderr.write(
+                    "✅ Risk assessment recalculated based on high-confidence resources only\n"
+                )
+            if unattributed:
+                sys.stderr.write(
+                    "⚠️  Warning: No per-resource concern attribution for "
+                    f"{', '.join(unattributed)}. "
+                    "Using original risk assessment (may be inaccurate).\n"
+                )
+
+    # Backfill missing buckets: the LLM may omit custom agents from
+    # risk_assessment even when the schema explicitly requests them.
+    # Add a default low-risk entry so they still appear in output.
+    if enabled_buckets:
+        ra = high_confidence_data.get("risk_assessment", {})
+        for bucket_id in enabled_buckets:
+            if bucket_id not in ra:
+                ra[bucket_id] = {
+                    "risk_level": "low",
+                    "concerns": [],
+                    "concern_summary": "None",
+                    "reasoning": "No assessment returned by LLM",
+                }
+        high_confidence_data["risk_assessment"] = ra
+
+    # Store enabled buckets in data for rendering (CI mode only)
+    if enabled_buckets:
+        high_confidence_data["_enabled_buckets"] = enabled_buckets
+
+    return high_confidence_data, low_confidence_data
+
+
+def apply_verdict(
+    high_confidence_data: dict,
+    enabled_buckets: list,
+    drift_threshold: str,
+    intent_threshold: str,
+    custom_thresholds: dict,
+) -> tuple[bool, list, list]:
+    """Evaluate the risk thresholds and replace the LLM's verdict with the result.
+
+    Returns:
+        Tuple of (is_safe, failed_buckets, review_buckets)
+    """
+    from .ci.risk_buckets import evaluate_risk_buckets
+    from .ci.verdict import VERDICT_REVIEW, VERDICT_SAFE, VERDICT_UNSAFE
+
+    is_safe, failed_buckets, review_buckets, risk_assessment = evaluate_risk_buckets(
+        high_confidence_data,
+        enabled_buckets,
+        drift_threshold,
+        intent_threshold,
+        custom_thresholds=custom_thresholds,
+    )
+
+    # Compute verdict_status: unsafe > review > safe
+    if failed_buckets:
+        verdict_status = VERDICT_UNSAFE
+    elif review_buckets:
+        verdict_status = VERDICT_REVIEW
+    else:
+        verdict_status = VERDICT_SAFE
+
+    # Override LLM verdict with threshold evaluation result
+    highest_bucket = failed_buckets[0] if failed_buckets else "none"
+    ra = high_confidence_data.get("risk_assessment", {})
+    highest_level = "low"
+    for bucket_id in enabled_buckets:
+        bucket_data = ra.get(bucket_id, {})
+        level = bucket_data.get("risk_level", "low")
+        level_idx = ["low", "medium", "high"].index(level)
+        if level_idx > ["low", "medium", "high"].index(highest_level):
+            highest_level = level
+    existing_verdict = high_confidence_data.get("verdict", {})
+    high_confidence_data["verdict"] = {
+        "safe": is_safe,
+        "verdict_status": verdict_status,
+        "highest_risk_bucket": highest_bucket,
+        "overall_risk_level": highest_level,
+        "reasoning": existing_verdict.get("reasoning", ""),
+    }
+    if review_buckets:
+        high_confidence_data["verdict"]["review_buckets"] = review_buckets
+
+    return is_safe, failed_buckets, review_buckets
+
+
+def parse_llm_response(response_text: str, bucket_id: Optional[str] = None) -> dict:
+    """Parse an LLM response as JSON, exiting with code 1 if it is not.
+
+    Args:
+        response_text: Raw LLM response text
+        bucket_id: Bucket the response was requested for (parallel mode)
+
+    Returns:
+        Parsed JSON dict
+    """
+    try:
+        return extract_json(response_text)
+    except ValueError:
+        # Truncate response to prevent exposing sensitive data
+        truncated = response_text[:500] + "..." if len(response_text) > 500 else response_text
+        source = f" for the '{bucket_id}' bucket" if bucket_id else ""
+        sys.stderr.write(
+            f"Error: LLM did not return valid JSON{source}.\n"
+            f"Raw response (first 500 chars):\n{truncated}\n"
+        )
+        sys.exit(1)
+
+
+# Summaries for resource rows built without the LLM
+_LOCAL_ACTION_SUMMARIES = {
+    "Deploy": "Will be redeployed; What-If predicts no property changes",
+    "NoChange": "No changes",
+    "Ignore": "Not in the template; ignored by this deployment",
+}
+
+
+def build_local_response(
+    kept_resources: list, num_filtered: int, enabled_buckets: Optional[list]
+) -> dict:
+    """Build the analysis result locally when no actionable changes remain.
+
+    Produces the same shape as a parsed LLM response: one high-confidence row
+    per surviving (Deploy/NoChange/Ignore) block and, in CI mode, a low-risk
+    entry for every enabled bucket. Pre-filtered noise rows are added later
+    by the caller, exactly as for LLM responses.
+
+    Args:
+        kept_resources: FilterResult.kept_resources (non-actionable blocks only)
+        num_filtered: Number of resource blocks removed as noise
+        enabled_buckets: Enabled bucket IDs in CI mode, None otherwise
+
+    Returns:
+        Response dict with resources, overall_summary and (CI mode)
+        risk_assessment and verdict
+    """
+    resources = []
+    for kept in kept_resources:
+        action = kept["operation"]
+        resources.append(
+            {
+                "resource_name": kept["resource_name"],
+                "resource_type": kept["resource_type"],
+                "action": action,
+                "summary": _LOCAL_ACTION_SUMMARIES.get(action, "No actionable change"),
+                "risk_level": "low",
+                "risk_reason": None,
+                "confidence_level": "high",
+                "confidence_reason": "Deterministic What-If operation with no changes to review",
+            }
+        )
+
+    parts = []
+    if num_filtered:
+        parts.append(f"{num_filtered} resource(s) filtered as What-If noise")
+    if resources:
+        parts.append(f"{len(resources)} resource(s) with no actionable change")
+    data = {
+        "resources": resources,
+        "overall_summary": f"No actionable changes: {', '.join(parts)}.",
+    }
+
+    if enabled_buckets is not None:
+        from .ci.buckets import active_buckets
+
+        data["risk_assessment"] = {}
+        for bucket_id in enabled_buckets:
+            bucket = active_buckets()[bucket_id]
+            data["risk_assessment"][bucket_id] = {
+                "risk_level": "low",
+                "concerns": [],
+                "concern_summary": "None",
+                "reasoning": (
+                    f"No actionable changes remained after noise filtering. No"
+                    f" {bucket.display_name.lower()} concerns to evaluate."
+                ),
+            }
+        data["verdict"] = {
+            "safe": True,
+            "highest_risk_bucket": "none",
+            "overall_risk_level": "low",
+            "reasoning": (
+                "All detected changes were identified as Azure What-If noise or"
+                " carry no actionable change. LLM analysis was skipped."
+            ),
+        }
+
+    return data
@@ -0,0 +1,655 @@
+"""Batch analysis of many What-If outputs (the ``batch`` command).
+
+Monorepos often deploy dozens of Bicep stacks from one pull request. Instead
+of one advisor process per stack, each loading the noise patterns, agents
+and provider client again, ``batch`` analyzes every stack's What-If file in
+one process, up to ``--jobs`` at a time, and reports one verdict:
+
+- stacks come from What-If files or glob patterns on the command line, or
+  from a YAML manifest with per-stack overrides (diff, Bicep directory,
+  thresholds);
+- noise patterns are compiled once and their match memos shared, custom
+  agents are registered once and a single provider (with its pooled client,
+  response cache and rate budget) serves every stack;
+- a failing stack is reported as an error without stopping the others, and
+  the exit code is that of the worst stack.
+
+Manifest format::
+
+    defaults:
+      drift_threshold: medium
+    stacks:
+      - name: networking
+        whatif: networking/whatif.json
+        bicep_dir: networking
+      - whatif: apps/*/whatif.txt
+        intent_threshold: medium
+        agent_threshold:
+          compliance: high
+
+Relative paths are resolved against the manifest's directory.
+"""
+
+import dataclasses
+import glob
+import io
+import os
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .ci.verdict import VERDICT_REVIEW, VERDICT_SAFE, VERDICT_UNSAFE
+from .input import InputError, WhatIfStream, load_bicep_files
+from .noise_filter import (
+    NoiseMatcher,
+    ResourcePatternIndex,
+    extract_resource_patterns,
+    filter_whatif_blocks,
+    filter_whatif_lines,
+)
+from .prompt import build_user_prompt
+from .providers import Provider
+from .whatif_json import detect_json_input, parse_whatif_json
+
+# Status of a stack whose analysis failed, and of one analyzed outside CI mode
+STATUS_ERROR = "error"
+STATUS_ANALYZED = "analyzed"
+
+# Worst first: the batch status is the first one any stack has
+_STATUS_ORDER = [STATUS_ERROR, VERDICT_UNSAFE, VERDICT_REVIEW, VERDICT_SAFE, STATUS_ANALYZED]
+
+_THRESHOLD_LEVELS = ("low", "medium", "high")
+
+# Manifest keys naming files or directories, resolved against the manifest
+_PATH_KEYS = ("whatif", "diff", "bicep_dir")
+
+
+@dataclass
+class Stack:
+    """One What-If file to analyze, with its per-stack options."""
+
+    name: str
+    whatif: str
+    diff: Optional[str] = None
+    diff_ref: str = "HEAD~1"
+    bicep_dir: Optional[str] = None
+    drift_threshold: str = "high"
+    intent_threshold: str = "high"
+    agent_thresholds: Dict[str, str] = field(default_factory=dict)
+    # Content sent by a ``serve`` client, used instead of reading the paths above
+    whatif_text: Optional[str] = None
+    diff_text: Optional[str] = None
+    bicep_text: Optional[str] = None
+
+
+@dataclass
+class StackResult:
+    """Outcome of analyzing one stack.
+
+    ``status`` is the verdict status (safe, review or unsafe) in CI mode,
+    ``analyzed`` outside it and ``error`` if the analysis failed.
+    ``exit_code`` is what a single run on this stack would have exited with.
+    """
+
+    stack: Stack
+    status: str
+    exit_code: int = 0
+    high_confidence: Optional[dict] = None
+    low_confidence: Optional[dict] = None
+    failed_buckets: List[str] = field(default_factory=list)
+    review_buckets: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def to_dict(self, include_noise: bool = True) -> dict:
+        """JSON-serializable form, as rendered in batch reports."""
+        result = {"name": self.stack.name, "whatif": self.stack.whatif, "status": self.status}
+        if self.error is not None:
+            result["error"] = self.error
+            return result
+        result["failed_buckets"] = self.failed_buckets
+        result["review_buckets"] = self.review_buckets
+        result["high_confidence"] = self.high_confidence
+        if include_noise and self.low_confidence:
+            result["low_confidence"] = self.low_confidence
+        return result
+
+
+def expand_sources(sources, defaults: Stack) -> List[Stack]:
+    """Build stacks from What-If file paths and glob patterns.
+
+    Args:
+        sources: Paths or glob patterns (``**`` matches directories recursively)
+        defaults: Stack whose options (other than name and file) every stack gets
+
+    Returns:
+        One stack per file, named after its path
+
+    Raises:
+        InputError: If a glob pattern matches no files
+    """
+    stacks = []
+    for source in sources:
+        for path in _expand(source):
+            stacks.append(dataclasses.replace(defaults, name=path, whatif=path))
+    return stacks
+
+
+def load_manifest(path: str, defaults: Stack) -> List[Stack]:
+    """Load stacks from a YAML manifest (see the module docstring).
+
+    Options are taken from the stack entry, then the manifest's ``defaults``,
+    then ``defaults`` (the command-line options).
+
+    Raises:
+        InputError: If the manifest cannot be read or is malformed
+    """
+    import yaml
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = yaml.safe_load(f)
+    except OSError as e:
+        raise InputError(f"Could not read manifest {path}: {e}")
+    except yaml.YAMLError as e:
+        raise InputError(f"Invalid YAML in manifest {path}: {e}")
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("stacks"), list):
+        raise InputError(f"Manifest {path} must be a mapping with a 'stacks' list")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    manifest_defaults = _stack_options(
+        manifest.get("defaults") or {}, base_dir, "defaults", defaults
+    )
+    manifest_defaults.pop("name", None)
+    manifest_defaults.pop("whatif", None)
+    defaults = dataclasses.replace(defaults, **manifest_defaults)
+
+    stacks = []
+    for index, entry in enumerate(manifest["stacks"], 1):
+        where = f"stack {index}"
+        options = _stack_options(entry, base_dir, where, defaults)
+        whatif = options.pop("whatif", None)
+        if not whatif:
+            raise InputError(f"Manifest {path}: {where} has no 'whatif' file")
+        name = options.pop("name", None)
+        paths = _expand(whatif)
+        for file_path in paths:
+            # A named entry matching several files names each after its path too
+            stack_name = os.path.relpath(file_path, base_dir)
+            if name:
+                stack_name = name if len(paths) == 1 else f"{name}:{stack_name}"
+            stacks.append(
+                dataclasses.replace(defaults, name=stack_name, whatif=file_path, **options)
+            )
+    return stacks
+
+
+def _stack_options(entry, base_dir: str, where: str, defaults: Stack) -> dict:
+    """Validate a manifest entry and convert it to Stack keyword arguments.
+
+    Agent thresholds are merged into those of ``defaults``.
+    """
+    if not isinstance(entry, dict):
+        raise InputError(f"Manifest {where} must be a mapping")
+    known = {f.name for f in dataclasses.fields(Stack)} - {"agent_thresholds"}
+    known.add("agent_threshold")
+    unknown = set(entry) - known
+    if unknown:
+        raise InputError(f"Manifest {where} has unknown keys: {', '.join(sorted(unknown))}")
+
+    options = {}
+    for key, value in entry.items():
+        if value is None:
+            continue
+        if key == "agent_threshold":
+            options["agent_thresholds"] = {
+                **defaults.agent_thresholds,
+                **_agent_thresholds(value, where),
+            }
+            continue
+        value = str(value)
+        if key in _PATH_KEYS:
+            value = os.path.join(base_dir, os.path.expanduser(value))
+        elif key.endswith("_threshold"):
+            value = value.lower()
+            if value not in _THRESHOLD_LEVELS:
+                raise InputError(
+                    f"Manifest {where}: {key} must be low, medium, or high (got '{value}')"
+                )
+        options[key] = value
+    return options
+
+
+def _agent_thresholds(value, where: str) -> Dict[str, str]:
+    """Accept ``{agent_id: level}`` or a list of ``agent_id=level`` strings."""
+    if isinstance(value, list):
+        pairs = []
+        for item in value:
+            if not isinstance(item, str) or "=" not in item:
+                raise InputError(
+                    f"Manifest {where}: agent_threshold entries must be agent_id=level"
+                )
+            pairs.append(item.split("=", 1))
+    elif isinstance(value, dict):
+        pairs = list(value.items())
+    else:
+        raise InputError(f"Manifest {where}: agent_threshold must be a mapping or a list")
+
+    thresholds = {}
+    for agent_id, level in pairs:
+        level = str(level).strip().lower()
+        if level not in _THRESHOLD_LEVELS:
+            raise InputError(
+                f"Manifest {where}: threshold for agent '{agent_id}' must be low, medium,"
+                f" or high (got '{level}')"
+            )
+        thresholds[str(agent_id).strip()] = level
+    return thresholds
+
+
+def _expand(source: str) -> List[str]:
+    """Expand a glob pattern to sorted file paths; plain paths are returned as-is."""
+    if not any(char in source for char in "*?["):
+        return [source]
+    paths = sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+    if not paths:
+        raise InputError(f"No What-If files match '{source}'")
+    return paths
+
+
+def compile_patterns(noise_patterns: list, fuzzy_threshold: float):
+    """Compile noise patterns for the resource-block and property-line filters.
+
+    Returns:
+        Tuple of (ResourcePatternIndex, NoiseMatcher or None if there are no
+        property patterns)
+    """
+    resource_patterns, _ = extract_resource_patterns(noise_patterns)
+    property_patterns = [p for p in noise_patterns if p.pattern_type != "resource"]
+    matcher = NoiseMatcher(property_patterns, fuzzy_threshold) if property_patterns else None
+    return ResourcePatternIndex(resource_patterns), matcher
+
+
+def create_analyzer(
+    provider_factory: Callable[[], Provider],
+    noise_patterns: list,
+    provider: str,
+    model: Optional[str] = None,
+    verbose: bool = False,
+    enabled_buckets: Optional[List[str]] = None,
+    pr_title: Optional[str] = None,
+    pr_description: Optional[str] = None,
+    parallel: bool = False,
+    structured_output: bool = True,
+    noise_threshold: int = 80,
+    **options,
+) -> "BatchAnalyzer":
+    """Build the prompts, schema and token budget shared by stacks, and an analyzer.
+
+    The system prompt and PR framing are the same for every stack, so the
+    budget left for each stack's What-If output, diff and Bicep source is too.
+
+    Args:
+        provider_factory: Creates the provider on first use
+        noise_patterns: Parsed noise patterns (resource and property)
+        provider: Provider name, for the model's context window
+        model: Model override, for the model's context window
+        verbose: Include property-level changes (standard mode only)
+        enabled_buckets: Risk bucket IDs in CI mode, None otherwise
+        pr_title: Pull request title for intent analysis
+        pr_description: Pull request description for intent analysis
+        parallel: One request per bucket (CI mode)
+        structured_output: Constrain responses to the prompts' JSON Schemas
+        noise_threshold: Fuzzy pattern similarity threshold percentage
+        **options: Other :class:`BatchAnalyzer` keyword arguments
+
+    Raises:
+        InputError: If the fixed prompt leaves no room for the What-If output
+    """
+    from .prompt import build_response_schema, build_system_prompt
+    from .providers import MAX_OUTPUT_TOKENS, resolve_model
+    from .tokens import get_token_counter, model_profile, prompt_budget
+
+    ci = enabled_buckets is not None
+    if ci and parallel:
+        from .ci.parallel import parallel_system_prompts
+
+        system_prompts = [
+            text for _, text in parallel_system_prompts(enabled_buckets, pr_title, pr_description)
+        ]
+    else:
+        parallel = False
+        system_prompts = [
+            build_system_prompt(
+                verbose=verbose,
+                ci_mode=ci,
+                pr_title=pr_title,
+                pr_description=pr_description,
+                enabled_buckets=enabled_buckets,
+            )
+        ]
+    count_tokens = get_token_counter()
+    profile = model_profile(*resolve_model(provider, model))
+    framing = build_user_prompt(
+        whatif_content="",
+        diff_content="" if ci else None,
+        pr_title=pr_title,
+        pr_description=pr_description,
+    )
+    prompt_tokens = prompt_budget(
+        profile,
+        MAX_OUTPUT_TOKENS,
+        max(count_tokens(text) for text in system_prompts) + count_tokens(framing),
+    )
+    if prompt_tokens <= 0:
+        raise InputError(
+            f"The system prompt and PR details leave no room for the What-If output"
+            f" in the {profile.context_window:,}-token context window"
+        )
+
+    response_schema = None
+    if structured_output:
+        response_schema = build_response_schema(
+            verbose=verbose,
+            ci_mode=ci,
+            pr_title=pr_title,
+            pr_description=pr_description,
+            enabled_buckets=enabled_buckets,
+        )
+
+    return BatchAnalyzer(
+        provider_factory,
+        noise_patterns,
+        noise_threshold / 100.0,
+        system_prompts,
+        prompt_tokens,
+        count_tokens,
+        enabled_buckets=enabled_buckets,
+        response_schema=response_schema,
+        parallel=parallel,
+        pr_title=pr_title,
+        pr_description=pr_description,
+        **options,
+    )
+
+
+class BatchAnalyzer:
+    """Analyzes stacks concurrently, sharing patterns, prompts and one provider.
+
+    Everything that does not depend on the stack is prepared once: the
+    compiled noise patterns, the system prompt(s) and response schema, the
+    prompt token budget and (on first use, so a batch with nothing to analyze
+    needs no credentials) the provider.
+    """
+
+    def __init__(
+        self,
+        provider_factory: Callable[[], Provider],
+        noise_patterns: list,
+        fuzzy_threshold: float,
+        system_prompts: List[str],
+        prompt_tokens: int,
+        count_tokens: Callable[[str], int],
+        enabled_buckets: Optional[List[str]] = None,
+        response_schema: Optional[dict] = None,
+        parallel: bool = False,
+        max_concurrency: int = 4,
+        pr_title: Optional[str] = None,
+        pr_description: Optional[str] = None,
+        input_format: str = "auto",
+        no_block: bool = False,
+        resource_index: Optional[ResourcePatternIndex] = None,
+        matcher: Optional[NoiseMatcher] = None,
+    ):
+        """Initialize the analyzer.
+
+        Args:
+            provider_factory: Creates the provider on first use
+            noise_patterns: Parsed noise patterns (resource and property)
+            fuzzy_threshold: Similarity threshold for fuzzy patterns (0.0-1.0)
+            system_prompts: System prompt, or (parallel mode) the resources
+                prompt followed by one per bucket
+            prompt_tokens: Token budget for What-If output, diff and Bicep source
+            count_tokens: Token counter used for budgeting
+            enabled_buckets: Risk bucket IDs in CI mode, None otherwise
+            response_schema: JSON Schema for single-request responses
+            parallel: One request per bucket (CI mode)
+            max_concurrency: Maximum concurrent requests per stack in parallel mode
+            pr_title: Pull request title for intent analysis
+            pr_description: Pull request description for intent analysis
+            input_format: "auto", "text" or "json"
+            no_block: Report unsafe stacks without failing the exit code
+            resource_index: ``noise_patterns`` already compiled (with
+                ``matcher``) by :func:`compile_patterns`, to share them
+            matcher: Compiled property patterns, or None if there are none
+        """
+        self.noise_patterns = noise_patterns
+        self.fuzzy_threshold = fuzzy_threshold
+        if resource_index is None:
+            resource_index, matcher = compile_patterns(noise_patterns, fuzzy_threshold)
+        self.resource_index = resource_index
+        self.matcher = matcher
+        self.system_prompts = system_prompts
+        self.prompt_tokens = prompt_tokens
+        self.count_tokens = count_tokens
+        self.enabled_buckets = enabled_buckets
+        self.response_schema = response_schema
+        self.parallel = parallel
+        self.max_concurrency = max_concurrency
+        self.pr_title = pr_title
+        self.pr_description = pr_description
+        self.input_format = input_format.lower()
+        self.no_block = no_block
+
+        self.llm_provider: Optional[Provider] = None
+        self._provider_factory = provider_factory
+        self._provider_lock = threading.Lock()
+        self._diffs: Dict[tuple, str] = {}
+        self._diff_lock = threading.Lock()
+
+    def run(self, stacks: List[Stack], jobs: int) -> List[StackResult]:
+        """Analyze ``stacks`` with up to ``jobs`` at a time; results are in input order."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        max_workers = max(1, min(jobs, len(stacks)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.analyze, stacks))
+
+    def analyze(self, stack: Stack) -> StackResult:
+        """Analyze one stack, capturing any failure in the result."""
+        try:
+            result = self._analyze(stack)
+        except InputError as e:
+            result = StackResult(stack, STATUS_ERROR, exit_code=2, error=str(e))
+        except SystemExit as e:
+            # Helpers shared with the single-stack command report the error
+            # themselves and exit; keep the other stacks running
+            code = e.code if isinstance(e.code, int) else 1
+            result = StackResult(
+                stack, STATUS_ERROR, exit_code=code or 1, error="Analysis failed (see log)"
+            )
+        except Exception as e:
+            result = StackResult(stack, STATUS_ERROR, exit_code=1, error=str(e))
+
+        icon = {
+            VERDICT_SAFE: "✅",
+            VERDICT_REVIEW: "👀",
+            VERDICT_UNSAFE: "❌",
+            STATUS_ERROR: "💥",
+        }.get(result.status, "📋")
+        detail = f": {result.error}" if result.error else ""
+        sys.stderr.write(f"{icon} [{stack.name}] {result.status}{detail}\n")
+        return result
+
+    def provider(self) -> Provider:
+        """The shared provider, created on first use."""
+        with self._provider_lock:
+            if self.llm_provider is None:
+                self.llm_provider = self._provider_factory()
+            return self.llm_provider
+
+    def _analyze(self, stack: Stack) -> StackResult:
+        from .analysis import (
+            apply_verdict,
+            build_local_response,
+            finalize_analysis,
+            parse_llm_response,
+        )
+        from .tokens import fit_section
+
+        filter_result = self._read_and_filter(stack)
+        ci = self.enabled_buckets is not None
+
+        diff_content = None
+        bicep_content = None
+        if ci:
+            remaining = self.prompt_tokens - filter_result.tokens
+            diff_content, _ = fit_section(
+                self._diff(stack), remaining, "\ndiff --git ", self.count_tokens
+            )
+            bicep_content = stack.bicep_text
+            if bicep_content is None and stack.bicep_dir:
+                bicep_content = load_bicep_files(stack.bicep_dir)
+            bicep_content, _ = fit_section(
+                bicep_content,
+                remaining - self.count_tokens(diff_content or ""),
+                "\n\n// File: ",
+                self.count_tokens,
+            )
+
+        pre_filtered = filter_result.removed_resources
+        llm_skipped = not filter_result.needs_analysis
+        if llm_skipped:
+            data = build_local_response(
+                filter_result.kept_resources, len(pre_filtered), self.enabled_buckets
+            )
+        else:
+            user_prompt = build_user_prompt(
+                whatif_content=filter_result.text,
+                diff_content=diff_content,
+                bicep_content=bicep_content,
+                pr_title=self.pr_title,
+                pr_description=self.pr_description,
+            )
+            if ci and self.parallel:
+                from .ci.parallel import merge_parallel_responses, run_parallel_analysis
+
+                resources_text, bucket_texts = run_parallel_analysis(
+                    self.provider(),
+                    user_prompt,
+                    self.enabled_buckets,
+                    pr_title=self.pr_title,
+                    pr_description=self.pr_description,
+                    max_concurrency=self.max_concurrency,
+                    structured_output=self.response_schema is not None,
+                )
+                data = merge_parallel_responses(
+                    parse_llm_response(resources_text),
+                    {
+                        bucket_id: parse_llm_response(text, bucket_id)
+                        for bucket_id, text in bucket_texts.items()
+                    },
+                )
+            else:
+                response_text = self.provider().complete(
+                    self.system_prompts[0], user_prompt, self.response_schema
+                )
+                data = parse_llm_response(response_text)
+
+        high, low = finalize_analysis(
+            data, pre_filtered, self.resource_index, self.enabled_buckets, llm_skipped
+        )
+        if not ci:
+            return StackResult(stack, STATUS_ANALYZED, high_confidence=high, low_confidence=low)
+
+        is_safe, failed, review = apply_verdict(
+            high,
+            self.enabled_buckets,
+            stack.drift_threshold,
+            stack.intent_threshold,
+            stack.agent_thresholds,
+        )
+        return StackResult(
+            stack,
+            high["verdict"]["verdict_status"],
+            exit_code=0 if is_safe or self.no_block else 1,
+            high_confidence=high,
+            low_confidence=low,
+            failed_buckets=failed,
+            review_buckets=review,
+        )
+
+    def _read_and_filter(self, stack: Stack):
+        """Read the stack's What-If file and noise-filter it within the token budget."""
+        if stack.whatif_text is not None:
+            f = io.StringIO(stack.whatif_text)
+        else:
+            try:
+                f = open(stack.whatif, "r", encoding="utf-8")
+            except OSError as e:
+                raise InputError(f"Could not read What-If file {stack.whatif}: {e}")
+        with f:
+            whatif_stream = WhatIfStream(f)
+            whatif_lines, is_json = detect_json_input(whatif_stream)
+            if self.input_format != "auto":
+                is_json = self.input_format == "json"
+            options = dict(
+                matcher=self.matcher,
+                resource_index=self.resource_index,
+                max_tokens=self.prompt_tokens,
+                count_tokens=self.count_tokens,
+            )
+            if is_json:
+                source = parse_whatif_json("".join(whatif_lines))
+                result = filter_whatif_blocks(
+                    source, self.noise_patterns, self.fuzzy_threshold, **options
+                )
+            else:
+                result = filter_whatif_lines(
+                    whatif_lines, self.noise_patterns, self.fuzzy_threshold, **options
+                )
+            whatif_stream.validate()
+
+        if result.truncated:
+            sys.stderr.write(
+                f"Warning: [{stack.name}] What-If output truncated to fit the context window"
+                f" ({result.blocks_truncated} resource block(s) omitted)\n"
+            )
+        return result
+
+    def _diff(self, stack: Stack) -> str:
+        """The stack's diff; stacks with the same diff file or ref share one read."""
+        from .ci.diff import get_diff
+
+        if stack.diff_text is not None:
+            return stack.diff_text
+        key = (stack.diff, stack.diff_ref)
+        with self._diff_lock:
+            if key not in self._diffs:
+                self._diffs[key] = get_diff(stack.diff, stack.diff_ref)
+            return self._diffs[key]
+
+
+def batch_status(results: List[StackResult]) -> str:
+    """The worst status of any stack (error > unsafe > review > safe)."""
+    statuses = {result.status for result in results}
+    for status in _STATUS_ORDER:
+        if status in statuses:
+            return status
+    return STATUS_ANALYZED
+
+
+def build_report(results: List[StackResult], include_noise: bool = True) -> dict:
+    """Aggregate stack results into the batch report rendered by the CLI."""
+    counts = {status: 0 for status in _STATUS_ORDER}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return {
+        "verdict": {
+            "status": batch_status(results),
+            "stacks": len(results),
+            **{status: count for status, count in counts.items() if count},
+        },
+        "stacks": [result.to_dict(include_noise) for result in results],
+    }
@@ -0,0 +1,316 @@
+"""Content-addressed on-disk cache of LLM responses.
+
+Pipelines often re-run on the same commit (retries, re-queued jobs, matrix
+reruns) and send byte-identical prompts each time. :class:`CachingProvider`
+wraps any provider and answers repeated requests from a local SQLite store
+instead, so a rerun returns in milliseconds and still goes through the normal
+``extract_json`` → ``filter_by_confidence`` → render path.
+
+Entries are keyed by provider, model, :data:`CACHE_SCHEMA_VERSION` and SHA-256
+hashes of both prompts. They expire after a TTL, and the store is trimmed to a
+size bound by evicting the least recently used entries. Cache failures (an
+unwritable directory, a locked or corrupt database) only disable the cache;
+they never fail the analysis.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from .analysis import extract_json
+from .hedging import HedgedProvider
+from .providers import Provider
+
+CACHE_DIR_ENV_VAR = "WHATIF_CACHE_DIR"
+
+# Bump when the response format or its post-processing changes in a way
+# that makes previously cached responses unusable
+CACHE_SCHEMA_VERSION = 1
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+_DB_NAME = "responses.sqlite3"
+
+
+def default_cache_dir() -> Path:
+    """Return the cache directory from WHATIF_CACHE_DIR, or the user cache dir."""
+    configured = os.environ.get(CACHE_DIR_ENV_VAR)
+    if configured:
+        return Path(configured)
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "bicep-whatif-advisor"
+
+
+class SQLiteStore:
+    """SQLite database in the cache directory with a TTL and a size bound.
+
+    Subclasses name the database file, the table created on first use and
+    the store itself (for warnings), and use :meth:`connect` per operation.
+    """
+
+    description = "cache"
+    db_name = ""
+    schema = ""
+
+    def __init__(
+        self,
+        cache_dir=None,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        """Initialize the store.
+
+        Args:
+            cache_dir: Directory for the database (default: :func:`default_cache_dir`)
+            ttl_seconds: Age after which an entry is no longer returned
+            max_bytes: Total entry size above which LRU entries are evicted
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.disabled = False
+
+    @property
+    def path(self) -> Path:
+        return self.cache_dir / self.db_name
+
+    def connect(self) -> "_Connection":
+        """Return a context manager yielding a committed connection, or None if the store failed."""
+        return _Connection(self)
+
+
+class ResponseCache(SQLiteStore):
+    """SQLite store of response texts with TTL expiry and LRU size bound."""
+
+    description = "LLM response cache"
+    db_name = _DB_NAME
+    schema = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+        " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+    )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for ``key``, or None on a miss or expiry."""
+        now = time.time()
+        with self.connect() as conn:
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        """Store a response, then drop expired entries and enforce the size bound."""
+        now = time.time()
+        with self.connect() as conn:
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._evict(conn)
+
+    def _evict(self, conn) -> None:
+        """Delete least recently used entries until the total size fits."""
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+        ).fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class _Connection:
+    """Context manager yielding a committed connection, or None if the store failed.
+
+    A connection is opened per operation so the store is safe to use from
+    executor threads and from concurrent processes sharing the directory.
+    """
+
+    def __init__(self, store: SQLiteStore):
+        self.store = store
+        self.conn = None
+
+    def __enter__(self):
+        import sqlite3
+
+        if self.store.disabled:
+            return None
+        try:
+            self.store.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(str(self.store.path), timeout=5)
+            self.conn.execute(self.store.schema)
+        except (OSError, sqlite3.Error) as e:
+            self._disable(e)
+            return None
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        import sqlite3
+
+        if self.conn is None:
+            return False
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            self.conn.close()
+        except sqlite3.Error as e:
+            self._disable(e)
+        if isinstance(exc, sqlite3.Error):
+            self._disable(exc)
+            return True
+        return False
+
+    def _disable(self, error: Exception) -> None:
+        self.store.disabled = True
+        sys.stderr.write(f"Warning: {self.store.description} disabled ({error}).\n")
+
+
+class CachingProvider(Provider):
+    """Provider wrapper that serves repeated requests from a :class:`ResponseCache`.
+
+    Only responses that contain valid JSON are stored, so a malformed
+    response is retried on the next run instead of being replayed.
+    """
+
+    def __init__(self, provider: Provider, cache: ResponseCache):
+        self.provider = provider
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def usage(self):
+        """Token usage of the wrapped provider (cache hits add none)."""
+        return self.provider.usage
+
+    def cache_key(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Hash the provider identity, schema version, both prompts and the response schema."""
+        return request_key(self.provider, system_prompt, user_prompt, response_schema)
+
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        key = self.cache_key(system_prompt, user_prompt, response_schema)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        response = self.provider.complete(system_prompt, user_prompt, response_schema)
+        self._store(key, response)
+        return response
+
+    async def acomplete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        key = self.cache_key(system_prompt, user_prompt, response_schema)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        response = await self.provider.acomplete(system_prompt, user_prompt, response_schema)
+        self._store(key, response)
+        return response
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        key = self.cache_key(system_prompt, user_prompt, response_schema)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        stream = self.provider.stream(
+            system_prompt, user_prompt, idle_timeout=idle_timeout, response_schema=response_schema
+        )
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, "".join(chunks))
+
+    def _lookup(self, key: str) -> Optional[str]:
+        cached = self.cache.get(key)
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached
+
+    def _store(self, key: str, response: str) -> None:
+        try:
+            extract_json(response)
+        except ValueError:
+            return
+        self.cache.put(key, response)
+
+
+def request_key(
+    provider: Provider,
+    system_prompt: str,
+    user_prompt: str,
+    response_schema: Optional[dict] = None,
+) -> str:
+    """Identify a request by provider, model, schema version and prompt hashes.
+
+    Wrapper providers (anything with a ``provider`` attribute) are looked
+    through, so wrapping doesn't change the key. A hedged provider is
+    identified by both its providers, since either may answer; its
+    responses are never served to runs of the primary alone. A response
+    schema, when given, is part of the request and so of the key.
+    """
+    parts = [
+        *_provider_identity(provider),
+        str(CACHE_SCHEMA_VERSION),
+        _sha256(system_prompt),
+        _sha256(user_prompt),
+    ]
+    if response_schema is not None:
+        parts.append(_sha256(json.dumps(response_schema, sort_keys=True)))
+    return _sha256("\0".join(parts))
+
+
+def _provider_identity(provider: Provider) -> List[str]:
+    while isinstance(getattr(provider, "provider", None), Provider):
+        provider = provider.provider
+    if isinstance(provider, HedgedProvider):
+        return [
+            "hedged",
+            *_provider_identity(provider.primary),
+            *_provider_identity(provider.secondary),
+        ]
+    return [
+        type(provider).__name__,
+        # Model (Anthropic, Ollama) or deployment (Azure OpenAI), plus the endpoint
+        str(getattr(provider, "model", None) or getattr(provider, "deployment", "")),
+        str(getattr(provider, "endpoint", None) or getattr(provider, "host", "")),
+    ]
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -245,18 +245,12 @@ def load_agents_from_directory(
     return agents, errors
 
 
-def register_agents(agents: List[RiskBucket]) -> List[str]:
-    """Register custom agents in the global RISK_BUCKETS registry.
-
-    Validates that agent IDs don't collide with built-in buckets
-    or with each other.
+def validate_agents(agents: List[RiskBucket]) -> None:
+    """Check that agent IDs don't collide with built-in buckets or with each other.
 
     Args:
         agents: List of RiskBucket instances from load_agents_from_directory
 
-    Returns:
-        List of registered agent IDs
-
     Raises:
         ValueError: If any agent ID collides with a built-in bucket
                     or if duplicate IDs exist among custom agents
@@ -273,6 +267,24 @@ def register_agents(agents: List[RiskBucket]) -> List[str]:
             raise ValueError(f"Duplicate custom agent id: '{agent.id}'")
         seen_ids.add(agent.id)
 
+
+def register_agents(agents: List[RiskBucket]) -> List[str]:
+    """Register custom agents in the global RISK_BUCKETS registry.
+
+    Validates them first with :func:`validate_agents`.
+
+    Args:
+        agents: List of RiskBucket instances from load_agents_from_directory
+
+    Returns:
+        List of registered agent IDs
+
+    Raises:
+        ValueError: If any agent ID collides with a built-in bucket
+                    or if duplicate IDs exist among custom agents
+    """
+    validate_agents(agents)
+
     # Register in global registry
     registered = []
     for agent in agents:
@@ -1,7 +1,9 @@
 """Central registry for risk assessment buckets."""
 
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 
 
 @dataclass
@@ -152,6 +154,36 @@ def get_enabled_buckets(
     return enabled
 
 
+# Registry for the analysis running in this context, set by use_buckets();
+# None means RISK_BUCKETS
+_active_buckets: ContextVar[Optional[Dict[str, RiskBucket]]] = ContextVar(
+    "active_buckets", default=None
+)
+
+
+def active_buckets() -> Dict[str, RiskBucket]:
+    """The bucket registry for the current analysis (RISK_BUCKETS unless overridden)."""
+    buckets = _active_buckets.get()
+    return RISK_BUCKETS if buckets is None else buckets
+
+
+@contextmanager
+def use_buckets(buckets: Dict[str, RiskBucket]) -> Iterator[None]:
+    """Resolve bucket IDs from ``buckets`` instead of RISK_BUCKETS within the block.
+
+    The advisor server gives each request a snapshot of the built-in buckets
+    plus its agents directory, so reloading one directory, or two directories
+    defining the same agent ID, never changes the buckets of a request that
+    is already running. The override follows the context into asyncio tasks
+    but not into plain threads.
+    """
+    token = _active_buckets.set(buckets)
+    try:
+        yield
+    finally:
+        _active_buckets.reset(token)
+
+
 def get_bucket(bucket_id: str) -> Optional[RiskBucket]:
     """Get bucket definition by ID."""
-    return RISK_BUCKETS.get(bucket_id)
+    return active_buckets().get(bucket_id)
@@ -0,0 +1,210 @@
+"""Concurrent per-bucket analysis for CI mode.
+
+Instead of one completion that evaluates every risk bucket, parallel mode
+issues one focused request per enabled bucket plus one for the per-resource
+summaries, all sharing the same user prompt. Requests run on a bounded thread
+pool, so wall-clock time is set by the slowest request rather than the sum,
+and no single response has to fit every bucket under the ``max_tokens`` cap.
+The parsed responses are merged back into the same shape as a combined
+CI-mode response.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..prompt import (
+    build_bucket_response_schema,
+    build_bucket_system_prompt,
+    build_resources_response_schema,
+    build_resources_system_prompt,
+)
+
+# Default number of requests in flight at once
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+def run_parallel_analysis(
+    llm_provider,
+    user_prompt: str,
+    enabled_buckets: List[str],
+    pr_title: Optional[str] = None,
+    pr_description: Optional[str] = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    structured_output: bool = True,
+) -> Tuple[str, Dict[str, str]]:
+    """Run the resources request and one request per bucket concurrently.
+
+    Args:
+        llm_provider: Provider instance with a ``complete(system, user)`` method
+        user_prompt: User prompt shared by every request
+        enabled_buckets: Bucket IDs to evaluate, one request each
+        pr_title: Optional PR title (used by the intent bucket prompt)
+        pr_description: Optional PR description (used by the intent bucket prompt)
+        max_concurrency: Maximum number of requests in flight at once
+        structured_output: Constrain each response to its request's JSON Schema
+
+    Returns:
+        Tuple of (resources_response, bucket_responses) where
+        bucket_responses maps bucket ID to raw response text
+
+    Raises:
+        ProviderError: For the first failed request; requests that have not
+            started are cancelled
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    system_prompts = parallel_system_prompts(enabled_buckets, pr_title, pr_description)
+
+    max_workers = max(1, min(max_concurrency, len(system_prompts)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                llm_provider.complete,
+                system_prompt,
+                user_prompt,
+                _response_schema(bucket_id, structured_output),
+            )
+            for bucket_id, system_prompt in system_prompts
+        ]
+        try:
+            texts = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return _split_responses(system_prompts, texts)
+
+
+async def run_parallel_analysis_async(
+    llm_provider,
+    user_prompt: str,
+    enabled_buckets: List[str],
+    pr_title: Optional[str] = None,
+    pr_description: Optional[str] = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    structured_output: bool = True,
+) -> Tuple[str, Dict[str, str]]:
+    """Async version of :func:`run_parallel_analysis` using ``acomplete``.
+
+    Requests share the running event loop, bounded by a semaphore. If one
+    fails, the others are cancelled and its error is raised.
+    """
+    import asyncio
+
+    system_prompts = parallel_system_prompts(enabled_buckets, pr_title, pr_description)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(bucket_id: Optional[str], system_prompt: str) -> str:
+        async with semaphore:
+            return await llm_provider.acomplete(
+                system_prompt, user_prompt, _response_schema(bucket_id, structured_output)
+            )
+
+    tasks = [
+        asyncio.ensure_future(run(bucket_id, system_prompt))
+        for bucket_id, system_prompt in system_prompts
+    ]
+    try:
+        texts = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    return _split_responses(system_prompts, texts)
+
+
+def parallel_system_prompts(
+    enabled_buckets: List[str], pr_title: Optional[str], pr_description: Optional[str]
+) -> List[Tuple[Optional[str], str]]:
+    """Build (bucket_id, system_prompt) pairs; the resources request comes first."""
+    system_prompts = [(None, build_resources_system_prompt())]
+    for bucket_id in enabled_buckets:
+        system_prompts.append(
+            (bucket_id, build_bucket_system_prompt(bucket_id, pr_title, pr_description))
+        )
+    return system_prompts
+
+
+def _response_schema(bucket_id: Optional[str], structured_output: bool) -> Optional[dict]:
+    """JSON Schema for the resources request (bucket_id None) or a bucket request."""
+    if not structured_output:
+        return None
+    if bucket_id is None:
+        return build_resources_response_schema()
+    return build_bucket_response_schema(bucket_id)
+
+
+def _split_responses(
+    system_prompts: List[Tuple[Optional[str], str]], texts: List[str]
+) -> Tuple[str, Dict[str, str]]:
+    """Split response texts back into (resources_response, bucket_responses)."""
+    bucket_responses = {
+        bucket_id: text for (bucket_id, _), text in zip(system_prompts[1:], texts[1:])
+    }
+    return texts[0], bucket_responses
+
+
+def merge_parallel_responses(resources_data: dict, bucket_data: Dict[str, dict]) -> Dict[str, Any]:
+    """Merge parsed parallel responses into one CI-mode response.
+
+    Args:
+        resources_data: Parsed resources response (resources, overall_summary)
+        bucket_data: Parsed bucket responses keyed by bucket ID
+
+    Returns:
+        Response dict with resources, overall_summary, risk_assessment and
+        verdict, as produced by a single combined CI-mode request. Buckets
+        whose response has no assessment are omitted (and later backfilled
+        like buckets the combined response leaves out).
+    """
+    data = {k: v for k, v in resources_data.items() if k not in ("risk_assessment", "verdict")}
+
+    risk_assessment = {}
+    for bucket_id, response in bucket_data.items():
+        entry = _bucket_entry(response, bucket_id)
+        if entry is not None:
+            risk_assessment[bucket_id] = entry
+
+    data["risk_assessment"] = risk_assessment
+    # Everything but the reasoning is recomputed from the thresholds later
+    data["verdict"] = {"reasoning": _verdict_reasoning(risk_assessment)}
+    return data
+
+
+def _bucket_entry(response: dict, bucket_id: str) -> Optional[dict]:
+    """Pull one bucket's assessment out of its response.
+
+    Accepts the requested ``{"risk_assessment": {bucket_id: {...}}}`` shape
+    as well as a bare bucket object.
+    """
+    risk_assessment = response.get("risk_assessment")
+    if isinstance(risk_assessment, dict):
+        entry = risk_assessment.get(bucket_id)
+        if entry is None and len(risk_assessment) == 1:
+            entry = next(iter(risk_assessment.values()))
+        return entry if isinstance(entry, dict) else None
+    if "risk_level" in response:
+        return response
+    return None
+
+
+def _verdict_reasoning(risk_assessment: Dict[str, dict]) -> str:
+    """Summarize independently assessed buckets for the verdict."""
+    from .buckets import active_buckets
+
+    flagged = []
+    for bucket_id, entry in risk_assessment.items():
+        level = str(entry.get("risk_level", "low")).lower()
+        if level == "low":
+            continue
+        bucket = active_buckets().get(bucket_id)
+        name = bucket.display_name if bucket else bucket_id
+        summary = entry.get("concern_summary") or entry.get("reasoning")
+        flagged.append(f"{name} ({level} risk): {summary}" if summary else f"{name} ({level} risk)")
+
+    if not flagged:
+        return "Each risk bucket was assessed independently and none reported concerns."
+    return "Each risk bucket was assessed independently. " + " ".join(
+        f if f.endswith(".") else f + "." for f in flagged
+    )
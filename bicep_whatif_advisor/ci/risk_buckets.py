@@ -1,12 +1,13 @@
 """Risk bucket evaluation for CI mode deployment gates."""
 
-from typing import Any, Dict, List, Tuple
+import json
+from typing import Any, Dict, List, Optional, Tuple
 
 # Import risk levels from verdict module
 from .verdict import RISK_LEVELS
 
 
-def _validate_risk_level(risk_level: str) -> str:
+def validate_risk_level(risk_level: str) -> str:
     """Validate and normalize risk level.
 
     Args:
@@ -83,7 +84,7 @@ def evaluate_risk_buckets(
             continue
 
         # Get and validate risk level
-        risk_level = _validate_risk_level(bucket_data.get("risk_level", "low"))
+        risk_level = validate_risk_level(bucket_data.get("risk_level", "low"))
 
         # Check against threshold: explicit > bucket default > "high"
         threshold = thresholds.get(bucket_id)
@@ -122,3 +123,196 @@ def _exceeds_threshold(risk_level: str, threshold: str) -> bool:
     risk_index = RISK_LEVELS.index(risk_level.lower())
     threshold_index = RISK_LEVELS.index(threshold.lower())
     return risk_index >= threshold_index
+
+
+def rescore_risk_assessment(
+    risk_assessment: Dict[str, Any],
+    excluded_resources: List[dict],
+    kept_resources: List[dict],
+) -> Tuple[List[str], List[str]]:
+    """Re-derive bucket risk locally after low-confidence resources are excluded.
+
+    Uses the per-bucket ``resource_concerns`` attribution requested by the CI
+    prompt: concerns about excluded resources are dropped, and the bucket's
+    risk level becomes the highest remaining concern level (never higher than
+    the LLM's original level). This replaces a second LLM round-trip.
+
+    Custom agent ``findings`` about excluded resources are dropped too, matched
+    on the agent's resource column; findings from an agent without one cannot
+    be attributed, so the bucket is reported as unattributed.
+
+    Buckets without a ``resource_concerns`` list cannot be re-derived and are
+    left unchanged; those above low risk are reported as unattributed.
+
+    Args:
+        risk_assessment: LLM risk_assessment dict, updated in place
+        excluded_resources: Resources moved to the low-confidence list
+        kept_resources: Resources that remain in the analysis
+
+    Returns:
+        Tuple of (rescored_buckets, unattributed_buckets) — bucket IDs whose
+        assessment changed, and above-low bucket IDs that had no attribution
+    """
+    kept_names = {resource_key(r.get("resource_name")) for r in kept_resources}
+    excluded_names = {resource_key(r.get("resource_name")) for r in excluded_resources} - kept_names
+    excluded_names.discard(None)
+
+    rescored = []
+    unattributed = []
+    for bucket_id, bucket_data in risk_assessment.items():
+        if not isinstance(bucket_data, dict):
+            continue
+        findings_attributed = _drop_excluded_findings(bucket_id, bucket_data, excluded_names)
+        if findings_attributed is None:
+            unattributed.append(bucket_id)
+        elif findings_attributed:
+            rescored.append(bucket_id)
+
+        attributions = bucket_data.get("resource_concerns")
+        if not isinstance(attributions, list):
+            # Only worth reporting if the stale level could affect the gate
+            level = validate_risk_level(str(bucket_data.get("risk_level", "low")))
+            if level != "low" and bucket_id not in unattributed:
+                unattributed.append(bucket_id)
+            continue
+
+        remaining = [
+            c
+            for c in attributions
+            if not isinstance(c, dict) or resource_key(c.get("resource_name")) not in excluded_names
+        ]
+        if len(remaining) == len(attributions):
+            continue
+
+        original_level = validate_risk_level(str(bucket_data.get("risk_level", "low")))
+        new_level = "low"
+        for concern in remaining:
+            if isinstance(concern, dict):
+                level = validate_risk_level(str(concern.get("risk_level", "low")))
+                if RISK_LEVELS.index(level) > RISK_LEVELS.index(new_level):
+                    new_level = level
+        if RISK_LEVELS.index(new_level) > RISK_LEVELS.index(original_level):
+            new_level = original_level
+
+        concern_texts = [
+            str(c.get("concern", "")) for c in remaining if isinstance(c, dict) and c.get("concern")
+        ]
+        num_dropped = len(attributions) - len(remaining)
+        bucket_data["risk_level"] = new_level
+        bucket_data["resource_concerns"] = remaining
+        bucket_data["concerns"] = concern_texts
+        bucket_data["concern_summary"] = "; ".join(concern_texts) if concern_texts else "None"
+        bucket_data["reasoning"] = (
+            f"{bucket_data.get('reasoning', '')} (Re-scored after excluding"
+            f" {num_dropped} concern(s) about low-confidence resources.)"
+        ).strip()
+        if bucket_id not in rescored:
+            rescored.append(bucket_id)
+
+    return rescored, unattributed
+
+
+def _drop_excluded_findings(
+    bucket_id: str, bucket_data: Dict[str, Any], excluded_names: set
+) -> Optional[int]:
+    """Drop a custom agent's findings about excluded resources, in place.
+
+    Returns:
+        Number of findings dropped, or None if the bucket has findings that
+        may concern excluded resources but no resource column to tell
+    """
+    findings = bucket_data.get("findings")
+    if not isinstance(findings, list) or not findings or not excluded_names:
+        return 0
+    key = _findings_resource_column(bucket_id)
+    if key is None:
+        return None
+
+    kept = [
+        f
+        for f in findings
+        if not isinstance(f, dict) or resource_key(f.get(key)) not in excluded_names
+    ]
+    bucket_data["findings"] = kept
+    return len(findings) - len(kept)
+
+
+def _findings_resource_column(bucket_id: str) -> Optional[str]:
+    """Key of the findings column naming the resource ("Resource" by default)."""
+    from .agents import DEFAULT_FINDINGS_COLUMNS
+    from .buckets import get_bucket
+
+    bucket = get_bucket(bucket_id)
+    if bucket is not None and bucket.columns:
+        keys = [c["key"] for c in bucket.columns]
+    else:
+        keys = [c["name"].lower() for c in DEFAULT_FINDINGS_COLUMNS]
+    return next((key for key in keys if key in ("resource", "resource_name")), None)
+
+
+def merge_risk_assessments(assessments: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reduce risk assessments of disjoint parts of one deployment (sharded mode).
+
+    Each bucket takes the highest risk level any part reported and the union
+    of their concerns; the reasoning comes from the highest-risk part.
+    ``resource_concerns`` is kept only if every part attributed its concerns,
+    so :func:`rescore_risk_assessment` never re-derives a level from a
+    partial list.
+
+    Args:
+        assessments: ``risk_assessment`` dicts, one per part
+
+    Returns:
+        Merged risk_assessment dict keyed by bucket ID
+    """
+    entries: Dict[str, List[dict]] = {}
+    for assessment in assessments:
+        for bucket_id, bucket_data in assessment.items():
+            if isinstance(bucket_data, dict):
+                entries.setdefault(bucket_id, []).append(bucket_data)
+
+    merged = {}
+    for bucket_id, parts in entries.items():
+        levels = [validate_risk_level(str(p.get("risk_level", "low"))) for p in parts]
+        highest = max(range(len(parts)), key=lambda i: RISK_LEVELS.index(levels[i]))
+        bucket_data = dict(parts[highest])
+        bucket_data["risk_level"] = levels[highest]
+
+        concerns = _unique(c for p in parts for c in p.get("concerns") or [])
+        summaries = _unique(
+            p["concern_summary"]
+            for p in parts
+            if p.get("concern_summary") and p["concern_summary"] != "None"
+        )
+        bucket_data["concerns"] = concerns
+        bucket_data["concern_summary"] = "; ".join(map(str, summaries)) if summaries else "None"
+
+        if all(isinstance(p.get("resource_concerns"), list) for p in parts):
+            bucket_data["resource_concerns"] = _unique(
+                c for p in parts for c in p["resource_concerns"]
+            )
+        else:
+            bucket_data.pop("resource_concerns", None)
+        merged[bucket_id] = bucket_data
+
+    return merged
+
+
+def _unique(items) -> list:
+    """Drop repeated items (compared by their JSON form), keeping the first."""
+    seen = set()
+    result = []
+    for item in items:
+        key = json.dumps(item, sort_keys=True, default=str)
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+def resource_key(name: Any) -> Optional[str]:
+    """Normalize a resource name for matching attributions to resources."""
+    if name is None:
+        return None
+    key = str(name).strip().lower()
+    return key or None
@@ -1,26 +1,72 @@
 """CLI entry point for bicep-whatif-advisor."""
 
-import json
+import functools
 import os
 import sys
 from typing import Optional
 
 import click
-import yaml
 
 from . import __version__
+from .analysis import (
+    apply_verdict,
+    build_local_response,
+    finalize_analysis,
+    parse_llm_response,
+)
+from .cache import CachingProvider
 from .ci.platform import detect_platform
-from .input import InputError, read_stdin
+from .coordination import CoalescingProvider
+from .hedging import HedgedProvider
+from .input import InputError, load_bicep_files, open_stdin, truncate_included_whatif
 from .noise_filter import (
+    ResourcePatternIndex,
     extract_resource_patterns,
-    filter_whatif_text,
+    filter_whatif_blocks,
+    filter_whatif_lines,
     load_builtin_patterns,
     load_user_patterns,
-    reclassify_resource_noise,
 )
-from .prompt import build_system_prompt, build_user_prompt
-from .providers import get_provider
-from .render import print_banner, render_json, render_markdown, render_table
+from .prompt import build_response_schema, build_system_prompt, build_user_prompt
+from .providers import (
+    MAX_OUTPUT_TOKENS,
+    Provider,
+    ProviderError,
+    get_provider,
+    resolve_model,
+)
+from .render import (
+    print_banner,
+    render_estimate,
+    render_json,
+    render_markdown,
+    render_streamed_resource,
+    render_table,
+)
+from .session import (
+    apply_platform_defaults,
+    build_llm_provider,
+    parse_agent_thresholds,
+    prepare_buckets,
+    print_provider_summary,
+)
+from .sharding import (
+    DEFAULT_SHARD_RESOURCES,
+    merge_shard_responses,
+    run_sharded_analysis,
+    shard_whatif,
+)
+from .streaming import DEFAULT_IDLE_TIMEOUT, stream_completion
+from .timings import NULL_RECORDER, Recorder, report, set_recorder
+from .tokens import (
+    estimate_output_tokens,
+    fit_section,
+    get_token_counter,
+    model_profile,
+    output_reserve,
+    prompt_budget,
+)
+from .whatif_json import detect_json_input, parse_whatif_json
 
 # Keys recognized in the config file (must match Click parameter names)
 _KNOWN_CONFIG_KEYS = {
@@ -51,8 +97,31 @@ _KNOWN_CONFIG_KEYS = {
     "agents_dir",
     "agent_threshold",
     "skip_agent",
+    "input_format",
+    "parallel",
+    "max_concurrency",
+    "sharded",
+    "shard_size",
+    "stream",
+    "stream_timeout",
+    "cache_dir",
+    "no_cache",
+    "incremental",
+    "coordination_dir",
+    "warm_up",
+    "fallback_provider",
+    "fallback_model",
+    "hedge_delay",
+    "no_structured_output",
+    "server",
+    "timings",
+    "stats_json",
 }
 
+# ctx.meta key set by the estimate command (price overrides) to stop main
+# before any provider is created
+_ESTIMATE_META_KEY = "bicep_whatif_advisor.estimate"
+
 
 def _load_config_file(ctx, param, value):
     """Click callback that loads a YAML config file into ctx.default_map.
@@ -64,6 +133,8 @@ def _load_config_file(ctx, param, value):
     if value is None:
         return
 
+    import yaml
+
     try:
         with open(value, "r", encoding="utf-8") as f:
             config = yaml.safe_load(f)
@@ -98,120 +169,7 @@ def _load_config_file(ctx, param, value):
     ctx.default_map = config
 
 
-def extract_json(text: str) -> dict:
-    """Attempt to extract JSON from LLM response.
-
-    Args:
-        text: Raw LLM response text
-
-    Returns:
-        Parsed JSON dict
-
-    Raises:
-        ValueError: If no valid JSON found
-    """
-    # Try parsing as-is first
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-
-    # Try to find JSON in the text by looking for balanced braces
-    # This handles deeply nested JSON properly
-    start = text.find("{")
-    if start == -1:
-        raise ValueError("Could not extract valid JSON from LLM response")
-
-    # Find the matching closing brace
-    brace_count = 0
-    in_string = False
-    escape_next = False
-
-    for i in range(start, len(text)):
-        char = text[i]
-
-        if escape_next:
-            escape_next = False
-            continue
-
-        if char == "\\":
-            escape_next = True
-            continue
-
-        if char == '"' and not escape_next:
-            in_string = not in_string
-            continue
-
-        if in_string:
-            continue
-
-        if char == "{":
-            brace_count += 1
-        elif char == "}":
-            brace_count -= 1
-            if brace_count == 0:
-                # Found the matching closing brace
-                json_str = text[start : i + 1]
-                try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    pass
-                break
-
-    # Failed to extract JSON
-    raise ValueError("Could not extract valid JSON from LLM response")
-
-
-def filter_by_confidence(data: dict) -> tuple[dict, dict]:
-    """Filter resources by confidence level.
-
-    Splits resources into high-confidence (medium/high) and low-confidence (low) lists.
-    Low-confidence resources are likely Azure What-If noise and should be excluded
-    from risk analysis but displayed separately.
-
-    Args:
-        data: Parsed LLM response with resources and other fields
-
-    Returns:
-        Tuple of (high_confidence_data, low_confidence_data) dicts with same structure
-    """
-    resources = data.get("resources", [])
-
-    high_confidence_resources = []
-    low_confidence_resources = []
-
-    for resource in resources:
-        confidence = resource.get("confidence_level", "medium").lower()
-
-        if confidence in ("low", "noise"):
-            # Low confidence and noise-matched resources excluded from analysis
-            low_confidence_resources.append(resource)
-        else:
-            # medium and high confidence included in analysis
-            high_confidence_resources.append(resource)
-
-    # Build high-confidence data dict (includes CI fields if present)
-    high_confidence_data = {
-        "resources": high_confidence_resources,
-        "overall_summary": data.get("overall_summary", ""),
-    }
-
-    # Preserve CI mode fields in high-confidence data
-    if "risk_assessment" in data:
-        high_confidence_data["risk_assessment"] = data["risk_assessment"]
-    if "verdict" in data:
-        high_confidence_data["verdict"] = data["verdict"]
-
-    # Build low-confidence data dict (no CI fields - these are excluded from risk analysis)
-    low_confidence_data = {
-        "resources": low_confidence_resources,
-        "overall_summary": "",  # No separate summary for noise
-    }
-
-    return high_confidence_data, low_confidence_data
-
-
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     "--config-file",
     type=click.Path(exists=False),
@@ -352,6 +310,121 @@ def filter_by_confidence(data: dict) -> tuple[dict, dict]:
     multiple=True,
     help=("Skip a custom agent by ID (e.g., --skip-agent compliance). Repeatable. CI mode only."),
 )
+@click.option(
+    "--input-format",
+    type=click.Choice(["auto", "text", "json"], case_sensitive=False),
+    default="auto",
+    help=(
+        "What-If input format: text report or 'what-if --output json' (default: auto-detect)."
+        " Text is filtered as it streams; JSON is read and parsed in full first"
+    ),
+)
+@click.option(
+    "--parallel",
+    is_flag=True,
+    help="Evaluate each risk bucket in its own concurrent LLM request (CI mode only)",
+)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    help="Maximum concurrent LLM requests with --parallel or --sharded (default: 4)",
+)
+@click.option(
+    "--sharded",
+    is_flag=True,
+    help="Split large What-If output into shards analyzed concurrently and merged,"
+    " instead of truncating it to fit one request",
+)
+@click.option(
+    "--shard-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SHARD_RESOURCES,
+    help=f"Maximum resource blocks per shard with --sharded (default: {DEFAULT_SHARD_RESOURCES})",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Stream the LLM response and show each resource as soon as it is analyzed",
+)
+@click.option(
+    "--stream-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_IDLE_TIMEOUT,
+    help="Seconds without streamed output before giving up (default: 60)",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="LLM response cache directory (default: $WHATIF_CACHE_DIR or the user cache dir)",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Always call the LLM instead of reusing cached responses for identical prompts",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Reuse stored per-resource results for What-If resource blocks unchanged since an"
+    " earlier run; only new or changed blocks are sent to the LLM",
+)
+@click.option(
+    "--coordination-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory shared by concurrent runs to coalesce identical requests and share"
+    " the rate budget (default: $WHATIF_COORDINATION_DIR)",
+)
+@click.option(
+    "--warm-up",
+    is_flag=True,
+    help="Start loading the model while the What-If input is read (Ollama)",
+)
+@click.option(
+    "--fallback-provider",
+    type=click.Choice(["anthropic", "azure-openai", "ollama"], case_sensitive=False),
+    default=None,
+    help="Provider to fail over to when a request fails (default: the primary provider"
+    " if --fallback-model is set)",
+)
+@click.option(
+    "--fallback-model",
+    type=str,
+    default=None,
+    help="Model or Azure OpenAI deployment for the fallback provider",
+)
+@click.option(
+    "--hedge-delay",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Seconds without a first token from the primary before the request is also sent"
+    " to the fallback; the first response wins (default: fail over on errors only)",
+)
+@click.option(
+    "--no-structured-output",
+    is_flag=True,
+    help="Don't constrain responses to a JSON Schema (for models without structured output)",
+)
+@click.option(
+    "--server",
+    type=str,
+    default=None,
+    help="URL of a 'bicep-whatif-advisor serve' instance to run the analysis"
+    " (e.g. http://127.0.0.1:8765)",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    help="Print time per phase, bytes, tokens, cache hits and retries to stderr",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write phase timings and run statistics to this JSON file",
+)
 @click.version_option(version=__version__)
 def main(
     provider: str,
@@ -381,6 +454,25 @@ def main(
     agents_dir: str,
     agent_threshold: tuple,
     skip_agent: tuple,
+    input_format: str,
+    parallel: bool,
+    max_concurrency: int,
+    sharded: bool,
+    shard_size: int,
+    stream: bool,
+    stream_timeout: float,
+    cache_dir: str,
+    no_cache: bool,
+    incremental: bool,
+    coordination_dir: str,
+    warm_up: bool,
+    fallback_provider: str,
+    fallback_model: str,
+    hedge_delay: float,
+    no_structured_output: bool,
+    server: str,
+    timings: bool,
+    stats_json: str,
 ):
     """Analyze Azure What-If deployment output using LLMs.
 
@@ -395,57 +487,47 @@ def main(
           --template-file main.bicep \\
           --parameters params.json | bicep-whatif-advisor
     """
+    if click.get_current_context().invoked_subcommand:
+        # The subcommand takes the same options and runs the analysis itself
+        return
+
+    # Phase timings and counters, reported when the command exits (including
+    # via sys.exit); the no-op recorder is used when neither option is set
+    recorder = NULL_RECORDER
+    if timings or stats_json:
+        recorder = Recorder()
+        set_recorder(recorder)
+        click.get_current_context().call_on_close(
+            functools.partial(report, recorder, timings, stats_json)
+        )
+    recorder.phase("setup")
+
     try:
-        # Read stdin
-        whatif_content = read_stdin()
+        # Open stdin for streaming. The What-If text is read and noise-filtered
+        # in a single pass once the patterns are loaded below.
+        whatif_stream = open_stdin(keep_text=include_whatif)
+
+        # Load a local model while What-If is still producing its output
+        if (
+            warm_up
+            and not server
+            and click.get_current_context().meta.get(_ESTIMATE_META_KEY) is None
+        ):
+            get_provider(provider, model).warm_up()
 
         # Auto-detect platform context (GitHub Actions, Azure DevOps, or local)
         platform_ctx = detect_platform()
 
-        # Apply smart defaults based on platform detection
-        if platform_ctx.platform != "local":
-            # Auto-enable CI mode in pipeline environments
-            if not ci:
-                platform_name = (
-                    "GitHub Actions" if platform_ctx.platform == "github" else "Azure DevOps"
-                )
-                sys.stderr.write(
-                    f"🤖 Auto-detected {platform_name} environment - enabling CI mode\n"
-                )
-                ci = True
-
-            # Auto-set diff reference if not manually provided
-            if diff_ref == "HEAD~1" and platform_ctx.base_branch:
-                diff_ref = platform_ctx.get_diff_ref()
-                sys.stderr.write(f"📊 Auto-detected diff reference: {diff_ref}\n")
-
-            # Auto-populate PR metadata if not manually provided
-            if not pr_title and platform_ctx.pr_title:
-                pr_title = platform_ctx.pr_title
-                title_preview = pr_title[:60] + "..." if len(pr_title) > 60 else pr_title
-                sys.stderr.write(f"📝 Auto-detected PR title: {title_preview}\n")
-
-            if not pr_description and platform_ctx.pr_description:
-                pr_description = platform_ctx.pr_description
-                desc_lines = len(pr_description.splitlines())
-                sys.stderr.write(f"📄 Auto-detected PR description ({desc_lines} lines)\n")
-
-            # Auto-enable PR comments if token available
-            if not post_comment:
-                has_token = (
-                    platform_ctx.platform == "github" and os.environ.get("GITHUB_TOKEN")
-                ) or (
-                    platform_ctx.platform == "azuredevops" and os.environ.get("SYSTEM_ACCESSTOKEN")
-                )
-                if has_token:
-                    sys.stderr.write("💬 Auto-enabling PR comments (auth token detected)\n")
-                    post_comment = True
+        ci, diff_ref, pr_title, pr_description, post_comment = apply_platform_defaults(
+            platform_ctx, ci, diff_ref, pr_title, pr_description, post_comment
+        )
 
         # Print banner in CI/CD mode only
         if ci:
             print_banner()
 
         # Get diff content if CI mode
+        recorder.phase("context")
         diff_content = None
         bicep_content = None
 
@@ -456,444 +538,600 @@ def main(
 
             # Optionally load Bicep source files
             if bicep_dir:
-                bicep_content = _load_bicep_files(bicep_dir)
-
-        # Load custom agents
-        custom_agent_ids = []
-        custom_thresholds = {}
-
-        if ci and agents_dir:
-            from .ci.agents import (
-                load_agents_from_directory,
-                register_agents,
-            )
-
-            agents, agent_errors = load_agents_from_directory(agents_dir)
-            for err in agent_errors:
-                sys.stderr.write(f"Warning: {err}\n")
-
-            if agents:
-                custom_agent_ids = register_agents(agents)
-                agent_names = ", ".join(custom_agent_ids)
-                sys.stderr.write(f"Loaded {len(custom_agent_ids)} agent(s): {agent_names}\n")
-        if not ci and agents_dir:
-            sys.stderr.write("Warning: --agents-dir is only used in CI mode. Ignoring.\n")
+                bicep_content = load_bicep_files(bicep_dir)
+
+        # Load custom agents and determine which risk buckets are enabled
+        # (CI mode only), before getting the provider to validate flags early
+        enabled_buckets, parallel = prepare_buckets(
+            ci,
+            agents_dir,
+            parallel,
+            skip_drift,
+            skip_intent,
+            skip_agent,
+            pr_title,
+            pr_description,
+        )
+        if parallel and sharded:
+            sys.stderr.write("Warning: --parallel is not used with --sharded. Ignoring.\n")
+            parallel = False
+        if parallel and stream:
+            sys.stderr.write("Warning: --stream is not used with --parallel. Ignoring.\n")
 
         # Parse --agent-threshold values
-        for entry in agent_threshold:
-            if "=" not in entry:
-                sys.stderr.write(
-                    f"Warning: Invalid --agent-threshold"
-                    f" format: '{entry}'."
-                    f" Expected format: agent_id=level\n"
-                )
-                continue
-            agent_id, level = entry.split("=", 1)
-            agent_id = agent_id.strip()
-            level = level.strip().lower()
-            if level not in ("low", "medium", "high"):
-                sys.stderr.write(
-                    f"Warning: Invalid threshold level"
-                    f" '{level}' for agent '{agent_id}'."
-                    f" Must be low, medium, or high.\n"
-                )
-                continue
-            custom_thresholds[agent_id] = level
-
-        # Determine which risk buckets are enabled (CI mode only)
-        # Do this before getting provider to validate flags early
-        enabled_buckets = None
-        if ci:
-            from .ci.buckets import get_enabled_buckets
-
-            enabled_buckets = get_enabled_buckets(
-                skip_drift=skip_drift,
-                skip_intent=skip_intent,
-                has_pr_metadata=bool(pr_title or pr_description),
-                custom_agent_ids=custom_agent_ids,
-                skip_agents=list(skip_agent),
+        custom_thresholds = parse_agent_thresholds(agent_threshold)
+
+        # --server: a serve instance filters and analyzes with its loaded
+        # patterns, agents and providers; rendering, the PR comment and the
+        # exit code stay here
+        if server and click.get_current_context().meta.get(_ESTIMATE_META_KEY) is None:
+            for name, used in (
+                ("--sharded", sharded),
+                ("--stream", stream),
+                ("--incremental", incremental),
+            ):
+                if used:
+                    sys.stderr.write(f"Warning: {name} is not used with --server. Ignoring.\n")
+
+            recorder.phase("read_filter")
+            whatif_lines, is_json = detect_json_input(whatif_stream)
+            whatif_text = "".join(whatif_lines)
+            whatif_stream.validate()
+            if input_format.lower() != "auto":
+                is_json = input_format.lower() == "json"
+            recorder.set("input_chars", whatif_stream.chars_read)
+
+            recorder.phase("llm")
+            result = _analyze_on_server(
+                server,
+                whatif_text,
+                diff_content,
+                bicep_content,
+                {
+                    "provider": provider,
+                    "model": model,
+                    "verbose": verbose,
+                    "ci": ci,
+                    "drift_threshold": drift_threshold,
+                    "intent_threshold": intent_threshold,
+                    "agent_threshold": custom_thresholds,
+                    "pr_title": pr_title,
+                    "pr_description": pr_description,
+                    "no_block": no_block,
+                    "skip_drift": skip_drift,
+                    "skip_intent": skip_intent,
+                    "skip_agent": list(skip_agent),
+                    "agents_dir": agents_dir if ci else None,
+                    "noise_file": noise_file,
+                    "noise_threshold": noise_threshold,
+                    "no_builtin_patterns": no_builtin_patterns,
+                    "input_format": input_format,
+                    "parallel": parallel,
+                    "max_concurrency": max_concurrency,
+                    "cache_dir": cache_dir,
+                    "no_cache": no_cache,
+                    "coordination_dir": coordination_dir,
+                    "fallback_provider": fallback_provider,
+                    "fallback_model": fallback_model,
+                    "hedge_delay": hedge_delay,
+                    "no_structured_output": no_structured_output,
+                },
             )
 
-            # Validation: At least one bucket must be enabled in CI mode
-            if not enabled_buckets:
-                sys.stderr.write(
-                    "❌ Error: At least one risk assessment bucket must be enabled in CI mode\n"
-                )
-                sys.stderr.write(
-                    "   Remove one or more --skip-* flags to enable risk assessment.\n"
+            whatif_content = None
+            if include_whatif:
+                whatif_content = truncate_included_whatif(
+                    parse_whatif_json(whatif_text).to_text() if is_json else whatif_stream.text
                 )
-                sys.exit(2)
+            _render_and_exit(
+                result["high_confidence"],
+                None if hide_noise else result.get("low_confidence"),
+                format=format,
+                verbose=verbose,
+                no_color=no_color,
+                ci=ci,
+                comment_title=comment_title,
+                no_block=no_block,
+                platform=platform_ctx.platform,
+                whatif_content=whatif_content,
+                post_comment=post_comment,
+                pr_url=pr_url,
+                is_safe=not result["failed_buckets"],
+                failed_buckets=result["failed_buckets"],
+                review_buckets=result["review_buckets"],
+                recorder=recorder,
+            )
 
         # Load noise patterns and separate resource vs property patterns
-        noise_patterns = []
-        if not no_builtin_patterns:
-            noise_patterns.extend(load_builtin_patterns())
-        if noise_file:
-            try:
-                noise_patterns.extend(load_user_patterns(noise_file))
-            except FileNotFoundError as e:
-                sys.stderr.write(f"Error: {e}\n")
-                sys.exit(2)
-            except IOError as e:
-                sys.stderr.write(f"Error reading noise file: {e}\n")
-                sys.exit(2)
-
-        # Separate resource patterns for post-LLM fallback reclassification
-        resource_noise_patterns, _ = extract_resource_patterns(noise_patterns)
-
-        # Preserve original What-If content for --include-whatif (before noise filtering)
-        original_whatif_content = whatif_content
-
-        # Tracks resource blocks removed pre-LLM so we can show them as noise
-        pre_filtered_resources = []
+        noise_patterns = _load_noise_patterns(no_builtin_patterns, noise_file)
 
-        if noise_patterns:
-            fuzzy_threshold = noise_threshold / 100.0
-            whatif_content, num_lines, num_blocks, pre_filtered_resources = filter_whatif_text(
-                whatif_content, noise_patterns, fuzzy_threshold
-            )
-            if num_blocks > 0:
-                sys.stderr.write(
-                    f"🔕 Pre-filtered {num_blocks} noisy resource block(s) from What-If output\n"
-                )
-            if num_lines > 0:
-                sys.stderr.write(
-                    f"🔕 Pre-filtered {num_lines} known-noisy line(s) from What-If output\n"
+        # Separate resource patterns and compile them once for both the
+        # pre-LLM block filter and the post-LLM fallback reclassification
+        resource_noise_patterns, _ = extract_resource_patterns(noise_patterns)
+        resource_index = ResourcePatternIndex(resource_noise_patterns)
+
+        # Budget the prompt in tokens before sending anything: the What-If
+        # output, then the diff, then the Bicep source get what the model's
+        # context window leaves after the system prompt, the prompt framing
+        # (including PR intent) and the response reservation.
+        recorder.phase("prompt")
+        if ci and parallel:
+            from .ci.parallel import parallel_system_prompts
+
+            system_prompts = [
+                text
+                for _, text in parallel_system_prompts(enabled_buckets, pr_title, pr_description)
+            ]
+        else:
+            system_prompts = [
+                build_system_prompt(
+                    verbose=verbose,
+                    ci_mode=ci,
+                    pr_title=pr_title,
+                    pr_description=pr_description,
+                    enabled_buckets=enabled_buckets,
                 )
-
-        # Get provider
-        llm_provider = get_provider(provider, model)
-
-        # Build prompts
-        system_prompt = build_system_prompt(
-            verbose=verbose,
-            ci_mode=ci,
+            ]
+        count_tokens = get_token_counter()
+        profile = model_profile(*resolve_model(provider, model))
+        framing = build_user_prompt(
+            whatif_content="",
+            diff_content="" if diff_content is not None else None,
             pr_title=pr_title,
             pr_description=pr_description,
-            enabled_buckets=enabled_buckets,
         )
-        user_prompt = build_user_prompt(
-            whatif_content=whatif_content,
-            diff_content=diff_content,
-            bicep_content=bicep_content,
-            pr_title=pr_title,
-            pr_description=pr_description,
+        system_tokens = [count_tokens(text) for text in system_prompts]
+        framing_tokens = count_tokens(framing)
+        prompt_tokens = prompt_budget(
+            profile, MAX_OUTPUT_TOKENS, max(system_tokens) + framing_tokens
         )
-
-        # Call LLM
-        response_text = llm_provider.complete(system_prompt, user_prompt)
-
-        # Parse JSON response
-        try:
-            data = extract_json(response_text)
-        except ValueError:
-            # Truncate response to prevent exposing sensitive data
-            truncated = response_text[:500] + "..." if len(response_text) > 500 else response_text
+        if prompt_tokens <= 0:
             sys.stderr.write(
-                "Error: LLM did not return valid JSON.\n"
-                f"Raw response (first 500 chars):\n{truncated}\n"
+                f"Error: The system prompt and PR details leave no room for the What-If output"
+                f" in the {profile.context_window:,}-token context window\n"
             )
-            sys.exit(1)
-
-        # Validate required fields
-        if "resources" not in data:
-            sys.stderr.write("Warning: LLM response missing 'resources' field. Using empty list.\n")
-            data["resources"] = []
-
-        if "overall_summary" not in data:
-            sys.stderr.write("Warning: LLM response missing 'overall_summary' field.\n")
-            data["overall_summary"] = "No summary provided."
-
-        # Add backward compatibility defaults for confidence fields
-        for resource in data.get("resources", []):
-            if "confidence_level" not in resource:
-                resource["confidence_level"] = "medium"  # Default to include in analysis
-            if "confidence_reason" not in resource:
-                resource["confidence_reason"] = "No confidence assessment provided"
-
-        # Post-LLM resource noise reclassification: demote matching resources to low confidence
-        if resource_noise_patterns:
-            num_reclassified = reclassify_resource_noise(
-                data.get("resources", []), resource_noise_patterns
+            sys.exit(2)
+
+        # --incremental: blocks with a stored result for this context are left
+        # out of the prompt, and their rows merged back after the LLM call
+        known_results = None
+        if incremental:
+            from .incremental import ResultStore, context_key
+
+            result_store = ResultStore(cache_dir)
+            result_context = context_key(provider, model, system_prompts)
+            known_results = result_store.load(result_context)
+
+        # Read stdin and filter noise in one streaming pass. The token budget
+        # applies to the filtered text and drops whole resource blocks.
+        recorder.phase("read_filter")
+        fuzzy_threshold = noise_threshold / 100.0
+        input_format = input_format.lower()
+        whatif_lines, is_json = detect_json_input(whatif_stream)
+        if input_format != "auto":
+            is_json = input_format == "json"
+        if is_json:
+            # JSON has to be parsed whole; it is rendered into the same block
+            # model as the text report and filtered on exact property paths.
+            whatif_source = parse_whatif_json("".join(whatif_lines))
+            filter_result = filter_whatif_blocks(
+                whatif_source,
+                noise_patterns,
+                fuzzy_threshold,
+                resource_index=resource_index,
+                max_tokens=None if sharded else prompt_tokens,
+                count_tokens=count_tokens,
+                reuse=known_results,
             )
-            if num_reclassified > 0:
-                sys.stderr.write(
-                    f"🔕 Reclassified {num_reclassified} resource(s) as low-confidence noise\n"
-                )
+        else:
+            filter_result = filter_whatif_lines(
+                whatif_lines,
+                noise_patterns,
+                fuzzy_threshold,
+                resource_index=resource_index,
+                max_tokens=None if sharded else prompt_tokens,
+                count_tokens=count_tokens,
+                reuse=known_results,
+            )
+        whatif_stream.validate()
+        whatif_content = filter_result.text
 
-        # Inject synthetic low-confidence entries for pre-LLM filtered resource blocks
-        # so they still appear in the "Potential Noise" section
-        if pre_filtered_resources:
-            action_map = {
-                "Create": "Create",
-                "Modify": "Modify",
-                "Delete": "Delete",
-                "Deploy": "Deploy",
-                "NoChange": "NoChange",
-                "Ignore": "Ignore",
-            }
-            for removed in pre_filtered_resources:
-                data["resources"].append(
-                    {
-                        "resource_name": removed["resource_name"],
-                        "resource_type": removed["resource_type"],
-                        "action": action_map.get(removed["operation"], removed["operation"]),
-                        "summary": "Removed by resource noise pattern",
-                        "confidence_level": "low",
-                        "confidence_reason": "Matched resource noise pattern (pre-LLM filtered)",
-                    }
-                )
+        # Preserve original What-If content for --include-whatif (before noise filtering)
+        if is_json and include_whatif:
+            original_whatif_content = truncate_included_whatif(whatif_source.to_text())
+        elif include_whatif:
+            original_whatif_content = truncate_included_whatif(whatif_stream.text)
+        else:
+            original_whatif_content = None
 
-        # Filter by confidence (always-on behavior)
-        high_confidence_data, low_confidence_data = filter_by_confidence(data)
+        # Tracks resource blocks removed pre-LLM so we can show them as noise
+        pre_filtered_resources = filter_result.removed_resources
 
-        # Suppress noise display if --hide-noise is set
-        display_noise_data = None if hide_noise else low_confidence_data
+        recorder.set("input_chars", whatif_stream.chars_read)
+        recorder.set("noise_blocks_removed", filter_result.blocks_removed)
+        recorder.set("noise_lines_removed", filter_result.lines_removed)
+        recorder.set("blocks_truncated", filter_result.blocks_truncated)
 
-        # CRITICAL FIX: If noise filtering removed resources in CI mode, the LLM's
-        # risk_assessment is stale (generated before filtering). Re-prompt the LLM
-        # with only high-confidence resources to get an accurate risk assessment.
-        if ci and low_confidence_data.get("resources"):
-            num_filtered = len(low_confidence_data["resources"])
-            num_remaining = len(high_confidence_data.get("resources", []))
+        if filter_result.blocks_removed > 0:
+            sys.stderr.write(
+                f"🔕 Pre-filtered {filter_result.blocks_removed} noisy resource block(s)"
+                f" from What-If output\n"
+            )
+        if filter_result.lines_removed > 0:
+            sys.stderr.write(
+                f"🔕 Pre-filtered {filter_result.lines_removed} known-noisy line(s)"
+                f" from What-If output\n"
+            )
+        reused_results = [
+            known_results[r["fingerprint"]] for r in filter_result.kept_resources if r.get("reused")
+        ]
+        if reused_results:
+            recorder.set("blocks_reused", len(reused_results))
+            sys.stderr.write(
+                f"♻️ Reusing earlier results for {len(reused_results)} unchanged resource block(s)\n"
+            )
+        if filter_result.truncated:
+            sys.stderr.write(
+                f"Warning: What-If output truncated to fit the {profile.context_window:,}-token"
+                f" context window after noise filtering ({filter_result.blocks_truncated}"
+                f" resource block(s) omitted, original: {whatif_stream.chars_read:,} characters;"
+                f" use --sharded to analyze all of it)\n"
+            )
 
+        # Trim the diff and Bicep source to what is left, on file boundaries.
+        # Sharded runs repeat them in every shard, so they get at most half.
+        recorder.phase("prompt")
+        remaining = prompt_tokens // 2 if sharded else prompt_tokens - filter_result.tokens
+        diff_content, omitted = fit_section(diff_content, remaining, "\ndiff --git ", count_tokens)
+        if omitted:
+            sys.stderr.write(
+                f"Warning: Code diff trimmed to fit the context window"
+                f" ({omitted} file(s) omitted)\n"
+            )
+        diff_tokens = count_tokens(diff_content or "")
+        bicep_content, omitted = fit_section(
+            bicep_content, remaining - diff_tokens, "\n\n// File: ", count_tokens
+        )
+        if omitted:
             sys.stderr.write(
-                f"🔄 Recalculating risk assessment: {num_filtered} low-confidence resources "
-                f"filtered, {num_remaining} high-confidence resources remain\n"
+                f"Warning: Bicep source trimmed to fit the context window"
+                f" ({omitted} file(s) omitted)\n"
             )
 
-            # Special case: If ALL resources were filtered as noise, skip LLM recalculation
-            # and set all risk buckets to low with no concerns.
-            # Rationale: if the LLM classified every resource as noise, then drift
-            # detected on those same resources is also noise-driven and unreliable.
-            if num_remaining == 0:
+        # Sharded mode: split the What-If output into shards that fit what is
+        # left, each analyzed in its own request
+        shards = [whatif_content]
+        shard_tokens = [filter_result.tokens]
+        if sharded:
+            bicep_tokens = count_tokens(bicep_content or "")
+            shards = shard_whatif(
+                whatif_content, prompt_tokens - diff_tokens - bicep_tokens, shard_size, count_tokens
+            )
+            if len(shards) == 1:
+                # Fits in one request: send it unchanged (epilogue included)
+                shards = [whatif_content]
+            shard_tokens = [count_tokens(shard) for shard in shards]
+            if len(shards) > 1:
                 sys.stderr.write(
-                    "✅ All resources filtered as noise - setting all risk buckets to low\n"
+                    f"🧩 Split What-If output into {len(shards)} shards"
+                    f" (up to {shard_size} resource(s) each)\n"
                 )
 
-                # Build a clean risk assessment with no concerns for enabled buckets only
-                from .ci.buckets import RISK_BUCKETS
-
-                high_confidence_data["risk_assessment"] = {}
-
-                for bucket_id in enabled_buckets:
-                    bucket = RISK_BUCKETS[bucket_id]
-                    high_confidence_data["risk_assessment"][bucket_id] = {
-                        "risk_level": "low",
-                        "concerns": [],
-                        "reasoning": (
-                            f"All detected changes were flagged as"
-                            f" low-confidence noise. No high-confidence"
-                            f" {bucket.display_name.lower()}"
-                            f" concerns to evaluate."
-                        ),
-                    }
-
-                # Update verdict
-                high_confidence_data["verdict"] = {
-                    "safe": True,
-                    "highest_risk_bucket": "none",
-                    "overall_risk_level": "low",
-                    "reasoning": (
-                        "All detected changes were identified as Azure"
-                        " What-If noise and excluded from risk analysis."
-                        " No meaningful infrastructure changes detected."
-                    ),
-                }
+        # estimate command: report the budget instead of calling the provider
+        prices = click.get_current_context().meta.get(_ESTIMATE_META_KEY)
+        if prices is not None:
+            sections = {"system_prompt": max(system_tokens), "whatif_output": max(shard_tokens)}
+            if diff_content is not None:
+                sections["code_diff"] = diff_tokens
+                sections["bicep_source"] = count_tokens(bicep_content or "")
+            sections["framing_and_pr_intent"] = framing_tokens
+            analyzed = len(filter_result.kept_resources) - filter_result.blocks_truncated
+            buckets = len(enabled_buckets or []) * len(shards)
+            estimate = _build_estimate(
+                profile,
+                prices,
+                sections,
+                system_tokens,
+                shard_tokens,
+                skipped=not filter_result.needs_analysis,
+                output_tokens=estimate_output_tokens(analyzed, buckets, verbose),
+                resource_output_tokens=estimate_output_tokens(analyzed, 0, verbose),
+                max_concurrency=max_concurrency,
+            )
+            render_estimate(estimate, format=format.lower(), no_color=no_color)
+            sys.exit(0)
+
+        # Skip the LLM entirely when nothing actionable survived noise filtering
+        # (every block removed, or only Deploy/NoChange/Ignore blocks left):
+        # the result is fully determined, so build it locally.
+        recorder.phase("llm")
+        llm_skipped = not filter_result.needs_analysis
+        if llm_skipped:
+            if reused_results:
+                sys.stderr.write(
+                    "✅ No new or changed resources since the last analysis - skipping LLM"
+                    " analysis\n"
+                )
             else:
-                # Re-prompt the LLM with the already noise-filtered What-If
-                # content (real format, blocks already stripped) for accurate
-                # risk assessment based on high-confidence resources only.
+                sys.stderr.write(
+                    "✅ No actionable changes after noise filtering - skipping LLM analysis\n"
+                )
+            data = build_local_response(
+                [r for r in filter_result.kept_resources if not r.get("reused")],
+                len(pre_filtered_resources),
+                enabled_buckets if ci else None,
+            )
+        else:
+            # Get provider, answering repeated identical requests from the cache
+            # and sharing identical in-flight ones with other runs on this machine
+            llm_provider, flight, hedged = build_llm_provider(
+                provider,
+                model,
+                fallback_provider=fallback_provider,
+                fallback_model=fallback_model,
+                hedge_delay=hedge_delay,
+                coordination_dir=coordination_dir,
+                cache_dir=cache_dir,
+                no_cache=no_cache,
+            )
 
-                # Re-build prompts with filtered data
-                filtered_system_prompt = build_system_prompt(
+            # Build prompts (one per shard in sharded mode)
+            user_prompts = [
+                build_user_prompt(
+                    whatif_content=shard,
+                    diff_content=diff_content,
+                    bicep_content=bicep_content,
+                    pr_title=pr_title,
+                    pr_description=pr_description,
+                )
+                for shard in shards
+            ]
+            user_prompt = user_prompts[0]
+
+            # Constrain the response to the prompt's schema (tool use, a
+            # json_schema response format or an Ollama format grammar)
+            response_schema = None
+            if not no_structured_output:
+                response_schema = build_response_schema(
                     verbose=verbose,
                     ci_mode=ci,
                     pr_title=pr_title,
                     pr_description=pr_description,
                     enabled_buckets=enabled_buckets,
                 )
-                filtered_user_prompt = build_user_prompt(
-                    whatif_content=whatif_content,
-                    diff_content=diff_content,
-                    bicep_content=bicep_content,
+
+            if len(shards) > 1:
+                # Map: one request per shard with the same context; reduce:
+                # concatenate resources and merge the risk buckets
+                sys.stderr.write(
+                    f"⚡ Analyzing {len(shards)} shards in parallel"
+                    f" (max concurrency: {max_concurrency})\n"
+                )
+                texts = run_sharded_analysis(
+                    llm_provider,
+                    system_prompts[0],
+                    user_prompts,
+                    max_concurrency=max_concurrency,
+                    response_schema=response_schema,
+                )
+                response_texts = texts
+                data = merge_shard_responses([parse_llm_response(text) for text in texts])
+            elif ci and parallel:
+                # One focused request per bucket plus one for the resource
+                # summaries, run concurrently and merged into one response
+                from .ci.parallel import merge_parallel_responses, run_parallel_analysis
+
+                num_requests = len(enabled_buckets) + 1
+                sys.stderr.write(
+                    f"⚡ Running {num_requests} analysis requests in parallel"
+                    f" (max concurrency: {max_concurrency})\n"
+                )
+                resources_text, bucket_texts = run_parallel_analysis(
+                    llm_provider,
+                    user_prompt,
+                    enabled_buckets,
                     pr_title=pr_title,
                     pr_description=pr_description,
+                    max_concurrency=max_concurrency,
+                    structured_output=not no_structured_output,
                 )
-
-                # Re-call LLM with filtered resources
-                sys.stderr.write(
-                    "📡 Re-analyzing with filtered resources for accurate risk assessment...\n"
+                response_texts = [resources_text, *bucket_texts.values()]
+                data = merge_parallel_responses(
+                    parse_llm_response(resources_text),
+                    {
+                        bucket_id: parse_llm_response(text, bucket_id)
+                        for bucket_id, text in bucket_texts.items()
+                    },
                 )
-                filtered_response_text = llm_provider.complete(
-                    filtered_system_prompt, filtered_user_prompt
+            else:
+                system_prompt = system_prompts[0]
+
+                # Call LLM
+                if stream:
+                    response_text = stream_completion(
+                        llm_provider,
+                        system_prompt,
+                        user_prompt,
+                        on_resource=lambda r: render_streamed_resource(r, no_color),
+                        idle_timeout=stream_timeout,
+                        response_schema=response_schema,
+                    )
+                else:
+                    response_text = llm_provider.complete(
+                        system_prompt, user_prompt, response_schema
+                    )
+                response_texts = [response_text]
+                data = parse_llm_response(response_text)
+
+            if recorder.enabled:
+                _record_provider_stats(
+                    recorder, llm_provider, system_prompts, user_prompts, response_texts
                 )
 
-                # Parse the new response
-                try:
-                    filtered_data = extract_json(filtered_response_text)
+            print_provider_summary(llm_provider, flight, hedged)
 
-                    # Merge the fresh risk_assessment into existing data.
-                    # Use update (not replace) so buckets the LLM omitted
-                    # in the re-analysis keep their original assessment.
-                    if "risk_assessment" in filtered_data:
-                        existing_ra = high_confidence_data.get("risk_assessment", {})
-                        existing_ra.update(filtered_data["risk_assessment"])
-                        high_confidence_data["risk_assessment"] = existing_ra
-                    if "verdict" in filtered_data:
-                        high_confidence_data["verdict"] = filtered_data["verdict"]
+        if incremental:
+            from .incremental import collect_results, merge_results
 
-                    sys.stderr.write(
-                        "✅ Risk assessment recalculated based on high-confidence resources only\n"
-                    )
+            if not llm_skipped:
+                new_results = collect_results(data, filter_result.kept_resources, enabled_buckets)
+                result_store.save(result_context, new_results)
+                recorder.set("results_stored", len(new_results))
+            if reused_results:
+                merge_results(data, reused_results, enabled_buckets, analyzed=not llm_skipped)
+                # The merged assessment is re-derived like an LLM response
+                llm_skipped = False
 
-                except ValueError:
-                    sys.stderr.write(
-                        "⚠️  Warning: Could not parse re-analysis response. "
-                        "Using original risk assessment (may be inaccurate).\n"
-                    )
+        # Validate required fields
+        recorder.phase("postprocess")
+        high_confidence_data, low_confidence_data = finalize_analysis(
+            data,
+            pre_filtered_resources,
+            resource_index,
+            enabled_buckets,
+            llm_skipped,
+            recorder,
+        )
 
-        # Backfill missing buckets: the LLM may omit custom agents from
-        # risk_assessment even when the schema explicitly requests them.
-        # Add a default low-risk entry so they still appear in output.
-        if ci and enabled_buckets:
-            ra = high_confidence_data.get("risk_assessment", {})
-            for bucket_id in enabled_buckets:
-                if bucket_id not in ra:
-                    ra[bucket_id] = {
-                        "risk_level": "low",
-                        "concerns": [],
-                        "concern_summary": "None",
-                        "reasoning": "No assessment returned by LLM",
-                    }
-            high_confidence_data["risk_assessment"] = ra
-
-        # Store enabled buckets in data for rendering (CI mode only)
-        if ci and enabled_buckets:
-            high_confidence_data["_enabled_buckets"] = enabled_buckets
+        # Suppress noise display if --hide-noise is set
+        display_noise_data = None if hide_noise else low_confidence_data
 
         # CI mode: evaluate thresholds and override LLM verdict before rendering
         is_safe = True
         failed_buckets = []
         review_buckets = []
         if ci:
-            from .ci.risk_buckets import evaluate_risk_buckets
-            from .ci.verdict import VERDICT_REVIEW, VERDICT_SAFE, VERDICT_UNSAFE
-
-            is_safe, failed_buckets, review_buckets, risk_assessment = evaluate_risk_buckets(
+            is_safe, failed_buckets, review_buckets = apply_verdict(
                 high_confidence_data,
                 enabled_buckets,
                 drift_threshold,
                 intent_threshold,
-                custom_thresholds=custom_thresholds,
+                custom_thresholds,
             )
 
-            # Compute verdict_status: unsafe > review > safe
-            if failed_buckets:
-                verdict_status = VERDICT_UNSAFE
-            elif review_buckets:
-                verdict_status = VERDICT_REVIEW
-            else:
-                verdict_status = VERDICT_SAFE
-
-            # Override LLM verdict with threshold evaluation result
-            highest_bucket = failed_buckets[0] if failed_buckets else "none"
-            ra = high_confidence_data.get("risk_assessment", {})
-            highest_level = "low"
-            for bucket_id in enabled_buckets:
-                bucket_data = ra.get(bucket_id, {})
-                level = bucket_data.get("risk_level", "low")
-                level_idx = ["low", "medium", "high"].index(level)
-                if level_idx > ["low", "medium", "high"].index(highest_level):
-                    highest_level = level
-            existing_verdict = high_confidence_data.get("verdict", {})
-            high_confidence_data["verdict"] = {
-                "safe": is_safe,
-                "verdict_status": verdict_status,
-                "highest_risk_bucket": highest_bucket,
-                "overall_risk_level": highest_level,
-                "reasoning": existing_verdict.get("reasoning", ""),
-            }
-            if review_buckets:
-                high_confidence_data["verdict"]["review_buckets"] = review_buckets
-
-        # Render output
-        if format == "table":
-            render_table(
-                high_confidence_data,
-                verbose=verbose,
-                no_color=no_color,
-                ci_mode=ci,
-                low_confidence_data=display_noise_data,
-            )
-        elif format == "json":
-            render_json(high_confidence_data, low_confidence_data=display_noise_data)
-        elif format == "markdown":
-            raw_whatif = original_whatif_content if include_whatif else None
-            markdown = render_markdown(
-                high_confidence_data,
-                ci_mode=ci,
-                custom_title=comment_title,
-                no_block=no_block,
-                low_confidence_data=display_noise_data,
-                platform=platform_ctx.platform,
-                whatif_content=raw_whatif,
-            )
-            print(markdown)
+        _render_and_exit(
+            high_confidence_data,
+            display_noise_data,
+            format=format,
+            verbose=verbose,
+            no_color=no_color,
+            ci=ci,
+            comment_title=comment_title,
+            no_block=no_block,
+            platform=platform_ctx.platform,
+            whatif_content=original_whatif_content if include_whatif else None,
+            post_comment=post_comment,
+            pr_url=pr_url,
+            is_safe=is_safe,
+            failed_buckets=failed_buckets,
+            review_buckets=review_buckets,
+            recorder=recorder,
+        )
 
-        # CI mode: post comment and exit
-        if ci:
-            # Post comment if requested
-            if post_comment:
-                raw_whatif = original_whatif_content if include_whatif else None
-                markdown = render_markdown(
-                    high_confidence_data,
-                    ci_mode=True,
-                    custom_title=comment_title,
-                    no_block=no_block,
-                    low_confidence_data=display_noise_data,
-                    platform=platform_ctx.platform,
-                    whatif_content=raw_whatif,
-                )
-                _post_pr_comment(markdown, pr_url)
+    except InputError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(2)
 
-            # Show review buckets if any
-            if review_buckets:
-                review_names = ", ".join(review_buckets)
-                sys.stderr.write(f"👀 Review recommended: {review_names}\n")
+    except ProviderError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(1)
 
-            # Exit with appropriate code
-            if is_safe:
-                sys.exit(0)  # Safe (or review) to deploy
-            else:
-                # Show which buckets failed
-                if failed_buckets:
-                    bucket_names = ", ".join(failed_buckets)
-                    if no_block:
-                        sys.stderr.write(
-                            f"⚠️  Warning: Failed risk buckets:"
-                            f" {bucket_names} (pipeline not blocked"
-                            f" due to --no-block)\n"
-                        )
-                    else:
-                        sys.stderr.write(
-                            f"❌ Deployment blocked: Failed risk buckets: {bucket_names}\n"
-                        )
-
-                # Exit with 0 if --no-block is set, otherwise exit with 1
-                if no_block:
-                    sys.stderr.write("ℹ️  CI mode: Reporting findings only (--no-block enabled)\n")
-                    sys.exit(0)  # Don't block pipeline
-                else:
-                    sys.exit(1)  # Unsafe, block deployment
+    except KeyboardInterrupt:
+        sys.stderr.write("\nInterrupted by user.\n")
+        sys.exit(130)
+
+    except Exception as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(1)
+
+
+def _estimate(input_price: Optional[float], output_price: Optional[float], **params):
+    """Estimate prompt tokens, cost and latency without calling the provider.
 
-        # Standard mode: exit successfully
-        sys.exit(0)
+    Reads and noise-filters What-If output from stdin exactly like an
+    analysis run with the same options, then prints the tokens in each
+    prompt section, the requests that would be made and their projected
+    cost and latency.
+
+        az deployment group what-if ... | bicep-whatif-advisor estimate --ci
+    """
+    ctx = click.get_current_context()
+    ctx.meta[_ESTIMATE_META_KEY] = {"input_price": input_price, "output_price": output_price}
+    ctx.invoke(main.callback, **params)
+
+
+main.add_command(
+    click.Command(
+        "estimate",
+        callback=_estimate,
+        help=_estimate.__doc__,
+        # Same options as the analysis itself, so a run's flags can be reused as-is
+        params=[param for param in main.params if param.name != "version"]
+        + [
+            click.Option(
+                ["--input-price"],
+                type=click.FloatRange(min=0),
+                default=None,
+                help="Input price in USD per million tokens (default: the model's list price)",
+            ),
+            click.Option(
+                ["--output-price"],
+                type=click.FloatRange(min=0),
+                default=None,
+                help="Output price in USD per million tokens (default: the model's list price)",
+            ),
+        ],
+    )
+)
+
+
+# Options of a single analysis that batch runs do not use: each stack is one
+# request (or one per bucket with --parallel) rendered when all are done
+_BATCH_EXCLUDED_PARAMS = {
+    "version",
+    "include_whatif",
+    "sharded",
+    "shard_size",
+    "stream",
+    "stream_timeout",
+    "warm_up",
+    "server",
+    "incremental",
+}
+
+
+def _batch(sources: tuple, manifest: Optional[str], jobs: int, **params):
+    """Analyze many What-If files concurrently and report one verdict.
+
+    Takes What-If files or glob patterns, and/or a YAML manifest with
+    per-stack diff, Bicep directory and threshold overrides. Noise patterns,
+    agents and the provider client are shared by all stacks; the exit code
+    is that of the worst stack.
+
+        bicep-whatif-advisor batch --ci --jobs 8 'stacks/*/whatif.json'
+
+        bicep-whatif-advisor batch --ci --manifest stacks.yaml
+    """
+    recorder = NULL_RECORDER
+    if params["timings"] or params["stats_json"]:
+        recorder = Recorder()
+        set_recorder(recorder)
+        click.get_current_context().call_on_close(
+            functools.partial(report, recorder, params["timings"], params["stats_json"])
+        )
+    recorder.phase("setup")
+
+    try:
+        sys.exit(_run_batch(sources, manifest, jobs, recorder, **params))
 
     except InputError as e:
         sys.stderr.write(f"Error: {e}\n")
         sys.exit(2)
 
+    except ProviderError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(1)
+
     except KeyboardInterrupt:
         sys.stderr.write("\nInterrupted by user.\n")
         sys.exit(130)
@@ -903,66 +1141,514 @@ def main(
         sys.exit(1)
 
 
-def _load_bicep_files(bicep_dir: str) -> Optional[str]:
-    """Load all Bicep files from directory for context.
+def _run_batch(
+    sources: tuple,
+    manifest: Optional[str],
+    jobs: int,
+    recorder: Recorder,
+    provider: str,
+    model: str,
+    format: str,
+    verbose: bool,
+    no_color: bool,
+    ci: bool,
+    diff: str,
+    diff_ref: str,
+    drift_threshold: str,
+    intent_threshold: str,
+    post_comment: bool,
+    pr_url: str,
+    bicep_dir: str,
+    pr_title: str,
+    pr_description: str,
+    no_block: bool,
+    skip_drift: bool,
+    skip_intent: bool,
+    comment_title: str,
+    noise_file: str,
+    noise_threshold: int,
+    no_builtin_patterns: bool,
+    hide_noise: bool,
+    agents_dir: str,
+    agent_threshold: tuple,
+    skip_agent: tuple,
+    input_format: str,
+    parallel: bool,
+    max_concurrency: int,
+    cache_dir: str,
+    no_cache: bool,
+    coordination_dir: str,
+    fallback_provider: str,
+    fallback_model: str,
+    hedge_delay: float,
+    no_structured_output: bool,
+    timings: bool,
+    stats_json: str,
+) -> int:
+    """Run the batch command and return its exit code (the worst stack's)."""
+    from .batch import Stack, build_report, create_analyzer, expand_sources, load_manifest
+
+    platform_ctx = detect_platform()
+    ci, diff_ref, pr_title, pr_description, post_comment = apply_platform_defaults(
+        platform_ctx, ci, diff_ref, pr_title, pr_description, post_comment
+    )
+
+    # Command-line options are every stack's defaults
+    defaults = Stack(
+        name="",
+        whatif="",
+        diff=diff,
+        diff_ref=diff_ref,
+        bicep_dir=bicep_dir,
+        drift_threshold=drift_threshold,
+        intent_threshold=intent_threshold,
+        agent_thresholds=parse_agent_thresholds(agent_threshold),
+    )
+    stacks = expand_sources(sources, defaults)
+    if manifest:
+        stacks.extend(load_manifest(manifest, defaults))
+    if not stacks:
+        raise InputError("No What-If files given. Pass files or glob patterns, or --manifest.")
+
+    if ci:
+        print_banner()
+
+    enabled_buckets, parallel = prepare_buckets(
+        ci,
+        agents_dir,
+        parallel,
+        skip_drift,
+        skip_intent,
+        skip_agent,
+        pr_title,
+        pr_description,
+    )
+
+    noise_patterns = _load_noise_patterns(no_builtin_patterns, noise_file)
+
+    # One provider (and its pooled client, cache and rate budget) for all stacks
+    wrappers = {}
+
+    def provider_factory() -> Provider:
+        llm_provider, wrappers["flight"], wrappers["hedged"] = build_llm_provider(
+            provider,
+            model,
+            fallback_provider=fallback_provider,
+            fallback_model=fallback_model,
+            hedge_delay=hedge_delay,
+            coordination_dir=coordination_dir,
+            cache_dir=cache_dir,
+            no_cache=no_cache,
+        )
+        return llm_provider
+
+    analyzer = create_analyzer(
+        provider_factory,
+        noise_patterns,
+        provider,
+        model,
+        verbose=verbose,
+        enabled_buckets=enabled_buckets,
+        pr_title=pr_title,
+        pr_description=pr_description,
+        parallel=parallel,
+        structured_output=not no_structured_output,
+        noise_threshold=noise_threshold,
+        max_concurrency=max_concurrency,
+        input_format=input_format,
+        no_block=no_block,
+    )
+
+    recorder.phase("analyze")
+    sys.stderr.write(f"📚 Analyzing {len(stacks)} stack(s) ({min(jobs, len(stacks))} at a time)\n")
+    results = analyzer.run(stacks, jobs)
+    recorder.set("stacks", len(results))
+    recorder.set("stacks_failed", sum(1 for result in results if result.error is not None))
+    if analyzer.llm_provider is not None:
+        print_provider_summary(analyzer.llm_provider, wrappers["flight"], wrappers["hedged"])
+
+    recorder.phase("render")
+    batch_report = build_report(results, include_noise=not hide_noise)
+    format = format.lower()
+    if format == "table":
+        from .render import render_batch_table
+
+        render_batch_table(batch_report, verbose=verbose, no_color=no_color, ci_mode=ci)
+    elif format == "json":
+        from .render import render_batch_json
+
+        render_batch_json(batch_report)
+    if format == "markdown" or (ci and post_comment):
+        from .render import render_batch_markdown
+
+        markdown = render_batch_markdown(
+            batch_report,
+            ci_mode=ci,
+            custom_title=comment_title,
+            no_block=no_block,
+            platform=platform_ctx.platform,
+        )
+        if format == "markdown":
+            print(markdown)
+        if ci and post_comment:
+            recorder.phase("pr_comment")
+            recorder.set("comment_bytes", len(markdown.encode("utf-8")))
+            _post_pr_comment(markdown, pr_url)
+            recorder.stop()
+
+    verdict = batch_report["verdict"]
+    counts = ", ".join(
+        f"{verdict[status]} {status}"
+        for status in ("error", "unsafe", "review", "safe", "analyzed")
+        if status in verdict
+    )
+    sys.stderr.write(f"📚 Batch: {len(results)} stack(s): {counts}\n")
+
+    exit_code = max(result.exit_code for result in results)
+    unsafe = [result.stack.name for result in results if result.failed_buckets]
+    if unsafe:
+        names = ", ".join(unsafe)
+        if no_block:
+            sys.stderr.write(
+                f"⚠️  Warning: Unsafe stacks: {names} (pipeline not blocked due to --no-block)\n"
+            )
+        else:
+            sys.stderr.write(f"❌ Deployment blocked: Unsafe stacks: {names}\n")
+    return exit_code
+
+
+main.add_command(
+    click.Command(
+        "batch",
+        callback=_batch,
+        help=_batch.__doc__,
+        params=[param for param in main.params if param.name not in _BATCH_EXCLUDED_PARAMS]
+        + [
+            click.Argument(["sources"], nargs=-1),
+            click.Option(
+                ["--manifest"],
+                type=click.Path(dir_okay=False),
+                default=None,
+                help="YAML manifest of stacks with per-stack overrides",
+            ),
+            click.Option(
+                ["--jobs", "-j"],
+                type=click.IntRange(min=1),
+                default=4,
+                show_default=True,
+                help="Maximum number of stacks analyzed at once",
+            ),
+        ],
+    )
+)
 
-    Args:
-        bicep_dir: Directory containing Bicep files
 
-    Returns:
-        Combined content of all .bicep files, or None if no files found
+def _serve(host: str, port: int, workers: int):
+    """Serve analyses over HTTP for runs started with --server.
+
+    Keeps compiled noise patterns, custom agents, provider connections and
+    the response cache in memory between runs, reloading pattern and agent
+    files when they change. Runs send their What-If output to POST /analyze;
+    GET /health and GET /metrics report status and counters.
+
+        bicep-whatif-advisor serve --workers 8
+
+        az deployment group what-if ... | bicep-whatif-advisor --ci \\
+          --server http://127.0.0.1:8765
     """
-    from pathlib import Path
+    from .server import serve
 
-    # Resolve to absolute path and validate
     try:
-        base_path = Path(bicep_dir).resolve()
-    except (OSError, RuntimeError) as e:
-        sys.stderr.write(f"Warning: Could not resolve bicep directory: {e}\n")
-        return None
+        serve(host, port, workers)
+    except OSError as e:
+        sys.stderr.write(f"Error: Could not listen on {host}:{port}: {e}\n")
+        sys.exit(1)
 
-    if not base_path.exists() or not base_path.is_dir():
-        sys.stderr.write(
-            f"Warning: Bicep directory does not exist or is not a directory: {bicep_dir}\n"
+
+main.add_command(
+    click.Command(
+        "serve",
+        callback=_serve,
+        help=_serve.__doc__,
+        params=[
+            click.Option(
+                ["--host"],
+                default="127.0.0.1",
+                show_default=True,
+                help="Address to listen on",
+            ),
+            click.Option(
+                ["--port"],
+                type=click.IntRange(min=0, max=65535),
+                default=8765,
+                show_default=True,
+                help="Port to listen on",
+            ),
+            click.Option(
+                ["--workers"],
+                type=click.IntRange(min=1),
+                default=4,
+                show_default=True,
+                help="Maximum number of requests handled at once",
+            ),
+        ],
+    )
+)
+
+
+def _analyze_on_server(
+    url: str,
+    whatif_text: str,
+    diff_content: Optional[str],
+    bicep_content: Optional[str],
+    options: dict,
+) -> dict:
+    """Send the analysis to a serve instance, exiting with its code if it failed.
+
+    Returns:
+        The server's result, with high_confidence, low_confidence,
+        failed_buckets and review_buckets
+    """
+    from .server import PATH_OPTIONS, request_analysis
+
+    # The server may run in another directory
+    for name in PATH_OPTIONS:
+        if options.get(name):
+            options[name] = os.path.abspath(options[name])
+
+    sys.stderr.write(f"🛰️ Analyzing on {url}\n")
+    result = request_analysis(url, whatif_text, options, diff=diff_content, bicep=bicep_content)
+    if result["status"] == "error":
+        sys.stderr.write(f"Error: {result['error']}\n")
+        sys.exit(result["exit_code"] or 1)
+    return result
+
+
+def _record_provider_stats(
+    recorder: Recorder, llm_provider, system_prompts, user_prompts, response_texts
+) -> None:
+    """Record request sizes, token usage and cache/coalescing/hedging counts."""
+    # Each system prompt is sent with each user prompt: parallel mode has
+    # several system prompts, sharded mode several user prompts
+    recorder.set(
+        "prompt_bytes",
+        sum(
+            len(system_prompt.encode("utf-8")) + len(user_prompt.encode("utf-8"))
+            for system_prompt in system_prompts
+            for user_prompt in user_prompts
+        ),
+    )
+    recorder.set("response_bytes", sum(len(text.encode("utf-8")) for text in response_texts))
+
+    usage = llm_provider.usage
+    recorder.set("input_tokens", usage.input_tokens)
+    recorder.set("cached_input_tokens", usage.cached_input_tokens)
+    recorder.set("cache_write_tokens", usage.cache_write_tokens)
+    recorder.set("output_tokens", usage.output_tokens)
+
+    # Look through the wrappers for their counters
+    provider = llm_provider
+    while isinstance(provider, Provider):
+        if isinstance(provider, CachingProvider):
+            recorder.set("cache_hits", provider.hits)
+            recorder.set("cache_misses", provider.misses)
+        elif isinstance(provider, CoalescingProvider):
+            recorder.set("coalesced", provider.flight.coalesced)
+        elif isinstance(provider, HedgedProvider):
+            recorder.set("hedged", provider.hedged)
+            recorder.set("failovers", provider.failovers)
+            recorder.set("fallback_wins", provider.secondary_wins)
+        provider = getattr(provider, "provider", None)
+
+
+def _render_and_exit(
+    high_confidence_data: dict,
+    low_confidence_data: Optional[dict],
+    *,
+    format: str,
+    verbose: bool,
+    no_color: bool,
+    ci: bool,
+    comment_title: Optional[str],
+    no_block: bool,
+    platform: str,
+    whatif_content: Optional[str],
+    post_comment: bool,
+    pr_url: Optional[str],
+    is_safe: bool,
+    failed_buckets: list,
+    review_buckets: list,
+    recorder: Recorder,
+):
+    """Render the result, post the PR comment if requested and exit with the verdict's code.
+
+    ``low_confidence_data`` is the noise to display (None with --hide-noise)
+    and ``whatif_content`` the raw What-If output to include (--include-whatif).
+    """
+    # Render output
+    recorder.phase("render")
+    if format == "table":
+        render_table(
+            high_confidence_data,
+            verbose=verbose,
+            no_color=no_color,
+            ci_mode=ci,
+            low_confidence_data=low_confidence_data,
+        )
+    elif format == "json":
+        render_json(high_confidence_data, low_confidence_data=low_confidence_data)
+    elif format == "markdown":
+        markdown = render_markdown(
+            high_confidence_data,
+            ci_mode=ci,
+            custom_title=comment_title,
+            no_block=no_block,
+            low_confidence_data=low_confidence_data,
+            platform=platform,
+            whatif_content=whatif_content,
         )
-        return None
+        print(markdown)
 
-    # Find all .bicep files recursively
-    bicep_files = []
-    try:
-        for file_path in base_path.rglob("*.bicep"):
-            # Security: Ensure file is within base_path (prevent path traversal)
-            try:
-                file_path.resolve().relative_to(base_path)
-            except ValueError:
-                sys.stderr.write(f"Warning: Skipping file outside base directory: {file_path}\n")
-                continue
-
-            # Security: Skip symbolic links
-            if file_path.is_symlink():
-                sys.stderr.write(f"Warning: Skipping symbolic link: {file_path}\n")
-                continue
-
-            bicep_files.append(file_path)
-    except (OSError, PermissionError) as e:
-        sys.stderr.write(f"Warning: Error scanning bicep directory: {e}\n")
-        return None
-
-    if not bicep_files:
-        return None
-
-    # Read file contents (limit to 5 files to avoid huge context)
-    contents = []
-    for file_path in bicep_files[:5]:
+    # CI mode: post comment and exit
+    if ci:
+        # Post comment if requested
+        if post_comment:
+            recorder.phase("pr_comment")
+            markdown = render_markdown(
+                high_confidence_data,
+                ci_mode=True,
+                custom_title=comment_title,
+                no_block=no_block,
+                low_confidence_data=low_confidence_data,
+                platform=platform,
+                whatif_content=whatif_content,
+            )
+            recorder.set("comment_bytes", len(markdown.encode("utf-8")))
+            _post_pr_comment(markdown, pr_url)
+            recorder.stop()
+
+        # Show review buckets if any
+        if review_buckets:
+            review_names = ", ".join(review_buckets)
+            sys.stderr.write(f"👀 Review recommended: {review_names}\n")
+
+        # Exit with appropriate code
+        if is_safe:
+            sys.exit(0)  # Safe (or review) to deploy
+        else:
+            # Show which buckets failed
+            if failed_buckets:
+                bucket_names = ", ".join(failed_buckets)
+                if no_block:
+                    sys.stderr.write(
+                        f"⚠️  Warning: Failed risk buckets:"
+                        f" {bucket_names} (pipeline not blocked"
+                        f" due to --no-block)\n"
+                    )
+                else:
+                    sys.stderr.write(
+                        f"❌ Deployment blocked: Failed risk buckets: {bucket_names}\n"
+                    )
+
+            # Exit with 0 if --no-block is set, otherwise exit with 1
+            if no_block:
+                sys.stderr.write("ℹ️  CI mode: Reporting findings only (--no-block enabled)\n")
+                sys.exit(0)  # Don't block pipeline
+            else:
+                sys.exit(1)  # Unsafe, block deployment
+
+    # Standard mode: exit successfully
+    sys.exit(0)
+
+
+def _load_noise_patterns(no_builtin_patterns: bool, noise_file: Optional[str]) -> list:
+    """Load the built-in and user noise patterns, exiting with code 2 on a bad file."""
+    noise_patterns = []
+    if not no_builtin_patterns:
+        noise_patterns.extend(load_builtin_patterns())
+    if noise_file:
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                rel_path = file_path.relative_to(base_path)
-                contents.append(f"// File: {rel_path}\n{f.read()}")
-        except (OSError, UnicodeDecodeError) as e:
-            sys.stderr.write(f"Warning: Could not read {file_path}: {e}\n")
-            continue
-
-    return "\n\n".join(contents) if contents else None
+            noise_patterns.extend(load_user_patterns(noise_file))
+        except FileNotFoundError as e:
+            sys.stderr.write(f"Error: {e}\n")
+            sys.exit(2)
+        except IOError as e:
+            sys.stderr.write(f"Error reading noise file: {e}\n")
+            sys.exit(2)
+    return noise_patterns
+
+
+def _build_estimate(
+    profile,
+    prices: dict,
+    sections: dict,
+    system_tokens: list,
+    shard_tokens: list,
+    skipped: bool,
+    output_tokens: int,
+    resource_output_tokens: int,
+    max_concurrency: int,
+) -> dict:
+    """Project tokens, cost and latency for the requests an analysis would make.
+
+    Args:
+        profile: ModelProfile for the provider and model
+        prices: Price overrides from the estimate command (input_price, output_price)
+        sections: Tokens per prompt section for the largest request
+        system_tokens: Tokens in each system prompt (one per bucket with --parallel)
+        shard_tokens: Tokens of What-If output in each shard (one entry unless sharded)
+        skipped: Whether the LLM would be skipped (nothing actionable)
+        output_tokens: Expected response tokens across all requests
+        resource_output_tokens: Expected tokens of the per-resource responses,
+            the longest ones when requests run in parallel
+        max_concurrency: Maximum concurrent requests
+
+    Returns:
+        Estimate dict for render_estimate
+    """
+    if prices.get("input_price") is not None:
+        profile.input_price = prices["input_price"]
+    if prices.get("output_price") is not None:
+        profile.output_price = prices["output_price"]
+
+    prompt_tokens = sum(sections.values())
+    requests = 0 if skipped else len(system_tokens) * len(shard_tokens)
+    input_tokens = 0
+    latency = 0.0
+    if requests:
+        # User prompt tokens other than the What-If output (same in every request)
+        context_tokens = prompt_tokens - sections["system_prompt"] - sections["whatif_output"]
+        input_tokens = sum(
+            sum(system_tokens) + len(system_tokens) * (context_tokens + tokens)
+            for tokens in shard_tokens
+        )
+        # Requests run concurrently in waves; with --parallel the per-resource
+        # response is the longest of each shard's requests
+        per_request = (resource_output_tokens if len(system_tokens) > 1 else output_tokens) / len(
+            shard_tokens
+        )
+        waves = -(-requests // max_concurrency)
+        latency = waves * profile.latency(prompt_tokens, int(per_request))
+    else:
+        output_tokens = 0
+    cost = profile.cost(input_tokens, output_tokens)
+    max_output_tokens = output_reserve(profile, MAX_OUTPUT_TOKENS)
+
+    return {
+        "provider": profile.provider,
+        "model": profile.model,
+        "sections": sections,
+        "prompt_tokens": prompt_tokens,
+        "shards": len(shard_tokens),
+        "requests": requests,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "max_output_tokens": max_output_tokens,
+        "context_window": profile.context_window,
+        "headroom_tokens": profile.context_window - prompt_tokens - max_output_tokens,
+        "cost_usd": round(cost, 6) if cost is not None else None,
+        "latency_seconds": round(latency, 1),
+    }
 
 
 def _post_pr_comment(markdown: str, pr_url: str = None) -> None:
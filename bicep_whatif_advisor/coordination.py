@@ -0,0 +1,366 @@
+"""Cross-process coordination for advisor runs sharing one machine.
+
+Self-hosted CI runners often execute many advisor jobs at once against the
+same provider deployment. Pointing them at a shared directory
+(``WHATIF_COORDINATION_DIR`` or ``--coordination-dir``) lets them cooperate:
+
+- :class:`SharedTokenBucket` keeps the ``WHATIF_REQUESTS_PER_MINUTE`` /
+  ``WHATIF_TOKENS_PER_MINUTE`` balance in a small memory-mapped counter file
+  guarded by a file lock, so the budget applies to all processes together
+  rather than to each one;
+- :class:`SingleFlight` coalesces identical in-flight requests: the first
+  process to ask holds a per-request lock while it calls the provider, and
+  the others block on that lock and then read the result it published.
+
+Locks are released by the OS when a process exits, so a crashed job never
+wedges the others; if the leader fails, the next waiter makes the request.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Hashable, Iterator, Optional, Tuple
+
+from .cache import request_key
+from .providers import Provider
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+COORDINATION_DIR_ENV_VAR = "WHATIF_COORDINATION_DIR"
+
+# Published results are read by waiters within moments; older ones are pruned
+RESULT_TTL_SECONDS = 60 * 60
+
+# Accept results published slightly before a waiter started waiting (the
+# leader can publish between our failed lock attempt and its release)
+_PUBLISH_GRACE_SECONDS = 5.0
+
+# Bucket file layout: token balance, wall-clock time of the last update
+_BUCKET = struct.Struct("<dd")
+
+
+def _lock(fd: int, blocking: bool = True) -> bool:
+    """Take an exclusive lock on an open file; False if busy and not blocking."""
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+
+def _unlock(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, held through this object's descriptor.
+
+    Each instance opens its own descriptor, so two instances exclude each
+    other whether they live in different processes or different threads.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Lock the file, waiting for the holder unless ``blocking`` is False."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            locked = _lock(fd, blocking)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not locked:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+
+class SharedTokenBucket:
+    """Token bucket whose balance lives in a file shared between processes.
+
+    A drop-in for :class:`~bicep_whatif_advisor.providers.retry.TokenBucket`:
+    :meth:`reserve` has the same semantics, but every process mapping the
+    same file draws from one balance.
+    """
+
+    def __init__(self, path, per_minute: float):
+        """Open (creating if needed) the counter file.
+
+        Raises:
+            OSError: If the file cannot be created or mapped
+        """
+        self.path = Path(path)
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        # The file lock excludes other processes; threads of this one share
+        # the descriptor, so they also take this lock
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if os.fstat(self._fd).st_size < _BUCKET.size:
+                # Extending a file zero-fills it; a zero timestamp marks it new
+                os.ftruncate(self._fd, _BUCKET.size)
+            self._map = mmap.mmap(self._fd, _BUCKET.size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens, returning how long to wait before using them."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            _lock(self._fd)
+            try:
+                balance, updated = _BUCKET.unpack_from(self._map)
+                now = time.time()
+                if updated == 0:
+                    balance = self.capacity
+                else:
+                    refill = max(0.0, now - updated) * self.rate
+                    balance = min(self.capacity, balance + refill)
+                balance -= amount
+                _BUCKET.pack_into(self._map, 0, balance, now)
+            finally:
+                _unlock(self._fd)
+        return 0.0 if balance >= 0 else -balance / self.rate
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+def shared_bucket(local, directory, key: Hashable, kind: str):
+    """Replace a scheduler's in-process bucket with one shared through ``directory``.
+
+    Args:
+        local: The scheduler's TokenBucket, or None if that budget is unset
+        directory: Coordination directory
+        key: Scheduler key (provider and account/deployment); hashed for the file name
+        kind: Budget name ("requests" or "tokens")
+
+    Returns:
+        A SharedTokenBucket, or ``local`` if the directory is unusable
+    """
+    if local is None:
+        return None
+    name = hashlib.sha256(repr(tuple(key)).encode("utf-8")).hexdigest()[:32]
+    try:
+        return SharedTokenBucket(Path(directory) / "budgets" / f"{name}-{kind}", local.capacity)
+    except OSError as e:
+        sys.stderr.write(f"Warning: shared rate limit disabled, using a per-process one ({e}).\n")
+        return local
+
+
+class SingleFlight:
+    """Coalesces identical requests made concurrently by processes sharing a directory."""
+
+    def __init__(self, directory, result_ttl: float = RESULT_TTL_SECONDS):
+        """Initialize the coordinator.
+
+        Args:
+            directory: Coordination directory (``inflight/`` is created inside it)
+            result_ttl: Age after which published results are pruned
+        """
+        self.directory = Path(directory) / "inflight"
+        self.result_ttl = result_ttl
+        self.coalesced = 0
+        self.disabled = False
+
+    def join(self, key: str) -> Tuple[Optional[str], Optional[FileLock]]:
+        """Wait for any identical in-flight request and take its result.
+
+        Returns:
+            ``(result, None)`` if another process published a result while we
+            waited, otherwise ``(None, lock)``: the caller makes the request
+            itself and must pass the lock to :meth:`publish`, or release it
+            if the request fails.
+        """
+        lock = FileLock(self.directory / f"{key}.lock")
+        if self.disabled:
+            return None, lock
+        started = time.time()
+        try:
+            if lock.acquire(blocking=False):
+                return None, lock
+            lock.acquire()
+        except OSError as e:
+            # An unacquired lock: release() and publish() become no-ops
+            self.disabled = True
+            sys.stderr.write(f"Warning: request coalescing disabled ({e}).\n")
+            return None, lock
+        result = self._read(key, since=started - _PUBLISH_GRACE_SECONDS)
+        if result is None:
+            # The leader failed; try ourselves while waiters queue behind us
+            return None, lock
+        lock.release()
+        self.coalesced += 1
+        return result, None
+
+    def publish(self, key: str, lock: FileLock, result: str) -> None:
+        """Make ``result`` available to waiters, then release the lock."""
+        try:
+            if self.disabled:
+                return
+            path = self.directory / f"{key}.result"
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(
+                json.dumps({"published": time.time(), "response": result}), encoding="utf-8"
+            )
+            os.replace(str(tmp), str(path))
+            self._prune()
+        except OSError:
+            # Waiters will make the request themselves
+            pass
+        finally:
+            lock.release()
+
+    def run(self, key: str, request) -> str:
+        """Return the result of an identical in-flight request, or of ``request()``."""
+        result, lock = self.join(key)
+        if lock is None:
+            return result
+        try:
+            result = request()
+        except BaseException:
+            lock.release()
+            raise
+        self.publish(key, lock, result)
+        return result
+
+    def _read(self, key: str, since: float) -> Optional[str]:
+        try:
+            data = json.loads((self.directory / f"{key}.result").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("published", 0) < since:
+            return None
+        return data.get("response")
+
+    def _prune(self) -> None:
+        """Delete results older than the TTL.
+
+        Lock files are kept: another process may hold or wait on one, and
+        unlinking it would let the next process lock a new file and become
+        a second leader for the same key.
+        """
+        cutoff = time.time() - self.result_ttl
+        for path in self.directory.glob("*.result"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+class CoalescingProvider(Provider):
+    """Provider wrapper that shares identical in-flight requests via :class:`SingleFlight`."""
+
+    def __init__(self, provider: Provider, flight: SingleFlight):
+        self.provider = provider
+        self.flight = flight
+
+    @property
+    def usage(self):
+        """Token usage of the wrapped provider (coalesced requests add none)."""
+        return self.provider.usage
+
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        key = request_key(self.provider, system_prompt, user_prompt, response_schema)
+        return self.flight.run(
+            key, lambda: self.provider.complete(system_prompt, user_prompt, response_schema)
+        )
+
+    async def acomplete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        key = request_key(self.provider, system_prompt, user_prompt, response_schema)
+        import asyncio
+
+        # Waiting on the file lock blocks, so do it off the event loop
+        loop = asyncio.get_running_loop()
+        result, lock = await loop.run_in_executor(None, self.flight.join, key)
+        if lock is None:
+            return result
+        try:
+            result = await self.provider.acomplete(system_prompt, user_prompt, response_schema)
+        except BaseException:
+            lock.release()
+            raise
+        self.flight.publish(key, lock, result)
+        return result
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        key = request_key(self.provider, system_prompt, user_prompt, response_schema)
+        result, lock = self.flight.join(key)
+        if lock is None:
+            yield result
+            return
+        chunks = []
+        try:
+            stream = self.provider.stream(
+                system_prompt,
+                user_prompt,
+                idle_timeout=idle_timeout,
+                response_schema=response_schema,
+            )
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        except BaseException:
+            lock.release()
+            raise
+        self.flight.publish(key, lock, "".join(chunks))
@@ -0,0 +1,214 @@
+"""Hedged requests and failover to a secondary provider.
+
+A single slow completion holds up the whole run, and provider latency has a
+long tail. :class:`HedgedProvider` sends each request to the primary
+provider and, if no output has arrived after ``hedge_delay`` seconds, sends
+the same request to a secondary provider (another deployment, model or
+provider) as well. The first to finish wins and the other is cancelled.
+Hard failures of the primary fail over to the secondary instead of ending
+the run.
+
+Requests are made with the providers' ``stream`` method so the first token
+can be observed; the response text is the same as from ``complete``.
+Cancelling a request closes its stream, which closes the HTTP response.
+"""
+
+import queue
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from .providers import Provider, TokenUsage
+
+
+class HedgedProvider(Provider):
+    """Provider wrapper that hedges slow requests and fails over on errors.
+
+    Attributes:
+        primary: Primary provider
+        secondary: Provider used for hedged and failed-over requests
+        hedge_delay: Seconds to wait for the primary's first token before
+            hedging, or None to only fail over
+        requests: Requests made through this wrapper
+        hedged: Requests also sent to the secondary because the primary was slow
+        failovers: Requests sent to the secondary because the primary failed
+        secondary_wins: Requests answered by the secondary
+    """
+
+    def __init__(self, primary: Provider, secondary: Provider, hedge_delay: Optional[float] = None):
+        self.primary = primary
+        self.secondary = secondary
+        self.hedge_delay = hedge_delay
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.secondary_wins = 0
+        self._lock = threading.Lock()
+
+    @property
+    def usage(self) -> TokenUsage:
+        """Token usage of both providers, including cancelled requests that reported it."""
+        usage = TokenUsage()
+        for provider in (self.primary, self.secondary):
+            usage.input_tokens += provider.usage.input_tokens
+            usage.output_tokens += provider.usage.output_tokens
+            usage.cached_input_tokens += provider.usage.cached_input_tokens
+            usage.cache_write_tokens += provider.usage.cache_write_tokens
+            usage.requests += provider.usage.requests
+        return usage
+
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Return the response of whichever provider finishes first.
+
+        Raises:
+            ProviderError: The primary's error, if both providers fail
+        """
+        return "".join(
+            self._race(system_prompt, user_prompt, None, response_schema, first_chunk_wins=False)
+        )
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        """Stream from whichever provider produces output first.
+
+        Once a provider has produced output the other is cancelled, and
+        errors after that point are raised rather than failed over.
+
+        Raises:
+            ProviderError: On errors after output has started, or the
+                primary's error if both providers fail first
+        """
+        return self._race(
+            system_prompt, user_prompt, idle_timeout, response_schema, first_chunk_wins=True
+        )
+
+    def warm_up(self) -> None:
+        self.primary.warm_up()
+        self.secondary.warm_up()
+
+    def describe(self) -> str:
+        """One-line summary of hedging for stderr."""
+        return (
+            f"{self.hedged} of {self.requests} request(s) hedged, {self.failovers} failover(s),"
+            f" {self.secondary_wins} answered by the fallback"
+        )
+
+    def _count(self, attribute: str) -> None:
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def _race(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float],
+        response_schema: Optional[dict],
+        first_chunk_wins: bool,
+    ) -> Iterator[str]:
+        self._count("requests")
+        events: "queue.Queue" = queue.Queue()
+        request = (system_prompt, user_prompt, idle_timeout, response_schema)
+        primary = _Attempt(self.primary, request, events)
+        secondary: Optional[_Attempt] = None
+        attempts = [primary]
+        deadline = None
+        if self.hedge_delay is not None:
+            deadline = time.monotonic() + self.hedge_delay
+        winner: Optional[_Attempt] = None
+        primary_error: Optional[BaseException] = None
+
+        def start_secondary(reason: str) -> _Attempt:
+            self._count(reason)
+            attempt = _Attempt(self.secondary, request, events)
+            attempts.append(attempt)
+            return attempt
+
+        try:
+            while True:
+                timeout = None
+                if deadline is not None and secondary is None:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    kind, attempt, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    # No first token from the primary in time: hedge
+                    secondary = start_secondary("hedged")
+                    continue
+                if attempt.cancelled or (winner is not None and attempt is not winner):
+                    continue
+
+                if kind == "chunk":
+                    attempt.chunks.append(value)
+                    if attempt is primary:
+                        deadline = None
+                    if first_chunk_wins:
+                        if winner is None:
+                            winner = attempt
+                            _cancel(a for a in attempts if a is not winner)
+                        yield value
+                elif kind == "done":
+                    if attempt is not primary:
+                        self._count("secondary_wins")
+                    _cancel(a for a in attempts if a is not attempt)
+                    if not first_chunk_wins:
+                        yield "".join(attempt.chunks)
+                    return
+                else:
+                    if attempt is winner:
+                        raise value
+                    attempt.failed = True
+                    if attempt is primary:
+                        primary_error = value
+                        if secondary is None:
+                            secondary = start_secondary("failovers")
+                    if all(a.failed for a in attempts):
+                        raise primary_error or value
+        finally:
+            _cancel(attempts)
+
+
+class _Attempt:
+    """One provider's stream, read on a daemon thread into a shared event queue."""
+
+    def __init__(self, provider: Provider, request: tuple, events: "queue.Queue"):
+        """Start streaming ``request`` (system prompt, user prompt, idle timeout, schema)."""
+        self.chunks: List[str] = []
+        self.cancelled = False
+        self.failed = False
+        self._provider = provider
+        self._request = request
+        self._events = events
+        threading.Thread(target=self._run, name="hedged-request", daemon=True).start()
+
+    def _run(self) -> None:
+        system_prompt, user_prompt, idle_timeout, response_schema = self._request
+        stream = None
+        try:
+            stream = self._provider.stream(
+                system_prompt,
+                user_prompt,
+                idle_timeout=idle_timeout,
+                response_schema=response_schema,
+            )
+            for chunk in stream:
+                if self.cancelled:
+                    return
+                self._events.put(("chunk", self, chunk))
+            self._events.put(("done", self, None))
+        except Exception as e:
+            self._events.put(("error", self, e))
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+
+
+def _cancel(attempts) -> None:
+    for attempt in attempts:
+        attempt.cancelled = True
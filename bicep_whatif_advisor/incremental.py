@@ -0,0 +1,225 @@
+"""Incremental re-analysis across pushes (``--incremental``).
+
+Each push to a pull request usually changes a few resources of a large
+deployment, yet every run sends the whole What-If output to the LLM. With
+``--incremental`` every resource block that survives noise filtering is
+fingerprinted (:func:`~bicep_whatif_advisor.noise_filter.block_fingerprint`),
+and the LLM's row for it (summary, confidence and, in CI mode, the concerns
+attributed to it in each risk bucket) is stored under that fingerprint.
+The next run sends only blocks without a stored result. It merges the
+stored rows back into the response before confidence filtering, so the
+bucket assessment and verdict cover the merged set.
+
+Stored results are reused only with the same provider, model and system
+prompt. The system prompt covers the output mode, the enabled buckets and
+the PR title and description. The code diff and Bicep source are not part
+of the key, so an unchanged block keeps its earlier drift assessment. Like
+the response cache, the store lives in the cache directory, expires
+entries after a TTL and only warns if it cannot be used.
+"""
+
+import hashlib
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .cache import CACHE_SCHEMA_VERSION, SQLiteStore
+
+
+class ResultStore(SQLiteStore):
+    """SQLite store of per-resource results keyed by analysis context and fingerprint."""
+
+    description = "incremental result store"
+    db_name = "resources.sqlite3"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS results ("
+        "context TEXT NOT NULL, fingerprint TEXT NOT NULL, result TEXT NOT NULL,"
+        " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+        " PRIMARY KEY (context, fingerprint))"
+    )
+
+    def load(self, context: str) -> Dict[str, dict]:
+        """Return the unexpired results stored for ``context``, by fingerprint."""
+        now = time.time()
+        rows = []
+        with self.connect() as conn:
+            if conn is None:
+                return {}
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+            rows = conn.execute(
+                "SELECT fingerprint, result FROM results WHERE context = ?", (context,)
+            ).fetchall()
+            conn.execute("UPDATE results SET accessed_at = ? WHERE context = ?", (now, context))
+
+        results = {}
+        for fingerprint, text in rows:
+            try:
+                results[fingerprint] = json.loads(text)
+            except ValueError:
+                continue
+        return results
+
+    def save(self, context: str, results: Dict[str, dict]) -> None:
+        """Store results by fingerprint, then enforce the size bound."""
+        if not results:
+            return
+        now = time.time()
+        rows = []
+        for fingerprint, result in results.items():
+            text = json.dumps(result)
+            rows.append((context, fingerprint, text, len(text.encode("utf-8")), now, now))
+        with self.connect() as conn:
+            if conn is None:
+                return
+            conn.executemany(
+                "INSERT OR REPLACE INTO results"
+                " (context, fingerprint, result, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+
+    def _evict(self, conn) -> None:
+        """Delete least recently used results until the total size fits."""
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        if total <= self.max_bytes:
+            return
+        for context, fingerprint, size in conn.execute(
+            "SELECT context, fingerprint, size FROM results ORDER BY accessed_at ASC"
+        ).fetchall():
+            conn.execute(
+                "DELETE FROM results WHERE context = ? AND fingerprint = ?", (context, fingerprint)
+            )
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def context_key(provider: str, model: Optional[str], system_prompts: List[str]) -> str:
+    """Identify the analysis context results are valid in.
+
+    Args:
+        provider: Provider name
+        model: Model override (None for the provider's default)
+        system_prompts: The run's system prompt(s)
+    """
+    from .providers import resolve_model
+
+    provider, model = resolve_model(provider, model)
+    parts = [provider, str(model or ""), str(CACHE_SCHEMA_VERSION), *system_prompts]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def collect_results(
+    data: dict, kept_resources: List[dict], enabled_buckets: Optional[List[str]]
+) -> Dict[str, dict]:
+    """Pair the rows of a parsed LLM response with the blocks they describe.
+
+    Rows are matched to fingerprinted (analyzed) blocks by resource name and
+    action. Names shared by several blocks are skipped, because the concerns
+    in ``resource_concerns`` are attributed by name only. In CI mode nothing
+    is collected unless every enabled bucket attributes its concerns, since
+    a reused row must carry its concerns into the next assessment.
+
+    Args:
+        data: Parsed LLM response, before post-processing
+        kept_resources: FilterResult.kept_resources of a run with ``reuse``
+        enabled_buckets: Enabled bucket IDs in CI mode, None otherwise
+
+    Returns:
+        Results to store, by block fingerprint
+    """
+    from .ci.risk_buckets import resource_key
+
+    attributions = {}
+    if enabled_buckets is not None:
+        risk_assessment = data.get("risk_assessment") or {}
+        for bucket_id in enabled_buckets:
+            concerns = (risk_assessment.get(bucket_id) or {}).get("resource_concerns")
+            if not isinstance(concerns, list):
+                return {}
+            attributions[bucket_id] = concerns
+
+    names = Counter(resource_key(r["resource_name"]) for r in kept_resources)
+    rows = {}
+    for row in data.get("resources") or []:
+        if isinstance(row, dict):
+            rows.setdefault(resource_key(row.get("resource_name")), []).append(row)
+
+    results = {}
+    for block in kept_resources:
+        if "fingerprint" not in block or block.get("reused"):
+            continue
+        name = resource_key(block["resource_name"])
+        matches = rows.get(name, [])
+        if names[name] != 1 or len(matches) != 1:
+            continue
+        row = matches[0]
+        if str(row.get("action", "")).lower() != block["operation"].lower():
+            continue
+        results[block["fingerprint"]] = {
+            "resource": row,
+            "concerns": {
+                bucket_id: [
+                    c
+                    for c in concerns
+                    if isinstance(c, dict) and resource_key(c.get("resource_name")) == name
+                ]
+                for bucket_id, concerns in attributions.items()
+            },
+        }
+    return results
+
+
+def merge_results(
+    data: dict,
+    reused: List[dict],
+    enabled_buckets: Optional[List[str]],
+    analyzed: bool = True,
+) -> None:
+    """Merge reused results into a response, in place.
+
+    Rows are appended to ``resources``. In CI mode each bucket's stored
+    concerns form one more part of the assessment, merged with the LLM's
+    like a shard's (highest level, union of concerns and attributions).
+
+    Args:
+        data: Parsed response for the analyzed blocks, or one built locally
+        reused: Stored results (see :func:`collect_results`)
+        enabled_buckets: Enabled bucket IDs in CI mode, None otherwise
+        analyzed: False if nothing was sent to the LLM and ``data`` was
+            built locally; its summary and assessment are then replaced
+    """
+    from .ci.risk_buckets import merge_risk_assessments, validate_risk_level
+    from .ci.verdict import RISK_LEVELS
+
+    data.setdefault("resources", []).extend(result["resource"] for result in reused)
+    if not analyzed:
+        data["overall_summary"] = (
+            f"No new or changed resources since the last analysis; reused the results"
+            f" for {len(reused)} resource(s)."
+        )
+    if enabled_buckets is None:
+        return
+
+    carried = {}
+    for bucket_id in enabled_buckets:
+        concerns = [c for result in reused for c in result["concerns"].get(bucket_id, [])]
+        levels = [validate_risk_level(str(c.get("risk_level", "low"))) for c in concerns]
+        texts = [str(c["concern"]) for c in concerns if c.get("concern")]
+        carried[bucket_id] = {
+            "risk_level": max(levels, key=RISK_LEVELS.index, default="low"),
+            "concerns": texts,
+            "concern_summary": "; ".join(texts) if texts else "None",
+            "resource_concerns": concerns,
+            "reasoning": f"Carried over from the analysis of {len(reused)} unchanged resource(s).",
+        }
+    parts = [carried]
+    if analyzed:
+        parts.insert(0, data.get("risk_assessment") or {})
+    elif "verdict" in data:
+        data["verdict"]["reasoning"] = (
+            "No resource changed since the last analysis; its results were reused."
+        )
+    data["risk_assessment"] = merge_risk_assessments(parts)
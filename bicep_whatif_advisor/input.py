@@ -1,6 +1,29 @@
 """Input validation and stdin reading for bicep-whatif-advisor."""
 
 import sys
+from pathlib import Path
+from typing import IO, Iterator, List, Optional
+
+# Maximum What-If characters sent to the LLM
+MAX_WHATIF_CHARS = 100000
+
+# Maximum raw What-If characters pasted into a report by --include-whatif;
+# the whole PR comment must stay under GitHub's 65,536-character limit
+MAX_INCLUDED_WHATIF_CHARS = 50000
+
+# Characters read from the input stream per read() call
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Text expected somewhere in genuine What-If output (soft check)
+WHATIF_MARKERS = [
+    "Resource changes:",
+    "+ Create",
+    "~ Modify",
+    "- Delete",
+    "Resource and property changes",
+    "Scope:",
+    '"changeType"',  # what-if --output json
+]
 
 
 class InputError(Exception):
@@ -9,7 +32,7 @@ class InputError(Exception):
     pass
 
 
-def read_stdin(max_chars: int = 100000) -> str:
+def read_stdin(max_chars: int = MAX_WHATIF_CHARS) -> str:
     """Read and validate What-If output from stdin.
 
     Args:
@@ -21,12 +44,7 @@ def read_stdin(max_chars: int = 100000) -> str:
     Raises:
         InputError: If stdin is a TTY, empty, or doesn't look like What-If output
     """
-    # Check if stdin is a TTY (interactive terminal, not piped)
-    if sys.stdin.isatty():
-        raise InputError(
-            "No input detected. Pipe Azure What-If output to this command:\n"
-            "  az deployment group what-if ... | bicep-whatif-advisor"
-        )
+    _check_not_tty()
 
     # Read all stdin
     content = sys.stdin.read()
@@ -45,22 +63,215 @@ def read_stdin(max_chars: int = 100000) -> str:
 
     # Basic validation: check for What-If markers
     # This is a soft check - we warn but don't fail
-    whatif_markers = [
-        "Resource changes:",
-        "+ Create",
-        "~ Modify",
-        "- Delete",
-        "Resource and property changes",
-        "Scope:",
-    ]
-
-    has_marker = any(marker in content for marker in whatif_markers)
+    has_marker = any(marker in content for marker in WHATIF_MARKERS)
 
     if not has_marker:
+        _warn_missing_markers()
+
+    return content
+
+
+def _warn_missing_markers() -> None:
+    sys.stderr.write(
+        "Warning: Input may not be Azure What-If output. "
+        "Expected to find markers like 'Resource changes:' or '+ Create'. "
+        "Attempting to proceed anyway.\n"
+    )
+
+
+def iter_lines(stream: IO[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield lines (with line endings) from a text stream read in chunks.
+
+    Args:
+        stream: Readable text stream
+        chunk_size: Characters to request per read() call
+
+    Yields:
+        Lines as produced by ``str.splitlines(keepends=True)``
+    """
+    pending = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).splitlines(keepends=True)
+        # The last line may continue in the next chunk (including a "\r"
+        # whose "\n" has not arrived yet), so always hold it back.
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+class WhatIfStream:
+    """Line iterator over What-If output that validates the input as it is read.
+
+    Iterate it once (e.g. through the noise filter), then call
+    :meth:`validate` to apply the same checks as :func:`read_stdin`.
+
+    Attributes:
+        chars_read: Characters consumed so far
+    """
+
+    def __init__(
+        self,
+        stream: IO[str],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        keep_text: bool = False,
+        max_kept_chars: int = MAX_INCLUDED_WHATIF_CHARS,
+    ):
+        """Initialize the reader.
+
+        Args:
+            stream: Readable text stream (usually sys.stdin)
+            chunk_size: Characters to request per read() call
+            keep_text: Retain the raw input so it is available as :attr:`text`
+                (needed for --include-whatif)
+            max_kept_chars: Stop retaining lines once this many characters
+                are kept; the kept text then runs one line past the limit
+                so :func:`truncate_included_whatif` can tell it was cut
+        """
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._kept: Optional[List[str]] = [] if keep_text else None
+        self._kept_chars = 0
+        self._max_kept_chars = max_kept_chars
+        self._has_content = False
+        self._has_marker = False
+        self.chars_read = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for line in iter_lines(self._stream, self._chunk_size):
+            self.chars_read += len(line)
+            if not self._has_content and line.strip():
+                self._has_content = True
+            if not self._has_marker and any(marker in line for marker in WHATIF_MARKERS):
+                self._has_marker = True
+            if self._kept is not None and self._kept_chars <= self._max_kept_chars:
+                self._kept.append(line)
+                self._kept_chars += len(line)
+            yield line
+
+    @property
+    def text(self) -> Optional[str]:
+        """Raw input kept so far (see max_kept_chars), or None if keep_text was not requested."""
+        if self._kept is None:
+            return None
+        return "".join(self._kept)
+
+    def validate(self) -> None:
+        """Validate the consumed input.
+
+        Raises:
+            InputError: If the input was empty or whitespace only
+        """
+        if not self._has_content:
+            raise InputError("No What-If output received. Input is empty.")
+        if not self._has_marker:
+            _warn_missing_markers()
+
+
+def open_stdin(chunk_size: int = DEFAULT_CHUNK_SIZE, keep_text: bool = False) -> WhatIfStream:
+    """Open piped stdin for streaming What-If input.
+
+    Unlike :func:`read_stdin`, nothing is read up front; the returned
+    :class:`WhatIfStream` reads in chunks as it is iterated.
+
+    Args:
+        chunk_size: Characters to request per read() call
+        keep_text: Retain the raw input for later use (see WhatIfStream)
+
+    Returns:
+        WhatIfStream over sys.stdin
+
+    Raises:
+        InputError: If stdin is a TTY
+    """
+    _check_not_tty()
+    return WhatIfStream(sys.stdin, chunk_size=chunk_size, keep_text=keep_text)
+
+
+def truncate_included_whatif(text: str, max_chars: int = MAX_INCLUDED_WHATIF_CHARS) -> str:
+    """Cap raw What-If output included in a report, cutting at a line boundary.
+
+    Args:
+        text: Raw What-If output
+        max_chars: Characters to keep at most
+
+    Returns:
+        The text, or its first whole lines within ``max_chars`` followed by a
+        truncation note
+    """
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars) + 1 or max_chars
+    return text[:cut] + f"... (truncated to the first {cut:,} characters)\n"
+
+
+def _check_not_tty() -> None:
+    # Check if stdin is a TTY (interactive terminal, not piped)
+    if sys.stdin.isatty():
+        raise InputError(
+            "No input detected. Pipe Azure What-If output to this command:\n"
+            "  az deployment group what-if ... | bicep-whatif-advisor"
+        )
+
+
+def load_bicep_files(bicep_dir: str) -> Optional[str]:
+    """Load all Bicep files from directory for context.
+
+    Args:
+        bicep_dir: Directory containing Bicep files
+
+    Returns:
+        Combined content of all .bicep files, or None if no files found
+    """
+    # Resolve to absolute path and validate
+    try:
+        base_path = Path(bicep_dir).resolve()
+    except (OSError, RuntimeError) as e:
+        sys.stderr.write(f"Warning: Could not resolve bicep directory: {e}\n")
+        return None
+
+    if not base_path.exists() or not base_path.is_dir():
         sys.stderr.write(
-            "Warning: Input may not be Azure What-If output. "
-            "Expected to find markers like 'Resource changes:' or '+ Create'. "
-            "Attempting to proceed anyway.\n"
+            f"Warning: Bicep directory does not exist or is not a directory: {bicep_dir}\n"
         )
+        return None
 
-    return content
+    # Find all .bicep files recursively
+    bicep_files = []
+    try:
+        for file_path in base_path.rglob("*.bicep"):
+            # Security: Ensure file is within base_path (prevent path traversal)
+            try:
+                file_path.resolve().relative_to(base_path)
+            except ValueError:
+                sys.stderr.write(f"Warning: Skipping file outside base directory: {file_path}\n")
+                continue
+
+            # Security: Skip symbolic links
+            if file_path.is_symlink():
+                sys.stderr.write(f"Warning: Skipping symbolic link: {file_path}\n")
+                continue
+
+            bicep_files.append(file_path)
+    except (OSError, PermissionError) as e:
+        sys.stderr.write(f"Warning: Error scanning bicep directory: {e}\n")
+        return None
+
+    if not bicep_files:
+        return None
+
+    # Read file contents (limit to 5 files to avoid huge context)
+    contents = []
+    for file_path in bicep_files[:5]:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                rel_path = file_path.relative_to(base_path)
+                contents.append(f"// File: {rel_path}\n{f.read()}")
+        except (OSError, UnicodeDecodeError) as e:
+            sys.stderr.write(f"Warning: Could not read {file_path}: {e}\n")
+            continue
+
+    return "\n\n".join(contents) if contents else None
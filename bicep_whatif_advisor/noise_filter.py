@@ -31,18 +31,20 @@ Pattern file format (one pattern per line, # for comments):
   Plain text (default)  — case-insensitive substring anywhere in the line
   regex: <pattern>      — Python re.search(), case-insensitive
   fuzzy: <pattern>      — legacy fuzzy similarity (SequenceMatcher)
+  path: <property.path> — exact property path, case-insensitive; ``*`` is a wildcard
   resource: <type>[:op] — remove matching resource blocks pre-LLM; also demote post-LLM
 
-Property-level patterns (keyword/regex/fuzzy) only match property-change lines
+Property-level patterns (keyword/regex/fuzzy/path) only match property-change lines
 (indented 4+ spaces with a ~ / + / - change symbol). Resource-level header lines
 and attribute lines are never touched by property patterns.
 """
 
+import hashlib
 import re
 from dataclasses import dataclass, field
 from difflib import SequenceMatcher
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Container, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Minimum leading-space indent for a property change line.
 # Resource-level lines use 2 spaces; property-level lines use 6+.
@@ -59,21 +61,42 @@ _SYMBOL_TO_OPERATION = {
     "=": "Deploy",
     "*": "NoChange",
     "x": "Ignore",
+    "!": "Unsupported",
 }
 
 # Valid operation names for resource: patterns.
-_VALID_OPERATIONS = frozenset({"Modify", "Create", "Delete", "Deploy", "NoChange", "Ignore"})
+_VALID_OPERATIONS = frozenset(_SYMBOL_TO_OPERATION.values())
+
+# Operations that change nothing that needs review: "=" Deploy, "*" NoChange, "x" Ignore.
+_NON_ACTIONABLE_OPERATIONS = frozenset({"Deploy", "NoChange", "Ignore"})
+
+# Lowercase operation name -> canonical operation name.
+_OPERATION_LOOKUP = {v.lower(): v for v in _VALID_OPERATIONS}
 
 # Regex for a resource header line: 2-space indent + change symbol + space + ARM type with /
 _RESOURCE_HEADER_RE = re.compile(r"^  ([~+\-=*x!])\s+(\S+/\S+)")
 
+# A regex that starts with a global inline flag group (e.g. "(?s)") cannot be
+# fused into an alternation without changing the meaning of its neighbours.
+_GLOBAL_FLAGS_RE = re.compile(r"^\(\?[aiLmsux]+\)")
+
+# Backreferences are numbered/named relative to the whole expression, so a
+# regex that uses them must be matched on its own.
+_BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=")
+
+# Property path at the start of a property change line ("~ properties.foo: ...").
+_PROPERTY_PATH_RE = re.compile(r"^\s*[~+\-]\s+(.+?):(?:\s|$)")
+
+# Upper bound on memoized line results before the memo is reset.
+_MEMO_MAX_ENTRIES = 100000
+
 
 @dataclass
 class ParsedPattern:
     """A noise pattern parsed from a patterns file."""
 
     raw: str  # Original line from the file
-    pattern_type: str  # "keyword", "regex", "fuzzy", or "resource"
+    pattern_type: str  # "keyword", "regex", "fuzzy", "path", or "resource"
     value: str  # The pattern value to match against
 
 
@@ -87,6 +110,10 @@ class _ResourceBlock:
     lines: List[str]  # All lines in this block (header + attributes + properties)
     # Indices of property-change lines within self.lines
     property_change_indices: List[int] = field(default_factory=list)
+    # Exact property path per property-change line index, when known from
+    # structured input (JSON). Text input leaves this empty and the path is
+    # read from the line itself.
+    property_paths: Dict[int, str] = field(default_factory=dict)
 
 
 # ---------------------------------------------------------------------------
@@ -100,6 +127,8 @@ def _parse_pattern_line(line: str) -> ParsedPattern:
         return ParsedPattern(raw=line, pattern_type="regex", value=line[len("regex:") :].strip())
     if line.startswith("fuzzy:"):
         return ParsedPattern(raw=line, pattern_type="fuzzy", value=line[len("fuzzy:") :].strip())
+    if line.startswith("path:"):
+        return ParsedPattern(raw=line, pattern_type="path", value=line[len("path:") :].strip())
     if line.startswith("resource:"):
         value = line[len("resource:") :].strip()
         return ParsedPattern(raw=line, pattern_type="resource", value=value)
@@ -170,6 +199,23 @@ def _is_property_change_line(line: str) -> bool:
     return stripped[0] in _CHANGE_SYMBOLS
 
 
+def _extract_property_path(line: str) -> Optional[str]:
+    """Return the property path from a property change line, or None.
+
+    For ``"      ~ properties.sku.name: "A" => "B""`` this is
+    ``"properties.sku.name"``. Nested lines inside arrays/objects in text
+    output carry paths relative to their parent, so text-mode paths are best
+    effort; JSON input supplies exact paths via ``_ResourceBlock.property_paths``.
+    """
+    m = _PROPERTY_PATH_RE.match(line)
+    return m.group(1).strip() if m else None
+
+
+def _path_pattern_regex(value: str) -> str:
+    """Translate a path: pattern to a regex (``*`` wildcard, everything else literal)."""
+    return ".*".join(re.escape(part) for part in value.split("*"))
+
+
 def _matches_pattern(line: str, pattern: ParsedPattern, fuzzy_threshold: float = 0.80) -> bool:
     """Check if a line matches a pattern using the pattern's strategy.
 
@@ -191,9 +237,214 @@ def _matches_pattern(line: str, pattern: ParsedPattern, fuzzy_threshold: float =
     if pattern.pattern_type == "fuzzy":
         ratio = SequenceMatcher(None, pattern.value.lower(), line.lower()).ratio()
         return ratio >= fuzzy_threshold
+    if pattern.pattern_type == "path":
+        path = _extract_property_path(line)
+        if path is None:
+            return False
+        return bool(re.fullmatch(_path_pattern_regex(pattern.value), path, re.IGNORECASE))
     return False
 
 
+# ---------------------------------------------------------------------------
+# Compiled matcher
+# ---------------------------------------------------------------------------
+
+
+def _build_keyword_regex(keywords: Iterable[str]) -> Optional["re.Pattern"]:
+    """Fold lowercase keywords into a single prefix-trie regex.
+
+    Keywords sharing a prefix share a branch, so the regex engine walks the
+    line once per start position instead of once per keyword (the same idea
+    as an Aho-Corasick automaton, executed by the C regex engine). A keyword
+    that is a prefix of another makes the longer one redundant for substring
+    matching, so the trie is pruned at the first terminal node.
+
+    Returns:
+        Compiled pattern, or None if there are no non-empty keywords
+    """
+    trie: Dict[str, dict] = {}
+    for keyword in keywords:
+        if not keyword:
+            continue
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node.clear()
+        node[""] = {}
+
+    if not trie:
+        return None
+
+    def _emit(node: dict) -> str:
+        if "" in node:
+            return ""
+        branches = [re.escape(ch) + _emit(child) for ch, child in sorted(node.items())]
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return re.compile(_emit(trie))
+
+
+class NoiseMatcher:
+    """Property-line matcher compiled once from a list of ParsedPatterns.
+
+    Equivalent to calling :func:`_matches_pattern` for every property pattern,
+    but with the per-line cost independent of the number of patterns:
+
+    - All keyword patterns are folded into one trie regex run against the
+      line lowercased once.
+    - All regex patterns are fused into one alternation with a named group
+      per pattern, so the pattern that hit is still known.
+    - Fuzzy patterns share one SequenceMatcher per line.
+    - Path patterns are fused into one alternation matched against the
+      line's full property path.
+    - Results are memoized per distinct line, since the same noisy property
+      lines repeat across resource blocks.
+
+    Resource (``resource:``) patterns are ignored.
+    """
+
+    def __init__(self, patterns: list, fuzzy_threshold: float = 0.80):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.patterns = [p for p in patterns if p.pattern_type != "resource"]
+
+        # Keywords: lowercase value -> first pattern with that value
+        self._keywords: Dict[str, ParsedPattern] = {}
+        self._matches_all: Optional[ParsedPattern] = None
+        regex_patterns = []
+        self._fuzzy: List[Tuple[str, ParsedPattern]] = []
+        path_patterns = []
+
+        for pattern in self.patterns:
+            if pattern.pattern_type == "keyword":
+                value = pattern.value.lower()
+                if not value:
+                    # Empty keyword is a substring of every line
+                    self._matches_all = self._matches_all or pattern
+                self._keywords.setdefault(value, pattern)
+            elif pattern.pattern_type == "regex":
+                regex_patterns.append(pattern)
+            elif pattern.pattern_type == "fuzzy":
+                self._fuzzy.append((pattern.value.lower(), pattern))
+            elif pattern.pattern_type == "path":
+                path_patterns.append(pattern)
+
+        self._keyword_re = _build_keyword_regex(self._keywords)
+        self._fused_re: Optional[re.Pattern] = None
+        self._fused_groups: Dict[str, ParsedPattern] = {}
+        self._single_res: List[Tuple[re.Pattern, ParsedPattern]] = []
+        self._compile_regexes(regex_patterns)
+
+        self._path_re: Optional[re.Pattern] = None
+        self._path_groups: Dict[str, ParsedPattern] = {}
+        if path_patterns:
+            alternation = []
+            for i, pattern in enumerate(path_patterns):
+                name = f"_q{i}"
+                self._path_groups[name] = pattern
+                alternation.append(f"(?P<{name}>{_path_pattern_regex(pattern.value)})")
+            self._path_re = re.compile("|".join(alternation), re.IGNORECASE)
+
+        self._memo: Dict[object, Optional[ParsedPattern]] = {}
+
+    def _compile_regexes(self, regex_patterns: list) -> None:
+        """Fuse fusable regex patterns; keep the rest as individual regexes."""
+        fusable = []
+        for pattern in regex_patterns:
+            try:
+                compiled = re.compile(pattern.value, re.IGNORECASE)
+            except re.error:
+                # Invalid regexes never match (same as _matches_pattern)
+                continue
+            if _GLOBAL_FLAGS_RE.match(pattern.value) or _BACKREF_RE.search(pattern.value):
+                self._single_res.append((compiled, pattern))
+            else:
+                fusable.append((compiled, pattern))
+
+        if not fusable:
+            return
+
+        groups = {}
+        alternation = []
+        for i, (_, pattern) in enumerate(fusable):
+            name = f"_p{i}"
+            groups[name] = pattern
+            alternation.append(f"(?P<{name}>{pattern.value})")
+        try:
+            self._fused_re = re.compile("|".join(alternation), re.IGNORECASE)
+            self._fused_groups = groups
+        except re.error:
+            # e.g. a user regex reusing one of our group names
+            self._single_res.extend(fusable)
+
+    def match(self, line: str, path: Optional[str] = None) -> Optional[ParsedPattern]:
+        """Return the first pattern matching this line, or None.
+
+        Args:
+            line: Property change line
+            path: Exact property path of the line, if known. When omitted,
+                path: patterns match against the path read from the line.
+        """
+        key = line if path is None else (line, path)
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+
+        hit = self._match_uncached(line, path)
+        if len(self._memo) >= _MEMO_MAX_ENTRIES:
+            self._memo.clear()
+        self._memo[key] = hit
+        return hit
+
+    def matches(self, line: str, path: Optional[str] = None) -> bool:
+        """Return True if any property pattern matches this line."""
+        return self.match(line, path) is not None
+
+    def _match_uncached(self, line: str, path: Optional[str] = None) -> Optional[ParsedPattern]:
+        if self._matches_all is not None:
+            return self._matches_all
+
+        if self._path_re is not None:
+            if path is None:
+                path = _extract_property_path(line)
+            if path is not None:
+                m = self._path_re.fullmatch(path)
+                if m:
+                    return self._path_groups[m.lastgroup]
+
+        line_lower = line.lower()
+
+        if self._keyword_re is not None:
+            m = self._keyword_re.search(line_lower)
+            if m:
+                return self._keywords[m.group(0)]
+
+        if self._fused_re is not None:
+            m = self._fused_re.search(line)
+            if m:
+                pattern = self._fused_groups.get(m.lastgroup)
+                if pattern is not None:
+                    return pattern
+                for name, value in m.groupdict().items():
+                    if value is not None and name in self._fused_groups:
+                        return self._fused_groups[name]
+
+        for compiled, pattern in self._single_res:
+            if compiled.search(line):
+                return pattern
+
+        if self._fuzzy:
+            matcher = SequenceMatcher(None, "", line_lower)
+            for value, pattern in self._fuzzy:
+                matcher.set_seq1(value)
+                if matcher.ratio() >= self.fuzzy_threshold:
+                    return pattern
+
+        return None
+
+
 # ---------------------------------------------------------------------------
 # Block parsing
 # ---------------------------------------------------------------------------
@@ -210,8 +461,106 @@ def _is_resource_header(line: str) -> bool:
     return bool(_RESOURCE_HEADER_RE.match(line))
 
 
+class _BlockStream:
+    """Incrementally lex What-If lines into resource blocks.
+
+    Iterating yields each :class:`_ResourceBlock` as soon as it is closed by
+    the next resource header (or by the end of input), so only one block is
+    held in memory at a time. ``preamble`` is complete once the first block
+    has been yielded (or iteration has finished); ``epilogue`` is complete
+    once iteration has finished.
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self._lines = lines
+        self.preamble: List[str] = []
+        self.epilogue: List[str] = []
+
+    def __iter__(self) -> Iterator[_ResourceBlock]:
+        current_block: Optional[_ResourceBlock] = None
+
+        for line in self._lines:
+            m = _RESOURCE_HEADER_RE.match(line)
+            if m:
+                # Close previous block
+                if current_block is not None:
+                    yield current_block
+
+                current_block = _ResourceBlock(
+                    header_line=line,
+                    operation=_SYMBOL_TO_OPERATION.get(m.group(1), "Modify"),
+                    resource_type=m.group(2),
+                    lines=[line],
+                    property_change_indices=[],
+                )
+            elif current_block is not None:
+                idx = len(current_block.lines)
+                current_block.lines.append(line)
+                if _is_property_change_line(line):
+                    current_block.property_change_indices.append(idx)
+            else:
+                self.preamble.append(line)
+
+        # Close last block
+        if current_block is not None:
+            self.epilogue = _split_epilogue(current_block)
+            yield current_block
+
+
+def split_resource_blocks(text: str) -> Tuple[str, List[str]]:
+    """Split What-If text into its preamble and one string per resource block.
+
+    The epilogue (e.g., "Resource changes: 10 to modify.") is dropped; its
+    counts describe the whole output, not any subset of the blocks.
+
+    Returns:
+        Tuple of (preamble, blocks); blocks is empty if no resource headers
+        were found, in which case the preamble is the whole text
+    """
+    stream = _BlockStream(text.splitlines(True))
+    blocks = ["".join(block.lines) for block in stream]
+    return "".join(stream.preamble), blocks
+
+
+def _split_epilogue(last_block: _ResourceBlock) -> List[str]:
+    """Split trailing summary lines off the last block and return them.
+
+    Anything after the last block's trailing content is epilogue. In practice,
+    epilogue lines are things like "Resource changes: 1 to create..." They
+    appear after the last resource block and are not indented like properties.
+    Since the lexer puts everything after the first header into blocks, the
+    last block has to be checked for trailing non-block content.
+    """
+    # Find where block content truly ends (last property or attribute line)
+    # and split off epilogue lines (like "Resource changes: ...")
+    epilogue_start = None
+    for i in range(len(last_block.lines) - 1, 0, -1):
+        line = last_block.lines[i]
+        stripped = line.strip()
+        if not stripped:
+            # Blank line — could be separator, keep looking
+            continue
+        # If line is not indented (starts at column 0) or starts with
+        # a non-whitespace char at low indent, it's epilogue
+        if line and not line.startswith(" "):
+            epilogue_start = i
+        else:
+            break
+
+    if epilogue_start is None:
+        return []
+
+    epilogue = last_block.lines[epilogue_start:]
+    last_block.lines = last_block.lines[:epilogue_start]
+    # Recompute property_change_indices
+    last_block.property_change_indices = [
+        j for j in last_block.property_change_indices if j < epilogue_start
+    ]
+    return epilogue
+
+
 def _parse_resource_blocks(
-    lines: List[str],
+    lines: Iterable[str],
 ) -> Tuple[List[str], List[_ResourceBlock], List[str]]:
     """Parse raw What-If lines into structured resource blocks.
 
@@ -220,75 +569,9 @@ def _parse_resource_blocks(
         everything before the first resource block and epilogue is everything
         after the last block.
     """
-    preamble = []  # type: List[str]
-    blocks = []  # type: List[_ResourceBlock]
-    epilogue = []  # type: List[str]
-    current_block = None  # type: Optional[_ResourceBlock]
-
-    for line in lines:
-        if _is_resource_header(line):
-            # Close previous block
-            if current_block is not None:
-                blocks.append(current_block)
-
-            # Parse header
-            m = _RESOURCE_HEADER_RE.match(line)
-            symbol = m.group(1)
-            resource_type = m.group(2)
-            operation = _SYMBOL_TO_OPERATION.get(symbol, "Modify")
-
-            current_block = _ResourceBlock(
-                header_line=line,
-                operation=operation,
-                resource_type=resource_type,
-                lines=[line],
-                property_change_indices=[],
-            )
-        elif current_block is not None:
-            idx = len(current_block.lines)
-            current_block.lines.append(line)
-            if _is_property_change_line(line):
-                current_block.property_change_indices.append(idx)
-        else:
-            preamble.append(line)
-
-    # Close last block
-    if current_block is not None:
-        blocks.append(current_block)
-
-    # Anything after the last block's trailing content is epilogue.
-    # We detect epilogue by looking for summary lines after the last block.
-    # In practice, epilogue lines are things like "Resource changes: 1 to create..."
-    # They appear after the last resource block and are not indented like properties.
-    # Since our parser puts everything after the first header into blocks, we need
-    # to check if the last block has trailing non-block content.
-    if blocks:
-        last_block = blocks[-1]
-        # Find where block content truly ends (last property or attribute line)
-        # and split off epilogue lines (like "Resource changes: ...")
-        epilogue_start = None
-        for i in range(len(last_block.lines) - 1, 0, -1):
-            line = last_block.lines[i]
-            stripped = line.strip()
-            if not stripped:
-                # Blank line — could be separator, keep looking
-                continue
-            # If line is not indented (starts at column 0) or starts with
-            # a non-whitespace char at low indent, it's epilogue
-            if line and not line.startswith(" "):
-                epilogue_start = i
-            else:
-                break
-
-        if epilogue_start is not None:
-            epilogue = last_block.lines[epilogue_start:]
-            last_block.lines = last_block.lines[:epilogue_start]
-            # Recompute property_change_indices
-            last_block.property_change_indices = [
-                j for j in last_block.property_change_indices if j < epilogue_start
-            ]
-
-    return preamble, blocks, epilogue
+    stream = _BlockStream(lines)
+    blocks = list(stream)
+    return stream.preamble, blocks, stream.epilogue
 
 
 # ---------------------------------------------------------------------------
@@ -350,8 +633,7 @@ def _matches_resource_pattern(block: _ResourceBlock, pattern: ParsedPattern) ->
 
         # Validate operation — if invalid, treat as type-only (the colon
         # may be part of the type string itself, though unlikely)
-        op_lookup = {v.lower(): v for v in _VALID_OPERATIONS}
-        matched_op = op_lookup.get(op_part.lower())
+        matched_op = _OPERATION_LOOKUP.get(op_part.lower())
 
         if matched_op:
             # Type substring + operation match
@@ -366,15 +648,186 @@ def _matches_resource_pattern(block: _ResourceBlock, pattern: ParsedPattern) ->
         return _type_matches(value)
 
 
+def _split_resource_pattern(value: str) -> Tuple[str, Optional[str]]:
+    """Split a resource: pattern value into (type needle, operation or None).
+
+    A trailing ``:<Operation>`` is only treated as an operation filter when it
+    names a valid operation; otherwise the whole value is the type needle.
+    """
+    if ":" in value:
+        type_part, op_part = value.rsplit(":", 1)
+        matched_op = _OPERATION_LOOKUP.get(op_part.strip().lower())
+        if matched_op:
+            return type_part.strip(), matched_op
+    return value, None
+
+
+class _NeedleGroup:
+    """Lowercase type needles sharing one operation filter."""
+
+    def __init__(self, needles: List[str]):
+        # An empty needle is a substring of every type string
+        self.matches_all = any(not n for n in needles)
+        self.regex = _build_keyword_regex(needles)
+        # Every suffix of every needle, for the post-LLM reverse match
+        self.suffixes = {n[i:] for n in needles for i in range(len(n) + 1)}
+
+    def contains_any(self, *texts: str) -> bool:
+        """True if some needle is a substring of one of the texts."""
+        if self.matches_all:
+            return True
+        if self.regex is None:
+            return False
+        return any(self.regex.search(text) for text in texts)
+
+
+class ResourcePatternIndex:
+    """``resource:`` patterns compiled once for both filtering phases.
+
+    Equivalent to testing every pattern with :func:`_matches_resource_pattern`
+    (pre-LLM, against What-If blocks) or :func:`_matches_resource_pattern_post_llm`
+    (post-LLM, against LLM resource rows), but with the per-resource cost
+    independent of the number of patterns:
+
+    - Type needles are grouped by operation filter (any operation, or one of
+      the valid operations) and each group is folded into one trie regex.
+    - The post-LLM reverse match (an abbreviated LLM type that is a suffix of
+      a pattern) becomes a set lookup over all needle suffixes.
+    - Results are memoized per (type, operation), since landing-zone
+      deployments repeat the same few resource types many times.
+
+    Non-resource patterns are ignored.
+    """
+
+    def __init__(self, patterns: list):
+        self.patterns = [p for p in patterns if p.pattern_type == "resource"]
+
+        by_op: Dict[Optional[str], List[str]] = {}
+        for pattern in self.patterns:
+            needle, op = _split_resource_pattern(pattern.value)
+            by_op.setdefault(op, []).append(needle.lower())
+        self._groups = {op: _NeedleGroup(needles) for op, needles in by_op.items()}
+
+        self._block_memo: Dict[Tuple[str, str], bool] = {}
+        self._llm_memo: Dict[Tuple[str, str], bool] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def _groups_for(self, operation: Optional[str]) -> List[_NeedleGroup]:
+        groups = []
+        if None in self._groups:
+            groups.append(self._groups[None])
+        if operation is not None and operation in self._groups:
+            groups.append(self._groups[operation])
+        return groups
+
+    def matches_block(self, block: _ResourceBlock) -> bool:
+        """Return True if any pattern matches this What-If resource block."""
+        key = (block.resource_type, block.operation)
+        try:
+            return self._block_memo[key]
+        except KeyError:
+            pass
+
+        full_path = block.resource_type.lower()
+        arm_type = _extract_arm_type(block.resource_type).lower()
+        hit = any(
+            group.contains_any(full_path, arm_type) for group in self._groups_for(block.operation)
+        )
+        if len(self._block_memo) >= _MEMO_MAX_ENTRIES:
+            self._block_memo.clear()
+        self._block_memo[key] = hit
+        return hit
+
+    def matches(self, resource_type: str, action: str) -> bool:
+        """Return True if any pattern matches an LLM resource row."""
+        key = (resource_type, action)
+        try:
+            return self._llm_memo[key]
+        except KeyError:
+            pass
+
+        type_lower = resource_type.lower()
+        operation = _OPERATION_LOOKUP.get(action.lower())
+        hit = any(
+            group.contains_any(type_lower) or type_lower in group.suffixes
+            for group in self._groups_for(operation)
+        )
+        if len(self._llm_memo) >= _MEMO_MAX_ENTRIES:
+            self._llm_memo.clear()
+        self._llm_memo[key] = hit
+        return hit
+
+
 # ---------------------------------------------------------------------------
 # Main filtering function
 # ---------------------------------------------------------------------------
 
 
+@dataclass
+class FilterResult:
+    """Outcome of filtering What-If output with :func:`filter_whatif_lines`."""
+
+    text: str  # Filtered What-If text
+    lines_removed: int  # Property-change lines removed (Phase 2)
+    blocks_removed: int  # Resource blocks removed (Phase 1 + hollow Modify blocks)
+    # One dict per removed block: resource_type, resource_name, operation
+    removed_resources: List[dict] = field(default_factory=list)
+    blocks_truncated: int = 0  # Surviving blocks dropped to honour max_chars/max_tokens
+    truncated: bool = False  # True if any content was dropped to honour a cap
+    # One dict per surviving block (same keys as removed_resources), including
+    # blocks dropped to honour max_chars/max_tokens
+    kept_resources: List[dict] = field(default_factory=list)
+    tokens: int = 0  # Estimated tokens in text (only counted when max_tokens is set)
+    blocks_reused: int = 0  # Surviving blocks left out of text because of ``reuse``
+
+    @property
+    def needs_analysis(self) -> bool:
+        """False when the input had resource blocks but none with an actionable change.
+
+        That is, every block was removed as noise, is a Deploy/NoChange/Ignore
+        block or has a reused earlier result, so there is nothing for an LLM
+        to assess. Input without any recognisable resource blocks always
+        needs analysis.
+        """
+        if not self.removed_resources and not self.kept_resources:
+            return True
+        return any(
+            r["operation"] not in _NON_ACTIONABLE_OPERATIONS and not r.get("reused")
+            for r in self.kept_resources
+        )
+
+
+def block_fingerprint(lines: List[str]) -> str:
+    """Hash a resource block's header and property lines, ignoring layout.
+
+    Lines are stripped, inner whitespace runs collapsed and blank lines
+    dropped, so re-indented or re-wrapped output of the same change hashes
+    the same.
+    """
+    normalized = "\n".join(" ".join(line.split()) for line in lines if line.strip())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _removed_resource_entry(block: _ResourceBlock) -> dict:
+    """Describe a block for display (noise section, locally built rows)."""
+    # Extract resource name (last path segment) for display
+    parts = block.resource_type.split("/")
+    resource_name = parts[-1] if parts else block.resource_type
+    return {
+        "resource_type": _extract_arm_type(block.resource_type),
+        "resource_name": resource_name,
+        "operation": block.operation,
+    }
+
+
 def filter_whatif_text(
     whatif_content: str,
     patterns: list,
     fuzzy_threshold: float = 0.80,
+    matcher: Optional[NoiseMatcher] = None,
+    resource_index: Optional[ResourcePatternIndex] = None,
 ) -> tuple:
     """Filter noisy resource blocks and property lines from raw What-If text.
 
@@ -390,6 +843,11 @@ def filter_whatif_text(
         patterns: List of ParsedPattern objects (both resource and property
             patterns are accepted)
         fuzzy_threshold: Similarity threshold for fuzzy patterns (0.0-1.0)
+        matcher: Optional pre-compiled :class:`NoiseMatcher` for the property
+            patterns, to reuse compilation and memo across calls. Built from
+            ``patterns`` when omitted.
+        resource_index: Optional pre-compiled :class:`ResourcePatternIndex`
+            for the resource patterns, likewise built when omitted.
 
     Returns:
         Tuple of (filtered_text, num_property_lines_removed,
@@ -398,106 +856,252 @@ def filter_whatif_text(
         ``resource_type``, ``resource_name``, and ``operation`` for
         each block removed in Phase 1.
     """
-    resource_patterns = [p for p in patterns if p.pattern_type == "resource"]
-    property_patterns = [p for p in patterns if p.pattern_type != "resource"]
-
-    if not resource_patterns and not property_patterns:
+    has_property_patterns = matcher is not None or any(
+        p.pattern_type != "resource" for p in patterns
+    )
+    has_resource_patterns = bool(resource_index) or any(
+        p.pattern_type == "resource" for p in patterns
+    )
+    if not has_property_patterns and not has_resource_patterns:
         return whatif_content, 0, 0, []
 
-    lines = whatif_content.splitlines(keepends=True)
-    preamble, blocks, epilogue = _parse_resource_blocks(lines)
-
-    # If there are no blocks (e.g., text has no resource headers), fall back
-    # to simple line-by-line filtering for backward compatibility
-    if not blocks:
-        if not property_patterns:
-            return whatif_content, 0, 0, []
-        filtered_lines = []
-        removed = 0
-        for line in lines:
-            if _is_property_change_line(line):
-                if any(_matches_pattern(line, p, fuzzy_threshold) for p in property_patterns):
-                    removed += 1
-                    continue
-            filtered_lines.append(line)
-        return "".join(filtered_lines), removed, 0, []
-
-    # Phase 1: Resource-level filtering — remove entire matching blocks
-    blocks_removed = 0
-    removed_resources = []  # type: List[dict]
-    if resource_patterns:
-        surviving_blocks = []
-        for block in blocks:
-            if any(_matches_resource_pattern(block, p) for p in resource_patterns):
-                blocks_removed += 1
-                # Extract resource name (last path segment) for display
-                parts = block.resource_type.split("/")
-                resource_name = parts[-1] if parts else block.resource_type
-                removed_resources.append(
-                    {
-                        "resource_type": _extract_arm_type(block.resource_type),
-                        "resource_name": resource_name,
-                        "operation": block.operation,
-                    }
-                )
-            else:
-                surviving_blocks.append(block)
-        blocks = surviving_blocks
-
-    # Phase 2: Property-level filtering on surviving blocks
-    result_lines = list(preamble)
-    total_property_removed = 0
-
-    for block in blocks:
-        # Apply property-level patterns within this block
-        if property_patterns and block.property_change_indices:
-            filtered_indices = set()  # Indices of lines to remove
-            for idx in block.property_change_indices:
-                line = block.lines[idx]
-                if any(_matches_pattern(line, p, fuzzy_threshold) for p in property_patterns):
-                    filtered_indices.add(idx)
+    result = filter_whatif_lines(
+        whatif_content.splitlines(keepends=True),
+        patterns,
+        fuzzy_threshold,
+        matcher=matcher,
+        resource_index=resource_index,
+    )
+    return result.text, result.lines_removed, result.blocks_removed, result.removed_resources
+
+
+def filter_whatif_lines(
+    lines: Iterable[str],
+    patterns: list,
+    fuzzy_threshold: float = 0.80,
+    matcher: Optional[NoiseMatcher] = None,
+    max_chars: Optional[int] = None,
+    resource_index: Optional[ResourcePatternIndex] = None,
+    max_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+    reuse: Optional[Container[str]] = None,
+) -> FilterResult:
+    """Filter What-If output on the fly as lines are read.
+
+    Streaming counterpart of :func:`filter_whatif_text`: ``lines`` may be any
+    iterable (e.g. a chunked stdin reader), and each resource block is
+    filtered as soon as the lexer closes it, so peak memory is roughly one
+    block plus the filtered output.
+
+    Args:
+        lines: What-If output lines, with line endings
+        patterns: List of ParsedPattern objects (resource and property)
+        fuzzy_threshold: Similarity threshold for fuzzy patterns (0.0-1.0)
+        matcher: Optional pre-compiled :class:`NoiseMatcher`
+        resource_index: Optional pre-compiled :class:`ResourcePatternIndex`
+        max_chars: Optional cap on the filtered output size. Surviving blocks
+            that would push the output past the cap are dropped whole rather
+            than cut mid-block; the rest of the input is still consumed so
+            removal counts cover the entire input.
+        max_tokens: Optional cap on the filtered output in tokens, applied
+            the same way as ``max_chars`` (both may be given)
+        count_tokens: Token counter for ``max_tokens`` (default: the
+            configured estimator, see :mod:`bicep_whatif_advisor.tokens`)
+        reuse: Fingerprints (see :func:`block_fingerprint`) of blocks with
+            an earlier result to reuse. When given, surviving blocks'
+            ``kept_resources`` entries carry their ``fingerprint``, and
+            blocks in ``reuse`` are marked ``reused`` and left out of the
+            text (incremental analysis).
+
+    Returns:
+        FilterResult with the filtered text and removal statistics
+    """
+    return filter_whatif_blocks(
+        _BlockStream(lines),
+        patterns,
+        fuzzy_threshold,
+        matcher=matcher,
+        max_chars=max_chars,
+        resource_index=resource_index,
+        max_tokens=max_tokens,
+        count_tokens=count_tokens,
+        reuse=reuse,
+    )
+
+
+def filter_whatif_blocks(
+    stream,
+    patterns: list,
+    fuzzy_threshold: float = 0.80,
+    matcher: Optional[NoiseMatcher] = None,
+    max_chars: Optional[int] = None,
+    resource_index: Optional[ResourcePatternIndex] = None,
+    max_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+    reuse: Optional[Container[str]] = None,
+) -> FilterResult:
+    """Filter an already-lexed source of resource blocks.
+
+    ``stream`` is anything shaped like the text lexer: iterating it yields
+    ``_ResourceBlock`` objects, ``preamble`` is available once the first
+    block is yielded and ``epilogue`` once iteration ends. Text input goes
+    through :func:`filter_whatif_lines`; structured JSON input supplies its
+    own source (see :mod:`bicep_whatif_advisor.whatif_json`).
+
+    Arguments and return value are as for :func:`filter_whatif_lines`.
+    """
+    if resource_index is None:
+        resource_index = ResourcePatternIndex(patterns)
+    if matcher is None:
+        property_patterns = [p for p in patterns if p.pattern_type != "resource"]
+        if property_patterns:
+            matcher = NoiseMatcher(property_patterns, fuzzy_threshold)
+    elif not matcher.patterns:
+        matcher = None
+
+    result = FilterResult(text="", lines_removed=0, blocks_removed=0)
+    result_lines: List[str] = []
+    budget = _OutputBudget(max_chars, max_tokens, count_tokens)
+
+    seen_block = False
+
+    for block in stream:
+        if not seen_block:
+            seen_block = True
+            _extend_within_budget(result_lines, stream.preamble, budget, result)
+
+        # Phase 1: Resource-level filtering — remove entire matching blocks
+        if resource_index and resource_index.matches_block(block):
+            result.blocks_removed += 1
+            result.removed_resources.append(_removed_resource_entry(block))
+            continue
+
+        # Phase 2: Property-level filtering on surviving blocks
+        kept_lines = block.lines
+        if matcher is not None and block.property_change_indices:
+            paths = block.property_paths
+            filtered_indices = {
+                idx
+                for idx in block.property_change_indices
+                if matcher.matches(block.lines[idx], paths.get(idx))
+            }
 
             if filtered_indices:
+                result.lines_removed += len(filtered_indices)
+
                 # If ALL property-change lines in a Modify block are
                 # filtered, suppress the entire block so the LLM never sees
                 # a "hollow" resource header with no actual changes.  Treat
                 # it like a Phase 1 removal so it appears in the noise
                 # section.  Create/Delete operations are inherently
                 # significant, so their headers are always preserved.
-                if block.operation == "Modify" and filtered_indices == set(
+                if block.operation == "Modify" and len(filtered_indices) == len(
                     block.property_change_indices
                 ):
-                    total_property_removed += len(filtered_indices)
-                    blocks_removed += 1
-                    parts = block.resource_type.split("/")
-                    resource_name = parts[-1] if parts else block.resource_type
-                    removed_resources.append(
-                        {
-                            "resource_type": _extract_arm_type(block.resource_type),
-                            "resource_name": resource_name,
-                            "operation": block.operation,
-                        }
-                    )
+                    result.blocks_removed += 1
+                    result.removed_resources.append(_removed_resource_entry(block))
                     continue
 
                 # Keep the block but remove matched property lines
-                for i, line in enumerate(block.lines):
-                    if i in filtered_indices:
-                        total_property_removed += 1
-                    else:
-                        result_lines.append(line)
+                kept_lines = [
+                    line for i, line in enumerate(block.lines) if i not in filtered_indices
+                ]
+
+        entry = _removed_resource_entry(block)
+        result.kept_resources.append(entry)
+        if reuse is not None:
+            fingerprint = block_fingerprint(kept_lines)
+            if fingerprint in reuse:
+                entry.update(fingerprint=fingerprint, reused=True)
+                result.blocks_reused += 1
                 continue
+        if result.truncated or not budget.take(kept_lines):
+            result.blocks_truncated += 1
+            result.truncated = True
+            continue
+        if reuse is not None:
+            # Only blocks the LLM sees get a fingerprint to store results under
+            entry["fingerprint"] = fingerprint
+        result_lines.extend(kept_lines)
+
+    if not seen_block:
+        # No blocks (e.g., text has no resource headers): fall back to simple
+        # line-by-line filtering for backward compatibility
+        preamble = stream.preamble
+        if matcher is not None:
+            preamble = []
+            for line in stream.preamble:
+                if _is_property_change_line(line) and matcher.matches(line):
+                    result.lines_removed += 1
+                    continue
+                preamble.append(line)
+        _extend_within_budget(result_lines, preamble, budget, result)
 
-        # No filtering needed — keep entire block
-        result_lines.extend(block.lines)
-
-    # Only preserve the epilogue when no resource blocks were removed.
+    # Only preserve the epilogue when no resource blocks were removed or reused.
     # The epilogue contains a summary like "Resource changes: 10 to modify."
     # which becomes misleading when blocks have been stripped — the LLM sees
     # the count mismatch and produces summary rows instead of individual resources.
-    if blocks_removed == 0:
-        result_lines.extend(epilogue)
-    return "".join(result_lines), total_property_removed, blocks_removed, removed_resources
+    if result.blocks_removed == 0 and result.blocks_reused == 0 and not result.truncated:
+        _extend_within_budget(result_lines, stream.epilogue, budget, result)
+
+    result.text = "".join(result_lines)
+    result.tokens = budget.tokens
+    return result
+
+
+class _OutputBudget:
+    """Running size of the filtered output against optional char and token caps."""
+
+    def __init__(
+        self,
+        max_chars: Optional[int],
+        max_tokens: Optional[int],
+        count_tokens: Optional[Callable[[str], int]],
+    ):
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        if max_tokens is not None and count_tokens is None:
+            from .tokens import get_token_counter
+
+            count_tokens = get_token_counter()
+        self.count_tokens = count_tokens
+        self.chars = 0
+        self.tokens = 0
+
+    def take(self, lines: List[str]) -> bool:
+        """Account for ``lines`` if they fit under both caps; False otherwise."""
+        chars = sum(len(line) for line in lines)
+        if self.max_chars is not None and self.chars + chars > self.max_chars:
+            return False
+        tokens = 0
+        if self.max_tokens is not None:
+            tokens = self.count_tokens("".join(lines))
+            if self.tokens + tokens > self.max_tokens:
+                return False
+        self.chars += chars
+        self.tokens += tokens
+        return True
+
+
+def _extend_within_budget(
+    result_lines: List[str],
+    lines: List[str],
+    budget: _OutputBudget,
+    result: FilterResult,
+) -> None:
+    """Append whole lines while the output stays within the budget.
+
+    Args:
+        result_lines: Output lines to extend
+        lines: Lines to append
+        budget: Output budget, updated with the appended lines
+        result: FilterResult to flag as truncated if lines are dropped
+    """
+    for line in lines:
+        if not budget.take([line]):
+            result.truncated = True
+            break
+        result_lines.append(line)
 
 
 # ---------------------------------------------------------------------------
@@ -559,8 +1163,7 @@ def _matches_resource_pattern_post_llm(
         type_part = type_part.strip()
         op_part = op_part.strip()
 
-        op_lookup = {v.lower(): v for v in _VALID_OPERATIONS}
-        matched_op = op_lookup.get(op_part.lower())
+        matched_op = _OPERATION_LOOKUP.get(op_part.lower())
 
         if matched_op:
             if not _type_matches(type_part):
@@ -572,7 +1175,7 @@ def _matches_resource_pattern_post_llm(
         return _type_matches(value)
 
 
-def reclassify_resource_noise(resources: list, resource_patterns: list) -> int:
+def reclassify_resource_noise(resources: list, resource_patterns) -> int:
     """Demote matching resources to low confidence after LLM analysis.
 
     Iterates over LLM-produced resource dicts and sets
@@ -581,7 +1184,8 @@ def reclassify_resource_noise(resources: list, resource_patterns: list) -> int:
 
     Args:
         resources: List of resource dicts from LLM response
-        resource_patterns: List of ParsedPattern objects with pattern_type == "resource"
+        resource_patterns: List of ParsedPattern objects with pattern_type == "resource",
+            or a :class:`ResourcePatternIndex` already compiled from them
 
     Returns:
         Number of resources reclassified
@@ -589,6 +1193,11 @@ def reclassify_resource_noise(resources: list, resource_patterns: list) -> int:
     if not resource_patterns or not resources:
         return 0
 
+    if isinstance(resource_patterns, ResourcePatternIndex):
+        index = resource_patterns
+    else:
+        index = ResourcePatternIndex(resource_patterns)
+
     count = 0
     for resource in resources:
         resource_type = resource.get("resource_type", "")
@@ -599,9 +1208,7 @@ def reclassify_resource_noise(resources: list, resource_patterns: list) -> int:
         if current_confidence in ("low", "noise"):
             continue
 
-        if any(
-            _matches_resource_pattern_post_llm(resource_type, action, p) for p in resource_patterns
-        ):
+        if index.matches(resource_type, action):
             resource["confidence_level"] = "low"
             resource["confidence_reason"] = "Matched resource noise pattern"
             count += 1
@@ -0,0 +1,149 @@
+"""Asyncio entry point for embedding the advisor in async services.
+
+The CLI runs synchronously; services that already own an event loop can call
+:func:`analyze` instead. It overlaps the git diff and Bicep source I/O with
+each other, and (in parallel mode) the independent per-bucket LLM requests,
+on the caller's loop::
+
+    data = await analyze(whatif_text, get_provider("anthropic"), ci=True, parallel=True)
+
+The result has the same shape as the parsed LLM response in the CLI
+(``resources``, ``overall_summary`` and, in CI mode, ``risk_assessment`` and
+``verdict``), ready for ``filter_by_confidence`` and ``evaluate_risk_buckets``.
+Provider failures raise :class:`~bicep_whatif_advisor.providers.ProviderError`.
+"""
+
+import asyncio
+import functools
+from typing import List, Optional, Tuple
+
+from .analysis import extract_json
+from .ci.parallel import (
+    DEFAULT_MAX_CONCURRENCY,
+    merge_parallel_responses,
+    run_parallel_analysis_async,
+)
+from .prompt import build_response_schema, build_system_prompt, build_user_prompt
+from .providers import Provider
+
+
+async def load_ci_context(
+    diff_path: Optional[str] = None,
+    diff_ref: str = "HEAD~1",
+    bicep_dir: Optional[str] = None,
+) -> Tuple[str, Optional[str]]:
+    """Collect the git diff and Bicep sources concurrently.
+
+    Both are blocking (subprocess and file I/O), so each runs in the loop's
+    default executor.
+
+    Args:
+        diff_path: Path to a diff file, or None to run git diff
+        diff_ref: Git reference to diff against
+        bicep_dir: Directory of Bicep files for context, or None to skip
+
+    Returns:
+        Tuple of (diff_content, bicep_content)
+    """
+    from .ci.diff import get_diff
+    from .input import load_bicep_files
+
+    loop = asyncio.get_running_loop()
+    diff_future = loop.run_in_executor(None, functools.partial(get_diff, diff_path, diff_ref))
+    if not bicep_dir:
+        return await diff_future, None
+
+    bicep_future = loop.run_in_executor(None, load_bicep_files, bicep_dir)
+    diff_content, bicep_content = await asyncio.gather(diff_future, bicep_future)
+    return diff_content, bicep_content
+
+
+async def analyze(
+    whatif_content: str,
+    provider: Provider,
+    *,
+    ci: bool = False,
+    verbose: bool = False,
+    diff_content: Optional[str] = None,
+    bicep_content: Optional[str] = None,
+    diff_path: Optional[str] = None,
+    diff_ref: str = "HEAD~1",
+    bicep_dir: Optional[str] = None,
+    pr_title: Optional[str] = None,
+    pr_description: Optional[str] = None,
+    enabled_buckets: Optional[List[str]] = None,
+    parallel: bool = False,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    structured_output: bool = True,
+) -> dict:
+    """Analyze (already noise-filtered) What-If text with the LLM.
+
+    Args:
+        whatif_content: What-If output text
+        provider: Provider instance (its ``acomplete`` is used)
+        ci: Enable CI mode with risk assessment and verdict
+        verbose: Include property-level changes (standard mode only)
+        diff_content: Git diff; loaded with :func:`load_ci_context` if None in CI mode
+        bicep_content: Bicep sources; loaded from ``bicep_dir`` if None in CI mode
+        diff_path: Diff file to load when ``diff_content`` is None
+        diff_ref: Git reference to diff against when ``diff_content`` is None
+        bicep_dir: Bicep directory to load when ``bicep_content`` is None
+        pr_title: Pull request title for intent analysis
+        pr_description: Pull request description for intent analysis
+        enabled_buckets: Risk bucket IDs (CI mode); defaults to the built-ins
+        parallel: One concurrent request per bucket instead of one combined request
+        max_concurrency: Maximum concurrent requests in parallel mode
+        structured_output: Constrain responses to the prompts' JSON Schemas
+
+    Returns:
+        Parsed (and, in parallel mode, merged) response dict
+
+    Raises:
+        ProviderError: If an LLM request fails
+        ValueError: If an LLM response is not valid JSON
+    """
+    if ci and diff_content is None:
+        diff_content, loaded_bicep = await load_ci_context(
+            diff_path, diff_ref, bicep_dir if bicep_content is None else None
+        )
+        if bicep_content is None:
+            bicep_content = loaded_bicep
+
+    if ci and enabled_buckets is None:
+        from .ci.buckets import get_enabled_buckets
+
+        enabled_buckets = get_enabled_buckets(has_pr_metadata=bool(pr_title or pr_description))
+
+    user_prompt = build_user_prompt(
+        whatif_content=whatif_content,
+        diff_content=diff_content if ci else None,
+        bicep_content=bicep_content if ci else None,
+        pr_title=pr_title,
+        pr_description=pr_description,
+    )
+
+    if ci and parallel:
+        resources_text, bucket_texts = await run_parallel_analysis_async(
+            provider,
+            user_prompt,
+            enabled_buckets,
+            pr_title=pr_title,
+            pr_description=pr_description,
+            max_concurrency=max_concurrency,
+            structured_output=structured_output,
+        )
+        return merge_parallel_responses(
+            extract_json(resources_text),
+            {bucket_id: extract_json(text) for bucket_id, text in bucket_texts.items()},
+        )
+
+    prompt_options = dict(
+        verbose=verbose,
+        ci_mode=ci,
+        pr_title=pr_title,
+        pr_description=pr_description,
+        enabled_buckets=enabled_buckets,
+    )
+    system_prompt = build_system_prompt(**prompt_options)
+    response_schema = build_response_schema(**prompt_options) if structured_output else None
+    return extract_json(await provider.acomplete(system_prompt, user_prompt, response_schema))
@@ -1,5 +1,10 @@
 """Prompt construction for LLM analysis of What-If output."""
 
+from typing import Tuple
+
+# Closing tag of the last run-invariant block in the CI user prompt
+_STATIC_PREFIX_END = "</bicep_source>"
+
 
 def build_system_prompt(
     verbose: bool = False,
@@ -34,7 +39,7 @@ def _build_standard_system_prompt(verbose: bool) -> str:
     {
       "resource_name": "string — the short resource name",
       "resource_type": "string — the Azure resource type, abbreviated",
-      "action": "string — Create, Modify, Delete, Deploy, NoChange, Ignore",
+      "action": "string — Create, Modify, Delete, Deploy, NoChange, Ignore, Unsupported",
       "summary": "string — plain English explanation of this change",
       "confidence_level": "low|medium|high — confidence this is a real change vs What-If noise",
       "confidence_reason": "string — brief explanation of confidence assessment"
@@ -93,125 +98,216 @@ You must respond with ONLY valid JSON matching this schema, no other text:
     return prompt
 
 
-def _build_ci_system_prompt(
-    pr_title: str = None, pr_description: str = None, enabled_buckets: list = None
-) -> str:
-    """Build system prompt for CI mode with risk assessment.
+# Per-bucket concern attribution, used to re-derive bucket risk locally when
+# resources are later excluded as low-confidence noise (no second LLM call).
+_RESOURCE_CONCERNS_SCHEMA = """      "resource_concerns": [
+        {
+          "resource_name": "string or null — resource_name from resources[] this concern is about",
+          "risk_level": "low|medium|high",
+          "concern": "string — the concern"
+        }
+      ]"""
 
-    Args:
-        pr_title: Optional PR title
-        pr_description: Optional PR description
-        enabled_buckets: List of bucket IDs to include (e.g., ["drift", "intent"])
-                        If None, defaults to all buckets
+# Single-bucket requests have no resources[] array to reference
+_BUCKET_RESOURCE_CONCERNS_SCHEMA = _RESOURCE_CONCERNS_SCHEMA.replace(
+    "resource_name from resources[]", "resource name from the What-If output"
+)
 
-    Returns:
-        System prompt string with dynamic bucket configuration
-    """
-    from .ci.buckets import RISK_BUCKETS, get_enabled_buckets
+_CONCERN_ATTRIBUTION_TEMPLATE = """
 
-    # Default to all buckets if not specified
-    if enabled_buckets is None:
-        enabled_buckets = get_enabled_buckets(has_pr_metadata=bool(pr_title or pr_description))
+## Concern Attribution
 
-    base_prompt = """You are an Azure infrastructure deployment safety reviewer. You are given:
-1. The Azure What-If output showing planned infrastructure changes
-2. The source code diff (Bicep/ARM template changes) that produced these changes"""
+For EVERY risk bucket, list each concern in "resource_concerns" together with the \
+"resource_name" ({name_source}) of the resource it is about and \
+the risk_level that concern alone justifies. Use null as resource_name only for \
+concerns not tied to a single resource (e.g. a code change with no What-If \
+counterpart). The bucket "risk_level" must equal the highest risk_level among its \
+resource_concerns, or "low" if it has none."""
 
-    # Add PR intent context if available and intent bucket is enabled
-    if (pr_title or pr_description) and "intent" in enabled_buckets:
-        base_prompt += (
-            "\n3. The pull request title and description stating the "
-            "INTENDED purpose of this change"
-        )
+_CONCERN_ATTRIBUTION_INSTRUCTIONS = _CONCERN_ATTRIBUTION_TEMPLATE.format(
+    name_source='exactly as in the "resources" array'
+)
 
-    # Dynamic bucket count
-    bucket_count = len(enabled_buckets)
-    bucket_word = "bucket" if bucket_count == 1 else "buckets"
-    base_prompt += (
-        f"\n\nEvaluate the deployment for safety and correctness across "
-        f"{bucket_count} independent risk {bucket_word}:"
-    )
+_CI_CONFIDENCE_INSTRUCTIONS = """
 
-    # Build risk_assessment schema dynamically based on enabled buckets
-    risk_buckets_schema = []
-    for bucket_id in enabled_buckets:
-        bucket = RISK_BUCKETS[bucket_id]
-        # Custom agents with table or list display get a findings array
-        if bucket.custom and bucket.display in ("table", "list"):
-            # Use custom columns if defined, otherwise default columns
-            if bucket.columns:
-                cols = bucket.columns
-            else:
-                from .ci.agents import DEFAULT_FINDINGS_COLUMNS
-
-                cols = [
-                    {"key": c["name"].lower(), "description": c["description"]}
-                    for c in DEFAULT_FINDINGS_COLUMNS
-                ]
-            findings_fields = ",\n".join(
-                f'          "{c["key"]}": "string — {c["description"]}"' for c in cols
-            )
-            risk_buckets_schema.append(f'''    "{bucket_id}": {{
+## Confidence Assessment
+
+For each resource, assess confidence that the change is REAL vs Azure What-If noise:
+
+**HIGH confidence (real changes):**
+- Resource creation, deletion, or state changes
+- Configuration modifications with clear intent
+- Security, networking, or compute changes
+
+**MEDIUM confidence (potentially real but uncertain):**
+- Retention policies or analytics settings
+- Subnet references changing from hardcoded to dynamic
+- Configuration changes that might be platform-managed
+
+**LOW confidence (likely What-If noise):**
+- Metadata-only changes (etag, id, provisioningState, type)
+- logAnalyticsDestinationType property changes
+- IPv6 flags (disableIpv6, enableIPv6Addressing)
+- Computed properties (resourceGuid)
+- Read-only or system-managed properties
+
+Use your judgment - these are guidelines, not rigid patterns."""
+
+_CI_RESOURCES_RULES = """\
+IMPORTANT rules for the top-level "resources" array ONLY (not agent findings):
+- List ONLY resources that appear in <whatif_output>.
+- Each resource must be its own entry. NEVER group or summarize multiple resources.
+- If the What-If output has no resource changes, return "resources": [].
+- These rules do NOT apply to risk_assessment findings — agents control their own output."""
+
+_CI_RESOURCES_SCHEMA = """  "resources": [
+    {
+      "resource_name": "string — individual resource name from the What-If output",
+      "resource_type": "string — Azure resource type from the What-If output",
+      "action": "string — Create, Modify, Delete, Deploy, NoChange, Ignore, Unsupported",
+      "summary": "string — what this change does",
+      "risk_level": "low|medium|high",
+      "risk_reason": "string or null — why this is risky, if applicable",
+      "confidence_level": "low|medium|high — confidence this is a real change vs What-If noise",
+      "confidence_reason": "string — brief explanation of confidence assessment"
+    }
+  ],
+  "overall_summary": "string\""""
+
+
+def _findings_columns(bucket) -> list:
+    """Return the findings columns for a custom agent bucket."""
+    if bucket.columns:
+        return bucket.columns
+
+    from .ci.agents import DEFAULT_FINDINGS_COLUMNS
+
+    return [
+        {"key": c["name"].lower(), "description": c["description"]}
+        for c in DEFAULT_FINDINGS_COLUMNS
+    ]
+
+
+def _bucket_schema(bucket_id: str, concerns_schema: str = _RESOURCE_CONCERNS_SCHEMA) -> str:
+    """Build the risk_assessment schema entry for one bucket."""
+    from .ci.buckets import active_buckets
+
+    bucket = active_buckets()[bucket_id]
+    # Custom agents with table or list display get a findings array
+    if bucket.custom and bucket.display in ("table", "list"):
+        findings_fields = ",\n".join(
+            f'          "{c["key"]}": "string — {c["description"]}"'
+            for c in _findings_columns(bucket)
+        )
+        return f'''    "{bucket_id}": {{
       "risk_level": "low|medium|high",
       "concerns": ["array of specific concerns"],
       "concern_summary": "1-2 sentences naming ALL non-compliant resources, or 'None'",
       "reasoning": "explanation of risk assessment",
+{concerns_schema},
       "findings": [
         {{
 {findings_fields}
         }}
       ]
-    }}''')
-        else:
-            risk_buckets_schema.append(f'''    "{bucket_id}": {{
+    }}'''
+    return f'''    "{bucket_id}": {{
       "risk_level": "low|medium|high",
       "concerns": ["array of specific concerns"],
       "concern_summary": "1-2 sentences naming ALL non-compliant resources, or 'None'",
-      "reasoning": "explanation of risk assessment"
-    }}''')
+      "reasoning": "explanation of risk assessment",
+{concerns_schema}
+    }}'''
 
-    risk_assessment_block = ",\n".join(risk_buckets_schema)
-    risk_assessment_schema = f""""risk_assessment": {{
-{risk_assessment_block}
-  }}"""
 
-    # Build instructions for each enabled bucket
-    bucket_instructions_list = []
-    for i, bucket_id in enumerate(enabled_buckets, 1):
-        bucket = RISK_BUCKETS[bucket_id]
-        bucket_text = f"""
-## Risk Bucket {i}: {bucket.display_name}
+def _bucket_instructions(bucket_id: str, heading: str) -> str:
+    """Build the instruction section for one bucket."""
+    from .ci.buckets import active_buckets
+
+    bucket = active_buckets()[bucket_id]
+    bucket_text = f"""
+## {heading}: {bucket.display_name}
 {bucket.prompt_instructions}"""
-        # Custom agents must be prescriptive — only evaluate what's explicitly defined
-        if bucket.custom:
-            bucket_text += f"""
+    # Custom agents must be prescriptive — only evaluate what's explicitly defined
+    if bucket.custom:
+        bucket_text += f"""
 
 IMPORTANT: For the "{bucket_id}" bucket, ONLY evaluate the specific checks described above. \
 Do NOT flag issues outside the scope of these instructions, even if they are legitimate \
 security or operational concerns. If no resources match the defined checks, return \
 risk_level "low" with an empty concerns array. You MUST still include finding rows for every \
 check, marking non-matching checks as not-applicable."""
-        # Add findings instructions for custom agents with table/list display
-        if bucket.custom and bucket.display in ("table", "list"):
-            if bucket.columns:
-                cols = bucket.columns
-            else:
-                from .ci.agents import DEFAULT_FINDINGS_COLUMNS
-
-                cols = [
-                    {"key": c["name"].lower(), "description": c["description"]}
-                    for c in DEFAULT_FINDINGS_COLUMNS
-                ]
-            col_descriptions = ", ".join(f'"{c["key"]}" ({c["description"]})' for c in cols)
-            bucket_text += f"""
+    # Add findings instructions for custom agents with table/list display
+    if bucket.custom and bucket.display in ("table", "list"):
+        col_descriptions = ", ".join(
+            f'"{c["key"]}" ({c["description"]})' for c in _findings_columns(bucket)
+        )
+        bucket_text += f"""
 For the "{bucket_id}" bucket, populate the "findings" array as described above.
 Each finding MUST have {col_descriptions}.
 You MUST include one finding for EVERY check defined in the agent instructions, \
 not just failing ones. Skipping checks is not acceptable. \
 The findings array count must equal the total number of checks."""
-        bucket_instructions_list.append(bucket_text)
+    return bucket_text
+
+
+def _ci_base_prompt(pr_title: str, pr_description: str, include_intent: bool) -> str:
+    """Build the reviewer preamble listing the inputs the LLM is given."""
+    base_prompt = """You are an Azure infrastructure deployment safety reviewer. You are given:
+1. The Azure What-If output showing planned infrastructure changes
+2. The source code diff (Bicep/ARM template changes) that produced these changes"""
+
+    # Add PR intent context if available and intent bucket is enabled
+    if (pr_title or pr_description) and include_intent:
+        base_prompt += (
+            "\n3. The pull request title and description stating the "
+            "INTENDED purpose of this change"
+        )
+    return base_prompt
+
+
+def _build_ci_system_prompt(
+    pr_title: str = None, pr_description: str = None, enabled_buckets: list = None
+) -> str:
+    """Build system prompt for CI mode with risk assessment.
+
+    Args:
+        pr_title: Optional PR title
+        pr_description: Optional PR description
+        enabled_buckets: List of bucket IDs to include (e.g., ["drift", "intent"])
+                        If None, defaults to all buckets
+
+    Returns:
+        System prompt string with dynamic bucket configuration
+    """
+    from .ci.buckets import get_enabled_buckets
+
+    # Default to all buckets if not specified
+    if enabled_buckets is None:
+        enabled_buckets = get_enabled_buckets(has_pr_metadata=bool(pr_title or pr_description))
+
+    base_prompt = _ci_base_prompt(pr_title, pr_description, "intent" in enabled_buckets)
+
+    # Dynamic bucket count
+    bucket_count = len(enabled_buckets)
+    bucket_word = "bucket" if bucket_count == 1 else "buckets"
+    base_prompt += (
+        f"\n\nEvaluate the deployment for safety and correctness across "
+        f"{bucket_count} independent risk {bucket_word}:"
+    )
 
-    bucket_instructions = "\n".join(bucket_instructions_list)
+    # Build risk_assessment schema dynamically based on enabled buckets
+    risk_assessment_block = ",\n".join(_bucket_schema(b) for b in enabled_buckets)
+    risk_assessment_schema = f""""risk_assessment": {{
+{risk_assessment_block}
+  }}"""
+
+    # Build instructions for each enabled bucket
+    bucket_instructions = "\n".join(
+        _bucket_instructions(bucket_id, f"Risk Bucket {i}")
+        for i, bucket_id in enumerate(enabled_buckets, 1)
+    )
+    bucket_instructions += _CONCERN_ATTRIBUTION_INSTRUCTIONS
 
     # Build verdict schema with dynamic highest_risk_bucket options
     bucket_options = "|".join(enabled_buckets)
@@ -223,65 +319,225 @@ The findings array count must equal the total number of checks."""
     "reasoning": "string — 2-3 sentence explanation considering all buckets"
   }}'''
 
-    confidence_instructions = """
+    return (
+        base_prompt
+        + bucket_instructions
+        + _CI_CONFIDENCE_INSTRUCTIONS
+        + f"""
 
-## Confidence Assessment
+Respond with ONLY valid JSON matching this schema:
 
-For each resource, assess confidence that the change is REAL vs Azure What-If noise:
+{_CI_RESOURCES_RULES}
 
-**HIGH confidence (real changes):**
-- Resource creation, deletion, or state changes
-- Configuration modifications with clear intent
-- Security, networking, or compute changes
+{{
+{_CI_RESOURCES_SCHEMA},
+  {risk_assessment_schema},
+  {verdict_schema}
+}}"""
+    )
 
-**MEDIUM confidence (potentially real but uncertain):**
-- Retention policies or analytics settings
-- Subnet references changing from hardcoded to dynamic
-- Configuration changes that might be platform-managed
 
-**LOW confidence (likely What-If noise):**
-- Metadata-only changes (etag, id, provisioningState, type)
-- logAnalyticsDestinationType property changes
-- IPv6 flags (disableIpv6, enableIPv6Addressing)
-- Computed properties (resourceGuid)
-- Read-only or system-managed properties
+def build_resources_system_prompt() -> str:
+    """Build the CI-mode system prompt for per-resource summarisation only.
 
-Use your judgment - these are guidelines, not rigid patterns."""
+    Used by parallel analysis alongside one :func:`build_bucket_system_prompt`
+    request per bucket; it asks for the ``resources`` array and
+    ``overall_summary`` without any risk bucket evaluation.
 
+    Returns:
+        System prompt string
+    """
     return (
-        base_prompt
-        + bucket_instructions
-        + confidence_instructions
+        _ci_base_prompt(None, None, include_intent=False)
+        + """
+
+Summarize each resource change. Risk buckets are evaluated separately; do NOT \
+include a risk_assessment or verdict."""
+        + _CI_CONFIDENCE_INSTRUCTIONS
         + f"""
 
 Respond with ONLY valid JSON matching this schema:
 
-IMPORTANT rules for the top-level "resources" array ONLY (not agent findings):
-- List ONLY resources that appear in <whatif_output>.
-- Each resource must be its own entry. NEVER group or summarize multiple resources.
-- If the What-If output has no resource changes, return "resources": [].
-- These rules do NOT apply to risk_assessment findings — agents control their own output.
+{_CI_RESOURCES_RULES}
 
 {{
-  "resources": [
-    {{
-      "resource_name": "string — individual resource name from the What-If output",
-      "resource_type": "string — Azure resource type from the What-If output",
-      "action": "string — Create, Modify, Delete, Deploy, NoChange, Ignore",
-      "summary": "string — what this change does",
-      "risk_level": "low|medium|high",
-      "risk_reason": "string or null — why this is risky, if applicable",
-      "confidence_level": "low|medium|high — confidence this is a real change vs What-If noise",
-      "confidence_reason": "string — brief explanation of confidence assessment"
-    }}
-  ],
-  "overall_summary": "string",
-  {risk_assessment_schema},
-  {verdict_schema}
+{_CI_RESOURCES_SCHEMA}
+}}"""
+    )
+
+
+def build_bucket_system_prompt(
+    bucket_id: str, pr_title: str = None, pr_description: str = None
+) -> str:
+    """Build a focused CI-mode system prompt that evaluates a single risk bucket.
+
+    Carries only that bucket's instructions and schema, so each request stays
+    small and buckets can be evaluated concurrently. The response is a
+    ``{"risk_assessment": {bucket_id: {...}}}`` object that merges directly
+    into the combined response.
+
+    Args:
+        bucket_id: Registered bucket ID (e.g., "drift")
+        pr_title: Optional PR title
+        pr_description: Optional PR description
+
+    Returns:
+        System prompt string
+    """
+    attribution = _CONCERN_ATTRIBUTION_TEMPLATE.format(
+        name_source="the individual resource name from the What-If output"
+    )
+    return (
+        _ci_base_prompt(pr_title, pr_description, bucket_id == "intent")
+        + """
+
+Evaluate the deployment for safety and correctness in this risk bucket only:"""
+        + _bucket_instructions(bucket_id, "Risk Bucket")
+        + attribution
+        + f"""
+
+Respond with ONLY valid JSON matching this schema:
+
+{{
+  "risk_assessment": {{
+{_bucket_schema(bucket_id, _BUCKET_RESOURCE_CONCERNS_SCHEMA)}
+  }}
 }}"""
     )
 
 
+# JSON Schemas for schema-constrained output (Anthropic tool use, Azure OpenAI
+# json_schema response format, Ollama format). They describe the same shapes
+# as the schemas written into the system prompts above and are generated from
+# the same bucket and agent registry. Every object lists all of its properties
+# as required and allows no others, as strict structured output requires.
+
+_LEVEL_SCHEMA = {"type": "string", "enum": ["low", "medium", "high"]}
+
+
+def _object_schema(properties: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def _array_schema(items: dict) -> dict:
+    return {"type": "array", "items": items}
+
+
+def _resources_schema(ci_mode: bool, verbose: bool = False) -> dict:
+    """Schema for the resources array and overall_summary."""
+    resource = {
+        "resource_name": {"type": "string"},
+        "resource_type": {"type": "string"},
+        "action": {
+            "type": "string",
+            "enum": [
+                "Create",
+                "Modify",
+                "Delete",
+                "Deploy",
+                "NoChange",
+                "Ignore",
+                "Unsupported",
+            ],
+        },
+        "summary": {"type": "string"},
+    }
+    if ci_mode:
+        resource["risk_level"] = _LEVEL_SCHEMA
+        resource["risk_reason"] = {"type": ["string", "null"]}
+    resource["confidence_level"] = _LEVEL_SCHEMA
+    resource["confidence_reason"] = {"type": "string"}
+    if verbose:
+        # Required in strict mode, so empty for anything but Modify
+        resource["changes"] = _array_schema({"type": "string"})
+    return {
+        "resources": _array_schema(_object_schema(resource)),
+        "overall_summary": {"type": "string"},
+    }
+
+
+def _bucket_response_schema(bucket_id: str) -> dict:
+    """Schema for one bucket's risk_assessment entry."""
+    from .ci.buckets import active_buckets
+
+    bucket = active_buckets()[bucket_id]
+    entry = {
+        "risk_level": _LEVEL_SCHEMA,
+        "concerns": _array_schema({"type": "string"}),
+        "concern_summary": {"type": "string"},
+        "reasoning": {"type": "string"},
+        "resource_concerns": _array_schema(
+            _object_schema(
+                {
+                    "resource_name": {"type": ["string", "null"]},
+                    "risk_level": _LEVEL_SCHEMA,
+                    "concern": {"type": "string"},
+                }
+            )
+        ),
+    }
+    if bucket.custom and bucket.display in ("table", "list"):
+        entry["findings"] = _array_schema(
+            _object_schema({c["key"]: {"type": "string"} for c in _findings_columns(bucket)})
+        )
+    return _object_schema(entry)
+
+
+def build_response_schema(
+    verbose: bool = False,
+    ci_mode: bool = False,
+    pr_title: str = None,
+    pr_description: str = None,
+    enabled_buckets: list = None,
+) -> dict:
+    """Build the JSON Schema for the response to :func:`build_system_prompt`.
+
+    Takes the same arguments, so the schema always matches the prompt.
+
+    Returns:
+        JSON Schema dict
+    """
+    if not ci_mode:
+        return _object_schema(_resources_schema(ci_mode=False, verbose=verbose))
+
+    from .ci.buckets import get_enabled_buckets
+
+    if enabled_buckets is None:
+        enabled_buckets = get_enabled_buckets(has_pr_metadata=bool(pr_title or pr_description))
+
+    properties = _resources_schema(ci_mode=True)
+    properties["risk_assessment"] = _object_schema(
+        {bucket_id: _bucket_response_schema(bucket_id) for bucket_id in enabled_buckets}
+    )
+    properties["verdict"] = _object_schema(
+        {
+            "safe": {"type": "boolean"},
+            "verdict_status": {"type": "string", "enum": ["safe", "review", "unsafe"]},
+            "highest_risk_bucket": {"type": "string", "enum": list(enabled_buckets) + ["none"]},
+            "overall_risk_level": _LEVEL_SCHEMA,
+            "reasoning": {"type": "string"},
+        }
+    )
+    return _object_schema(properties)
+
+
+def build_resources_response_schema() -> dict:
+    """Build the JSON Schema for the response to :func:`build_resources_system_prompt`."""
+    return _object_schema(_resources_schema(ci_mode=True))
+
+
+def build_bucket_response_schema(bucket_id: str) -> dict:
+    """Build the JSON Schema for the response to :func:`build_bucket_system_prompt`."""
+    return _object_schema(
+        {"risk_assessment": _object_schema({bucket_id: _bucket_response_schema(bucket_id)})}
+    )
+
+
 def build_user_prompt(
     whatif_content: str,
     diff_content: str = None,
@@ -302,17 +558,17 @@ def build_user_prompt(
         User prompt string
     """
     if diff_content is not None:
-        # CI mode with diff
+        # CI mode with diff. Content that rarely changes between runs comes
+        # first so it forms a byte-stable prefix the provider can cache
+        # (see split_cacheable_prefix); per-run content follows.
         prompt = """Review this Azure deployment for safety."""
 
-        # Add PR intent context if available
-        if pr_title or pr_description:
+        if bicep_content:
             prompt += f"""
 
-<pull_request_intent>
-Title: {pr_title or "Not provided"}
-Description: {pr_description or "Not provided"}
-</pull_request_intent>"""
+<bicep_source>
+{bicep_content}
+</bicep_source>"""
 
         prompt += f"""
 
@@ -324,12 +580,14 @@ Description: {pr_description or "Not provided"}
 {diff_content}
 </code_diff>"""
 
-        if bicep_content:
+        # Add PR intent context if available
+        if pr_title or pr_description:
             prompt += f"""
 
-<bicep_source>
-{bicep_content}
-</bicep_source>"""
+<pull_request_intent>
+Title: {pr_title or "Not provided"}
+Description: {pr_description or "Not provided"}
+</pull_request_intent>"""
 
         return prompt
     else:
@@ -339,3 +597,25 @@ Description: {pr_description or "Not provided"}
 <whatif_output>
 {whatif_content}
 </whatif_output>"""
+
+
+def split_cacheable_prefix(user_prompt: str) -> Tuple[str, str]:
+    """Split a user prompt into its run-invariant prefix and per-run remainder.
+
+    :func:`build_user_prompt` places the Bicep source ahead of the What-If
+    output, diff and PR metadata, so everything up to ``</bicep_source>`` is
+    usually identical across runs in a repository. Providers mark the end of
+    the prefix as a prompt-cache breakpoint.
+
+    Args:
+        user_prompt: Prompt returned by :func:`build_user_prompt`
+
+    Returns:
+        Tuple of (prefix, remainder); the prefix is empty when there is no
+        Bicep source. ``prefix + remainder == user_prompt``.
+    """
+    end = user_prompt.find(_STATIC_PREFIX_END)
+    if end == -1:
+        return "", user_prompt
+    end += len(_STATIC_PREFIX_END)
+    return user_prompt[:end], user_prompt[end:]
@@ -1,28 +1,331 @@
 """LLM provider implementations for bicep-whatif-advisor."""
 
+import functools
 import os
+import sys
+import threading
+import weakref
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+# Response tokens requested from the API providers (max_tokens); prompt
+# budgeting reserves this much of the context window for the output, or a
+# quarter of the window if that is smaller (tokens.output_reserve)
+MAX_OUTPUT_TOKENS = 16384
+
+# Connection pool size for provider HTTP clients (keep-alive connections per host)
+POOL_SIZE_ENV_VAR = "WHATIF_HTTP_POOL_SIZE"
+DEFAULT_POOL_SIZE = 10
+
+# Process-wide SDK clients and HTTP sessions, keyed by provider and settings.
+# Reusing them keeps connections warm across calls and across analyses.
+_client_cache: Dict[Hashable, Any] = {}
+_client_cache_lock = threading.Lock()
+
+# Async clients are bound to the event loop that created them, so they are
+# cached per loop and dropped with it.
+_async_client_cache: "weakref.WeakKeyDictionary[Any, Dict[Hashable, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class ProviderError(Exception):
+    """Base class for LLM provider failures.
+
+    The message is user-facing; the CLI prints it as ``Error: <message>``
+    and exits with code 1.
+    """
+
+
+class ProviderConfigError(ProviderError):
+    """Missing credentials, settings, or provider SDK."""
+
+
+class ProviderRateLimitError(ProviderError):
+    """The provider rejected the request because of rate limiting."""
+
+
+class ProviderConnectionError(ProviderError):
+    """The provider could not be reached, or kept failing after a retry."""
+
+
+class ProviderTimeoutError(ProviderError):
+    """The request to the provider timed out."""
+
+
+class ProviderResponseError(ProviderError):
+    """The provider returned an error response."""
+
+
+@dataclass
+class TokenUsage:
+    """Token counts accumulated over a provider's requests.
+
+    ``input_tokens`` is the full prompt size; ``cached_input_tokens`` is the
+    part of it served from the provider's prompt cache and
+    ``cache_write_tokens`` the part written to it.
+    """
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_input_tokens: int = 0
+    cache_write_tokens: int = 0
+    requests: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(
+        self,
+        input_tokens: Any = 0,
+        output_tokens: Any = 0,
+        cached_input_tokens: Any = 0,
+        cache_write_tokens: Any = 0,
+    ) -> None:
+        """Record one response's usage; missing (non-integer) counts are treated as 0."""
+        with self._lock:
+            self.input_tokens += _count(input_tokens)
+            self.output_tokens += _count(output_tokens)
+            self.cached_input_tokens += _count(cached_input_tokens)
+            self.cache_write_tokens += _count(cache_write_tokens)
+            self.requests += 1
+
+    def describe(self) -> str:
+        """One-line summary for stderr."""
+        text = f"{self.input_tokens:,} input ({self.cached_input_tokens:,} cached"
+        if self.cache_write_tokens:
+            text += f", {self.cache_write_tokens:,} written to cache"
+        return text + f"), {self.output_tokens:,} output"
+
+
+def _count(value: Any) -> int:
+    return value if isinstance(value, int) and not isinstance(value, bool) else 0
 
 
 class Provider(ABC):
-    """Base class for LLM providers."""
+    """Base class for LLM providers.
+
+    Attributes:
+        coordination_dir: Directory whose rate budgets this provider's
+            scheduler shares with other processes (default: the
+            WHATIF_COORDINATION_DIR environment variable)
+    """
+
+    coordination_dir: Optional[str] = None
+
+    @property
+    def usage(self) -> TokenUsage:
+        """Token counts reported by this provider's responses so far."""
+        return self.__dict__.setdefault("_usage", TokenUsage())
 
     @abstractmethod
-    def complete(self, system_prompt: str, user_prompt: str) -> str:
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
         """Send prompts to the LLM and return the raw response text.
 
         Args:
             system_prompt: The system prompt defining the assistant's behavior
             user_prompt: The user's prompt with the content to analyze
+            response_schema: JSON Schema the response must match. Providers
+                request schema-constrained output for it (tool use, a
+                json_schema response format, or a format grammar), so the
+                response is always valid JSON of that shape.
 
         Returns:
             Raw response text from the LLM (should be JSON)
 
         Raises:
-            Exception: On API errors, missing credentials, etc.
+            ProviderError: On API errors, missing SDKs, etc.
         """
         pass
 
+    async def acomplete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Async version of :meth:`complete`.
+
+        The default runs :meth:`complete` in the loop's default executor;
+        providers override it with their SDK's native async client.
+
+        Raises:
+            ProviderError: On API errors, missing SDKs, etc.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.complete, system_prompt, user_prompt, response_schema)
+        )
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        """Stream the response text in chunks as the LLM generates it.
+
+        The default yields the whole :meth:`complete` response as one chunk;
+        providers override it to stream natively.
+
+        Args:
+            system_prompt: The system prompt defining the assistant's behavior
+            user_prompt: The user's prompt with the content to analyze
+            idle_timeout: Fail if no data arrives for this many seconds,
+                rather than bounding the total duration
+            response_schema: JSON Schema the response must match (see :meth:`complete`)
+
+        Yields:
+            Successive pieces of the raw response text
+
+        Raises:
+            ProviderError: On API errors, missing SDKs, etc.
+        """
+        yield self.complete(system_prompt, user_prompt, response_schema)
+
+    def warm_up(self) -> None:
+        """Start preparing the model for requests without blocking.
+
+        Called once at startup with ``--warm-up`` so the work overlaps with
+        reading the What-If input. The default does nothing; providers that
+        load the model locally override it.
+        """
+
+
+def stream_interrupted_error(service: str, error: Exception, timed_out: bool) -> ProviderError:
+    """Build the error for a stream that fails after output has started.
+
+    Such a stream is not retried (the caller has already consumed part of
+    the response), so the error says whether it stalled or dropped.
+    """
+    if timed_out:
+        return ProviderTimeoutError(
+            f"Stream from {service} stalled: no data within the idle timeout.\nDetails: {error}"
+        )
+    return ProviderConnectionError(f"Stream from {service} was interrupted.\nDetails: {error}")
+
+
+def get_pool_size() -> Optional[int]:
+    """Return the configured HTTP connection pool size, or None if unset.
+
+    Read from the ``WHATIF_HTTP_POOL_SIZE`` environment variable. Invalid
+    values are ignored with a warning.
+    """
+    value = os.environ.get(POOL_SIZE_ENV_VAR)
+    if not value:
+        return None
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size < 1:
+        sys.stderr.write(
+            f"Warning: Invalid {POOL_SIZE_ENV_VAR} '{value}'. Must be a positive integer.\n"
+        )
+        return None
+    return size
+
+
+def get_cached_client(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Return the cached client for ``key``, creating it with ``factory`` once.
+
+    Thread-safe, so concurrent requests share one client (and its
+    connection pool) instead of racing to create several.
+
+    Args:
+        key: Cache key identifying the client's settings (provider, endpoint,
+             credentials, pool size)
+        factory: Zero-argument callable that builds the client
+
+    Returns:
+        The cached client
+    """
+    client = _client_cache.get(key)
+    if client is None:
+        with _client_cache_lock:
+            client = _client_cache.get(key)
+            if client is None:
+                client = factory()
+                _client_cache[key] = client
+    return client
+
+
+def get_cached_async_client(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Return the async client for ``key`` on the running event loop.
+
+    Like :func:`get_cached_client`, but scoped to the current event loop so
+    concurrent ``acomplete`` calls share one connection pool without ever
+    using a client from a different (or closed) loop.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    clients = _async_client_cache.setdefault(loop, {})
+    client = clients.get(key)
+    if client is None:
+        client = factory()
+        clients[key] = client
+    return client
+
+
+def clear_client_cache() -> None:
+    """Close and forget all cached provider clients and sessions.
+
+    Async clients are forgotten without being closed (closing them needs
+    their event loop); they are released when garbage collected.
+    """
+    with _client_cache_lock:
+        clients = list(_client_cache.values())
+        _client_cache.clear()
+        _async_client_cache.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+
+def _httpx_limits(pool_size: Optional[int]):
+    """Build httpx connection limits for the SDK clients.
+
+    Returns None (keep the SDK's defaults) when no pool size is configured
+    or httpx is not importable.
+    """
+    if pool_size is None:
+        return None
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+
+
+def resolve_model(name: str, model: str = None) -> Tuple[str, Optional[str]]:
+    """Return the provider and model :func:`get_provider` would use, without creating it.
+
+    No credentials are needed, so this works for estimates and budgeting.
+    Azure OpenAI has no default: its model is the AZURE_OPENAI_DEPLOYMENT
+    deployment, which may be unset (None).
+    """
+    provider_name = os.environ.get("WHATIF_PROVIDER", name)
+    model_name = os.environ.get("WHATIF_MODEL", model)
+    if model_name:
+        return provider_name, model_name
+    if provider_name == "anthropic":
+        from .anthropic import AnthropicProvider
+
+        return provider_name, AnthropicProvider.DEFAULT_MODEL
+    if provider_name == "azure-openai":
+        return provider_name, os.environ.get("AZURE_OPENAI_DEPLOYMENT")
+    if provider_name == "ollama":
+        from .ollama import OllamaProvider
+
+        return provider_name, OllamaProvider.DEFAULT_MODEL
+    return provider_name, None
+
 
 def get_provider(name: str, model: str = None) -> Provider:
     """Get a provider instance by name.
@@ -36,12 +339,24 @@ def get_provider(name: str, model: str = None) -> Provider:
 
     Raises:
         ValueError: If provider name is invalid
-        ImportError: If required SDK is not installed
+        ProviderConfigError: If required credentials or settings are missing
     """
     # Allow environment variable override
     provider_name = os.environ.get("WHATIF_PROVIDER", name)
     model_name = os.environ.get("WHATIF_MODEL", model)
+    return create_provider(provider_name, model_name)
 
+
+def create_provider(provider_name: str, model_name: str = None) -> Provider:
+    """Create a provider exactly as named, ignoring WHATIF_PROVIDER and WHATIF_MODEL.
+
+    Used for the fallback provider, which must stay distinct from the
+    primary when the environment overrides it.
+
+    Raises:
+        ValueError: If provider name is invalid
+        ProviderConfigError: If required credentials or settings are missing
+    """
     if provider_name == "anthropic":
         from .anthropic import AnthropicProvider
 
@@ -1,10 +1,37 @@
 """Anthropic Claude provider implementation."""
 
+import json
 import os
-import sys
-import time
+from typing import Iterator, Optional
 
-from . import Provider
+from ..prompt import split_cacheable_prefix
+from ..tokens import model_profile, output_reserve
+from . import (
+    MAX_OUTPUT_TOKENS,
+    Provider,
+    ProviderConfigError,
+    _count,
+    _httpx_limits,
+    get_cached_async_client,
+    get_cached_client,
+    get_pool_size,
+)
+from .retry import (
+    acall_with_retry,
+    call_with_retry,
+    classify_sdk_error,
+    estimate_tokens,
+    get_scheduler,
+    stream_with_retry,
+)
+
+# Prompt-cache breakpoint: the request prefix up to and including this block
+# is cached for reuse by later requests with the same prefix
+_CACHE_BREAKPOINT = {"type": "ephemeral"}
+
+# Tool the model is made to call when a response schema is given; its input
+# is the response
+_RESPONSE_TOOL = "submit_analysis"
 
 
 class AnthropicProvider(Provider):
@@ -17,77 +44,229 @@ class AnthropicProvider(Provider):
 
         Args:
             model: Optional model override (default: claude-sonnet-4-20250514)
+
+        Raises:
+            ProviderConfigError: If ANTHROPIC_API_KEY is not set
         """
         self.model = model or self.DEFAULT_MODEL
         self.api_key = os.environ.get("ANTHROPIC_API_KEY")
 
         if not self.api_key:
-            sys.stderr.write(
-                "Error: ANTHROPIC_API_KEY environment variable not set.\n"
-                "Get your API key from: https://console.anthropic.com/\n"
+            raise ProviderConfigError(
+                "ANTHROPIC_API_KEY environment variable not set.\n"
+                "Get your API key from: https://console.anthropic.com/"
             )
-            sys.exit(1)
 
-    def complete(self, system_prompt: str, user_prompt: str) -> str:
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
         """Send prompts to Anthropic Claude API.
 
         Args:
             system_prompt: System prompt defining behavior
             user_prompt: User prompt with content to analyze
+            response_schema: JSON Schema for the response, requested as the
+                input schema of a tool the model must call
 
         Returns:
             Raw response text from Claude (JSON)
 
         Raises:
-            SystemExit: On API errors after retry
+            ProviderError: On API errors after retries
         """
-        try:
-            from anthropic import Anthropic, APIError, RateLimitError
-        except ImportError:
-            sys.stderr.write(
-                "Error: anthropic package not installed.\n"
-                "Install it with: pip install bicep-whatif-advisor[anthropic]\n"
-            )
-            sys.exit(1)
-
-        client = Anthropic(api_key=self.api_key)
-
-        # Try with automatic retry on network errors
-        for attempt in range(2):
-            try:
-                response = client.messages.create(
-                    model=self.model,
-                    max_tokens=16384,
-                    temperature=0,
-                    system=system_prompt,
-                    messages=[{"role": "user", "content": user_prompt}],
-                )
-                return response.content[0].text
-
-            except RateLimitError as e:
-                sys.stderr.write(
-                    f"Error: Rate limited by Anthropic API.\nTry again in a moment. Details: {e}\n"
-                )
-                sys.exit(1)
-
-            except APIError as e:
-                if attempt == 0:
-                    # First attempt failed, retry once
-                    sys.stderr.write(f"Network error, retrying... ({e})\n")
-                    time.sleep(1)
-                    continue
+        _import_sdk()
+        client = get_cached_client(
+            ("anthropic", self.api_key, get_pool_size()), self._create_client
+        )
+        request = self._request(system_prompt, user_prompt, response_schema)
+
+        response = call_with_retry(
+            self._scheduler(),
+            lambda: client.messages.create(**request),
+            _classify,
+            estimate_tokens(system_prompt, user_prompt),
+        )
+        self._record_usage(response.usage)
+        return _response_text(response)
+
+    async def acomplete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Send prompts to Anthropic Claude API using the async client.
+
+        Same behavior as :meth:`complete`, without blocking the event loop.
+
+        Raises:
+            ProviderError: On API errors after retries
+        """
+        _import_sdk()
+        client = get_cached_async_client(
+            ("anthropic", self.api_key, get_pool_size()), self._create_async_client
+        )
+        request = self._request(system_prompt, user_prompt, response_schema)
+
+        response = await acall_with_retry(
+            self._scheduler(),
+            lambda: client.messages.create(**request),
+            _classify,
+            estimate_tokens(system_prompt, user_prompt),
+        )
+        self._record_usage(response.usage)
+        return _response_text(response)
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        """Stream the response text from Anthropic Claude API.
+
+        Failures before the first chunk are retried like :meth:`complete`;
+        once text has been yielded, errors are raised. With a response
+        schema, the tool input is streamed as it is generated.
+
+        Raises:
+            ProviderError: On API errors, or when no data arrives for ``idle_timeout``
+        """
+        _import_sdk()
+        client = get_cached_client(
+            ("anthropic", self.api_key, get_pool_size()), self._create_client
+        )
+        request = self._request(system_prompt, user_prompt, response_schema)
+        if idle_timeout is not None:
+            # httpx applies the read timeout per chunk, not to the whole response
+            request["timeout"] = idle_timeout
+
+        def open_stream():
+            with client.messages.stream(**request) as stream:
+                if response_schema is None:
+                    yield from stream.text_stream
                 else:
-                    # Second attempt failed
-                    sys.stderr.write(
-                        f"Error: Network error contacting Anthropic API after retry.\n"
-                        f"Details: {e}\n"
-                    )
-                    sys.exit(1)
-
-            except Exception as e:
-                sys.stderr.write(f"Error: Unexpected error calling Anthropic API.\nDetails: {e}\n")
-                sys.exit(1)
-
-        # Should not reach here
-        sys.stderr.write("Error: Failed to get response from Anthropic API.\n")
-        sys.exit(1)
+                    for event in stream:
+                        if event.type == "content_block_delta" and (
+                            event.delta.type == "input_json_delta"
+                        ):
+                            yield event.delta.partial_json
+                self._record_usage(stream.get_final_message().usage)
+
+        return stream_with_retry(
+            self._scheduler(), open_stream, _classify, estimate_tokens(system_prompt, user_prompt)
+        )
+
+    def _scheduler(self):
+        """Rate limits and retries are shared by all requests with this API key."""
+        return get_scheduler(("anthropic", self.api_key), "Anthropic API", self.coordination_dir)
+
+    def _request(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> dict:
+        """Build the messages.create() arguments.
+
+        The system prompt and the run-invariant prefix of the user prompt
+        (the Bicep source) each end in a prompt-cache breakpoint, so repeat
+        runs only pay full price for the What-If output, diff and PR metadata.
+        A response schema becomes the only tool, and the model must call it;
+        tools precede the system prompt, so the schema is cached with it.
+        """
+        prefix, remainder = split_cacheable_prefix(user_prompt)
+        if prefix:
+            content = [
+                {"type": "text", "text": prefix, "cache_control": _CACHE_BREAKPOINT},
+                {"type": "text", "text": remainder},
+            ]
+        else:
+            content = user_prompt
+
+        max_tokens = output_reserve(model_profile("anthropic", self.model), MAX_OUTPUT_TOKENS)
+        request = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "system": [{"type": "text", "text": system_prompt, "cache_control": _CACHE_BREAKPOINT}],
+            "messages": [{"role": "user", "content": content}],
+        }
+        if response_schema is not None:
+            request["tools"] = [
+                {
+                    "name": _RESPONSE_TOOL,
+                    "description": "Submit the analysis in the required JSON structure.",
+                    "input_schema": response_schema,
+                }
+            ]
+            request["tool_choice"] = {"type": "tool", "name": _RESPONSE_TOOL}
+        return request
+
+    def _record_usage(self, usage) -> None:
+        """Add a response's token usage, counting cache reads and writes as input."""
+        cache_read = getattr(usage, "cache_read_input_tokens", 0)
+        cache_write = getattr(usage, "cache_creation_input_tokens", 0)
+        self.usage.add(
+            input_tokens=sum(
+                _count(value)
+                for value in (getattr(usage, "input_tokens", 0), cache_read, cache_write)
+            ),
+            output_tokens=getattr(usage, "output_tokens", 0),
+            cached_input_tokens=cache_read,
+            cache_write_tokens=cache_write,
+        )
+
+    def _create_client(self):
+        """Create the SDK client, sized by WHATIF_HTTP_POOL_SIZE if set.
+
+        The SDK's own retries are disabled; the request scheduler retries.
+        """
+        from anthropic import Anthropic
+
+        limits = _httpx_limits(get_pool_size())
+        if limits is None:
+            return Anthropic(api_key=self.api_key, max_retries=0)
+
+        from anthropic import DefaultHttpxClient
+
+        return Anthropic(
+            api_key=self.api_key, max_retries=0, http_client=DefaultHttpxClient(limits=limits)
+        )
+
+    def _create_async_client(self):
+        """Create the async SDK client, sized by WHATIF_HTTP_POOL_SIZE if set."""
+        from anthropic import AsyncAnthropic
+
+        limits = _httpx_limits(get_pool_size())
+        if limits is None:
+            return AsyncAnthropic(api_key=self.api_key, max_retries=0)
+
+        from anthropic import DefaultAsyncHttpxClient
+
+        return AsyncAnthropic(
+            api_key=self.api_key,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=limits),
+        )
+
+
+def _response_text(response) -> str:
+    """Return the tool input as JSON if the model called the response tool, else the text."""
+    for block in response.content:
+        if getattr(block, "type", None) == "tool_use":
+            return json.dumps(block.input)
+    return response.content[0].text
+
+
+def _import_sdk() -> None:
+    """Fail with install instructions if the anthropic package is missing."""
+    try:
+        import anthropic  # noqa: F401
+    except ImportError:
+        raise ProviderConfigError(
+            "anthropic package not installed.\n"
+            "Install it with: pip install bicep-whatif-advisor[anthropic]"
+        )
+
+
+def _classify(error: Exception):
+    """Classify an anthropic SDK error for the retry scheduler."""
+    import anthropic
+
+    return classify_sdk_error(error, anthropic, "Anthropic API")
@@ -1,10 +1,30 @@
 """Azure OpenAI provider implementation."""
 
 import os
-import sys
-import time
-
-from . import Provider
+from typing import Iterator, Optional
+
+from ..tokens import model_profile, output_reserve
+from . import (
+    MAX_OUTPUT_TOKENS,
+    Provider,
+    ProviderConfigError,
+    _httpx_limits,
+    get_cached_async_client,
+    get_cached_client,
+    get_pool_size,
+)
+from .retry import (
+    acall_with_retry,
+    call_with_retry,
+    classify_sdk_error,
+    estimate_tokens,
+    get_scheduler,
+    stream_with_retry,
+)
+
+# 2024-10-21 is the first GA version reporting cached prompt tokens
+# (usage.prompt_tokens_details) and accepting stream_options
+_API_VERSION = "2024-10-21"
 
 
 class AzureOpenAIProvider(Provider):
@@ -15,6 +35,9 @@ class AzureOpenAIProvider(Provider):
 
         Args:
             model: Optional model override (uses deployment name)
+
+        Raises:
+            ProviderConfigError: If required environment variables are missing
         """
         self.endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
         self.api_key = os.environ.get("AZURE_OPENAI_API_KEY")
@@ -30,79 +53,198 @@ class AzureOpenAIProvider(Provider):
             missing.append("AZURE_OPENAI_DEPLOYMENT")
 
         if missing:
-            sys.stderr.write(
-                f"Error: Missing required environment variables: {', '.join(missing)}\n"
-                f"Set them to use Azure OpenAI provider.\n"
+            raise ProviderConfigError(
+                f"Missing required environment variables: {', '.join(missing)}\n"
+                f"Set them to use Azure OpenAI provider."
             )
-            sys.exit(1)
 
-    def complete(self, system_prompt: str, user_prompt: str) -> str:
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
         """Send prompts to Azure OpenAI API.
 
         Args:
             system_prompt: System prompt defining behavior
             user_prompt: User prompt with content to analyze
+            response_schema: JSON Schema for the response, requested as a
+                strict ``json_schema`` response format
 
         Returns:
             Raw response text from Azure OpenAI (JSON)
 
         Raises:
-            SystemExit: On API errors after retry
+            ProviderError: On API errors after retries
         """
-        try:
-            from openai import APIError, AzureOpenAI, RateLimitError
-        except ImportError:
-            sys.stderr.write(
-                "Error: openai package not installed.\n"
-                "Install it with: pip install bicep-whatif-advisor[azure]\n"
-            )
-            sys.exit(1)
+        _import_sdk()
+        client = get_cached_client(
+            ("azure-openai", self.endpoint, self.api_key, get_pool_size()), self._create_client
+        )
+        request = self._request(system_prompt, user_prompt, response_schema)
+
+        response = call_with_retry(
+            self._scheduler(),
+            lambda: client.chat.completions.create(**request),
+            _classify,
+            estimate_tokens(system_prompt, user_prompt),
+        )
+        self._record_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def acomplete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Send prompts to Azure OpenAI API using the async client.
 
-        client = AzureOpenAI(
-            azure_endpoint=self.endpoint, api_key=self.api_key, api_version="2024-02-15-preview"
+        Same behavior as :meth:`complete`, without blocking the event loop.
+
+        Raises:
+            ProviderError: On API errors after retries
+        """
+        _import_sdk()
+        client = get_cached_async_client(
+            ("azure-openai", self.endpoint, self.api_key, get_pool_size()),
+            self._create_async_client,
+        )
+        request = self._request(system_prompt, user_prompt, response_schema)
+
+        response = await acall_with_retry(
+            self._scheduler(),
+            lambda: client.chat.completions.create(**request),
+            _classify,
+            estimate_tokens(system_prompt, user_prompt),
         )
+        self._record_usage(response.usage)
+        return response.choices[0].message.content
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        """Stream the response text from Azure OpenAI API.
+
+        Failures before the first chunk are retried like :meth:`complete`;
+        once text has been yielded, errors are raised.
+
+        Raises:
+            ProviderError: On API errors, or when no data arrives for ``idle_timeout``
+        """
+        _import_sdk()
+        client = get_cached_client(
+            ("azure-openai", self.endpoint, self.api_key, get_pool_size()), self._create_client
+        )
+        request = self._request(system_prompt, user_prompt, response_schema)
+        request["stream"] = True
+        # The final chunk then carries usage (with no choices)
+        request["stream_options"] = {"include_usage": True}
+        if idle_timeout is not None:
+            # httpx applies the read timeout per chunk, not to the whole response
+            request["timeout"] = idle_timeout
+
+        def open_stream():
+            for chunk in client.chat.completions.create(**request):
+                # Azure sends a leading chunk with no choices (content filter results)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                elif not chunk.choices and getattr(chunk, "usage", None) is not None:
+                    self._record_usage(chunk.usage)
+
+        return stream_with_retry(
+            self._scheduler(), open_stream, _classify, estimate_tokens(system_prompt, user_prompt)
+        )
+
+    def _scheduler(self):
+        """Rate limits and retries are shared by all requests to this deployment."""
+        return get_scheduler(
+            ("azure-openai", self.endpoint, self.deployment),
+            "Azure OpenAI API",
+            self.coordination_dir,
+        )
+
+    def _request(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> dict:
+        """Build the chat.completions.create() arguments.
+
+        Azure OpenAI caches prompt prefixes automatically, so no hints are
+        sent: the system prompt followed by the user prompt (which starts
+        with the run-invariant Bicep source) is already a stable prefix.
+        """
+        max_tokens = output_reserve(
+            model_profile("azure-openai", self.deployment), MAX_OUTPUT_TOKENS
+        )
+        request = {
+            "model": self.deployment,
+            "temperature": 0,
+            "max_tokens": max_tokens,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+        }
+        if response_schema is not None:
+            request["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "whatif_analysis",
+                    "strict": True,
+                    "schema": response_schema,
+                },
+            }
+        return request
+
+    def _record_usage(self, usage) -> None:
+        """Add a response's token usage, including cached prompt tokens."""
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.usage.add(
+            input_tokens=getattr(usage, "prompt_tokens", 0),
+            output_tokens=getattr(usage, "completion_tokens", 0),
+            cached_input_tokens=getattr(details, "cached_tokens", 0),
+        )
+
+    def _client_kwargs(self, http_client_class: str) -> dict:
+        kwargs = {
+            "azure_endpoint": self.endpoint,
+            "api_key": self.api_key,
+            "api_version": _API_VERSION,
+            # The request scheduler retries; the SDK's own retries are disabled
+            "max_retries": 0,
+        }
+        limits = _httpx_limits(get_pool_size())
+        if limits is not None:
+            import openai
+
+            kwargs["http_client"] = getattr(openai, http_client_class)(limits=limits)
+        return kwargs
+
+    def _create_client(self):
+        """Create the SDK client, sized by WHATIF_HTTP_POOL_SIZE if set."""
+        from openai import AzureOpenAI
+
+        return AzureOpenAI(**self._client_kwargs("DefaultHttpxClient"))
+
+    def _create_async_client(self):
+        """Create the async SDK client, sized by WHATIF_HTTP_POOL_SIZE if set."""
+        from openai import AsyncAzureOpenAI
+
+        return AsyncAzureOpenAI(**self._client_kwargs("DefaultAsyncHttpxClient"))
+
+
+def _import_sdk() -> None:
+    """Fail with install instructions if the openai package is missing."""
+    try:
+        import openai  # noqa: F401
+    except ImportError:
+        raise ProviderConfigError(
+            "openai package not installed.\n"
+            "Install it with: pip install bicep-whatif-advisor[azure]"
+        )
+
+
+def _classify(error: Exception):
+    """Classify an openai SDK error for the retry scheduler."""
+    import openai
 
-        # Try with automatic retry on network errors
-        for attempt in range(2):
-            try:
-                response = client.chat.completions.create(
-                    model=self.deployment,
-                    temperature=0,
-                    max_tokens=16384,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                )
-                return response.choices[0].message.content
-
-            except RateLimitError as e:
-                sys.stderr.write(
-                    f"Error: Rate limited by Azure OpenAI API.\n"
-                    f"Try again in a moment. Details: {e}\n"
-                )
-                sys.exit(1)
-
-            except APIError as e:
-                if attempt == 0:
-                    # First attempt failed, retry once
-                    sys.stderr.write(f"Network error, retrying... ({e})\n")
-                    time.sleep(1)
-                    continue
-                else:
-                    # Second attempt failed
-                    sys.stderr.write(
-                        f"Error: Network error contacting Azure OpenAI API after retry.\n"
-                        f"Details: {e}\n"
-                    )
-                    sys.exit(1)
-
-            except Exception as e:
-                sys.stderr.write(
-                    f"Error: Unexpected error calling Azure OpenAI API.\nDetails: {e}\n"
-                )
-                sys.exit(1)
-
-        # Should not reach here
-        sys.stderr.write("Error: Failed to get response from Azure OpenAI API.\n")
-        sys.exit(1)
+    return classify_sdk_error(error, openai, "Azure OpenAI API")
@@ -1,10 +1,64 @@
-"""Ollama local LLM provider implementation."""
+"""Ollama local LLM provider implementation.
 
+Requests go to ``/api/chat`` with the system and user prompts as separate
+messages, so the chat template keeps the system prompt in its own turn and
+Ollama can reuse the KV cache for it. Each request also sets:
+
+- ``keep_alive`` (``WHATIF_OLLAMA_KEEP_ALIVE``, default 30m) so the model
+  stays loaded between requests and between runs;
+- ``num_ctx`` sized to the prompt plus room for the response, rounded up to a
+  power of two so runs of similar size reuse the loaded model (a different
+  ``num_ctx`` makes Ollama reload it) and capped at the model's context
+  window (``WHATIF_CONTEXT_WINDOW`` overrides it) and at
+  ``WHATIF_OLLAMA_MAX_CTX`` (default 32,768);
+- ``format``: the response's JSON Schema when one is given, else ``json``,
+  so generation is constrained to valid JSON.
+"""
+
+import functools
+import json
 import os
 import sys
-import time
+import threading
+from typing import Iterator, Optional, Union
+
+from ..tokens import SAFETY_MARGIN, model_profile
+from . import (
+    DEFAULT_POOL_SIZE,
+    Provider,
+    ProviderConfigError,
+    ProviderConnectionError,
+    ProviderError,
+    ProviderRateLimitError,
+    ProviderResponseError,
+    ProviderTimeoutError,
+    get_cached_client,
+    get_pool_size,
+)
+from .retry import (
+    Failure,
+    acall_with_retry,
+    call_with_retry,
+    estimate_tokens,
+    get_scheduler,
+    retry_after_from_headers,
+    stream_with_retry,
+)
+
+KEEP_ALIVE_ENV_VAR = "WHATIF_OLLAMA_KEEP_ALIVE"
+DEFAULT_KEEP_ALIVE = "30m"
 
-from . import Provider
+TIMEOUT_ENV_VAR = "WHATIF_OLLAMA_TIMEOUT"
+# A whole response is generated before the first byte arrives, which takes
+# minutes for a large analysis on CPU-only runners
+DEFAULT_TIMEOUT = 600.0
+
+# Context kept free for the response when sizing num_ctx
+OUTPUT_RESERVE = 8192
+
+# Smallest num_ctx requested; also what the warm-up request loads the model
+# with, since it covers prompts up to about 8K tokens
+MIN_NUM_CTX = 16384
 
 
 class OllamaProvider(Provider):
@@ -21,79 +75,312 @@ class OllamaProvider(Provider):
         """
         self.model = model or self.DEFAULT_MODEL
         self.host = os.environ.get("OLLAMA_HOST", self.DEFAULT_HOST)
+        self.keep_alive = _keep_alive()
+        self.timeout = _timeout()
 
-    def complete(self, system_prompt: str, user_prompt: str) -> str:
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
         """Send prompts to Ollama API.
 
         Args:
             system_prompt: System prompt defining behavior
             user_prompt: User prompt with content to analyze
+            response_schema: JSON Schema for the response, sent as ``format``
 
         Returns:
             Raw response text from Ollama (JSON)
 
         Raises:
-            SystemExit: On API errors after retry
+            ProviderError: On API errors after retries
         """
-        try:
-            import requests
-        except ImportError:
-            sys.stderr.write(
-                "Error: requests package not installed.\n"
-                "Install it with: pip install bicep-whatif-advisor[ollama]\n"
+        return call_with_retry(
+            self._scheduler(),
+            functools.partial(self._post, system_prompt, user_prompt, response_schema),
+            self._classify,
+            estimate_tokens(system_prompt, user_prompt),
+        )
+
+    async def acomplete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Send prompts to Ollama API without blocking the event loop.
+
+        The request runs on the shared keep-alive session in the loop's
+        default executor; Ollama has no async SDK and the ``ollama`` extra
+        only depends on requests.
+
+        Raises:
+            ProviderError: On API errors after retries
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await acall_with_retry(
+            self._scheduler(),
+            lambda: loop.run_in_executor(
+                None, functools.partial(self._post, system_prompt, user_prompt, response_schema)
+            ),
+            self._classify,
+            estimate_tokens(system_prompt, user_prompt),
+        )
+
+    def stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        idle_timeout: Optional[float] = None,
+        response_schema: Optional[dict] = None,
+    ) -> Iterator[str]:
+        """Stream the response text from Ollama API.
+
+        Ollama streams newline-delimited JSON objects, each carrying the next
+        piece of ``message.content`` until one has ``"done": true``. Failures before
+        the first chunk are retried like :meth:`complete`; once text has been
+        yielded, errors are raised.
+
+        Raises:
+            ProviderError: On API errors, or when no data arrives for ``idle_timeout``
+        """
+
+        def open_stream():
+            session = self._session()
+            # requests applies the read timeout per socket read, not to the whole body
+            response = session.post(
+                f"{self.host}/api/chat",
+                json=self._payload(system_prompt, user_prompt, response_schema, stream=True),
+                timeout=idle_timeout or self.timeout,
+                verify=True,
+                stream=True,
             )
-            sys.exit(1)
+            try:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise ProviderResponseError(
+                            f"Error from Ollama API.\nDetails: {data['error']}"
+                        )
+                    content = (data.get("message") or {}).get("content")
+                    if content:
+                        yield content
+                    if data.get("done"):
+                        self._record_usage(data)
+                        break
+            finally:
+                response.close()
+
+        return stream_with_retry(
+            self._scheduler(),
+            open_stream,
+            self._classify,
+            estimate_tokens(system_prompt, user_prompt),
+        )
+
+    def warm_up(self) -> None:
+        """Load the model in the background so the first request need not wait.
+
+        A chat request without messages makes Ollama load the model with the
+        given ``num_ctx`` and ``keep_alive`` and return without generating.
+        Failures are ignored: the real request reports them.
+        """
+
+        def load():
+            try:
+                self._session().post(
+                    f"{self.host}/api/chat",
+                    json={
+                        "model": self.model,
+                        "messages": [],
+                        "keep_alive": self.keep_alive,
+                        "options": {"num_ctx": self._num_ctx(0)},
+                    },
+                    timeout=self.timeout,
+                    verify=True,
+                )
+            except Exception:
+                pass
+
+        threading.Thread(target=load, name="ollama-warm-up", daemon=True).start()
+
+    def _scheduler(self):
+        """Rate limits and retries are shared by all requests to this host."""
+        return get_scheduler(("ollama", self.host), "Ollama", self.coordination_dir)
+
+    def _post(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
+        """Send one chat request on the cached session."""
+        session = self._session()
 
-        # Combine system and user prompts for Ollama
-        combined_prompt = f"{system_prompt}\n\n{user_prompt}"
+        url = f"{self.host}/api/chat"
+        response = session.post(
+            url,
+            json=self._payload(system_prompt, user_prompt, response_schema),
+            timeout=self.timeout,
+            verify=True,
+        )
+        response.raise_for_status()
 
-        url = f"{self.host}/api/generate"
-        payload = {
+        data = response.json()
+        self._record_usage(data)
+        return (data.get("message") or {}).get("content", "")
+
+    def _record_usage(self, data: dict) -> None:
+        """Add token counts from a final response object.
+
+        Ollama reuses the KV cache for a repeated prompt prefix internally
+        but does not report it, so only evaluated prompt tokens are counted.
+        """
+        self.usage.add(
+            input_tokens=data.get("prompt_eval_count", 0),
+            output_tokens=data.get("eval_count", 0),
+        )
+
+    def _payload(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        response_schema: Optional[dict] = None,
+        stream: bool = False,
+    ) -> dict:
+        """Build the /api/chat request body."""
+        prompt_tokens = estimate_tokens(system_prompt, user_prompt)
+        return {
             "model": self.model,
-            "prompt": combined_prompt,
-            "stream": False,
-            "options": {"temperature": 0},
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            "stream": stream,
+            "format": response_schema or "json",
+            "keep_alive": self.keep_alive,
+            "options": {"temperature": 0, "num_ctx": self._num_ctx(prompt_tokens)},
         }
 
-        # Try with automatic retry on network errors
-        for attempt in range(2):
-            try:
-                response = requests.post(url, json=payload, timeout=120, verify=True)
-                response.raise_for_status()
+    def _num_ctx(self, prompt_tokens: int) -> int:
+        """Context size for a prompt: a power of two with room for the response.
+
+        The token estimate gets the same safety margin as prompt budgeting,
+        and the result never exceeds the model's context window, which
+        :func:`model_profile` caps at WHATIF_OLLAMA_MAX_CTX.
+        """
+        needed = int(prompt_tokens / (1 - SAFETY_MARGIN)) + OUTPUT_RESERVE
+        num_ctx = MIN_NUM_CTX
+        while num_ctx < needed:
+            num_ctx *= 2
+        return min(num_ctx, model_profile("ollama", self.model).context_window)
+
+    def _session(self):
+        """Return the cached keep-alive session for this host."""
+        try:
+            import requests  # noqa: F401
+        except ImportError:
+            raise ProviderConfigError(
+                "requests package not installed.\n"
+                "Install it with: pip install bicep-whatif-advisor[ollama]"
+            )
+
+        pool_size = get_pool_size() or DEFAULT_POOL_SIZE
+        return get_cached_client(
+            ("ollama", self.host, pool_size), lambda: _create_session(pool_size)
+        )
+
+    def _classify(self, error: Exception) -> Failure:
+        """Classify a requests error for the retry scheduler.
+
+        Connection failures and an overloaded server (429/503) are retried.
+        Read timeouts are not: the model is too slow for the prompt, and a
+        retry would wait just as long.
+        """
+        import requests
 
-                data = response.json()
-                return data.get("response", "")
-
-            except requests.exceptions.ConnectionError:
-                if attempt == 0:
-                    # First attempt failed, retry once
-                    sys.stderr.write("Connection error, retrying...\n")
-                    time.sleep(1)
-                    continue
-                else:
-                    # Second attempt failed
-                    sys.stderr.write(
-                        f"Error: Cannot reach Ollama at {self.host}.\n"
-                        f"Make sure Ollama is running and try again.\n"
-                        f"Start Ollama with: ollama serve\n"
-                    )
-                    sys.exit(1)
-
-            except requests.exceptions.Timeout:
-                sys.stderr.write(
-                    "Error: Request to Ollama timed out.\n"
-                    "The model may be too slow or the prompt too large.\n"
+        if isinstance(error, requests.exceptions.ConnectTimeout) or (
+            isinstance(error, requests.exceptions.ConnectionError) and not _is_read_timeout(error)
+        ):
+            return Failure(
+                ProviderConnectionError(
+                    f"Cannot reach Ollama at {self.host}.\n"
+                    f"Make sure Ollama is running and try again.\n"
+                    f"Start Ollama with: ollama serve"
+                ),
+                retryable=True,
+            )
+
+        if _is_read_timeout(error):
+            return Failure(
+                ProviderTimeoutError(
+                    "Request to Ollama timed out.\n"
+                    "The model may be too slow or the prompt too large."
+                )
+            )
+
+        if isinstance(error, requests.exceptions.HTTPError):
+            response = error.response
+            status = getattr(response, "status_code", None)
+            if status in (429, 503):
+                return Failure(
+                    ProviderRateLimitError(f"Ollama is overloaded (HTTP {status}).\n{error}"),
+                    retryable=True,
+                    retry_after=retry_after_from_headers(getattr(response, "headers", None)),
+                    rate_limited=True,
                 )
-                sys.exit(1)
+            return Failure(ProviderResponseError(f"HTTP error from Ollama API.\nDetails: {error}"))
+
+        return Failure(ProviderError(f"Unexpected error calling Ollama API.\nDetails: {error}"))
+
+
+def _keep_alive() -> Union[str, int]:
+    """keep_alive from WHATIF_OLLAMA_KEEP_ALIVE.
+
+    Ollama takes a duration such as ``30m`` or a number of seconds (negative
+    keeps the model loaded indefinitely, 0 unloads it after the request).
+    """
+    value = os.environ.get(KEEP_ALIVE_ENV_VAR, "").strip() or DEFAULT_KEEP_ALIVE
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _timeout() -> float:
+    """Request timeout in seconds from WHATIF_OLLAMA_TIMEOUT (invalid values ignored)."""
+    value = os.environ.get(TIMEOUT_ENV_VAR)
+    if value:
+        try:
+            timeout = float(value)
+        except ValueError:
+            timeout = 0
+        if timeout > 0:
+            return timeout
+        sys.stderr.write(
+            f"Warning: Invalid {TIMEOUT_ENV_VAR} '{value}'. Must be a positive number of seconds.\n"
+        )
+    return DEFAULT_TIMEOUT
+
+
+def _create_session(pool_size: int):
+    """Create a keep-alive session whose pool holds ``pool_size`` connections."""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
-            except requests.exceptions.HTTPError as e:
-                sys.stderr.write(f"Error: HTTP error from Ollama API.\nDetails: {e}\n")
-                sys.exit(1)
+def _is_read_timeout(error: Exception) -> bool:
+    """Whether a requests error is a read timeout.
 
-            except Exception as e:
-                sys.stderr.write(f"Error: Unexpected error calling Ollama API.\nDetails: {e}\n")
-                sys.exit(1)
+    A timeout while reading a streamed body surfaces as a ConnectionError
+    wrapping urllib3's ReadTimeoutError rather than as requests' Timeout.
+    """
+    import requests
+    from urllib3.exceptions import ReadTimeoutError
 
-        # Should not reach here
-        sys.stderr.write("Error: Failed to get response from Ollama API.\n")
-        sys.exit(1)
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    return any(isinstance(arg, ReadTimeoutError) for arg in error.args)
@@ -0,0 +1,617 @@
+"""Rate-limit-aware retry scheduling shared by the providers.
+
+Every provider request goes through a :class:`RequestScheduler`, one per
+provider account/deployment (cached with the SDK clients), which:
+
+- retries transient failures (rate limits, connection errors, 5xx) with
+  jittered exponential backoff, waiting at least as long as the server asks
+  via ``Retry-After`` or the provider's rate-limit reset headers;
+- enforces optional requests-per-minute and tokens-per-minute budgets with
+  token buckets (``WHATIF_REQUESTS_PER_MINUTE`` / ``WHATIF_TOKENS_PER_MINUTE``),
+  shared across processes when ``WHATIF_COORDINATION_DIR`` is set;
+- adapts how many requests it lets run at once (AIMD): the limit halves on a
+  429, shrinks when latency climbs well above its baseline while several
+  requests are in flight, and grows back additively while saturated.
+
+Providers translate SDK exceptions into a :class:`Failure` with a classifier;
+the scheduler decides whether and when to retry. Requests, retries and
+rate-limit waits are counted on the active :mod:`~bicep_whatif_advisor.timings`
+recorder.
+"""
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Hashable, Iterator, Optional, TypeVar
+
+from ..timings import get_recorder
+from . import (
+    ProviderConnectionError,
+    ProviderError,
+    ProviderRateLimitError,
+    ProviderResponseError,
+    ProviderTimeoutError,
+    get_cached_client,
+    stream_interrupted_error,
+)
+
+MAX_RETRIES_ENV_VAR = "WHATIF_MAX_RETRIES"
+REQUESTS_PER_MINUTE_ENV_VAR = "WHATIF_REQUESTS_PER_MINUTE"
+TOKENS_PER_MINUTE_ENV_VAR = "WHATIF_TOKENS_PER_MINUTE"
+
+DEFAULT_MAX_RETRIES = 3
+
+# Ceiling for the adaptive in-flight limit (AIMD starts here)
+DEFAULT_MAX_IN_FLIGHT = 16
+
+T = TypeVar("T")
+
+
+@dataclass
+class Failure:
+    """A classified request failure.
+
+    Attributes:
+        error: The ProviderError to raise if the failure is final
+        retryable: Whether another attempt may succeed
+        retry_after: Seconds the server asked us to wait, if it said
+        rate_limited: Whether the provider throttled the request (HTTP 429)
+    """
+
+    error: ProviderError
+    retryable: bool = False
+    retry_after: Optional[float] = None
+    rate_limited: bool = False
+
+
+@dataclass
+class RetryPolicy:
+    """Attempt budget and backoff curve."""
+
+    max_attempts: int = DEFAULT_MAX_RETRIES + 1
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before the attempt after ``attempt`` (0-based).
+
+        Full-jitter exponential backoff, but never shorter than the server's
+        ``retry_after``; both are capped at ``max_delay``.
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            # A little jitter so throttled clients don't all return at once
+            backoff = max(backoff, retry_after + random.uniform(0, self.base_delay / 2))
+        return min(backoff, self.max_delay)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``per_minute``."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens, returning how long to wait before using them.
+
+        The reservation is made immediately (the balance may go negative), so
+        concurrent callers queue up behind each other instead of all waking
+        when the bucket refills.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Waiter:
+    """A request queued for a concurrency slot."""
+
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake: Optional[Callable[[], None]] = None):
+        self.granted = False
+        self.wake = wake
+
+
+def _resolve(future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveConcurrency:
+    """In-flight request limit adjusted by additive increase / multiplicative decrease.
+
+    Requests that find the limit reached queue up, threads and coroutines
+    alike, and :meth:`release` hands freed slots to them in arrival order.
+    """
+
+    def __init__(self, max_limit: int = DEFAULT_MAX_IN_FLIGHT, latency_factor: float = 2.0):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.latency_factor = latency_factor
+        self._baseline: Optional[float] = None
+        self._cond = threading.Condition()
+        self._waiters: Deque[_Waiter] = deque()
+
+    def _has_room(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def _admit(self) -> None:
+        """Give free slots to queued requests, oldest first (lock held)."""
+        while self._waiters and self._has_room():
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            if waiter.wake is not None:
+                waiter.wake()
+        self._cond.notify_all()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            # Never jump ahead of requests already waiting
+            if self._waiters or not self._has_room():
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self) -> None:
+        with self._cond:
+            if not self._waiters and self._has_room():
+                self.in_flight += 1
+                return
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+            while not waiter.granted:
+                self._cond.wait()
+
+    async def acquire_async(self) -> None:
+        """Async version of :meth:`acquire`; waits on a future that a release resolves."""
+        import asyncio
+
+        with self._cond:
+            if not self._waiters and self._has_room():
+                self.in_flight += 1
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, future))
+            self._waiters.append(waiter)
+        try:
+            await future
+        except BaseException:
+            with self._cond:
+                if waiter.granted:
+                    # Cancelled after being admitted: pass the slot on
+                    self.in_flight -= 1
+                    self._admit()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+
+    def release(self, latency: Optional[float] = None, rate_limited: bool = False) -> None:
+        """Free a slot and adapt the limit from how the request went."""
+        with self._cond:
+            concurrent = self.in_flight > 1
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+
+            if rate_limited:
+                # Halve what was actually running, not a limit we never reached
+                self.limit = max(1.0, min(self.limit, self.in_flight + 1) / 2)
+            elif latency is not None:
+                slow = self._baseline is not None and latency > self.latency_factor * self._baseline
+                if concurrent and slow:
+                    self.limit = max(1.0, self.limit * 0.75)
+                elif concurrent and saturated:
+                    self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                if not slow:
+                    self._baseline = (
+                        latency if self._baseline is None else 0.8 * self._baseline + 0.2 * latency
+                    )
+            self._admit()
+
+
+class RequestScheduler:
+    """Rate limiting, adaptive concurrency and retry decisions for one provider."""
+
+    def __init__(
+        self,
+        name: str,
+        policy: Optional[RetryPolicy] = None,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            name: Provider name for retry messages (e.g., "Anthropic API")
+            policy: Retry policy (default: 3 retries with backoff)
+            requests_per_minute: Request budget, or None for unlimited
+            tokens_per_minute: Estimated prompt-token budget, or None for unlimited
+            max_in_flight: Ceiling for the adaptive concurrency limit
+        """
+        self.name = name
+        self.policy = policy or RetryPolicy()
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_in_flight)
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(
+        cls, name: str, key: Optional[Hashable] = None, directory: Optional[str] = None
+    ) -> "RequestScheduler":
+        """Create a scheduler configured from the WHATIF_* environment variables.
+
+        With a coordination ``directory`` (default: WHATIF_COORDINATION_DIR),
+        the per-minute budgets are shared with every other process using that
+        directory and the same ``key``.
+        """
+        from ..coordination import COORDINATION_DIR_ENV_VAR, shared_bucket
+
+        max_retries = _env_number(MAX_RETRIES_ENV_VAR, int, minimum=0)
+        scheduler = cls(
+            name,
+            policy=RetryPolicy(
+                max_attempts=(DEFAULT_MAX_RETRIES if max_retries is None else max_retries) + 1
+            ),
+            requests_per_minute=_env_number(REQUESTS_PER_MINUTE_ENV_VAR, float, minimum=1),
+            tokens_per_minute=_env_number(TOKENS_PER_MINUTE_ENV_VAR, float, minimum=1),
+        )
+        directory = directory or os.environ.get(COORDINATION_DIR_ENV_VAR)
+        if directory and key is not None:
+            scheduler.requests = shared_bucket(scheduler.requests, directory, key, "requests")
+            scheduler.tokens = shared_bucket(scheduler.tokens, directory, key, "tokens")
+        return scheduler
+
+    def close(self) -> None:
+        """Release shared budget files (called by ``clear_client_cache``)."""
+        for bucket in (self.requests, self.tokens):
+            close = getattr(bucket, "close", None)
+            if callable(close):
+                close()
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = max(0.0, self._cooldown_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until the budgets and concurrency limit admit a request.
+
+        Returns:
+            Start time to pass to :meth:`release`
+        """
+        wait = self._wait_time(tokens)
+        if wait > 0:
+            get_recorder().add("rate_limit_wait_seconds", wait)
+            time.sleep(wait)
+        self.concurrency.acquire()
+        return time.monotonic()
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Async version of :meth:`acquire` that never blocks the event loop."""
+        import asyncio
+
+        wait = self._wait_time(tokens)
+        if wait > 0:
+            get_recorder().add("rate_limit_wait_seconds", wait)
+            await asyncio.sleep(wait)
+        await self.concurrency.acquire_async()
+        return time.monotonic()
+
+    def release(self, started: float, failure: Optional[Failure] = None) -> None:
+        """Free the slot taken by :meth:`acquire` and record the outcome."""
+        recorder = get_recorder()
+        if failure is None:
+            latency = time.monotonic() - started
+            self.concurrency.release(latency=latency)
+            recorder.add("provider_requests")
+            recorder.add("provider_request_seconds", latency)
+            return
+        self.concurrency.release(rate_limited=failure.rate_limited)
+        recorder.add("provider_failures")
+        if failure.rate_limited and failure.retry_after:
+            # Hold back every request to this provider, not just the throttled one
+            with self._lock:
+                self._cooldown_until = max(
+                    self._cooldown_until, time.monotonic() + failure.retry_after
+                )
+
+    def next_delay(self, failure: Failure, attempt: int, cause: BaseException) -> float:
+        """Return the backoff before retrying, or raise if the failure is final.
+
+        Args:
+            failure: The classified failure of attempt ``attempt`` (0-based)
+            attempt: Attempt number that failed
+            cause: Original exception, chained onto the raised ProviderError
+        """
+        if not failure.retryable or attempt + 1 >= self.policy.max_attempts:
+            raise failure.error from cause
+        delay = self.policy.delay(attempt, failure.retry_after)
+        get_recorder().add("retries")
+        reason = str(failure.error).splitlines()[0].rstrip(".")
+        sys.stderr.write(
+            f"{reason}, retrying in {delay:.1f}s"
+            f" (attempt {attempt + 2} of {self.policy.max_attempts})...\n"
+        )
+        return delay
+
+
+def get_scheduler(key: Hashable, name: str, directory: Optional[str] = None) -> RequestScheduler:
+    """Return the process-wide scheduler for a provider account or deployment.
+
+    Cached alongside the SDK clients, so every request to the same endpoint
+    and coordination ``directory`` shares one set of budgets and one
+    concurrency limit.
+    """
+    return get_cached_client(
+        ("scheduler", directory) + tuple(key),
+        lambda: RequestScheduler.from_env(name, key, directory),
+    )
+
+
+def call_with_retry(
+    scheduler: RequestScheduler,
+    request: Callable[[], T],
+    classify: Callable[[Exception], Failure],
+    tokens: int = 0,
+) -> T:
+    """Run ``request`` under the scheduler, retrying per its policy.
+
+    Args:
+        scheduler: Scheduler for the provider
+        request: Zero-argument callable performing one attempt
+        classify: Maps an exception from ``request`` to a :class:`Failure`
+        tokens: Estimated prompt tokens, charged to the tokens-per-minute budget
+
+    Raises:
+        ProviderError: When a failure is not retryable or attempts run out
+    """
+    for attempt in range(scheduler.policy.max_attempts):
+        started = scheduler.acquire(tokens)
+        try:
+            result = request()
+        except Exception as e:
+            failure = classify_failure(e, classify)
+            scheduler.release(started, failure)
+            time.sleep(scheduler.next_delay(failure, attempt, e))
+        else:
+            scheduler.release(started)
+            return result
+    raise ProviderError(f"Failed to get response from {scheduler.name}.")
+
+
+async def acall_with_retry(
+    scheduler: RequestScheduler,
+    request: Callable[[], Any],
+    classify: Callable[[Exception], Failure],
+    tokens: int = 0,
+) -> Any:
+    """Async version of :func:`call_with_retry`; ``request`` returns an awaitable."""
+    import asyncio
+
+    for attempt in range(scheduler.policy.max_attempts):
+        started = await scheduler.acquire_async(tokens)
+        try:
+            result = await request()
+        except Exception as e:
+            failure = classify_failure(e, classify)
+            scheduler.release(started, failure)
+            await asyncio.sleep(scheduler.next_delay(failure, attempt, e))
+        else:
+            scheduler.release(started)
+            return result
+    raise ProviderError(f"Failed to get response from {scheduler.name}.")
+
+
+def stream_with_retry(
+    scheduler: RequestScheduler,
+    open_stream: Callable[[], Iterator[str]],
+    classify: Callable[[Exception], Failure],
+    tokens: int = 0,
+) -> Iterator[str]:
+    """Yield chunks from ``open_stream()`` under the scheduler.
+
+    Failures before the first chunk are retried per the policy. Once a chunk
+    has been yielded the caller has consumed part of the response, so a
+    failure is raised instead (see :func:`stream_interrupted_error`).
+    """
+    for attempt in range(scheduler.policy.max_attempts):
+        received = False
+        released = False
+        started = scheduler.acquire(tokens)
+        try:
+            for chunk in open_stream():
+                received = True
+                yield chunk
+        except Exception as e:
+            failure = classify_failure(e, classify)
+            scheduler.release(started, failure)
+            released = True
+            if received and not isinstance(e, ProviderError):
+                timed_out = isinstance(failure.error, ProviderTimeoutError)
+                raise stream_interrupted_error(scheduler.name, e, timed_out) from e
+            if received:
+                raise
+            time.sleep(scheduler.next_delay(failure, attempt, e))
+        else:
+            scheduler.release(started)
+            released = True
+            return
+        finally:
+            # The consumer stopped early (GeneratorExit)
+            if not released:
+                scheduler.release(started)
+    raise ProviderError(f"Failed to get response from {scheduler.name}.")
+
+
+def classify_sdk_error(error: Exception, sdk: Any, service: str) -> Failure:
+    """Classify an exception from the anthropic or openai SDK.
+
+    Both SDKs share the same exception hierarchy. Rate limits, timeouts,
+    connection failures and 408/409/5xx responses are retryable; other HTTP
+    errors (bad request, authentication) are not.
+
+    Args:
+        error: Exception raised by the SDK call
+        sdk: The imported SDK module (``anthropic`` or ``openai``)
+        service: Name for messages (e.g., "Anthropic API")
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+
+    if isinstance(error, sdk.RateLimitError):
+        return Failure(
+            ProviderRateLimitError(
+                f"Rate limited by {service}.\nTry again in a moment. Details: {error}"
+            ),
+            retryable=True,
+            retry_after=retry_after_from_headers(headers),
+            rate_limited=True,
+        )
+
+    if isinstance(error, sdk.APITimeoutError):
+        return Failure(
+            ProviderTimeoutError(f"Request to {service} timed out.\nDetails: {error}"),
+            retryable=True,
+        )
+
+    if isinstance(error, sdk.APIStatusError):
+        status = error.status_code
+        if status in (408, 409) or status >= 500:
+            return Failure(
+                ProviderConnectionError(f"Server error from {service} (HTTP {status}).\n{error}"),
+                retryable=True,
+                retry_after=retry_after_from_headers(headers),
+            )
+        return Failure(ProviderResponseError(f"{service} rejected the request.\nDetails: {error}"))
+
+    if isinstance(error, sdk.APIError):
+        return Failure(
+            ProviderConnectionError(f"Network error contacting {service}.\nDetails: {error}"),
+            retryable=True,
+        )
+
+    return Failure(ProviderError(f"Unexpected error calling {service}.\nDetails: {error}"))
+
+
+def classify_failure(error: Exception, classify: Callable[[Exception], Failure]) -> Failure:
+    """Classify an exception, passing ProviderErrors through as final."""
+    if isinstance(error, ProviderError):
+        return Failure(error)
+    return classify(error)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Prompt-token estimate from the configured local token counter."""
+    from ..tokens import count_tokens
+
+    return sum(count_tokens(text) for text in texts)
+
+
+# Header pairs (remaining, reset) reported by Azure OpenAI and Anthropic
+_RATE_LIMIT_HEADERS = (
+    ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+    ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ("anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset"),
+    ("anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset"),
+    ("anthropic-ratelimit-input-tokens-remaining", "anthropic-ratelimit-input-tokens-reset"),
+    ("anthropic-ratelimit-output-tokens-remaining", "anthropic-ratelimit-output-tokens-reset"),
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def retry_after_from_headers(headers: Any) -> Optional[float]:
+    """Seconds to wait before retrying, from a throttled response's headers.
+
+    Honors ``retry-after-ms`` and ``retry-after`` (seconds or an HTTP date).
+    Without them, uses the reset time of whichever rate limit is exhausted
+    (remaining == 0). Returns None if the headers give no hint.
+    """
+    if not headers:
+        return None
+    get = headers.get
+
+    value = get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+
+    value = get("retry-after")
+    if value:
+        seconds = _parse_reset(value)
+        if seconds is not None:
+            return seconds
+
+    waits = []
+    for remaining_header, reset_header in _RATE_LIMIT_HEADERS:
+        remaining, reset = get(remaining_header), get(reset_header)
+        if remaining is not None and reset and str(remaining).strip() == "0":
+            seconds = _parse_reset(reset)
+            if seconds is not None:
+                waits.append(seconds)
+    return max(waits) if waits else None
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """Parse seconds ("20"), a duration ("6m0s", "250ms") or a timestamp into a delay."""
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+    try:
+        if value[:1].isdigit():
+            # RFC 3339 (Anthropic reset headers)
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        else:
+            # HTTP date (Retry-After)
+            moment = parsedate_to_datetime(value)
+        return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _env_number(name: str, cast, minimum: float):
+    """Read a numeric setting from the environment, ignoring invalid values."""
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        number = cast(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        sys.stderr.write(f"Warning: Ignoring invalid {name}={value!r}.\n")
+        return None
+    return number
@@ -3,10 +3,12 @@
 import json
 import shutil
 import sys
+from typing import TYPE_CHECKING
 
-from rich import box
-from rich.console import Console
-from rich.table import Table
+# rich is imported by the functions that draw tables, so JSON and markdown
+# output (and runs that exit before rendering) never pay for loading it
+if TYPE_CHECKING:
+    from rich.console import Console
 
 
 def print_banner() -> None:
@@ -20,6 +22,11 @@ def print_banner() -> None:
     print(banner, file=sys.stderr)
 
 
+# Footer of CI-mode markdown comments
+_FOOTER = (
+    "*Generated by [bicep-whatif-advisor](https://github.com/neilpeterson/bicep-whatif-advisor)*"
+)
+
 # Action symbols and colors
 ACTION_STYLES = {
     "Create": ("✅", "green"),
@@ -28,6 +35,7 @@ ACTION_STYLES = {
     "Deploy": ("🔄", "blue"),
     "NoChange": ("➖", "dim"),
     "Ignore": ("⬜", "dim"),
+    "Unsupported": ("⚠️", "magenta"),
 }
 
 # Risk level symbols and colors for CI mode
@@ -75,6 +83,10 @@ def render_table(
     terminal_width = shutil.get_terminal_size().columns
     reduced_width = int(terminal_width * 0.85)
 
+    from rich import box
+    from rich.console import Console
+    from rich.table import Table
+
     console = Console(force_terminal=use_color, no_color=not use_color, width=reduced_width)
 
     # Print risk bucket summary in CI mode
@@ -155,8 +167,35 @@ def render_table(
         _print_noise_section(console, low_confidence_data, use_color, ci_mode)
 
 
+def render_streamed_resource(resource: dict, no_color: bool = False) -> None:
+    """Print one resource row to stderr as it arrives from a streamed response.
+
+    Gives immediate feedback with ``--stream`` while the LLM is still
+    generating; the full report is rendered once the response is complete.
+
+    Args:
+        resource: A completed element of the response's resources array
+        no_color: Disable colored output
+    """
+    from rich.console import Console
+
+    use_color = not no_color and sys.stderr.isatty()
+    console = Console(
+        stderr=True, force_terminal=use_color, no_color=not use_color, highlight=False
+    )
+
+    action = resource.get("action", "Unknown")
+    symbol, color = ACTION_STYLES.get(action, ("?", "white"))
+    resource_name = resource.get("resource_name", "Unknown")
+    resource_type = resource.get("resource_type", "Unknown")
+    console.print(
+        f"  {symbol} {_colorize(action, color, use_color)}  {resource_name} ({resource_type})",
+        markup=use_color,
+    )
+
+
 def _print_noise_section(
-    console: Console, low_confidence_data: dict, use_color: bool, ci_mode: bool
+    console: "Console", low_confidence_data: dict, use_color: bool, ci_mode: bool
 ) -> None:
     """Print low-confidence resources as potential Azure What-If noise."""
     resources = low_confidence_data.get("resources", [])
@@ -185,6 +224,9 @@ def _print_noise_section(
     console.print()
 
     # Create noise table
+    from rich import box
+    from rich.table import Table
+
     noise_table = Table(box=box.ROUNDED, show_lines=False, padding=(0, 1))
     noise_table.add_column("#", style="dim", width=4)
     noise_table.add_column("Resource", style="bold")
@@ -217,7 +259,7 @@ def _print_noise_section(
 
 
 def _print_risk_bucket_summary(
-    console: Console, risk_assessment: dict, use_color: bool, enabled_buckets: list = None
+    console: "Console", risk_assessment: dict, use_color: bool, enabled_buckets: list = None
 ) -> None:
     """Print risk bucket summary table in CI mode.
 
@@ -231,13 +273,16 @@ def _print_risk_bucket_summary(
     if not risk_assessment:
         return
 
-    from .ci.buckets import RISK_BUCKETS
+    from .ci.buckets import active_buckets
 
     # If enabled_buckets not provided, use all buckets present in risk_assessment
     if enabled_buckets is None:
         enabled_buckets = list(risk_assessment.keys())
 
     # Create risk bucket table
+    from rich import box
+    from rich.table import Table
+
     bucket_table = Table(box=box.ROUNDED, show_header=True, padding=(0, 1))
     bucket_table.add_column("Risk Assessment", style="bold")
     bucket_table.add_column("Risk Level", justify="center")
@@ -246,7 +291,7 @@ def _print_risk_bucket_summary(
 
     # Render only enabled buckets
     for bucket_id in enabled_buckets:
-        bucket = RISK_BUCKETS[bucket_id]
+        bucket = active_buckets()[bucket_id]
         bucket_data = risk_assessment.get(bucket_id, {})
 
         if bucket_data:
@@ -271,7 +316,7 @@ def _print_risk_bucket_summary(
     console.print()
 
 
-def _print_verbose_details(console: Console, resources: list, use_color: bool) -> None:
+def _print_verbose_details(console: "Console", resources: list, use_color: bool) -> None:
     """Print verbose property-level change details."""
     modified_resources = [r for r in resources if r.get("action") == "Modify" and r.get("changes")]
 
@@ -291,7 +336,7 @@ def _print_verbose_details(console: Console, resources: list, use_color: bool) -
             console.print()
 
 
-def _print_ci_verdict(console: Console, verdict: dict, use_color: bool) -> None:
+def _print_ci_verdict(console: "Console", verdict: dict, use_color: bool) -> None:
     """Print CI mode verdict."""
     if not verdict:
         return
@@ -342,7 +387,7 @@ def _render_agent_detail_sections(data: dict, platform: str = None) -> list:
     Returns:
         List of markdown lines
     """
-    from .ci.buckets import RISK_BUCKETS
+    from .ci.buckets import active_buckets
 
     lines = []
     enabled_buckets = data.get("_enabled_buckets")
@@ -351,7 +396,7 @@ def _render_agent_detail_sections(data: dict, platform: str = None) -> list:
         return lines
 
     for bucket_id in enabled_buckets:
-        bucket = RISK_BUCKETS.get(bucket_id)
+        bucket = active_buckets().get(bucket_id)
         if not bucket or not bucket.custom:
             continue
 
@@ -446,6 +491,89 @@ def render_json(data: dict, low_confidence_data: dict = None) -> None:
     print(json.dumps(output, indent=2))
 
 
+def render_batch_json(report: dict) -> None:
+    """Render a batch report as pretty-printed JSON.
+
+    Args:
+        report: Batch report (see ``bicep_whatif_advisor.batch.build_report``)
+    """
+    print(json.dumps(report, indent=2))
+
+
+# Display names for estimate prompt sections
+_SECTION_LABELS = {
+    "system_prompt": "System prompt",
+    "whatif_output": "What-If output",
+    "code_diff": "Code diff",
+    "bicep_source": "Bicep source",
+    "framing_and_pr_intent": "Framing and PR intent",
+}
+
+
+def render_estimate(estimate: dict, format: str = "table", no_color: bool = False) -> None:
+    """Render a token and cost estimate (the ``estimate`` command).
+
+    Args:
+        estimate: Estimate dict built by the CLI (sections, requests, tokens, cost)
+        format: "json" for JSON, anything else for a table
+        no_color: Disable colored output
+    """
+    if format == "json":
+        print(json.dumps(estimate, indent=2))
+        return
+
+    from rich import box
+    from rich.console import Console
+    from rich.table import Table
+
+    use_color = not no_color and sys.stdout.isatty()
+    console = Console(force_terminal=use_color, no_color=not use_color)
+
+    model = estimate["model"] or "default model"
+    console.print(_colorize(f"Estimate for {estimate['provider']} ({model})", "bold", use_color))
+
+    table = Table(box=box.ROUNDED, show_lines=False, padding=(0, 1))
+    table.add_column("Prompt section")
+    table.add_column("Tokens", justify="right")
+    for name, tokens in estimate["sections"].items():
+        table.add_row(_SECTION_LABELS.get(name, name), f"{tokens:,}")
+    table.add_row(
+        _colorize("Total per request", "bold", use_color),
+        _colorize(f"{estimate['prompt_tokens']:,}", "bold", use_color),
+    )
+    console.print(table)
+
+    if not estimate["requests"]:
+        console.print("No LLM request needed: nothing actionable after noise filtering.")
+        return
+
+    headroom = estimate["headroom_tokens"]
+    headroom_color = "green" if headroom >= 0 else "red"
+    cost = estimate["cost_usd"]
+    cost_text = (
+        f"${cost:.4f}" if cost is not None else "unknown (set --input-price and --output-price)"
+    )
+    requests = f"{estimate['requests']}"
+    if estimate.get("shards", 1) > 1:
+        requests += f" ({estimate['shards']} shards; sections above are for the largest)"
+    lines = [
+        ("Requests", requests),
+        ("Input tokens (all requests)", f"{estimate['input_tokens']:,}"),
+        ("Expected output tokens", f"{estimate['output_tokens']:,}"),
+        (
+            "Context window",
+            f"{estimate['context_window']:,} (output reservation"
+            f" {estimate['max_output_tokens']:,}, headroom "
+            + _colorize(f"{headroom:,}", headroom_color, use_color)
+            + ")",
+        ),
+        ("Projected cost", cost_text),
+        ("Projected latency", f"~{estimate['latency_seconds']:.0f}s"),
+    ]
+    for label, value in lines:
+        console.print(f"{_colorize(label + ':', 'bold', use_color)} {value}")
+
+
 def render_markdown(
     data: dict,
     ci_mode: bool = False,
@@ -454,6 +582,7 @@ def render_markdown(
     low_confidence_data: dict = None,
     platform: str = None,
     whatif_content: str = None,
+    section: bool = False,
 ) -> str:
     """Render output as markdown table suitable for PR comments.
 
@@ -464,6 +593,8 @@ def render_markdown(
         no_block: Append "(non-blocking)" to title if True
         low_confidence_data: Optional dict with low-confidence resources (potential noise)
         platform: CI/CD platform ("github", "azuredevops", or None for default)
+        section: Render one section of a larger comment (batch reports): headings
+            one level down and no footer
 
     Returns:
         Markdown-formatted string
@@ -474,13 +605,13 @@ def render_markdown(
         title = custom_title if custom_title else "What-If Deployment Review"
         if no_block:
             title = f"{title} (non-blocking)"
-        lines.append(f"## {title}")
+        lines.append(f"{'###' if section else '##'} {title}")
         lines.append("")
 
         # Add risk bucket summary (without heading label)
         risk_assessment = data.get("risk_assessment", {})
         if risk_assessment:
-            from .ci.buckets import RISK_BUCKETS
+            from .ci.buckets import active_buckets
 
             # Get enabled buckets (default to all if not specified)
             enabled_buckets = data.get("_enabled_buckets")
@@ -492,7 +623,7 @@ def render_markdown(
 
             # Render enabled buckets dynamically
             for bucket_id in enabled_buckets:
-                bucket = RISK_BUCKETS[bucket_id]
+                bucket = active_buckets()[bucket_id]
                 bucket_data = risk_assessment.get(bucket_id, {})
 
                 if bucket_data:
@@ -625,7 +756,7 @@ def render_markdown(
                 verdict_text = "❌ UNSAFE"
             else:
                 verdict_text = "✅ SAFE"
-            lines.append(f"### Verdict: {verdict_text}")
+            lines.append(f"{'####' if section else '###'} Verdict: {verdict_text}")
             # Show review buckets
             review_buckets = verdict.get("review_buckets", [])
             if review_buckets:
@@ -635,10 +766,152 @@ def render_markdown(
                 lines.append(f"**Reasoning:** {reasoning}")
             lines.append("")
 
-    if ci_mode:
+    if ci_mode and not section:
         lines.append("---")
-        lines.append(
-            "*Generated by [bicep-whatif-advisor](https://github.com/neilpeterson/bicep-whatif-advisor)*"
+        lines.append(_FOOTER)
+
+    return "\n".join(lines)
+
+
+# Batch status labels, worst first
+_BATCH_STATUS_LABELS = {
+    "error": "💥 ERROR",
+    "unsafe": "❌ UNSAFE",
+    "review": "👀 REVIEW",
+    "safe": "✅ SAFE",
+    "analyzed": "📋 ANALYZED",
+}
+
+
+def _stack_detail(stack: dict) -> str:
+    """Failed/review buckets or the error of one batch stack, for summary tables."""
+    if stack.get("error"):
+        return stack["error"]
+    if stack.get("failed_buckets"):
+        return "Failed: " + ", ".join(stack["failed_buckets"])
+    if stack.get("review_buckets"):
+        return "Review: " + ", ".join(stack["review_buckets"])
+    return ""
+
+
+def render_batch_table(
+    report: dict, verbose: bool = False, no_color: bool = False, ci_mode: bool = False
+) -> None:
+    """Render a batch report: each stack's table, then one row per stack.
+
+    Args:
+        report: Batch report (see ``bicep_whatif_advisor.batch.build_report``)
+        verbose: Show property-level changes for modified resources
+        no_color: Disable colored output
+        ci_mode: Include risk assessment columns and verdicts
+    """
+    from rich import box
+    from rich.console import Console
+    from rich.table import Table
+
+    use_color = not no_color and sys.stdout.isatty()
+    console = Console(force_terminal=use_color, no_color=not use_color)
+
+    for stack in report["stacks"]:
+        console.rule(_colorize(f"Stack: {stack['name']}", "bold", use_color))
+        if stack.get("error"):
+            console.print(_colorize(f"Analysis failed: {stack['error']}", "red", use_color))
+            console.print()
+            continue
+        render_table(
+            stack["high_confidence"],
+            verbose=verbose,
+            no_color=no_color,
+            ci_mode=ci_mode,
+            low_confidence_data=stack.get("low_confidence"),
+        )
+
+    table = Table(box=box.ROUNDED, show_lines=False, padding=(0, 1))
+    table.add_column("Stack", style="bold")
+    table.add_column("Status", justify="center")
+    table.add_column("Resources", justify="right")
+    table.add_column("Details")
+    for stack in report["stacks"]:
+        resources = len((stack.get("high_confidence") or {}).get("resources", []))
+        table.add_row(
+            stack["name"],
+            _BATCH_STATUS_LABELS.get(stack["status"], stack["status"]),
+            "" if stack.get("error") else str(resources),
+            _stack_detail(stack),
         )
+    console.rule(_colorize("Batch summary", "bold", use_color))
+    console.print(table)
+    verdict = report["verdict"]
+    status = _BATCH_STATUS_LABELS.get(verdict["status"], verdict["status"])
+    console.print(f"{_colorize('Batch verdict:', 'bold', use_color)} {status}")
+
+
+def render_batch_markdown(
+    report: dict,
+    ci_mode: bool = False,
+    custom_title: str = None,
+    no_block: bool = False,
+    platform: str = None,
+) -> str:
+    """Render a batch report as one markdown document (and PR comment).
+
+    A summary table with a row per stack comes first; each stack's full
+    review follows in a collapsed section.
+
+    Args:
+        report: Batch report (see ``bicep_whatif_advisor.batch.build_report``)
+        ci_mode: Include risk assessments and verdicts
+        custom_title: Custom title (default: "What-If Deployment Review")
+        no_block: Append "(non-blocking)" to title if True
+        platform: CI/CD platform ("github", "azuredevops", or None for default)
+
+    Returns:
+        Markdown-formatted string
+    """
+    title = custom_title if custom_title else "What-If Deployment Review"
+    if no_block:
+        title = f"{title} (non-blocking)"
+    stacks = report["stacks"]
+    lines = [f"## {title} ({len(stacks)} stacks)", ""]
+
+    lines.append("| Stack | Status | Resources | Details |")
+    lines.append("|-------|--------|-----------|---------|")
+    for stack in stacks:
+        resources = len((stack.get("high_confidence") or {}).get("resources", []))
+        detail = _stack_detail(stack).replace("|", "\\|")
+        status = _BATCH_STATUS_LABELS.get(stack["status"], stack["status"])
+        count = "" if stack.get("error") else str(resources)
+        lines.append(f"| {stack['name']} | {status} | {count} | {detail} |")
+    lines.append("")
+
+    for stack in stacks:
+        status = _BATCH_STATUS_LABELS.get(stack["status"], stack["status"])
+        lines.append("<details>")
+        lines.append(f"<summary>{status}: {stack['name']}</summary>")
+        lines.append("")
+        if stack.get("error"):
+            lines.append(f"**Analysis failed:** {stack['error']}")
+        else:
+            lines.append(
+                render_markdown(
+                    stack["high_confidence"],
+                    ci_mode=ci_mode,
+                    custom_title=stack["name"],
+                    low_confidence_data=stack.get("low_confidence"),
+                    platform=platform,
+                    section=True,
+                )
+            )
+        lines.append("")
+        lines.append("</details>")
+        lines.append("")
+
+    if ci_mode:
+        verdict = report["verdict"]
+        status = _BATCH_STATUS_LABELS.get(verdict["status"], verdict["status"])
+        lines.append(f"### Batch verdict: {status}")
+        lines.append("")
+        lines.append("---")
+        lines.append(_FOOTER)
 
     return "\n".join(lines)
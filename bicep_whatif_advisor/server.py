@@ -0,0 +1,515 @@
+"""Long-running advisor service for self-hosted runners (the ``serve`` command).
+
+Each advisor run pays to start the interpreter, load and compile the noise
+patterns, parse the agent files and open a provider connection before it
+sends anything. On a self-hosted runner, ``bicep-whatif-advisor serve``
+pays those costs once and keeps the results in memory:
+
+- compiled noise patterns (and their match memos) per pattern set;
+- custom agents per agents directory, parsed once into a bucket registry
+  that each request reads from (the process-wide registry is never changed,
+  so reloads and directories sharing an agent ID don't affect other requests);
+- providers per configuration, with their pooled clients, response cache
+  and rate budget.
+
+Runs started with ``--server URL`` send the What-If output, diff, Bicep
+source and options to ``POST /analyze`` and render the result themselves,
+so a job's overhead is one local HTTP round trip. Requests are handled
+concurrently by a bounded pool of worker threads; ``GET /health`` and
+``GET /metrics`` report liveness and counters. Noise pattern files and
+agent directories are reloaded when they change on disk.
+
+Only the standard library is used, and the server binds to 127.0.0.1 by
+default: requests name files on the server's machine and use its credentials.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from . import __version__
+from .batch import Stack, compile_patterns, create_analyzer
+from .ci.buckets import RISK_BUCKETS, RiskBucket, use_buckets
+from .input import InputError
+from .providers import Provider
+from .session import build_llm_provider, enabled_buckets_for
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 4
+
+# Seconds a client waits for an analysis (the connection timeout is shorter)
+DEFAULT_CLIENT_TIMEOUT = 600.0
+_CONNECT_TIMEOUT = 10.0
+
+# Largest request body accepted (What-If output, diff and Bicep source)
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# Options accepted by POST /analyze (CLI parameter names) and their defaults
+ANALYZE_OPTIONS = {
+    "provider": "anthropic",
+    "model": None,
+    "verbose": False,
+    "ci": False,
+    "drift_threshold": "high",
+    "intent_threshold": "high",
+    "agent_threshold": {},
+    "pr_title": None,
+    "pr_description": None,
+    "no_block": False,
+    "skip_drift": False,
+    "skip_intent": False,
+    "skip_agent": [],
+    "agents_dir": None,
+    "noise_file": None,
+    "noise_threshold": 80,
+    "no_builtin_patterns": False,
+    "input_format": "auto",
+    "parallel": False,
+    "max_concurrency": 4,
+    "cache_dir": None,
+    "no_cache": False,
+    "coordination_dir": None,
+    "fallback_provider": None,
+    "fallback_model": None,
+    "hedge_delay": None,
+    "no_structured_output": False,
+}
+
+# Options that name files or directories, sent as absolute paths
+PATH_OPTIONS = ("noise_file", "agents_dir", "cache_dir", "coordination_dir")
+
+# Options passed to session.build_llm_provider, in its argument order
+_PROVIDER_OPTIONS = (
+    "provider",
+    "model",
+    "fallback_provider",
+    "fallback_model",
+    "hedge_delay",
+    "coordination_dir",
+    "cache_dir",
+    "no_cache",
+)
+
+_THRESHOLD_LEVELS = ("low", "medium", "high")
+
+
+class ServerError(Exception):
+    """The advisor server could not be reached or failed to handle a request."""
+
+
+class AdvisorService:
+    """State shared by requests: compiled patterns, agents, providers and counters."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._agents_lock = threading.Lock()
+        self._provider_lock = threading.Lock()
+        # (no_builtin, noise file, threshold) -> (file stamp, (patterns, index, matcher))
+        self._patterns: Dict[tuple, tuple] = {}
+        # agents directory -> (directory stamp, bucket registry for its requests)
+        self._agents: Dict[str, Tuple[tuple, Dict[str, RiskBucket]]] = {}
+        self._providers: Dict[tuple, Provider] = {}
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "analysis_seconds": 0.0,
+            "pattern_reloads": 0,
+            "agent_reloads": 0,
+        }
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "version": __version__,
+            "uptime_seconds": round(time.time() - self.started, 3),
+        }
+
+    def metrics(self) -> dict:
+        """Request counters plus token usage and cache hits per provider."""
+        from .cache import CachingProvider
+
+        with self._lock:
+            metrics = dict(self._counters)
+        metrics["analysis_seconds"] = round(metrics["analysis_seconds"], 6)
+        metrics["uptime_seconds"] = round(time.time() - self.started, 3)
+
+        providers = {}
+        with self._provider_lock:
+            items = list(self._providers.items())
+        for key, llm_provider in items:
+            usage = llm_provider.usage
+            stats = {
+                "requests": usage.requests,
+                "input_tokens": usage.input_tokens,
+                "cached_input_tokens": usage.cached_input_tokens,
+                "output_tokens": usage.output_tokens,
+            }
+            if isinstance(llm_provider, CachingProvider):
+                stats["cache_hits"] = llm_provider.hits
+                stats["cache_misses"] = llm_provider.misses
+            providers[f"{key[0]}:{key[1] or 'default'}"] = stats
+        metrics["providers"] = providers
+        return metrics
+
+    def analyze(self, payload) -> dict:
+        """Handle a POST /analyze body.
+
+        Returns:
+            The stack result (as in batch reports) plus ``exit_code``; a
+            failed analysis is reported with status ``error``
+
+        Raises:
+            InputError: If the request is malformed
+        """
+        if not isinstance(payload, dict) or not isinstance(payload.get("whatif"), str):
+            raise InputError("Request must be a JSON object with a 'whatif' string")
+        options = parse_options(payload.get("options") or {})
+
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["in_flight"] += 1
+        started = time.perf_counter()
+        try:
+            result = self._analyze(payload, options)
+        finally:
+            with self._lock:
+                self._counters["in_flight"] -= 1
+                self._counters["analysis_seconds"] += time.perf_counter() - started
+        if result.error is not None:
+            with self._lock:
+                self._counters["errors"] += 1
+        return {**result.to_dict(), "exit_code": result.exit_code}
+
+    def _analyze(self, payload: dict, options: dict):
+        buckets = RISK_BUCKETS
+        custom_agent_ids = []
+        if options["ci"] and options["agents_dir"]:
+            buckets = self.agents(options["agents_dir"])
+            custom_agent_ids = [bucket_id for bucket_id, bucket in buckets.items() if bucket.custom]
+        enabled_buckets = enabled_buckets_for(
+            options["ci"],
+            custom_agent_ids,
+            options["skip_drift"],
+            options["skip_intent"],
+            options["skip_agent"],
+            has_pr_metadata=bool(options["pr_title"] or options["pr_description"]),
+        )
+
+        # The request keeps this registry even if the directory is reloaded
+        with use_buckets(buckets):
+            noise_patterns, resource_index, matcher = self.patterns(
+                options["no_builtin_patterns"], options["noise_file"], options["noise_threshold"]
+            )
+            provider_key = tuple(options[name] for name in _PROVIDER_OPTIONS)
+            analyzer = create_analyzer(
+                lambda: self.provider(provider_key),
+                noise_patterns,
+                options["provider"],
+                options["model"],
+                verbose=options["verbose"],
+                enabled_buckets=enabled_buckets,
+                pr_title=options["pr_title"],
+                pr_description=options["pr_description"],
+                parallel=options["parallel"],
+                structured_output=not options["no_structured_output"],
+                noise_threshold=options["noise_threshold"],
+                max_concurrency=options["max_concurrency"],
+                input_format=options["input_format"],
+                no_block=options["no_block"],
+                resource_index=resource_index,
+                matcher=matcher,
+            )
+            stack = Stack(
+                name="request",
+                whatif="<request>",
+                drift_threshold=options["drift_threshold"],
+                intent_threshold=options["intent_threshold"],
+                agent_thresholds=options["agent_threshold"],
+                whatif_text=payload["whatif"],
+                # The client reads the diff; the server never runs git for it
+                diff_text=payload.get("diff") or "",
+                bicep_text=payload.get("bicep"),
+            )
+            return analyzer.analyze(stack)
+
+    def patterns(self, no_builtin: bool, noise_file: Optional[str], noise_threshold: int):
+        """Compiled noise patterns, reloaded when the noise file changes.
+
+        Returns:
+            Tuple of (patterns, ResourcePatternIndex, NoiseMatcher or None)
+
+        Raises:
+            InputError: If the noise file cannot be read
+        """
+        from .noise_filter import load_builtin_patterns, load_user_patterns
+
+        key = (no_builtin, noise_file, noise_threshold)
+        stamp = None
+        if noise_file:
+            try:
+                stat = os.stat(noise_file)
+            except OSError as e:
+                raise InputError(f"Could not read noise file {noise_file}: {e}")
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._patterns.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        patterns = [] if no_builtin else load_builtin_patterns()
+        if noise_file:
+            try:
+                patterns = patterns + load_user_patterns(noise_file)
+            except (OSError, UnicodeDecodeError) as e:
+                raise InputError(f"Could not read noise file {noise_file}: {e}")
+        compiled = (patterns, *compile_patterns(patterns, noise_threshold / 100.0))
+        with self._lock:
+            if cached is not None:
+                self._counters["pattern_reloads"] += 1
+                sys.stderr.write(f"🔄 Reloaded noise patterns from {noise_file}\n")
+            self._patterns[key] = (stamp, compiled)
+        return compiled
+
+    def agents(self, agents_dir: str) -> Dict[str, RiskBucket]:
+        """Bucket registry for ``agents_dir``, rebuilt when its .md files change.
+
+        The registry holds the built-in buckets plus the directory's agents.
+        A reload builds a new registry and swaps it in, so requests already
+        running with the old one keep every bucket they refer to.
+
+        Returns:
+            Bucket ID -> RiskBucket, for :func:`~.ci.buckets.use_buckets`
+
+        Raises:
+            InputError: If the directory is missing or an agent ID is invalid
+        """
+        from .ci.agents import load_agents_from_directory, validate_agents
+
+        directory = Path(agents_dir)
+        if not directory.is_dir():
+            raise InputError(f"Agents directory not found: {agents_dir}")
+        try:
+            stamp = tuple(
+                (path.name, path.stat().st_mtime_ns, path.stat().st_size)
+                for path in sorted(directory.glob("*.md"))
+            )
+        except OSError as e:
+            raise InputError(f"Could not read agents directory {agents_dir}: {e}")
+
+        with self._agents_lock:
+            cached = self._agents.get(agents_dir)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+
+            agents, errors = load_agents_from_directory(agents_dir)
+            for err in errors:
+                sys.stderr.write(f"Warning: {err}\n")
+            try:
+                validate_agents(agents)
+            except ValueError as e:
+                raise InputError(str(e))
+            buckets = {
+                bucket_id: bucket for bucket_id, bucket in RISK_BUCKETS.items() if not bucket.custom
+            }
+            buckets.update((agent.id, agent) for agent in agents)
+            self._agents[agents_dir] = (stamp, buckets)
+
+        if cached is not None:
+            with self._lock:
+                self._counters["agent_reloads"] += 1
+            sys.stderr.write(f"🔄 Reloaded agents from {agents_dir}\n")
+        elif agents:
+            agent_ids = ", ".join(agent.id for agent in agents)
+            sys.stderr.write(f"Loaded {len(agents)} agent(s): {agent_ids}\n")
+        return buckets
+
+    def provider(self, key: tuple) -> Provider:
+        """The provider for ``key`` (see ``_PROVIDER_OPTIONS``), created on first use."""
+        with self._provider_lock:
+            if key not in self._providers:
+                self._providers[key] = build_llm_provider(*key)[0]
+            return self._providers[key]
+
+
+def parse_options(options) -> dict:
+    """Validate POST /analyze options and fill in the defaults.
+
+    Raises:
+        InputError: If an option is unknown or a threshold level is invalid
+    """
+    if not isinstance(options, dict):
+        raise InputError("'options' must be a JSON object")
+    unknown = set(options) - set(ANALYZE_OPTIONS)
+    if unknown:
+        raise InputError(f"Unknown options: {', '.join(sorted(unknown))}")
+
+    parsed = {**ANALYZE_OPTIONS, **{k: v for k, v in options.items() if v is not None}}
+    parsed["provider"] = parsed["provider"].lower()
+    parsed["input_format"] = parsed["input_format"].lower()
+    for name in PATH_OPTIONS:
+        if parsed[name]:
+            parsed[name] = os.path.abspath(os.path.expanduser(parsed[name]))
+
+    thresholds = {
+        "drift_threshold": parsed["drift_threshold"],
+        "intent_threshold": parsed["intent_threshold"],
+    }
+    if not isinstance(parsed["agent_threshold"], dict):
+        raise InputError("'agent_threshold' must map agent IDs to levels")
+    thresholds.update(
+        (f"agent_threshold for '{agent_id}'", level)
+        for agent_id, level in parsed["agent_threshold"].items()
+    )
+    for name, level in thresholds.items():
+        if str(level).lower() not in _THRESHOLD_LEVELS:
+            raise InputError(f"{name} must be low, medium, or high (got '{level}')")
+    parsed["drift_threshold"] = parsed["drift_threshold"].lower()
+    parsed["intent_threshold"] = parsed["intent_threshold"].lower()
+    parsed["agent_threshold"] = {
+        agent_id: level.lower() for agent_id, level in parsed["agent_threshold"].items()
+    }
+    parsed["skip_agent"] = list(parsed["skip_agent"])
+    return parsed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = f"bicep-whatif-advisor/{__version__}"
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/health":
+            self._send(200, self.server.service.health())
+        elif path == "/metrics":
+            self._send(200, self.server.service.metrics())
+        else:
+            self._send(404, {"error": f"Not found: {path}"})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        if path != "/analyze":
+            self._send(404, {"error": f"Not found: {path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._send(411, {"error": "Content-Length required"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self._send(413, {"error": f"Request body over {MAX_REQUEST_BYTES:,} bytes"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON: {e}"})
+            return
+        try:
+            result = self.server.service.analyze(payload)
+        except InputError as e:
+            self._send(400, {"error": str(e)})
+            return
+        self._send(200, result)
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class AdvisorServer(HTTPServer):
+    """HTTP server handling each connection on a bounded pool of worker threads.
+
+    Connections beyond ``workers`` wait in the pool's queue, so a burst of
+    jobs cannot start more concurrent analyses than the pool allows.
+    """
+
+    def __init__(self, address, service: AdvisorService, workers: int = DEFAULT_WORKERS):
+        from concurrent.futures import ThreadPoolExecutor
+
+        super().__init__(address, _Handler)
+        self.service = service
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        # As socketserver.ThreadingMixIn, on a pool thread
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS):
+    """Serve until interrupted.
+
+    Raises:
+        OSError: If the address cannot be bound
+    """
+    server = AdvisorServer((host, port), AdvisorService(), workers)
+    sys.stderr.write(
+        f"🛰️ bicep-whatif-advisor {__version__} serving on http://{host}:{server.server_port}"
+        f" ({workers} worker(s))\n"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nShutting down.\n")
+    finally:
+        server.server_close()
+
+
+def request_analysis(
+    url: str,
+    whatif: str,
+    options: dict,
+    diff: Optional[str] = None,
+    bicep: Optional[str] = None,
+    timeout: float = DEFAULT_CLIENT_TIMEOUT,
+) -> dict:
+    """Send one analysis to a ``serve`` instance (the ``--server`` client).
+
+    Returns:
+        The server's result (see :meth:`AdvisorService.analyze`)
+
+    Raises:
+        InputError: If the server rejected the request as malformed
+        ServerError: If the server is unreachable or failed
+    """
+    import requests
+
+    endpoint = url.rstrip("/") + "/analyze"
+    payload = {"whatif": whatif, "diff": diff, "bicep": bicep, "options": options}
+    try:
+        response = requests.post(endpoint, json=payload, timeout=(_CONNECT_TIMEOUT, timeout))
+    except requests.RequestException as e:
+        raise ServerError(f"Could not reach the advisor server at {url}: {e}")
+    try:
+        body = response.json()
+    except ValueError:
+        raise ServerError(f"Advisor server at {url} returned HTTP {response.status_code}")
+    if response.status_code == 400:
+        raise InputError(body.get("error", "Bad request"))
+    if response.status_code != 200:
+        raise ServerError(
+            f"Advisor server at {url} returned HTTP {response.status_code}: {body.get('error')}"
+        )
+    return body
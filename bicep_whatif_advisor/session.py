@@ -0,0 +1,237 @@
+"""Setup shared by single runs, batch runs and the advisor server.
+
+Each entry point resolves the same things before it analyzes anything: the
+options implied by the CI/CD platform, the custom agents and the risk
+buckets they enable, and the provider wrapped for hedging, coalescing and
+caching. The CLI (``main`` and ``batch``) and ``server.AdvisorService`` call
+the functions here so the three stay in step.
+"""
+
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from .cache import CachingProvider, ResponseCache
+from .coordination import COORDINATION_DIR_ENV_VAR, CoalescingProvider, SingleFlight
+from .hedging import HedgedProvider
+from .input import InputError
+from .providers import Provider, create_provider, get_provider, resolve_model
+
+
+def apply_platform_defaults(
+    platform_ctx,
+    ci: bool,
+    diff_ref: str,
+    pr_title: Optional[str],
+    pr_description: Optional[str],
+    post_comment: bool,
+) -> tuple:
+    """Fill in options from the detected CI/CD platform that were not set explicitly.
+
+    Returns:
+        Tuple of (ci, diff_ref, pr_title, pr_description, post_comment)
+    """
+    if platform_ctx.platform != "local":
+        # Auto-enable CI mode in pipeline environments
+        if not ci:
+            platform_name = (
+                "GitHub Actions" if platform_ctx.platform == "github" else "Azure DevOps"
+            )
+            sys.stderr.write(f"🤖 Auto-detected {platform_name} environment - enabling CI mode\n")
+            ci = True
+
+        # Auto-set diff reference if not manually provided
+        if diff_ref == "HEAD~1" and platform_ctx.base_branch:
+            diff_ref = platform_ctx.get_diff_ref()
+            sys.stderr.write(f"📊 Auto-detected diff reference: {diff_ref}\n")
+
+        # Auto-populate PR metadata if not manually provided
+        if not pr_title and platform_ctx.pr_title:
+            pr_title = platform_ctx.pr_title
+            title_preview = pr_title[:60] + "..." if len(pr_title) > 60 else pr_title
+            sys.stderr.write(f"📝 Auto-detected PR title: {title_preview}\n")
+
+        if not pr_description and platform_ctx.pr_description:
+            pr_description = platform_ctx.pr_description
+            desc_lines = len(pr_description.splitlines())
+            sys.stderr.write(f"📄 Auto-detected PR description ({desc_lines} lines)\n")
+
+        # Auto-enable PR comments if token available
+        if not post_comment:
+            has_token = (platform_ctx.platform == "github" and os.environ.get("GITHUB_TOKEN")) or (
+                platform_ctx.platform == "azuredevops" and os.environ.get("SYSTEM_ACCESSTOKEN")
+            )
+            if has_token:
+                sys.stderr.write("💬 Auto-enabling PR comments (auth token detected)\n")
+                post_comment = True
+
+    return ci, diff_ref, pr_title, pr_description, post_comment
+
+
+def load_custom_agents(agents_dir: str) -> List[str]:
+    """Load and register the custom agents in ``agents_dir``, returning their IDs."""
+    from .ci.agents import load_agents_from_directory, register_agents
+
+    custom_agent_ids = []
+    agents, agent_errors = load_agents_from_directory(agents_dir)
+    for err in agent_errors:
+        sys.stderr.write(f"Warning: {err}\n")
+
+    if agents:
+        custom_agent_ids = register_agents(agents)
+        agent_names = ", ".join(custom_agent_ids)
+        sys.stderr.write(f"Loaded {len(custom_agent_ids)} agent(s): {agent_names}\n")
+    return custom_agent_ids
+
+
+def parse_agent_thresholds(entries) -> dict:
+    """Parse ``--agent-threshold agent_id=level`` values, warning about invalid ones."""
+    custom_thresholds = {}
+    for entry in entries:
+        if "=" not in entry:
+            sys.stderr.write(
+                f"Warning: Invalid --agent-threshold"
+                f" format: '{entry}'."
+                f" Expected format: agent_id=level\n"
+            )
+            continue
+        agent_id, level = entry.split("=", 1)
+        agent_id = agent_id.strip()
+        level = level.strip().lower()
+        if level not in ("low", "medium", "high"):
+            sys.stderr.write(
+                f"Warning: Invalid threshold level"
+                f" '{level}' for agent '{agent_id}'."
+                f" Must be low, medium, or high.\n"
+            )
+            continue
+        custom_thresholds[agent_id] = level
+    return custom_thresholds
+
+
+def enabled_buckets_for(
+    ci: bool,
+    custom_agent_ids: List[str],
+    skip_drift: bool,
+    skip_intent: bool,
+    skip_agents,
+    has_pr_metadata: bool,
+) -> Optional[List[str]]:
+    """Risk buckets a run evaluates, or None outside CI mode.
+
+    Raises:
+        InputError: If every bucket is skipped in CI mode
+    """
+    if not ci:
+        return None
+    from .ci.buckets import get_enabled_buckets
+
+    enabled_buckets = get_enabled_buckets(
+        skip_drift=skip_drift,
+        skip_intent=skip_intent,
+        has_pr_metadata=has_pr_metadata,
+        custom_agent_ids=custom_agent_ids,
+        skip_agents=list(skip_agents),
+    )
+    if not enabled_buckets:
+        raise InputError(
+            "At least one risk assessment bucket must be enabled in CI mode."
+            " Remove one or more --skip-* flags to enable risk assessment."
+        )
+    return enabled_buckets
+
+
+def prepare_buckets(
+    ci: bool,
+    agents_dir: Optional[str],
+    parallel: bool,
+    skip_drift: bool,
+    skip_intent: bool,
+    skip_agents,
+    pr_title: Optional[str],
+    pr_description: Optional[str],
+) -> Tuple[Optional[List[str]], bool]:
+    """Register ``agents_dir`` and resolve the enabled buckets for a CLI run.
+
+    ``--agents-dir`` and ``--parallel`` only apply in CI mode; outside it they
+    are ignored with a warning.
+
+    Returns:
+        Tuple of (enabled bucket IDs or None, whether to run in parallel)
+
+    Raises:
+        InputError: If every bucket is skipped in CI mode
+    """
+    custom_agent_ids = []
+    if ci and agents_dir:
+        custom_agent_ids = load_custom_agents(agents_dir)
+    if not ci and agents_dir:
+        sys.stderr.write("Warning: --agents-dir is only used in CI mode. Ignoring.\n")
+    if not ci and parallel:
+        sys.stderr.write("Warning: --parallel is only used in CI mode. Ignoring.\n")
+        parallel = False
+
+    enabled_buckets = enabled_buckets_for(
+        ci,
+        custom_agent_ids,
+        skip_drift,
+        skip_intent,
+        skip_agents,
+        has_pr_metadata=bool(pr_title or pr_description),
+    )
+    return enabled_buckets, parallel
+
+
+def build_llm_provider(
+    provider: str,
+    model: Optional[str],
+    fallback_provider: Optional[str] = None,
+    fallback_model: Optional[str] = None,
+    hedge_delay: Optional[float] = None,
+    coordination_dir: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    no_cache: bool = False,
+):
+    """Create the provider and wrap it for hedging, coalescing and caching.
+
+    Returns:
+        Tuple of (provider, SingleFlight or None, HedgedProvider or None)
+    """
+    coordination_dir = coordination_dir or os.environ.get(COORDINATION_DIR_ENV_VAR)
+    flight = None
+    if coordination_dir:
+        flight = SingleFlight(coordination_dir)
+    llm_provider = get_provider(provider, model)
+    # The provider's scheduler shares its rate budget through the directory too
+    llm_provider.coordination_dir = coordination_dir
+    hedged = None
+    if fallback_provider or fallback_model:
+        # A fallback deployment of the same provider unless one is named
+        secondary = create_provider(
+            fallback_provider or resolve_model(provider, model)[0], fallback_model
+        )
+        secondary.coordination_dir = coordination_dir
+        llm_provider = hedged = HedgedProvider(llm_provider, secondary, hedge_delay)
+    elif hedge_delay is not None:
+        sys.stderr.write(
+            "Warning: --hedge-delay needs --fallback-provider or --fallback-model. Ignoring.\n"
+        )
+    if flight is not None:
+        llm_provider = CoalescingProvider(llm_provider, flight)
+    if not no_cache:
+        llm_provider = CachingProvider(llm_provider, ResponseCache(cache_dir))
+    return llm_provider, flight, hedged
+
+
+def print_provider_summary(llm_provider: Provider, flight, hedged) -> None:
+    """Report cache, coalescing, hedging and token counts on stderr."""
+    if isinstance(llm_provider, CachingProvider):
+        sys.stderr.write(
+            f"💾 Response cache: {llm_provider.hits} hit(s), {llm_provider.misses} miss(es)\n"
+        )
+    if flight is not None and flight.coalesced:
+        sys.stderr.write(f"🔗 Shared {flight.coalesced} in-flight request(s) with other runs\n")
+    if hedged is not None and hedged.requests:
+        sys.stderr.write(f"🛡️ Hedging: {hedged.describe()}\n")
+    if llm_provider.usage.requests:
+        sys.stderr.write(f"🧮 Tokens: {llm_provider.usage.describe()}\n")
@@ -0,0 +1,144 @@
+"""Map-reduce analysis of What-If output too large for one request.
+
+Landing-zone deployments can have thousands of resource blocks: more than
+fits in the context window, and more than one response can list one by one
+under the ``max_tokens`` cap. Sharded mode splits the filtered What-If output
+on resource-block boundaries into shards bounded by tokens and by resource
+count, analyzes every shard concurrently with the same system prompt and
+context, and reduces the parsed responses into one: ``resources[]`` in input
+order and, in CI mode, each risk bucket at the highest level any shard
+reported with the union of their concerns. The result has the same shape as
+a single response, ready for ``evaluate_risk_buckets``.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+from .ci.parallel import DEFAULT_MAX_CONCURRENCY
+from .ci.risk_buckets import merge_risk_assessments
+from .ci.verdict import RISK_LEVELS
+from .noise_filter import split_resource_blocks
+from .tokens import get_token_counter
+
+# Resource blocks per shard. A response spends roughly 110-160 tokens per
+# resource, so this keeps every response well under the max_tokens cap.
+DEFAULT_SHARD_RESOURCES = 40
+
+
+def shard_whatif(
+    text: str,
+    max_tokens: int,
+    max_resources: int = DEFAULT_SHARD_RESOURCES,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> List[str]:
+    """Split What-If text into shards of whole resource blocks.
+
+    Every shard repeats the preamble (legend and deployment scope) and gets
+    as many consecutive blocks as fit in ``max_tokens`` and
+    ``max_resources``. A single block larger than ``max_tokens`` becomes a
+    shard of its own. The epilogue is dropped.
+
+    Args:
+        text: Filtered What-If text
+        max_tokens: Token budget for each shard's What-If text
+        max_resources: Maximum resource blocks per shard
+        count_tokens: Token counter (default: the configured estimator)
+
+    Returns:
+        List of shard texts (just ``[text]`` if it has no resource blocks)
+    """
+    count_tokens = count_tokens or get_token_counter()
+    preamble, blocks = split_resource_blocks(text)
+    if not blocks:
+        return [text]
+
+    preamble_tokens = count_tokens(preamble)
+    shards = []
+    current: List[str] = []
+    used = preamble_tokens
+    for block in blocks:
+        tokens = count_tokens(block)
+        if current and (used + tokens > max_tokens or len(current) >= max_resources):
+            shards.append(preamble + "".join(current))
+            current = []
+            used = preamble_tokens
+        current.append(block)
+        used += tokens
+    shards.append(preamble + "".join(current))
+    return shards
+
+
+def run_sharded_analysis(
+    llm_provider,
+    system_prompt: str,
+    user_prompts: List[str],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    response_schema: Optional[dict] = None,
+) -> List[str]:
+    """Run one request per shard concurrently.
+
+    Args:
+        llm_provider: Provider instance with a ``complete(system, user)`` method
+        system_prompt: System prompt shared by every shard
+        user_prompts: One user prompt per shard
+        max_concurrency: Maximum number of requests in flight at once
+        response_schema: JSON Schema to constrain each shard's response to
+
+    Returns:
+        Raw response texts in shard order
+
+    Raises:
+        ProviderError: For the first failed request; requests that have not
+            started are cancelled
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    max_workers = max(1, min(max_concurrency, len(user_prompts)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(llm_provider.complete, system_prompt, user_prompt, response_schema)
+            for user_prompt in user_prompts
+        ]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def merge_shard_responses(responses: List[dict]) -> Dict:
+    """Reduce parsed shard responses into one response.
+
+    Args:
+        responses: Parsed responses in shard order
+
+    Returns:
+        Response dict with the concatenated resources, the shard summaries
+        joined, and (if the shards assessed risk) the merged risk_assessment
+        and the verdict of the highest-risk shard
+    """
+    data = {"resources": [], "overall_summary": ""}
+    summaries = []
+    for response in responses:
+        data["resources"].extend(response.get("resources") or [])
+        summary = str(response.get("overall_summary") or "").strip()
+        if summary:
+            summaries.append(summary)
+    data["overall_summary"] = " ".join(summaries)
+
+    assessments = [
+        r["risk_assessment"] for r in responses if isinstance(r.get("risk_assessment"), dict)
+    ]
+    if assessments:
+        data["risk_assessment"] = merge_risk_assessments(assessments)
+
+    verdicts = [r["verdict"] for r in responses if isinstance(r.get("verdict"), dict)]
+    if verdicts:
+        # Everything but the reasoning is recomputed from the thresholds later
+        data["verdict"] = max(verdicts, key=_verdict_rank)
+    return data
+
+
+def _verdict_rank(verdict: dict) -> int:
+    level = str(verdict.get("overall_risk_level", "low")).lower()
+    return RISK_LEVELS.index(level) if level in RISK_LEVELS else 0
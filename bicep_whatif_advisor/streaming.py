@@ -0,0 +1,149 @@
+"""Streaming LLM responses with incremental parsing of resources[].
+
+With ``--stream`` the provider's response arrives in chunks. Rather than
+waiting for the full JSON document, :class:`ResourceStreamParser` scans the
+text as it grows and emits each element of the top-level ``resources`` array
+as soon as its closing brace arrives, so rows can be shown while the rest of
+the response (summary, risk assessment) is still being generated. The full
+text is still parsed with ``extract_json`` once the stream ends.
+"""
+
+import json
+from typing import Callable, List, Optional
+
+# Stream idle timeout (seconds without any output) when none is configured
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+
+class ResourceStreamParser:
+    """Incrementally extract ``resources[]`` elements from streamed JSON.
+
+    Tracks string/escape state and nesting depth character by character, so
+    braces inside strings and arbitrarily nested resource objects are handled.
+    Text before the first ``{`` (e.g. a Markdown code fence) is ignored.
+
+    Usage::
+
+        parser = ResourceStreamParser()
+        for chunk in chunks:
+            for resource in parser.feed(chunk):
+                show(resource)
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        # Start index and value of the last string closed at depth 1 (a key)
+        self._string_start = -1
+        self._last_key: Optional[str] = None
+        self._in_resources = False
+        self._item_start = -1
+        self.resources: List[dict] = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        """Add a chunk of response text.
+
+        Args:
+            chunk: Next piece of the response
+
+        Returns:
+            Resource dicts completed by this chunk, in order
+        """
+        self.text += chunk
+        completed = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            char = text[i]
+
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        try:
+                            self._last_key = json.loads(text[self._string_start : i + 1])
+                        except ValueError:
+                            self._last_key = None
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                if char == "[" and self._depth == 1 and self._last_key == "resources":
+                    self._in_resources = True
+                elif char == "{" and self._in_resources and self._depth == 2:
+                    self._item_start = i
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._in_resources:
+                    if char == "}" and self._depth == 2 and self._item_start >= 0:
+                        resource = _load_object(text[self._item_start : i + 1])
+                        if resource is not None:
+                            completed.append(resource)
+                        self._item_start = -1
+                    elif char == "]" and self._depth == 1:
+                        self._in_resources = False
+                        self._last_key = None
+
+        self._pos = len(text)
+        self.resources.extend(completed)
+        return completed
+
+
+def _load_object(text: str) -> Optional[dict]:
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def stream_completion(
+    provider,
+    system_prompt: str,
+    user_prompt: str,
+    on_resource: Optional[Callable[[dict], None]] = None,
+    idle_timeout: Optional[float] = None,
+    response_schema: Optional[dict] = None,
+) -> str:
+    """Stream a completion, reporting each resource row as it completes.
+
+    Args:
+        provider: Provider instance (its ``stream`` method is used)
+        system_prompt: System prompt
+        user_prompt: User prompt
+        on_resource: Called with each ``resources[]`` element as it closes
+        idle_timeout: Abort if no output arrives for this many seconds
+        response_schema: JSON Schema to constrain the response to
+
+    Returns:
+        The full response text
+
+    Raises:
+        ProviderError: On API errors, including an idle timeout
+    """
+    parser = ResourceStreamParser()
+    stream = provider.stream(
+        system_prompt, user_prompt, idle_timeout=idle_timeout, response_schema=response_schema
+    )
+    for chunk in stream:
+        for resource in parser.feed(chunk):
+            if on_resource is not None:
+                on_resource(resource)
+    return parser.text
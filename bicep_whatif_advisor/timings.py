@@ -0,0 +1,163 @@
+"""Phase timings and run statistics (``--timings``, ``--stats-json``).
+
+A :class:`Recorder` measures wall time per phase of a run and keeps counters
+(bytes, tokens, cache hits, retries, noise-filter removals). ``cli.main``
+marks each phase as it starts; the provider request scheduler adds request,
+retry and rate-limit counts to the active recorder.
+
+When neither option is given the active recorder is :data:`NULL_RECORDER`,
+whose methods do nothing, so instrumentation costs a method call per mark.
+"""
+
+import sys
+import threading
+import time
+from typing import Dict, Optional, Union
+
+Number = Union[int, float]
+
+
+class Recorder:
+    """Wall time per phase plus named counters for one run.
+
+    Phases are laps: :meth:`phase` ends the current phase and starts the
+    next. Time for a name that recurs is added up.
+
+    Attributes:
+        phases: Seconds spent in each phase, in the order phases first ran
+        counters: Named counts and totals
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, Number] = {}
+        self._started = time.perf_counter()
+        self._current: Optional[str] = None
+        self._current_started = self._started
+        self._lock = threading.Lock()
+
+    def phase(self, name: str) -> None:
+        """End the current phase (if any) and start ``name``."""
+        now = time.perf_counter()
+        with self._lock:
+            self._end(now)
+            self._current = name
+            self._current_started = now
+
+    def stop(self) -> None:
+        """End the current phase."""
+        with self._lock:
+            self._end(time.perf_counter())
+            self._current = None
+
+    def add(self, name: str, value: Number = 1) -> None:
+        """Add ``value`` to a counter (thread-safe; providers call it from workers)."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: Number) -> None:
+        """Set a counter, replacing any previous value."""
+        with self._lock:
+            self.counters[name] = value
+
+    def to_dict(self) -> dict:
+        """JSON-serializable statistics, as written by ``--stats-json``.
+
+        A phase still running is included up to now.
+        """
+        with self._lock:
+            now = time.perf_counter()
+            phases = dict(self.phases)
+            if self._current is not None:
+                phases[self._current] = phases.get(self._current, 0.0) + now - self._current_started
+            return {
+                "total_seconds": round(now - self._started, 6),
+                "phases": {name: round(seconds, 6) for name, seconds in phases.items()},
+                "counters": {
+                    name: round(value, 6) if isinstance(value, float) else value
+                    for name, value in self.counters.items()
+                },
+            }
+
+    def describe(self) -> str:
+        """Human-readable summary for stderr."""
+        stats = self.to_dict()
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stats["phases"].items())
+        text = f"⏱️ Timings ({stats['total_seconds']:.2f}s): {phases or 'none'}\n"
+        if stats["counters"]:
+            counters = ", ".join(
+                f"{name}={value:.2f}" if isinstance(value, float) else f"{name}={value:,}"
+                for name, value in stats["counters"].items()
+            )
+            text += f"📊 Stats: {counters}\n"
+        return text
+
+    def write(self, path: str) -> None:
+        """Write :meth:`to_dict` as JSON to ``path``.
+
+        Raises:
+            OSError: If the file cannot be written
+        """
+        import json
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+    def _end(self, now: float) -> None:
+        if self._current is not None:
+            self.phases[self._current] = (
+                self.phases.get(self._current, 0.0) + now - self._current_started
+            )
+
+
+class _NullRecorder(Recorder):
+    """Recorder that records nothing, active when instrumentation is off."""
+
+    enabled = False
+
+    def phase(self, name: str) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def add(self, name: str, value: Number = 1) -> None:
+        pass
+
+    def set(self, name: str, value: Number) -> None:
+        pass
+
+
+NULL_RECORDER = _NullRecorder()
+
+_active: Recorder = NULL_RECORDER
+
+
+def get_recorder() -> Recorder:
+    """Return the active recorder (:data:`NULL_RECORDER` when disabled)."""
+    return _active
+
+
+def set_recorder(recorder: Optional[Recorder]) -> None:
+    """Make ``recorder`` the active recorder, or disable recording with None."""
+    global _active
+    _active = recorder if recorder is not None else NULL_RECORDER
+
+
+def report(recorder: Recorder, show: bool, stats_path: Optional[str]) -> None:
+    """Deactivate ``recorder`` and print and/or write its statistics.
+
+    A stats file that cannot be written only produces a warning.
+    """
+    recorder.stop()
+    set_recorder(None)
+    if show:
+        sys.stderr.write(recorder.describe())
+    if stats_path:
+        try:
+            recorder.write(stats_path)
+        except OSError as e:
+            sys.stderr.write(f"Warning: Could not write stats file {stats_path}: {e}\n")
@@ -0,0 +1,265 @@
+"""Ingestion of structured What-If output (``az deployment ... what-if --output json``).
+
+The JSON ``WhatIfOperationResult`` carries the same information as the text
+report, but with exact property paths and typed change kinds instead of
+indentation and symbols. This module turns it into the block model used by
+:mod:`bicep_whatif_advisor.noise_filter`, rendering each resource in the same
+layout as the text report so everything downstream (noise filtering, the LLM
+prompt, ``--include-whatif``) is format-agnostic::
+
+    {"changes": [{"changeType": "Modify",
+                  "resourceId": ".../providers/Microsoft.Network/virtualNetworks/vnet",
+                  "delta": [{"path": "properties.flowTimeoutInMinutes",
+                             "propertyChangeType": "Modify",
+                             "before": 4, "after": 10}]}]}
+
+becomes::
+
+      ~ Microsoft.Network/virtualNetworks/vnet
+
+          ~ properties.flowTimeoutInMinutes: 4 => 10
+
+Each property line records its full path, so ``path:`` noise patterns match
+exactly rather than relying on the best-effort path read from a text line.
+"""
+
+import json
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .input import InputError
+from .noise_filter import _SYMBOL_TO_OPERATION, _ResourceBlock
+
+# Change symbol per resource changeType (inverse of the text lexer's mapping,
+# so rendered text lexes back to the same operations)
+_OPERATION_TO_SYMBOL = {op: symbol for symbol, op in _SYMBOL_TO_OPERATION.items()}
+
+# Change symbol per delta propertyChangeType
+_PROPERTY_CHANGE_SYMBOLS = {
+    "Create": "+",
+    "Delete": "-",
+    "Modify": "~",
+    "Array": "~",
+    "NoEffect": "x",
+}
+
+# Order and wording of the "Resource changes:" summary line
+_SUMMARY_LABELS = [
+    ("Create", "to create"),
+    ("Delete", "to delete"),
+    ("Deploy", "to deploy"),
+    ("Modify", "to modify"),
+    ("NoChange", "no change"),
+    ("Ignore", "to ignore"),
+    ("Unsupported", "unsupported"),
+]
+
+_PROPERTY_INDENT = "      "
+
+
+def detect_json_input(lines: Iterable[str]) -> Tuple[Iterator[str], bool]:
+    """Peek at the first non-blank line to tell JSON input from text.
+
+    Args:
+        lines: Input lines (consumed only up to the first non-blank line)
+
+    Returns:
+        Tuple of (lines, is_json) where ``lines`` replays the peeked lines
+        followed by the rest of the input
+    """
+    iterator = iter(lines)
+    peeked: List[str] = []
+    for line in iterator:
+        peeked.append(line)
+        if line.strip():
+            break
+    is_json = bool(peeked) and peeked[-1].lstrip().startswith(("{", "["))
+    return chain(peeked, iterator), is_json
+
+
+def parse_whatif_json(content: str) -> "WhatIfJsonSource":
+    """Parse JSON What-If output into a block source.
+
+    Accepts the CLI output (``{"changes": [...], "status": ...}``), the REST
+    shape with the changes under ``properties``, or a bare list of changes.
+
+    Raises:
+        InputError: If the content is not valid JSON, has no changes list, or
+            reports a failed What-If operation
+    """
+    try:
+        data = json.loads(content)
+    except ValueError as e:
+        raise InputError(f"Invalid What-If JSON: {e}")
+
+    if isinstance(data, list):
+        return WhatIfJsonSource(data)
+    if not isinstance(data, dict):
+        raise InputError("Invalid What-If JSON: expected an object with a 'changes' list.")
+
+    error = data.get("error")
+    if isinstance(error, dict) and error:
+        code = error.get("code", "Error")
+        message = error.get("message", "")
+        raise InputError(f"What-If operation failed: {code}: {message}")
+
+    changes = data.get("changes")
+    if changes is None and isinstance(data.get("properties"), dict):
+        changes = data["properties"].get("changes")
+    if not isinstance(changes, list):
+        raise InputError("Invalid What-If JSON: expected an object with a 'changes' list.")
+    return WhatIfJsonSource(changes)
+
+
+def _split_resource_id(resource_id: str) -> Tuple[str, str]:
+    """Split a resource ID into (scope, type path) as shown in the text report.
+
+    ``/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/app``
+    becomes ``("/subscriptions/s/resourceGroups/rg", "Microsoft.Web/sites/app")``.
+    Extension resources split at the last ``/providers/``.
+    """
+    marker = "/providers/"
+    idx = resource_id.lower().rfind(marker)
+    if idx >= 0:
+        return resource_id[:idx], resource_id[idx + len(marker) :]
+
+    # Resource groups and subscriptions have no provider segment
+    parts = resource_id.rstrip("/").split("/")
+    if len(parts) >= 5 and parts[3].lower() == "resourcegroups":
+        return "/".join(parts[:3]), f"Microsoft.Resources/resourceGroups/{parts[4]}"
+    if len(parts) >= 3 and parts[1].lower() == "subscriptions":
+        return "/", f"Microsoft.Resources/subscriptions/{parts[2]}"
+    return "", resource_id
+
+
+def _format_value(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _join_path(parent: str, child: str) -> str:
+    if child.isdigit():
+        return f"{parent}[{child}]"
+    return f"{parent}.{child}" if parent else child
+
+
+def _flatten_delta(delta: list, parent: str = "") -> Iterator[Tuple[str, str, str]]:
+    """Yield (symbol, full_path, rendered_value) for each leaf property change."""
+    for item in delta or []:
+        if not isinstance(item, dict):
+            continue
+        path = _join_path(parent, str(item.get("path", "")))
+        children = item.get("children")
+        if children:
+            yield from _flatten_delta(children, path)
+            continue
+
+        change = item.get("propertyChangeType", "Modify")
+        symbol = _PROPERTY_CHANGE_SYMBOLS.get(change, "~")
+        if change == "Create":
+            rendered = _format_value(item.get("after"))
+        elif change in ("Delete", "NoEffect"):
+            rendered = _format_value(item.get("before"))
+        else:
+            rendered = f"{_format_value(item.get('before'))} => {_format_value(item.get('after'))}"
+        yield symbol, path, rendered
+
+
+def _flatten_properties(value, parent: str = "") -> Iterator[Tuple[str, str]]:
+    """Yield (path, rendered_value) for the leaves of a resource body."""
+    if isinstance(value, dict) and value:
+        for key, child in value.items():
+            yield from _flatten_properties(child, _join_path(parent, str(key)))
+    elif parent:
+        yield parent, _format_value(value)
+
+
+class WhatIfJsonSource:
+    """Block source over parsed JSON What-If changes.
+
+    Has the same interface as the text lexer (iterate for blocks, then read
+    ``preamble`` and ``epilogue``), so it can be passed to
+    :func:`~bicep_whatif_advisor.noise_filter.filter_whatif_blocks`. Unlike
+    the text lexer it can be iterated more than once.
+    """
+
+    def __init__(self, changes: list):
+        self._changes = sorted(
+            (c for c in changes if isinstance(c, dict)),
+            key=lambda c: _split_resource_id(str(c.get("resourceId", "")))[0].lower(),
+        )
+        self._scopes = [_split_resource_id(str(c.get("resourceId", "")))[0] for c in self._changes]
+
+        self.preamble: List[str] = []
+        if self._scopes:
+            self.preamble = [f"Scope: {self._scopes[0]}\n", "\n"]
+        self.epilogue = self._summary()
+
+    def _summary(self) -> List[str]:
+        counts: dict = {}
+        for change in self._changes:
+            op = change.get("changeType", "Modify")
+            counts[op] = counts.get(op, 0) + 1
+        parts = [f"{counts[op]} {label}" for op, label in _SUMMARY_LABELS if counts.get(op)]
+        if not parts:
+            return ["Resource changes: no change.\n"]
+        return ["\n", f"Resource changes: {', '.join(parts)}.\n"]
+
+    def __iter__(self) -> Iterator[_ResourceBlock]:
+        for i, change in enumerate(self._changes):
+            block = self._build_block(change)
+            # Scope switches trail the previous block, as in the text report
+            next_scope: Optional[str] = self._scopes[i + 1] if i + 1 < len(self._scopes) else None
+            if next_scope is not None and next_scope != self._scopes[i]:
+                block.lines.extend([f"Scope: {next_scope}\n", "\n"])
+            yield block
+
+    def to_text(self) -> str:
+        """Render the full What-If report as text."""
+        lines = list(self.preamble)
+        for block in self:
+            lines.extend(block.lines)
+        lines.extend(self.epilogue)
+        return "".join(lines)
+
+    def _build_block(self, change: dict) -> _ResourceBlock:
+        operation = change.get("changeType") or "Modify"
+        symbol = _OPERATION_TO_SYMBOL.get(operation, "~")
+        _, type_path = _split_resource_id(str(change.get("resourceId", "")))
+
+        body = change.get("after") if operation != "Delete" else change.get("before")
+        body = body if isinstance(body, dict) else {}
+        api_version = body.get("apiVersion")
+        header = f"  {symbol} {type_path}"
+        if api_version:
+            header += f" [{api_version}]"
+        header += "\n"
+
+        block = _ResourceBlock(
+            header_line=header,
+            operation=operation,
+            resource_type=type_path,
+            lines=[header],
+        )
+
+        content: List[str] = []
+        if operation in ("Create", "Delete"):
+            for path, rendered in _flatten_properties(body):
+                content.append(f"{_PROPERTY_INDENT}{path}: {rendered}\n")
+        elif operation == "Unsupported":
+            reason = change.get("unsupportedReason") or "Unknown"
+            content.append(f"{_PROPERTY_INDENT}Unsupported: {reason}\n")
+        else:
+            # Header, then a blank separator line, then the property lines
+            first_index = 2
+            for prop_symbol, path, rendered in _flatten_delta(change.get("delta")):
+                if prop_symbol != "x":
+                    idx = first_index + len(content)
+                    block.property_change_indices.append(idx)
+                    block.property_paths[idx] = path
+                content.append(f"{_PROPERTY_INDENT}{prop_symbol} {path}: {rendered}\n")
+
+        if content:
+            block.lines.append("\n")
+            block.lines.extend(content)
+            block.lines.append("\n")
+        return block
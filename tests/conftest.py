@@ -2,12 +2,12 @@
 
 import json
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import pytest
 
 from bicep_whatif_advisor.ci.buckets import RISK_BUCKETS
-from bicep_whatif_advisor.providers import Provider
+from bicep_whatif_advisor.providers import Provider, clear_client_cache
 
 FIXTURES_DIR = Path(__file__).parent / "fixtures"
 
@@ -30,6 +30,20 @@ def clean_risk_buckets_global():
         del RISK_BUCKETS[key]
 
 
+@pytest.fixture(autouse=True)
+def clean_client_cache():
+    """Drop cached provider clients so SDK mocks don't leak between tests."""
+    clear_client_cache()
+    yield
+    clear_client_cache()
+
+
+@pytest.fixture(autouse=True)
+def isolated_response_cache(tmp_path, monkeypatch):
+    """Point the LLM response cache at a per-test directory."""
+    monkeypatch.setenv("WHATIF_CACHE_DIR", str(tmp_path / "cache"))
+
+
 # ---------------------------------------------------------------------------
 # MockProvider
 # ---------------------------------------------------------------------------
@@ -41,9 +55,13 @@ class MockProvider(Provider):
     def __init__(self, response: Union[dict, str, None] = None):
         self.response = response or {}
         self.calls: List[Tuple[str, str]] = []
+        self.schemas: List[Optional[dict]] = []
 
-    def complete(self, system_prompt: str, user_prompt: str) -> str:
+    def complete(
+        self, system_prompt: str, user_prompt: str, response_schema: Optional[dict] = None
+    ) -> str:
         self.calls.append((system_prompt, user_prompt))
+        self.schemas.append(response_schema)
         if isinstance(self.response, str):
             return self.response
         return json.dumps(self.response)
@@ -69,6 +87,11 @@ def noisy_changes_fixture():
     return (FIXTURES_DIR / "noisy_changes.txt").read_text()
 
 
+@pytest.fixture(scope="session")
+def whatif_json_fixture():
+    return (FIXTURES_DIR / "whatif_changes.json").read_text()
+
+
 # ---------------------------------------------------------------------------
 # Sample LLM responses
 # ---------------------------------------------------------------------------
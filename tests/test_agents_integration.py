@@ -79,7 +79,7 @@ class TestAgentsCLIIntegration:
 
         provider = MockProvider(response)
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=provider,
         )
         mocker.patch(
@@ -156,7 +156,7 @@ class TestAgentsCLIIntegration:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch(
@@ -209,7 +209,7 @@ class TestAgentsCLIIntegration:
 
         provider = MockProvider(response)
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=provider,
         )
         mocker.patch(
@@ -255,7 +255,7 @@ class TestAgentsCLIIntegration:
         )
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_standard_response),
         )
 
@@ -331,7 +331,7 @@ class TestAgentsCLIIntegration:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch(
@@ -408,7 +408,7 @@ class TestAgentsCLIIntegration:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch(
@@ -499,7 +499,7 @@ class TestAgentsCLIIntegration:
 
         provider = MockProvider(response)
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=provider,
         )
         mocker.patch(
@@ -0,0 +1,188 @@
+"""Tests for bicep_whatif_advisor.analysis module."""
+
+import json
+import math
+import time
+
+import pytest
+
+from bicep_whatif_advisor.analysis import extract_json, filter_by_confidence
+
+# ---------------------------------------------------------------------------
+# extract_json
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.unit
+class TestExtractJson:
+    def test_pure_json(self):
+        result = extract_json('{"key": "value"}')
+        assert result == {"key": "value"}
+
+    def test_json_with_surrounding_text(self):
+        text = 'Here is the response:\n{"key": "value"}\nEnd.'
+        result = extract_json(text)
+        assert result == {"key": "value"}
+
+    def test_deeply_nested_json(self):
+        obj = {"a": {"b": {"c": [1, 2, {"d": True}]}}}
+        text = f"Some prefix {json.dumps(obj)} suffix"
+        result = extract_json(text)
+        assert result == obj
+
+    def test_json_with_escaped_quotes(self):
+        text = '{"msg": "He said \\"hello\\""}'
+        result = extract_json(text)
+        assert result["msg"] == 'He said "hello"'
+
+    def test_no_json_raises_value_error(self):
+        with pytest.raises(ValueError, match="Could not extract"):
+            extract_json("no json here at all")
+
+    def test_no_brace_raises_value_error(self):
+        with pytest.raises(ValueError, match="Could not extract"):
+            extract_json("just plain text")
+
+    def test_invalid_json_raises_value_error(self):
+        with pytest.raises(ValueError, match="Could not extract"):
+            extract_json("{invalid json content]")
+
+    def test_markdown_fenced_json(self):
+        text = '```json\n{"resources": []}\n```'
+        result = extract_json(text)
+        assert result == {"resources": []}
+
+    def test_json_fence_preferred(self):
+        text = 'Template {name}:\n```\n{"a": 1}\n```\n```json\n{"resources": []}\n```\n'
+        assert extract_json(text) == {"resources": []}
+
+    def test_prose_braces_before_json(self):
+        text = 'Checked {tags} and {"bad" json}, result: {"resources": []} (see {"x": 1})'
+        assert extract_json(text) == {"resources": []}
+
+    def test_truncated_response_does_not_yield_nested_object(self):
+        text = 'Result: {"resources": [{"resource_name": "a"}, {"resource_name": "b"'
+        with pytest.raises(ValueError, match="Could not extract"):
+            extract_json(text)
+
+    def test_fragment_of_malformed_response_is_rejected(self):
+        # Single-quoted keys: only the nested resource is valid JSON, and
+        # returning it would drop the risk assessment (every bucket "low")
+        text = (
+            'Result: {\'resources\': [{"resource_name": "vnet", "action": "Modify"}],'
+            " 'overall_summary': 'x'}"
+        )
+        with pytest.raises(ValueError, match="Could not extract"):
+            extract_json(text)
+
+    def test_without_orjson(self, mocker):
+        mocker.patch("bicep_whatif_advisor.analysis._orjson_loads", return_value=None)
+
+        assert extract_json('Here:\n{"key": "value"}') == {"key": "value"}
+
+    def test_nan_falls_back_to_stdlib(self):
+        # orjson rejects NaN; the standard library accepts it
+        assert math.isnan(extract_json('{"score": NaN}')["score"])
+
+
+@pytest.fixture(scope="module")
+def large_response():
+    rows = [
+        {
+            "resource_name": f"app{i}",
+            "resource_type": "Web/sites",
+            "action": "Modify",
+            "summary": 'Updates {tags} and the "appSettings" block. ' * 4,
+            "confidence_level": "high",
+            "confidence_reason": "Property change",
+        }
+        for i in range(1500)
+    ]
+    return json.dumps({"resources": rows, "overall_summary": "Done."}, indent=2)
+
+
+@pytest.mark.unit
+class TestExtractJsonBenchmark:
+    """Micro-benchmark: extraction runs on every LLM response, some several hundred KB."""
+
+    # Best of three per response (seconds); about 5 ms is typical, so only
+    # a return to per-character or quadratic scanning fails
+    BUDGET_SECONDS = 0.25
+
+    def _best(self, text):
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            result = extract_json(text)
+            timings.append(time.perf_counter() - start)
+        assert len(result["resources"]) == 1500
+        return min(timings)
+
+    def test_response_is_several_hundred_kb(self, large_response):
+        assert len(large_response) > 400_000
+
+    @pytest.mark.parametrize(
+        "wrap",
+        [
+            "{}",
+            "Here is the analysis:\n{}\nLet me know if you need more.",
+            "Using {{name}} placeholders:\n```json\n{}\n```\n",
+            "{{x}} " * 50_000 + "{}",
+        ],
+        ids=["bare", "prose", "fenced", "stray-braces"],
+    )
+    def test_extraction_within_budget(self, large_response, wrap):
+        assert self._best(wrap.format(large_response)) < self.BUDGET_SECONDS
+
+
+# ---------------------------------------------------------------------------
+# filter_by_confidence
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.unit
+class TestFilterByConfidence:
+    def test_splits_by_confidence(self):
+        data = {
+            "resources": [
+                {"resource_name": "r1", "confidence_level": "high"},
+                {"resource_name": "r2", "confidence_level": "low"},
+                {"resource_name": "r3", "confidence_level": "medium"},
+            ],
+            "overall_summary": "test",
+        }
+        high, low = filter_by_confidence(data)
+        assert len(high["resources"]) == 2
+        assert len(low["resources"]) == 1
+        assert low["resources"][0]["resource_name"] == "r2"
+
+    def test_noise_level_goes_to_low(self):
+        data = {
+            "resources": [
+                {"resource_name": "r1", "confidence_level": "noise"},
+            ],
+            "overall_summary": "",
+        }
+        high, low = filter_by_confidence(data)
+        assert len(high["resources"]) == 0
+        assert len(low["resources"]) == 1
+
+    def test_preserves_ci_fields_in_high(self):
+        data = {
+            "resources": [],
+            "overall_summary": "",
+            "risk_assessment": {"drift": {}},
+            "verdict": {"safe": True},
+        }
+        high, low = filter_by_confidence(data)
+        assert "risk_assessment" in high
+        assert "verdict" in high
+        assert "risk_assessment" not in low
+
+    def test_defaults_missing_confidence_to_medium(self):
+        data = {
+            "resources": [{"resource_name": "r1"}],
+            "overall_summary": "",
+        }
+        high, low = filter_by_confidence(data)
+        assert len(high["resources"]) == 1  # medium -> included
@@ -0,0 +1,275 @@
+"""Tests for bicep_whatif_advisor.batch module."""
+
+import pytest
+
+from bicep_whatif_advisor.batch import (
+    BatchAnalyzer,
+    Stack,
+    StackResult,
+    batch_status,
+    build_report,
+    expand_sources,
+    load_manifest,
+)
+from bicep_whatif_advisor.input import InputError
+from bicep_whatif_advisor.noise_filter import ParsedPattern
+from bicep_whatif_advisor.tokens import count_tokens
+
+WHATIF = (
+    "Resource changes: 1 to create.\n  + Microsoft.Storage/storageAccounts/store1 [2023-01-01]\n"
+)
+
+NOCHANGE = (
+    "Resource changes: 1 no change.\n  = Microsoft.Storage/storageAccounts/store1 [2023-01-01]\n"
+)
+
+
+def _write(tmp_path, name, text=WHATIF):
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def _analyzer(provider, **kwargs):
+    return BatchAnalyzer(
+        lambda: provider,
+        [],
+        0.8,
+        ["system prompt"],
+        100_000,
+        count_tokens,
+        **kwargs,
+    )
+
+
+@pytest.mark.unit
+class TestSources:
+    def test_glob_expands_sorted(self, tmp_path):
+        _write(tmp_path, "b/whatif.txt")
+        _write(tmp_path, "a/whatif.txt")
+        defaults = Stack(name="", whatif="", drift_threshold="medium")
+
+        stacks = expand_sources([str(tmp_path / "*" / "whatif.txt")], defaults)
+
+        assert [s.whatif for s in stacks] == [
+            str(tmp_path / "a" / "whatif.txt"),
+            str(tmp_path / "b" / "whatif.txt"),
+        ]
+        assert all(s.drift_threshold == "medium" for s in stacks)
+
+    def test_glob_without_matches_raises(self, tmp_path):
+        with pytest.raises(InputError, match="No What-If files match"):
+            expand_sources([str(tmp_path / "*.txt")], Stack(name="", whatif=""))
+
+
+@pytest.mark.unit
+class TestLoadManifest:
+    def test_overrides_and_relative_paths(self, tmp_path):
+        _write(tmp_path, "net/whatif.txt")
+        _write(tmp_path, "apps/one/whatif.txt")
+        _write(tmp_path, "apps/two/whatif.txt")
+        manifest = _write(
+            tmp_path,
+            "stacks.yaml",
+            "defaults:\n"
+            "  drift_threshold: medium\n"
+            "stacks:\n"
+            "  - name: networking\n"
+            "    whatif: net/whatif.txt\n"
+            "    bicep_dir: net\n"
+            "    intent_threshold: LOW\n"
+            "  - whatif: apps/*/whatif.txt\n"
+            "    agent_threshold: [compliance=low]\n",
+        )
+        defaults = Stack(name="", whatif="", agent_thresholds={"cost": "high"})
+
+        stacks = load_manifest(str(manifest), defaults)
+
+        assert [s.name for s in stacks] == [
+            "networking",
+            "apps/one/whatif.txt",
+            "apps/two/whatif.txt",
+        ]
+        net = stacks[0]
+        assert net.whatif == str(tmp_path / "net/whatif.txt")
+        assert net.bicep_dir == str(tmp_path / "net")
+        assert (net.drift_threshold, net.intent_threshold) == ("medium", "low")
+        assert stacks[1].agent_thresholds == {"cost": "high", "compliance": "low"}
+
+    @pytest.mark.parametrize(
+        "content, message",
+        [
+            ("- whatif: x\n", "'stacks' list"),
+            ("stacks:\n  - name: x\n", "no 'whatif' file"),
+            ("stacks:\n  - whatif: x\n    colour: red\n", "unknown keys: colour"),
+            ("stacks:\n  - whatif: x\n    drift_threshold: severe\n", "low, medium, or high"),
+        ],
+    )
+    def test_malformed_manifest(self, tmp_path, content, message):
+        manifest = _write(tmp_path, "stacks.yaml", content)
+        with pytest.raises(InputError, match=message):
+            load_manifest(str(manifest), Stack(name="", whatif=""))
+
+    def test_missing_manifest(self, tmp_path):
+        with pytest.raises(InputError, match="Could not read manifest"):
+            load_manifest(str(tmp_path / "missing.yaml"), Stack(name="", whatif=""))
+
+
+@pytest.mark.unit
+class TestBatchAnalyzer:
+    def test_shares_one_provider_across_stacks(self, tmp_path, sample_standard_response):
+        from conftest import MockProvider
+
+        provider = MockProvider(sample_standard_response)
+        created = []
+        analyzer = BatchAnalyzer(
+            lambda: created.append(1) or provider,
+            [],
+            0.8,
+            ["system prompt"],
+            100_000,
+            count_tokens,
+        )
+        stacks = [Stack(name=f"s{i}", whatif=str(_write(tmp_path, f"s{i}.txt"))) for i in range(3)]
+
+        results = analyzer.run(stacks, jobs=2)
+
+        assert [r.stack.name for r in results] == ["s0", "s1", "s2"]
+        assert [r.status for r in results] == ["analyzed"] * 3
+        assert len(provider.calls) == 3
+        assert created == [1]
+
+    def test_no_actionable_changes_needs_no_provider(self, tmp_path):
+        analyzer = BatchAnalyzer(
+            lambda: pytest.fail("provider created"), [], 0.8, ["s"], 100_000, count_tokens
+        )
+        stack = Stack(name="s", whatif=str(_write(tmp_path, "s.txt", NOCHANGE)))
+
+        (result,) = analyzer.run([stack], jobs=1)
+
+        assert result.status == "analyzed"
+        assert analyzer.llm_provider is None
+
+    def test_per_stack_thresholds_and_verdict(
+        self, tmp_path, mocker, sample_ci_response_unsafe, capsys
+    ):
+        from conftest import MockProvider
+
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="")
+        sample_ci_response_unsafe["risk_assessment"]["drift"]["risk_level"] = "medium"
+        analyzer = _analyzer(MockProvider(sample_ci_response_unsafe), enabled_buckets=["drift"])
+        path = str(_write(tmp_path, "s.txt"))
+        stacks = [
+            Stack(name="strict", whatif=path, drift_threshold="medium"),
+            Stack(name="lenient", whatif=path, drift_threshold="high"),
+        ]
+
+        strict, lenient = analyzer.run(stacks, jobs=2)
+
+        assert (strict.status, strict.failed_buckets, strict.exit_code) == ("unsafe", ["drift"], 1)
+        assert (lenient.status, lenient.exit_code) == ("safe", 0)
+        assert "❌ [strict] unsafe" in capsys.readouterr().err
+
+    def test_no_block_reports_unsafe_with_zero_exit_code(
+        self, tmp_path, mocker, sample_ci_response_unsafe
+    ):
+        from conftest import MockProvider
+
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="")
+        analyzer = _analyzer(
+            MockProvider(sample_ci_response_unsafe), enabled_buckets=["drift"], no_block=True
+        )
+        stack = Stack(name="s", whatif=str(_write(tmp_path, "s.txt")))
+
+        (result,) = analyzer.run([stack], jobs=1)
+
+        assert (result.status, result.exit_code) == ("unsafe", 0)
+
+    def test_failed_stack_does_not_stop_others(self, tmp_path, sample_standard_response):
+        from conftest import MockProvider
+
+        analyzer = _analyzer(MockProvider(sample_standard_response))
+        good = Stack(name="good", whatif=str(_write(tmp_path, "good.txt")))
+        missing = Stack(name="missing", whatif=str(tmp_path / "missing.txt"))
+        empty = Stack(name="empty", whatif=str(_write(tmp_path, "empty.txt", "")))
+
+        results = analyzer.run([missing, good, empty], jobs=3)
+
+        assert [r.status for r in results] == ["error", "analyzed", "error"]
+        assert "Could not read What-If file" in results[0].error
+        assert results[0].exit_code == 2
+        assert "empty" in results[2].error
+
+    def test_invalid_json_response_is_a_stack_error(self, tmp_path):
+        from conftest import MockProvider
+
+        analyzer = _analyzer(MockProvider("not json"))
+        stack = Stack(name="s", whatif=str(_write(tmp_path, "s.txt")))
+
+        (result,) = analyzer.run([stack], jobs=1)
+
+        assert result.status == "error"
+        assert result.exit_code == 1
+
+    def test_shared_noise_patterns(self, tmp_path, sample_standard_response):
+        from conftest import MockProvider
+
+        patterns = [
+            ParsedPattern(
+                raw="resource: Microsoft.Storage/storageAccounts",
+                pattern_type="resource",
+                value="Microsoft.Storage/storageAccounts",
+            )
+        ]
+        analyzer = BatchAnalyzer(
+            lambda: MockProvider(sample_standard_response),
+            patterns,
+            0.8,
+            ["s"],
+            100_000,
+            count_tokens,
+        )
+        stack = Stack(name="s", whatif=str(_write(tmp_path, "s.txt")))
+
+        (result,) = analyzer.run([stack], jobs=1)
+
+        assert analyzer.llm_provider is None
+        assert result.low_confidence["resources"][0]["resource_name"] == "store1"
+
+
+@pytest.mark.unit
+class TestReport:
+    def test_worst_status_wins(self):
+        stack = Stack(name="s", whatif="s.txt")
+        results = [
+            StackResult(stack, "safe", high_confidence={}),
+            StackResult(stack, "review", high_confidence={}),
+        ]
+        assert batch_status(results) == "review"
+        results.append(StackResult(stack, "error", exit_code=1, error="boom"))
+        assert batch_status(results) == "error"
+
+    def test_build_report(self):
+        results = [
+            StackResult(
+                Stack(name="a", whatif="a.txt"),
+                "unsafe",
+                high_confidence={"resources": []},
+                low_confidence={"resources": [{"resource_name": "x"}]},
+                failed_buckets=["drift"],
+            ),
+            StackResult(Stack(name="b", whatif="b.txt"), "error", exit_code=2, error="boom"),
+        ]
+
+        report = build_report(results, include_noise=False)
+
+        assert report["verdict"] == {"status": "error", "stacks": 2, "error": 1, "unsafe": 1}
+        assert report["stacks"][0]["failed_buckets"] == ["drift"]
+        assert "low_confidence" not in report["stacks"][0]
+        assert report["stacks"][1] == {
+            "name": "b",
+            "whatif": "b.txt",
+            "status": "error",
+            "error": "boom",
+        }
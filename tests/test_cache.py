@@ -0,0 +1,134 @@
+"""Tests for bicep_whatif_advisor.cache module."""
+
+import asyncio
+import json
+
+import pytest
+
+from bicep_whatif_advisor.cache import (
+    CachingProvider,
+    ResponseCache,
+    default_cache_dir,
+)
+
+RESPONSE = {"resources": [], "overall_summary": "No changes"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(tmp_path / "cache")
+
+
+@pytest.mark.unit
+class TestResponseCache:
+    def test_default_dir_from_env(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WHATIF_CACHE_DIR", str(tmp_path))
+        assert default_cache_dir() == tmp_path
+
+    def test_default_dir_user_cache(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("WHATIF_CACHE_DIR")
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+        assert default_cache_dir() == tmp_path / "bicep-whatif-advisor"
+
+    def test_put_then_get(self, cache):
+        assert cache.get("k") is None
+        cache.put("k", "value")
+        assert cache.get("k") == "value"
+        assert cache.path.exists()
+
+    def test_expired_entry_is_a_miss(self, cache, mocker):
+        clock = mocker.patch("bicep_whatif_advisor.cache.time.time", return_value=1000.0)
+        cache.put("k", "value")
+        clock.return_value = 1000.0 + cache.ttl_seconds + 1
+        assert cache.get("k") is None
+
+    def test_evicts_least_recently_used(self, tmp_path, mocker):
+        cache = ResponseCache(tmp_path, max_bytes=10)
+        clock = mocker.patch("bicep_whatif_advisor.cache.time.time", return_value=1.0)
+        cache.put("a", "aaaa")
+        clock.return_value = 2.0
+        cache.put("b", "bbbb")
+        clock.return_value = 3.0
+        # Reading "a" makes "b" the least recently used
+        assert cache.get("a") == "aaaa"
+        clock.return_value = 4.0
+        cache.put("c", "cccc")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == "aaaa"
+        assert cache.get("c") == "cccc"
+
+    def test_unusable_dir_disables_cache(self, tmp_path, capsys):
+        blocker = tmp_path / "file"
+        blocker.write_text("not a directory")
+        cache = ResponseCache(blocker / "cache")
+
+        cache.put("k", "value")
+        assert cache.get("k") is None
+        assert cache.disabled
+        assert "cache disabled" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+class TestCachingProvider:
+    def test_second_call_served_from_cache(self, cache):
+        from conftest import MockProvider
+
+        inner = MockProvider(RESPONSE)
+        provider = CachingProvider(inner, cache)
+
+        first = provider.complete("system", "user")
+        second = CachingProvider(inner, cache).complete("system", "user")
+
+        assert first == second == json.dumps(RESPONSE)
+        assert len(inner.calls) == 1
+        assert (provider.hits, provider.misses) == (0, 1)
+
+    def test_key_covers_prompts_and_model(self, cache):
+        from conftest import MockProvider
+
+        inner = MockProvider(RESPONSE)
+        provider = CachingProvider(inner, cache)
+        key = provider.cache_key("system", "user")
+
+        assert provider.cache_key("system", "user2") != key
+        assert provider.cache_key("system2", "user") != key
+        inner.model = "other-model"
+        assert provider.cache_key("system", "user") != key
+
+    def test_key_covers_response_schema(self, cache):
+        from conftest import MockProvider
+
+        provider = CachingProvider(MockProvider(RESPONSE), cache)
+        key = provider.cache_key("system", "user", {"type": "object"})
+
+        assert provider.cache_key("system", "user") != key
+        assert provider.cache_key("system", "user", {"type": "array"}) != key
+
+    def test_invalid_json_not_cached(self, cache):
+        from conftest import MockProvider
+
+        inner = MockProvider("not json")
+        provider = CachingProvider(inner, cache)
+        provider.complete("system", "user")
+        provider.complete("system", "user")
+        assert len(inner.calls) == 2
+
+    def test_acomplete_uses_cache(self, cache):
+        from conftest import MockProvider
+
+        inner = MockProvider(RESPONSE)
+        provider = CachingProvider(inner, cache)
+        asyncio.run(provider.acomplete("system", "user"))
+        assert asyncio.run(provider.acomplete("system", "user")) == json.dumps(RESPONSE)
+        assert len(inner.calls) == 1
+        assert provider.hits == 1
+
+    def test_stream_stores_full_response(self, cache):
+        from conftest import MockProvider
+
+        inner = MockProvider(RESPONSE)
+        provider = CachingProvider(inner, cache)
+        assert "".join(provider.stream("system", "user")) == json.dumps(RESPONSE)
+        assert list(provider.stream("system", "user")) == [json.dumps(RESPONSE)]
+        assert len(inner.calls) == 1
@@ -1,150 +1,15 @@
 """Tests for bicep_whatif_advisor.cli module."""
 
 import json
+import os
 
 import pytest
 from click.testing import CliRunner
 
-from bicep_whatif_advisor.cli import (
-    _load_bicep_files,
-    extract_json,
-    filter_by_confidence,
-    main,
-)
-
-# ---------------------------------------------------------------------------
-# extract_json
-# ---------------------------------------------------------------------------
-
-
-@pytest.mark.unit
-class TestExtractJson:
-    def test_pure_json(self):
-        result = extract_json('{"key": "value"}')
-        assert result == {"key": "value"}
-
-    def test_json_with_surrounding_text(self):
-        text = 'Here is the response:\n{"key": "value"}\nEnd.'
-        result = extract_json(text)
-        assert result == {"key": "value"}
-
-    def test_deeply_nested_json(self):
-        obj = {"a": {"b": {"c": [1, 2, {"d": True}]}}}
-        text = f"Some prefix {json.dumps(obj)} suffix"
-        result = extract_json(text)
-        assert result == obj
-
-    def test_json_with_escaped_quotes(self):
-        text = '{"msg": "He said \\"hello\\""}'
-        result = extract_json(text)
-        assert result["msg"] == 'He said "hello"'
-
-    def test_no_json_raises_value_error(self):
-        with pytest.raises(ValueError, match="Could not extract"):
-            extract_json("no json here at all")
-
-    def test_no_brace_raises_value_error(self):
-        with pytest.raises(ValueError, match="Could not extract"):
-            extract_json("just plain text")
-
-    def test_invalid_json_raises_value_error(self):
-        with pytest.raises(ValueError, match="Could not extract"):
-            extract_json("{invalid json content]")
-
-    def test_markdown_fenced_json(self):
-        text = '```json\n{"resources": []}\n```'
-        result = extract_json(text)
-        assert result == {"resources": []}
-
-
-# ---------------------------------------------------------------------------
-# filter_by_confidence
-# ---------------------------------------------------------------------------
-
-
-@pytest.mark.unit
-class TestFilterByConfidence:
-    def test_splits_by_confidence(self):
-        data = {
-            "resources": [
-                {"resource_name": "r1", "confidence_level": "high"},
-                {"resource_name": "r2", "confidence_level": "low"},
-                {"resource_name": "r3", "confidence_level": "medium"},
-            ],
-            "overall_summary": "test",
-        }
-        high, low = filter_by_confidence(data)
-        assert len(high["resources"]) == 2
-        assert len(low["resources"]) == 1
-        assert low["resources"][0]["resource_name"] == "r2"
-
-    def test_noise_level_goes_to_low(self):
-        data = {
-            "resources": [
-                {"resource_name": "r1", "confidence_level": "noise"},
-            ],
-            "overall_summary": "",
-        }
-        high, low = filter_by_confidence(data)
-        assert len(high["resources"]) == 0
-        assert len(low["resources"]) == 1
-
-    def test_preserves_ci_fields_in_high(self):
-        data = {
-            "resources": [],
-            "overall_summary": "",
-            "risk_assessment": {"drift": {}},
-            "verdict": {"safe": True},
-        }
-        high, low = filter_by_confidence(data)
-        assert "risk_assessment" in high
-        assert "verdict" in high
-        assert "risk_assessment" not in low
-
-    def test_defaults_missing_confidence_to_medium(self):
-        data = {
-            "resources": [{"resource_name": "r1"}],
-            "overall_summary": "",
-        }
-        high, low = filter_by_confidence(data)
-        assert len(high["resources"]) == 1  # medium -> included
-
-
-# ---------------------------------------------------------------------------
-# _load_bicep_files
-# ---------------------------------------------------------------------------
-
-
-@pytest.mark.unit
-class TestLoadBicepFiles:
-    def test_loads_bicep_files(self, tmp_path):
-        bicep = tmp_path / "main.bicep"
-        bicep.write_text("param location string")
-        result = _load_bicep_files(str(tmp_path))
-        assert "param location string" in result
-
-    def test_returns_none_for_nonexistent_dir(self):
-        result = _load_bicep_files("/nonexistent/dir")
-        assert result is None
-
-    def test_returns_none_for_empty_dir(self, tmp_path):
-        result = _load_bicep_files(str(tmp_path))
-        assert result is None
-
-    def test_limits_to_five_files(self, tmp_path):
-        for i in range(10):
-            (tmp_path / f"file{i}.bicep").write_text(f"resource r{i}")
-        result = _load_bicep_files(str(tmp_path))
-        # Should contain at most 5 files
-        assert result.count("// File:") <= 5
-
-    def test_recursive_discovery(self, tmp_path):
-        subdir = tmp_path / "modules"
-        subdir.mkdir()
-        (subdir / "child.bicep").write_text("module content")
-        result = _load_bicep_files(str(tmp_path))
-        assert "module content" in result
-
+from bicep_whatif_advisor.analysis import extract_json
+from bicep_whatif_advisor.cli import main
+from bicep_whatif_advisor.providers import MAX_OUTPUT_TOKENS
+from bicep_whatif_advisor.tokens import count_tokens
 
 # ---------------------------------------------------------------------------
 # CLI invocations via CliRunner
@@ -180,13 +45,13 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         whatif_input = "Resource changes: 1 to create.\n+ Microsoft.Storage/test"
         result = runner.invoke(main, ["--format", "json"], input=whatif_input)
         assert result.exit_code == 0
-        parsed = json.loads(result.output)
+        parsed = json.loads(result.stdout)
         assert "high_confidence" in parsed
 
     def test_standard_mode_markdown_output(
@@ -195,7 +60,7 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
@@ -203,11 +68,100 @@ class TestCLIMain:
         assert result.exit_code == 0
         assert "| #" in result.output
 
+    def test_warm_up_flag(self, clean_env, mocker, sample_standard_response):
+        runner = self._make_runner()
+        provider = _mock_provider(sample_standard_response)
+        provider.warm_up = mocker.Mock()
+        mocker.patch("bicep_whatif_advisor.cli.get_provider", return_value=provider)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1 to create.\n+ Microsoft.Storage/test"
+
+        result = runner.invoke(
+            main, ["--provider", "ollama", "--warm-up", "--format", "json"], input=whatif_input
+        )
+        assert result.exit_code == 0
+        provider.warm_up.assert_called_once_with()
+        assert len(provider.calls) == 1
+
+    def test_response_schema_sent_to_provider(self, clean_env, mocker, sample_standard_response):
+        runner = self._make_runner()
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1 to create.\n+ Microsoft.Storage/test"
+
+        result = runner.invoke(main, ["--format", "json", "--no-cache"], input=whatif_input)
+        assert result.exit_code == 0
+        (schema,) = provider.schemas
+        assert set(schema["required"]) == {"resources", "overall_summary"}
+
+    def test_no_structured_output_flag(self, clean_env, mocker, sample_standard_response):
+        runner = self._make_runner()
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1 to create.\n+ Microsoft.Storage/test"
+
+        result = runner.invoke(
+            main, ["--format", "json", "--no-cache", "--no-structured-output"], input=whatif_input
+        )
+        assert result.exit_code == 0
+        assert provider.schemas == [None]
+
+    def test_stats_json_written(self, clean_env, mocker, tmp_path, sample_standard_response):
+        runner = self._make_runner()
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1 to create.\n+ Microsoft.Storage/test"
+        path = tmp_path / "stats.json"
+
+        result = runner.invoke(
+            main, ["--format", "json", "--timings", "--stats-json", str(path)], input=whatif_input
+        )
+        assert result.exit_code == 0
+        stats = json.loads(path.read_text())
+        assert list(stats["phases"]) == [
+            "setup",
+            "context",
+            "prompt",
+            "read_filter",
+            "llm",
+            "postprocess",
+            "render",
+        ]
+        counters = stats["counters"]
+        assert counters["input_chars"] == len(whatif_input)
+        assert counters["prompt_bytes"] > counters["input_chars"]
+        assert counters["response_bytes"] == len(json.dumps(sample_standard_response))
+        assert (counters["cache_hits"], counters["cache_misses"]) == (0, 1)
+        assert "⏱️ Timings" in result.stderr
+
+    def test_fallback_model_fails_over(self, clean_env, mocker, sample_standard_response):
+        from bicep_whatif_advisor.providers import ProviderConnectionError
+
+        runner = self._make_runner()
+        primary = _mock_provider(sample_standard_response)
+        primary.complete = mocker.Mock(side_effect=ProviderConnectionError("down"))
+        secondary = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=primary)
+        create = mocker.patch(
+            "bicep_whatif_advisor.session.create_provider", return_value=secondary
+        )
+        whatif_input = "Resource changes: 1 to create.\n+ Microsoft.Storage/test"
+
+        result = runner.invoke(
+            main,
+            ["--provider", "azure-openai", "--fallback-model", "gpt-4o-westus", "--format", "json"],
+            input=whatif_input,
+        )
+        assert result.exit_code == 0
+        create.assert_called_once_with("azure-openai", "gpt-4o-westus")
+        assert len(secondary.calls) == 1
+        assert "1 failover(s)" in result.stderr
+
     def test_ci_mode_safe_exit_0(self, clean_env, monkeypatch, mocker, sample_ci_response_safe):
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_ci_response_safe),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -221,7 +175,7 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_ci_response_unsafe),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -235,7 +189,7 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_ci_response_unsafe),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
@@ -262,7 +216,7 @@ class TestCLIMain:
         from conftest import MockProvider
 
         provider = MockProvider(response="This is not valid JSON at all")
-        mocker.patch("bicep_whatif_advisor.cli.get_provider", return_value=provider)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
 
         whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
         result = runner.invoke(main, ["--format", "json"], input=whatif_input)
@@ -283,7 +237,7 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
@@ -297,7 +251,7 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
@@ -307,6 +261,24 @@ class TestCLIMain:
         assert result.exit_code == 0
         assert "Raw What-If Output" in result.output
 
+    def test_include_whatif_is_truncated(
+        self, clean_env, monkeypatch, mocker, sample_standard_response
+    ):
+        """Large What-If output is capped so the PR comment stays postable."""
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider",
+            return_value=_mock_provider(sample_standard_response),
+        )
+        whatif_input = "Resource changes: 1\n" + '      location: "eastus"\n' * 10_000
+        result = runner.invoke(
+            main, ["--format", "markdown", "--include-whatif"], input=whatif_input
+        )
+        assert result.exit_code == 0
+        assert "(truncated to the first" in result.stdout
+        assert len(result.stdout) < 65_536
+
     def test_include_whatif_shows_original_not_filtered(
         self, clean_env, monkeypatch, mocker, sample_standard_response, tmp_path
     ):
@@ -314,7 +286,7 @@ class TestCLIMain:
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         # Create a noise file that filters the etag property
@@ -363,7 +335,7 @@ class TestCLIMain:
             "overall_summary": "2 modifications.",
         }
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
 
@@ -418,13 +390,13 @@ class TestCLIMain:
             "overall_summary": "One real, one noisy.",
         }
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
         whatif_input = "Resource changes: 2\n+ Microsoft.Storage/test\n~ Microsoft.Network/test"
         result = runner.invoke(main, ["--format", "json", "--hide-noise"], input=whatif_input)
         assert result.exit_code == 0
-        parsed = json.loads(result.output)
+        parsed = json.loads(result.stdout)
         assert "low_confidence" not in parsed
         assert "high_confidence" in parsed
 
@@ -454,13 +426,13 @@ class TestCLIMain:
             "overall_summary": "One real, one noisy.",
         }
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
         whatif_input = "Resource changes: 2\n+ Microsoft.Storage/test\n~ Microsoft.Network/test"
         result = runner.invoke(main, ["--format", "json"], input=whatif_input)
         assert result.exit_code == 0
-        parsed = json.loads(result.output)
+        parsed = json.loads(result.stdout)
         assert "low_confidence" in parsed
         assert len(parsed["low_confidence"]["resources"]) == 1
 
@@ -490,7 +462,7 @@ class TestCLIMain:
             "overall_summary": "One real, one noisy.",
         }
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
         whatif_input = "Resource changes: 2\n+ Microsoft.Storage/test\n~ Microsoft.Network/test"
@@ -538,7 +510,7 @@ class TestCLIMain:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -608,7 +580,7 @@ class TestCLIMain:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -678,7 +650,7 @@ class TestCLIMain:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -708,11 +680,103 @@ class TestCLIMain:
         # All resources are noise -> all buckets low -> safe regardless of threshold
         assert result.exit_code == 0
 
+    def test_oversized_input_truncated_at_block_boundary(
+        self, clean_env, monkeypatch, mocker, sample_standard_response
+    ):
+        """Input over the token budget is cut between resource blocks, not mid-block."""
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.setenv("WHATIF_CONTEXT_WINDOW", "30000")
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        block = (
+            "  + Microsoft.Storage/storageAccounts/store{i} [2023-01-01]\n"
+            '      name: "store{i}"\n' + '      location: "eastus"\n' * 20 + "\n"
+        )
+        whatif_input = "Resource changes:\n" + "".join(block.format(i=i) for i in range(300))
+        result = runner.invoke(
+            main, ["--format", "json", "--no-builtin-patterns"], input=whatif_input
+        )
+        assert result.exit_code == 0
+        user_prompt = provider.calls[0][1]
+        sent = user_prompt.split("<whatif_output>\n", 1)[1].split("\n</whatif_output>")[0]
+        # A quarter of the 30,000-token window is reserved for the response
+        assert count_tokens(sent) <= 30000 - 7500
+        assert len(sent) < len(whatif_input)
+        assert sent.endswith("\n\n")  # ends on a whole block
+        assert "truncated to fit the 30,000-token context window" in result.stderr
+
+    def test_noise_only_input_skips_llm(self, clean_env, monkeypatch, mocker, tmp_path):
+        """No provider is built when every resource block is filtered as noise."""
+        runner = self._make_runner()
+        mock_get = mocker.patch("bicep_whatif_advisor.session.get_provider")
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="")
+        noise_file = tmp_path / "noise.txt"
+        noise_file.write_text("resource: diagnosticSettings\n")
+        whatif_input = (
+            "Resource changes: 1 to modify.\n"
+            "  ~ Microsoft.Insights/diagnosticSettings/diag1 [2021-05-01]\n"
+            "      ~ properties.logs[0].enabled: false => true\n"
+        )
+        result = runner.invoke(
+            main,
+            ["--ci", "--format", "json", "--noise-file", str(noise_file)],
+            input=whatif_input,
+        )
+        assert result.exit_code == 0
+        mock_get.assert_not_called()
+        parsed = json.loads(result.stdout)
+        assert parsed["high_confidence"]["verdict"]["safe"] is True
+        assert parsed["high_confidence"]["risk_assessment"]["drift"]["risk_level"] == "low"
+        noise = parsed["low_confidence"]["resources"]
+        assert [r["resource_name"] for r in noise] == ["diag1"]
+
+    def test_nochange_only_input_skips_llm(self, clean_env, monkeypatch, mocker):
+        runner = self._make_runner()
+        mock_get = mocker.patch("bicep_whatif_advisor.session.get_provider")
+        whatif_input = (
+            "Resource changes: 2 no change.\n"
+            "  * Microsoft.Web/serverfarms/plan1 [2022-03-01]\n"
+            "  * Microsoft.Web/sites/app1 [2022-03-01]\n"
+        )
+        result = runner.invoke(main, ["--format", "json"], input=whatif_input)
+        assert result.exit_code == 0
+        mock_get.assert_not_called()
+        resources = json.loads(result.stdout)["high_confidence"]["resources"]
+        assert [(r["resource_name"], r["action"]) for r in resources] == [
+            ("plan1", "NoChange"),
+            ("app1", "NoChange"),
+        ]
+
+    def test_json_input_rendered_and_filtered(
+        self, clean_env, monkeypatch, mocker, sample_standard_response, whatif_json_fixture
+    ):
+        """JSON What-If input is auto-detected and sent to the LLM as text blocks."""
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        result = runner.invoke(main, ["--format", "json"], input=whatif_json_fixture)
+        assert result.exit_code == 0
+        user_prompt = provider.calls[0][1]
+        assert "~ Microsoft.Network/virtualNetworks/vnet-demo" in user_prompt
+        assert '"changeType"' not in user_prompt
+        # Built-in patterns still apply (provisioningState, etag)
+        assert "properties.provisioningState" not in user_prompt
+        assert "nsg-demo" not in user_prompt
+
+    def test_invalid_json_input_exits_2(self, clean_env, monkeypatch, mocker):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        mocker.patch("bicep_whatif_advisor.session.get_provider")
+        result = runner.invoke(main, ["--input-format", "json"], input="not json\n")
+        assert result.exit_code == 2
+
     def test_provider_flag(self, clean_env, monkeypatch, mocker, sample_standard_response):
         runner = self._make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mock_get = mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
@@ -722,6 +786,385 @@ class TestCLIMain:
         assert result.exit_code == 0
         mock_get.assert_called_once_with("anthropic", None)
 
+    def test_provider_error_exits_1(self, clean_env, monkeypatch, mocker):
+        runner = self._make_runner()
+        from bicep_whatif_advisor.providers import ProviderConfigError
+
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider",
+            side_effect=ProviderConfigError("ANTHROPIC_API_KEY environment variable not set."),
+        )
+        whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
+        result = runner.invoke(main, ["--format", "json"], input=whatif_input)
+        assert result.exit_code == 1
+        assert "Error: ANTHROPIC_API_KEY environment variable not set." in result.stderr
+
+    def test_parallel_mode_one_request_per_bucket(
+        self, clean_env, monkeypatch, mocker, sample_ci_response_unsafe
+    ):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        provider = _mock_provider(sample_ci_response_unsafe)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
+        whatif_input = "Resource changes: 1\n- Microsoft.Sql/servers/databases/prod-db"
+        result = runner.invoke(
+            main,
+            ["--ci", "--parallel", "--pr-title", "Remove db", "--format", "json"],
+            input=whatif_input,
+        )
+        # Resources + drift + intent, each with a focused system prompt
+        assert len(provider.calls) == 3
+        assert sum('"drift": {' in system for system, _ in provider.calls) == 1
+        # Merged drift assessment still drives the gate
+        assert result.exit_code == 1
+        parsed = json.loads(result.stdout)
+        assert parsed["high_confidence"]["risk_assessment"]["drift"]["risk_level"] == "high"
+
+    def test_parallel_mode_invalid_bucket_json_exits_1(self, clean_env, monkeypatch, mocker):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        from conftest import MockProvider
+
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider",
+            return_value=MockProvider(response="not json"),
+        )
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
+        whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
+        result = runner.invoke(main, ["--ci", "--parallel", "--skip-intent"], input=whatif_input)
+        assert result.exit_code == 1
+
+    def test_stream_mode_shows_resources_as_they_arrive(
+        self, clean_env, monkeypatch, mocker, sample_standard_response
+    ):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        provider = _mock_provider(sample_standard_response)
+        stream = mocker.spy(provider, "stream")
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
+        result = runner.invoke(
+            main, ["--stream", "--stream-timeout", "5", "--format", "json"], input=whatif_input
+        )
+        assert result.exit_code == 0
+        assert stream.call_args.kwargs["idle_timeout"] == 5
+        first = sample_standard_response["resources"][0]
+        assert f"{first['resource_name']} ({first['resource_type']})" in result.stderr
+        parsed = json.loads(result.stdout)
+        assert len(parsed["high_confidence"]["resources"]) == len(
+            sample_standard_response["resources"]
+        )
+
+    def test_repeated_run_served_from_cache(
+        self, clean_env, monkeypatch, mocker, sample_standard_response
+    ):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
+
+        first = runner.invoke(main, ["--format", "json"], input=whatif_input)
+        second = runner.invoke(main, ["--format", "json"], input=whatif_input)
+
+        assert first.exit_code == second.exit_code == 0
+        assert len(provider.calls) == 1
+        assert "0 hit(s), 1 miss(es)" in first.stderr
+        assert "1 hit(s), 0 miss(es)" in second.stderr
+        assert json.loads(second.stdout) == json.loads(first.stdout)
+
+    def test_no_cache_always_calls_provider(
+        self, clean_env, monkeypatch, mocker, tmp_path, sample_standard_response
+    ):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes: 1\n+ Microsoft.Storage/test"
+        cache_dir = tmp_path / "explicit-cache"
+
+        runner.invoke(main, ["--cache-dir", str(cache_dir)], input=whatif_input)
+        result = runner.invoke(main, ["--no-cache"], input=whatif_input)
+
+        assert result.exit_code == 0
+        assert (cache_dir / "responses.sqlite3").exists()
+        assert len(provider.calls) == 2
+        assert "Response cache" not in result.stderr
+
+    def test_coordination_dir_routes_requests_through_single_flight(
+        self, clean_env, monkeypatch, mocker, tmp_path, sample_standard_response
+    ):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.setenv("WHATIF_COORDINATION_DIR", "")
+        provider = _mock_provider(sample_standard_response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        shared = tmp_path / "shared"
+
+        result = runner.invoke(
+            main,
+            ["--no-cache", "--coordination-dir", str(shared), "--format", "json"],
+            input="Resource changes: 1\n+ Microsoft.Storage/test",
+        )
+
+        assert result.exit_code == 0
+        assert len(provider.calls) == 1
+        assert len(list((shared / "inflight").glob("*.result"))) == 1
+        assert provider.coordination_dir == str(shared)
+        # Passed to the provider, not exported to later runs in this process
+        assert os.environ["WHATIF_COORDINATION_DIR"] == ""
+
+    def test_oversized_diff_trimmed_on_file_boundary(
+        self, clean_env, monkeypatch, mocker, sample_ci_response_safe
+    ):
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.setenv("WHATIF_CONTEXT_WINDOW", "30000")
+        file_diff = "diff --git a/f{i}.bicep b/f{i}.bicep\n" + "+  name: 'value'\n" * 400
+        diff = "\n".join(file_diff.format(i=i) for i in range(20))
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value=diff)
+        provider = _mock_provider(sample_ci_response_safe)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+
+        result = runner.invoke(
+            main,
+            ["--ci", "--format", "json", "--bicep-dir", ""],
+            input="Resource changes: 1\n+ Microsoft.Storage/test",
+        )
+
+        sent = provider.calls[0][1].split("<code_diff>\n", 1)[1].split("\n</code_diff>")[0]
+        assert 0 < len(sent) < len(diff)
+        assert sent.startswith("diff --git a/f0.bicep")
+        assert sent.endswith("+  name: 'value'\n")  # whole files only
+        assert "Code diff trimmed to fit the context window" in result.stderr
+
+    def test_sharded_analyzes_every_block(self, clean_env, monkeypatch, mocker):
+        """--sharded sends all blocks across several requests instead of truncating."""
+        runner = self._make_runner()
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        provider = _mock_provider(
+            {"resources": [{"resource_name": "r", "action": "Create"}], "overall_summary": "ok"}
+        )
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif_input = "Resource changes:\n" + "".join(
+            f"  + Microsoft.Storage/storageAccounts/store{i} [2023-01-01]\n\n" for i in range(25)
+        )
+
+        result = runner.invoke(
+            main,
+            ["--sharded", "--shard-size", "10", "--no-builtin-patterns", "--format", "json"],
+            input=whatif_input,
+        )
+
+        assert result.exit_code == 0
+        assert len(provider.calls) == 3
+        sent = "".join(user for _, user in provider.calls)
+        assert all(f"store{i} " in sent for i in range(25))
+        assert len(json.loads(result.stdout)["high_confidence"]["resources"]) == 3
+        assert "Split What-If output into 3 shards" in result.stderr
+
+
+@pytest.mark.unit
+class TestEstimateCommand:
+    WHATIF = (
+        "Resource changes: 2 to create.\n"
+        "  + Microsoft.Storage/storageAccounts/store1 [2023-01-01]\n"
+        "  + Microsoft.Storage/storageAccounts/store2 [2023-01-01]\n"
+    )
+
+    def _invoke(self, args):
+        try:
+            runner = CliRunner(mix_stderr=False)
+        except TypeError:
+            runner = CliRunner()
+        return runner.invoke(main, ["estimate", *args], input=self.WHATIF)
+
+    def test_reports_sections_without_calling_provider(self, clean_env, mocker):
+        mock_get = mocker.patch("bicep_whatif_advisor.session.get_provider")
+
+        result = self._invoke(["--format", "json"])
+
+        assert result.exit_code == 0
+        mock_get.assert_not_called()
+        estimate = json.loads(result.stdout)
+        assert estimate["provider"] == "anthropic"
+        assert estimate["model"].startswith("claude")
+        assert estimate["context_window"] == 200_000
+        assert estimate["requests"] == 1
+        assert estimate["sections"]["whatif_output"] > 0
+        assert estimate["prompt_tokens"] == sum(estimate["sections"].values())
+        assert estimate["max_output_tokens"] == MAX_OUTPUT_TOKENS
+        assert estimate["cost_usd"] > 0
+
+    def test_parallel_ci_counts_one_request_per_bucket(self, clean_env, mocker):
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff --git a b\n")
+
+        result = self._invoke(["--ci", "--parallel", "--bicep-dir", "", "--format", "json"])
+
+        estimate = json.loads(result.stdout)
+        # Resources request plus the drift bucket (intent needs PR metadata)
+        assert estimate["requests"] == 2
+        assert "code_diff" in estimate["sections"]
+
+    def test_price_override_and_unknown_model(self, clean_env, monkeypatch):
+        monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "my-deployment")
+
+        result = self._invoke(
+            ["-p", "azure-openai", "--input-price", "1", "--output-price", "2", "-f", "json"]
+        )
+
+        estimate = json.loads(result.stdout)
+        assert estimate["model"] == "my-deployment"
+        assert estimate["context_window"] == 128_000
+        expected = (estimate["input_tokens"] * 1 + estimate["output_tokens"] * 2) / 1_000_000
+        assert estimate["cost_usd"] == pytest.approx(expected, abs=1e-6)
+
+    def test_sharded_counts_one_request_per_shard(self, clean_env):
+        result = self._invoke(["--sharded", "--shard-size", "1", "--format", "json"])
+
+        estimate = json.loads(result.stdout)
+        assert estimate["shards"] == 2
+        assert estimate["requests"] == 2
+
+    def test_table_output(self, clean_env):
+        result = self._invoke(["--no-color"])
+
+        assert result.exit_code == 0
+        assert "What-If output" in result.stdout
+        assert "Projected cost" in result.stdout
+
+
+@pytest.mark.unit
+class TestBatchCommand:
+    WHATIF = (
+        "Resource changes: 1 to create.\n"
+        "  + Microsoft.Storage/storageAccounts/store1 [2023-01-01]\n"
+    )
+
+    def _invoke(self, args):
+        try:
+            runner = CliRunner(mix_stderr=False)
+        except TypeError:
+            runner = CliRunner()
+        return runner.invoke(main, ["batch", *args])
+
+    def _stacks(self, tmp_path, names):
+        for name in names:
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "whatif.txt").write_text(self.WHATIF)
+        return str(tmp_path / "*" / "whatif.txt")
+
+    def test_json_report_for_glob(self, clean_env, mocker, tmp_path, sample_standard_response):
+        provider = _mock_provider(sample_standard_response)
+        get_provider = mocker.patch(
+            "bicep_whatif_advisor.session.get_provider", return_value=provider
+        )
+
+        result = self._invoke(
+            ["--format", "json", "--no-cache", self._stacks(tmp_path, ["app", "net"])]
+        )
+
+        assert result.exit_code == 0
+        report = json.loads(result.stdout)
+        assert report["verdict"] == {"status": "analyzed", "stacks": 2, "analyzed": 2}
+        assert [s["name"].split(os.sep)[-2] for s in report["stacks"]] == ["app", "net"]
+        get_provider.assert_called_once()
+        assert len(provider.calls) == 2
+
+    def test_exit_code_reflects_worst_stack(
+        self, clean_env, mocker, tmp_path, sample_ci_response_unsafe
+    ):
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider",
+            return_value=_mock_provider(sample_ci_response_unsafe),
+        )
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="")
+        (tmp_path / "whatif.txt").write_text(self.WHATIF)
+        manifest = tmp_path / "stacks.yaml"
+        manifest.write_text("stacks:\n  - name: db\n    whatif: whatif.txt\n")
+
+        result = self._invoke(["--ci", "--format", "markdown", "--manifest", str(manifest)])
+        assert result.exit_code == 1
+        assert "| db | ❌ UNSAFE |" in result.stdout
+        assert "Deployment blocked: Unsafe stacks: db" in result.stderr
+
+        result = self._invoke(
+            ["--ci", "--no-block", "--format", "json", "--manifest", str(manifest)]
+        )
+        assert result.exit_code == 0
+        assert json.loads(result.stdout)["verdict"]["status"] == "unsafe"
+
+    def test_missing_file_is_reported_and_fails(
+        self, clean_env, mocker, tmp_path, sample_standard_response
+    ):
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider",
+            return_value=_mock_provider(sample_standard_response),
+        )
+        good = tmp_path / "good.txt"
+        good.write_text(self.WHATIF)
+
+        result = self._invoke(["--format", "json", str(good), str(tmp_path / "missing.txt")])
+
+        assert result.exit_code == 2
+        stacks = json.loads(result.stdout)["stacks"]
+        assert [s["status"] for s in stacks] == ["analyzed", "error"]
+
+    def test_no_sources(self, clean_env):
+        result = self._invoke([])
+
+        assert result.exit_code == 2
+        assert "No What-If files given" in result.stderr
+
+
+@pytest.mark.unit
+class TestServerOption:
+    WHATIF = TestBatchCommand.WHATIF
+
+    @pytest.fixture
+    def server_url(self):
+        import threading
+
+        from bicep_whatif_advisor.server import AdvisorServer, AdvisorService
+
+        server = AdvisorServer(("127.0.0.1", 0), AdvisorService(), workers=1)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    def _invoke(self, args):
+        try:
+            runner = CliRunner(mix_stderr=False)
+        except TypeError:
+            runner = CliRunner()
+        return runner.invoke(main, args, input=self.WHATIF)
+
+    def test_analysis_runs_on_server(
+        self, clean_env, mocker, server_url, sample_ci_response_unsafe
+    ):
+        provider = _mock_provider(sample_ci_response_unsafe)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff --git a b\n")
+
+        result = self._invoke(
+            ["--ci", "--drift-threshold", "medium", "--format", "json", "--server", server_url]
+        )
+
+        assert result.exit_code == 1
+        assert json.loads(result.stdout)["high_confidence"]["verdict"]["safe"] is False
+        assert "Failed risk buckets: drift" in result.stderr
+        assert "diff --git a b" in provider.calls[0][1]
+
+    def test_unreachable_server(self, clean_env):
+        result = self._invoke(["--server", "http://127.0.0.1:1"])
+
+        assert result.exit_code == 1
+        assert "Could not reach the advisor server" in result.stderr
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -195,7 +195,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mock_get = mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         cfg = tmp_path / "config.yaml"
@@ -215,7 +215,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mock_get = mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         cfg = tmp_path / "config.yaml"
@@ -234,7 +234,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         cfg = tmp_path / "config.yaml"
@@ -249,7 +249,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_ci_response_safe),
         )
         mocker.patch(
@@ -267,7 +267,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_ci_response_safe),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
@@ -277,7 +277,7 @@ class TestConfigFileCLI:
         assert result.exit_code == 0
         # CI mode prints a Rich banner to stdout before JSON, so use
         # extract_json (same approach as test_cli.py) instead of json.loads.
-        from bicep_whatif_advisor.cli import extract_json
+        from bicep_whatif_advisor.analysis import extract_json
 
         parsed = extract_json(result.output)
         assert "high_confidence" in parsed
@@ -314,7 +314,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mock_get = mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         cfg = tmp_path / "config.yaml"
@@ -330,7 +330,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         cfg = tmp_path / "config.yaml"
@@ -345,7 +345,7 @@ class TestConfigFileCLI:
         runner = _make_runner()
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=_mock_provider(sample_standard_response),
         )
         cfg = tmp_path / "config.yaml"
@@ -0,0 +1,260 @@
+"""Tests for bicep_whatif_advisor.coordination module."""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from bicep_whatif_advisor.cache import CachingProvider, request_key
+from bicep_whatif_advisor.coordination import (
+    CoalescingProvider,
+    FileLock,
+    SharedTokenBucket,
+    SingleFlight,
+)
+from bicep_whatif_advisor.providers import clear_client_cache
+from bicep_whatif_advisor.providers.retry import RequestScheduler, TokenBucket, get_scheduler
+
+RESPONSE = {"resources": [], "overall_summary": "No changes"}
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Child process for the multi-process test: waits for a shared start signal,
+# charges the shared token budget, then asks a slow fake provider for the
+# same prompt through SingleFlight. Prints its token wait and the response.
+WORKER = textwrap.dedent(
+    """
+    import json, sys, time
+    from pathlib import Path
+
+    from bicep_whatif_advisor.coordination import SharedTokenBucket, SingleFlight
+
+    directory, worker = Path(sys.argv[1]), sys.argv[2]
+
+    def slow_provider():
+        with open(directory / "calls.log", "a") as log:
+            log.write(worker + "\\n")
+        time.sleep(1.0)
+        return json.dumps({"answered_by": worker})
+
+    bucket = SharedTokenBucket(directory / "tokens", per_minute=100)
+    (directory / f"ready-{worker}").touch()
+    while not (directory / "go").exists():
+        time.sleep(0.01)
+
+    wait = bucket.reserve(30)
+    flight = SingleFlight(directory)
+    response = flight.run("same-prompt", slow_provider)
+    print(json.dumps({"wait": wait, "response": response, "coalesced": flight.coalesced}))
+    """
+)
+
+
+@pytest.mark.unit
+class TestFileLock:
+    def test_excludes_second_holder(self, tmp_path):
+        first = FileLock(tmp_path / "x.lock")
+        second = FileLock(tmp_path / "x.lock")
+
+        assert first.acquire(blocking=False)
+        assert not second.acquire(blocking=False)
+        first.release()
+        assert second.acquire(blocking=False)
+        second.release()
+
+
+@pytest.mark.unit
+class TestSharedTokenBucket:
+    def test_instances_share_one_balance(self, tmp_path):
+        a = SharedTokenBucket(tmp_path / "budget", per_minute=60)
+        b = SharedTokenBucket(tmp_path / "budget", per_minute=60)
+
+        assert a.reserve(40) == 0.0
+        assert b.reserve(20) == 0.0
+        # Both drew from the same 60 tokens, so the next one must wait
+        assert a.reserve(6) == pytest.approx(6.0, abs=0.1)
+        a.close()
+        b.close()
+
+    def test_refills_over_time(self, tmp_path, mocker):
+        clock = mocker.patch("time.time", return_value=1000.0)
+        bucket = SharedTokenBucket(tmp_path / "budget", per_minute=60)
+        bucket.reserve(60)
+        clock.return_value = 1030.0
+        assert bucket.reserve(30) == 0.0
+        assert bucket.reserve(1) == pytest.approx(1.0)
+        bucket.close()
+
+    def test_scheduler_shares_budget_via_env(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WHATIF_COORDINATION_DIR", str(tmp_path))
+        monkeypatch.setenv("WHATIF_TOKENS_PER_MINUTE", "1000")
+
+        scheduler = RequestScheduler.from_env("Test API", key=("azure-openai", "https://x", "gpt"))
+        assert isinstance(scheduler.tokens, SharedTokenBucket)
+        assert scheduler.tokens.capacity == 1000
+        assert scheduler.requests is None
+        scheduler.close()
+
+    def test_scheduler_per_explicit_directory(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("WHATIF_COORDINATION_DIR", raising=False)
+        monkeypatch.setenv("WHATIF_TOKENS_PER_MINUTE", "1000")
+        key = ("ollama", "http://localhost")
+
+        try:
+            shared = get_scheduler(key, "Ollama", str(tmp_path))
+            local = get_scheduler(key, "Ollama")
+
+            assert isinstance(shared.tokens, SharedTokenBucket)
+            assert type(local.tokens) is TokenBucket
+            assert get_scheduler(key, "Ollama", str(tmp_path)) is shared
+            assert "WHATIF_COORDINATION_DIR" not in os.environ
+        finally:
+            clear_client_cache()
+
+    def test_unusable_dir_falls_back_to_local_bucket(self, tmp_path, monkeypatch, capsys):
+        blocker = tmp_path / "file"
+        blocker.write_text("not a directory")
+        monkeypatch.setenv("WHATIF_COORDINATION_DIR", str(blocker))
+        monkeypatch.setenv("WHATIF_TOKENS_PER_MINUTE", "1000")
+
+        scheduler = RequestScheduler.from_env("Test API", key=("ollama", "http://localhost"))
+        assert type(scheduler.tokens) is TokenBucket
+        assert "shared rate limit disabled" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+class TestSingleFlight:
+    def test_waiter_receives_leaders_result(self, tmp_path):
+        flight = SingleFlight(tmp_path)
+        calls = []
+        leader_started = threading.Event()
+        results = {}
+
+        def slow_request():
+            calls.append(1)
+            leader_started.set()
+            time.sleep(0.3)
+            return "answer"
+
+        leader = threading.Thread(
+            target=lambda: results.setdefault("leader", flight.run("k", slow_request))
+        )
+        leader.start()
+        leader_started.wait()
+        results["waiter"] = SingleFlight(tmp_path).run("k", slow_request)
+        leader.join()
+
+        assert results == {"leader": "answer", "waiter": "answer"}
+        assert len(calls) == 1
+
+    def test_old_result_not_replayed(self, tmp_path):
+        flight = SingleFlight(tmp_path)
+        assert flight.run("k", lambda: "first") == "first"
+        # Nothing in flight: the next caller makes its own request
+        assert flight.run("k", lambda: "second") == "second"
+        assert flight.coalesced == 0
+
+    def test_leader_failure_releases_lock(self, tmp_path):
+        flight = SingleFlight(tmp_path)
+
+        def failing():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            flight.run("k", failing)
+        assert FileLock(tmp_path / "inflight" / "k.lock").acquire(blocking=False)
+
+    def test_prunes_old_results(self, tmp_path):
+        flight = SingleFlight(tmp_path, result_ttl=10)
+        flight.run("old", lambda: "x")
+        hour_ago = time.time() - 3600
+        os.utime(tmp_path / "inflight" / "old.result", (hour_ago, hour_ago))
+        flight.run("new", lambda: "y")
+
+        assert not (tmp_path / "inflight" / "old.result").exists()
+        assert (tmp_path / "inflight" / "new.result").exists()
+
+    def test_prune_keeps_held_lock_files(self, tmp_path):
+        flight = SingleFlight(tmp_path, result_ttl=10)
+        flight.run("old", lambda: "x")
+        hour_ago = time.time() - 3600
+        os.utime(tmp_path / "inflight" / "old.result", (hour_ago, hour_ago))
+        _, held = flight.join("old")
+
+        try:
+            flight.run("new", lambda: "y")
+
+            # Still the same lock: a second process cannot become a leader too
+            assert not FileLock(tmp_path / "inflight" / "old.lock").acquire(blocking=False)
+        finally:
+            held.release()
+
+    def test_unusable_dir_disables_coalescing(self, tmp_path, capsys):
+        blocker = tmp_path / "file"
+        blocker.write_text("not a directory")
+        flight = SingleFlight(blocker)
+
+        assert flight.run("k", lambda: "answer") == "answer"
+        assert flight.disabled
+        assert "coalescing disabled" in capsys.readouterr().err
+
+    def test_processes_share_one_call_and_one_budget(self, tmp_path):
+        workers = 4
+        procs = [
+            subprocess.Popen(
+                [sys.executable, "-c", WORKER, str(tmp_path), str(n)],
+                cwd=str(REPO_ROOT),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for n in range(workers)
+        ]
+        deadline = time.time() + 30
+        while len(list(tmp_path.glob("ready-*"))) < workers and time.time() < deadline:
+            time.sleep(0.01)
+        (tmp_path / "go").touch()
+        outputs = []
+        for proc in procs:
+            stdout, stderr = proc.communicate(timeout=30)
+            assert proc.returncode == 0, stderr
+            outputs.append(json.loads(stdout))
+
+        # One process called the provider; the others got its response
+        assert len((tmp_path / "calls.log").read_text().splitlines()) == 1
+        assert len({o["response"] for o in outputs}) == 1
+        assert sum(o["coalesced"] for o in outputs) == workers - 1
+        # 4 x 30 tokens against one 100/min budget: exactly three fit
+        assert sum(1 for o in outputs if o["wait"] == 0) == 3
+
+
+@pytest.mark.unit
+class TestCoalescingProvider:
+    def test_complete_and_stream(self, tmp_path):
+        from conftest import MockProvider
+
+        inner = MockProvider(RESPONSE)
+        provider = CoalescingProvider(inner, SingleFlight(tmp_path))
+
+        assert json.loads(provider.complete("system", "user")) == RESPONSE
+        assert json.loads("".join(provider.stream("system", "user"))) == RESPONSE
+        assert len(inner.calls) == 2
+
+    def test_acomplete(self, tmp_path):
+        from conftest import MockProvider
+
+        provider = CoalescingProvider(MockProvider(RESPONSE), SingleFlight(tmp_path))
+        assert json.loads(asyncio.run(provider.acomplete("system", "user"))) == RESPONSE
+
+    def test_wrapping_keeps_cache_key(self, tmp_path):
+        from conftest import MockProvider
+
+        inner = MockProvider(RESPONSE)
+        wrapped = CachingProvider(CoalescingProvider(inner, SingleFlight(tmp_path)), None)
+        assert wrapped.cache_key("s", "u") == request_key(inner, "s", "u")
@@ -0,0 +1,146 @@
+"""Tests for bicep_whatif_advisor.hedging module."""
+
+import threading
+import time
+
+import pytest
+
+from bicep_whatif_advisor.cache import CachingProvider, ResponseCache, request_key
+from bicep_whatif_advisor.hedging import HedgedProvider
+from bicep_whatif_advisor.providers import (
+    Provider,
+    ProviderConnectionError,
+    ProviderError,
+    ProviderTimeoutError,
+)
+
+
+class ScriptedProvider(Provider):
+    """Streams ``chunks`` after ``first_delay`` seconds, or raises ``error``."""
+
+    def __init__(self, chunks=("{}",), first_delay=0.0, chunk_delay=0.0, error=None):
+        self.chunks = chunks
+        self.first_delay = first_delay
+        self.chunk_delay = chunk_delay
+        self.error = error
+        self.calls = 0
+        self.closed = threading.Event()
+
+    def complete(self, system_prompt, user_prompt, response_schema=None):
+        return "".join(self.stream(system_prompt, user_prompt))
+
+    def stream(self, system_prompt, user_prompt, idle_timeout=None, response_schema=None):
+        self.calls += 1
+        try:
+            time.sleep(self.first_delay)
+            if self.error is not None:
+                raise self.error
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    time.sleep(self.chunk_delay)
+                yield chunk
+        finally:
+            self.closed.set()
+
+
+@pytest.mark.unit
+class TestHedgedComplete:
+    def test_fast_primary_is_not_hedged(self):
+        primary = ScriptedProvider(chunks=('{"from": ', '"primary"}'))
+        secondary = ScriptedProvider()
+        hedged = HedgedProvider(primary, secondary, hedge_delay=1.0)
+
+        assert hedged.complete("system", "user") == '{"from": "primary"}'
+        assert secondary.calls == 0
+        assert (hedged.requests, hedged.hedged, hedged.failovers) == (1, 0, 0)
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        primary = ScriptedProvider(chunks=("primary",), first_delay=0.5)
+        secondary = ScriptedProvider(chunks=("secondary",))
+        hedged = HedgedProvider(primary, secondary, hedge_delay=0.05)
+
+        start = time.monotonic()
+        assert hedged.complete("system", "user") == "secondary"
+        assert time.monotonic() - start < 0.4
+        assert (hedged.hedged, hedged.secondary_wins) == (1, 1)
+        # The primary's stream is closed once it notices the cancellation
+        assert primary.closed.wait(2)
+
+    def test_first_token_within_delay_prevents_hedge(self):
+        primary = ScriptedProvider(chunks=("a", "b"), chunk_delay=0.2)
+        secondary = ScriptedProvider()
+        hedged = HedgedProvider(primary, secondary, hedge_delay=0.05)
+
+        assert hedged.complete("system", "user") == "ab"
+        assert secondary.calls == 0
+
+    def test_failure_fails_over_without_hedge_delay(self):
+        primary = ScriptedProvider(error=ProviderConnectionError("down"))
+        secondary = ScriptedProvider(chunks=("secondary",))
+        hedged = HedgedProvider(primary, secondary)
+
+        assert hedged.complete("system", "user") == "secondary"
+        assert (hedged.failovers, hedged.secondary_wins) == (1, 1)
+
+    def test_both_failing_raises_primary_error(self):
+        primary = ScriptedProvider(error=ProviderConnectionError("primary down"))
+        secondary = ScriptedProvider(error=ProviderTimeoutError("secondary slow"))
+        hedged = HedgedProvider(primary, secondary)
+
+        with pytest.raises(ProviderConnectionError, match="primary down"):
+            hedged.complete("system", "user")
+
+    def test_hedged_secondary_failure_waits_for_primary(self):
+        primary = ScriptedProvider(chunks=("primary",), first_delay=0.2)
+        secondary = ScriptedProvider(error=ProviderError("boom"))
+        hedged = HedgedProvider(primary, secondary, hedge_delay=0.01)
+
+        assert hedged.complete("system", "user") == "primary"
+        assert (hedged.hedged, hedged.secondary_wins) == (1, 0)
+
+    def test_usage_combines_both_providers(self):
+        primary = ScriptedProvider()
+        secondary = ScriptedProvider()
+        primary.usage.add(input_tokens=10, output_tokens=1)
+        secondary.usage.add(input_tokens=5, output_tokens=2)
+
+        usage = HedgedProvider(primary, secondary).usage
+        assert (usage.input_tokens, usage.output_tokens, usage.requests) == (15, 3, 2)
+
+
+@pytest.mark.unit
+class TestHedgedStream:
+    def test_first_provider_to_produce_output_is_streamed(self):
+        primary = ScriptedProvider(chunks=("p1", "p2"), first_delay=0.5)
+        secondary = ScriptedProvider(chunks=("s1", "s2"))
+        hedged = HedgedProvider(primary, secondary, hedge_delay=0.01)
+
+        assert list(hedged.stream("system", "user")) == ["s1", "s2"]
+
+    def test_error_after_output_is_raised(self):
+        class Dropping(ScriptedProvider):
+            def stream(self, system_prompt, user_prompt, idle_timeout=None, response_schema=None):
+                yield "partial"
+                raise ProviderConnectionError("dropped")
+
+        secondary = ScriptedProvider()
+        hedged = HedgedProvider(Dropping(), secondary)
+
+        with pytest.raises(ProviderConnectionError, match="dropped"):
+            list(hedged.stream("system", "user"))
+        assert secondary.calls == 0
+
+
+@pytest.mark.unit
+class TestHedgedRequestKey:
+    def test_key_names_both_providers(self):
+        primary, secondary, other = ScriptedProvider(), ScriptedProvider(), ScriptedProvider()
+        primary.model, secondary.model, other.model = "primary", "secondary", "other"
+        hedged = HedgedProvider(primary, secondary)
+
+        key = CachingProvider(hedged, ResponseCache()).cache_key("s", "u")
+
+        # A secondary's answer is never served to a run of the primary alone
+        assert key != request_key(primary, "s", "u")
+        assert key != request_key(HedgedProvider(primary, other), "s", "u")
+        assert key == request_key(HedgedProvider(primary, secondary), "s", "u")
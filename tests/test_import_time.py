@@ -0,0 +1,87 @@
+"""Startup regression tests: what importing and short-circuit runs load.
+
+Short-lived CI containers start the CLI thousands of times a day, so
+rendering, config, async and provider dependencies are imported where they
+are used rather than at module load.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative import time budget for bicep_whatif_advisor.cli (microseconds),
+# well above the ~50 ms measured on a CI runner so only regressions fail
+IMPORT_BUDGET_US = 100_000
+
+# Top-level packages that must not be loaded until they are needed
+DEFERRED = {
+    "anthropic",
+    "asyncio",
+    "concurrent",
+    "openai",
+    "orjson",
+    "requests",
+    "rich",
+    "sqlite3",
+    "tiktoken",
+    "yaml",
+}
+
+
+def _import_times(code: str) -> dict:
+    """Run ``code`` with -X importtime and map module name to cumulative microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.unit
+class TestImportTime:
+    def test_cli_import_defers_heavy_dependencies(self):
+        baseline = _import_times("pass")
+        loaded = set(_import_times("import bicep_whatif_advisor.cli")) - set(baseline)
+
+        assert not {name for name in loaded if name.split(".")[0] in DEFERRED}
+
+    def test_cli_import_within_budget(self):
+        # Best of three, so a busy machine does not fail the test
+        best = min(
+            _import_times("import bicep_whatif_advisor.cli")["bicep_whatif_advisor.cli"]
+            for _ in range(3)
+        )
+        assert best < IMPORT_BUDGET_US
+
+    def test_short_circuit_json_run_loads_no_renderer_or_provider(self):
+        code = (
+            "import sys\n"
+            "from bicep_whatif_advisor.cli import main\n"
+            "try:\n"
+            "    main(['--format', 'json', '--no-cache'])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(' '.join(sys.modules), file=sys.stderr)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            input="Resource changes: 1 no change.\n\n"
+            "  = Microsoft.Storage/storageAccounts/x [2023-01-01]\n",
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        modules = set(result.stderr.splitlines()[-1].split())
+
+        assert '"high_confidence"' in result.stdout
+        assert not {name for name in modules if name.split(".")[0] in DEFERRED}
@@ -0,0 +1,233 @@
+"""Tests for bicep_whatif_advisor.incremental module."""
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from bicep_whatif_advisor.cli import main
+from bicep_whatif_advisor.incremental import (
+    ResultStore,
+    collect_results,
+    context_key,
+    merge_results,
+)
+from bicep_whatif_advisor.noise_filter import block_fingerprint, filter_whatif_lines
+
+WHATIF = (
+    "Resource changes: 2 to create.\n"
+    "\n"
+    "  + Microsoft.Storage/storageAccounts/alpha [2023-01-01]\n"
+    "\n"
+    "  + Microsoft.Storage/storageAccounts/beta [{version}]\n"
+)
+
+
+def _row(name, action="Create", **fields):
+    return {
+        "resource_name": name,
+        "resource_type": "Storage/storageAccounts",
+        "action": action,
+        "summary": f"Creates {name}",
+        "confidence_level": "high",
+        "confidence_reason": "New resource",
+        **fields,
+    }
+
+
+def _filter(text, reuse):
+    return filter_whatif_lines(text.splitlines(keepends=True), [], reuse=reuse)
+
+
+def _kept(names, operation="Create"):
+    return [
+        {
+            "resource_name": name,
+            "resource_type": "Microsoft.Storage/storageAccounts",
+            "operation": operation,
+            "fingerprint": f"fp-{name}",
+        }
+        for name in names
+    ]
+
+
+@pytest.mark.unit
+class TestFingerprint:
+    def test_layout_does_not_matter(self):
+        assert block_fingerprint(["  ~ Microsoft.Web/sites/app\n", "    x:  1\n"]) == (
+            block_fingerprint(["~ Microsoft.Web/sites/app\n", "\n", "x: 1\n"])
+        )
+        assert block_fingerprint(["x: 1\n"]) != block_fingerprint(["x: 2\n"])
+
+    def test_reused_blocks_are_left_out_of_the_text(self):
+        text = WHATIF.format(version="2023-01-01")
+        first = _filter(text, reuse=set())
+        alpha = first.kept_resources[0]["fingerprint"]
+
+        result = _filter(text, reuse={alpha})
+
+        assert "alpha" not in result.text
+        assert "beta" in result.text
+        assert result.blocks_reused == 1
+        assert result.kept_resources[0]["reused"] is True
+        assert result.needs_analysis
+
+    def test_all_reused_needs_no_analysis(self):
+        text = WHATIF.format(version="2023-01-01")
+        fingerprints = {r["fingerprint"] for r in _filter(text, set()).kept_resources}
+
+        assert not _filter(text, fingerprints).needs_analysis
+
+
+@pytest.mark.unit
+class TestResultStore:
+    def test_round_trip_per_context(self, tmp_path):
+        store = ResultStore(tmp_path)
+        store.save("ctx", {"fp": {"resource": _row("alpha"), "concerns": {}}})
+
+        assert store.load("ctx")["fp"]["resource"]["resource_name"] == "alpha"
+        assert store.load("other") == {}
+
+    def test_expired_results_are_dropped(self, tmp_path, mocker):
+        store = ResultStore(tmp_path, ttl_seconds=60)
+        clock = mocker.patch("bicep_whatif_advisor.incremental.time.time", return_value=1000.0)
+        store.save("ctx", {"fp": {"resource": _row("alpha"), "concerns": {}}})
+
+        clock.return_value = 1061.0
+
+        assert store.load("ctx") == {}
+
+    def test_size_bound_evicts_least_recently_used(self, tmp_path):
+        store = ResultStore(tmp_path, max_bytes=300)
+        for name in ("a", "b", "c"):
+            store.save("ctx", {name: {"resource": _row(name), "concerns": {}}})
+
+        assert set(store.load("ctx")) == {"c"}
+
+    def test_context_depends_on_model_and_prompt(self):
+        key = context_key("anthropic", "m1", ["prompt"])
+
+        assert key == context_key("anthropic", "m1", ["prompt"])
+        assert key != context_key("anthropic", "m2", ["prompt"])
+        assert key != context_key("anthropic", "m1", ["other prompt"])
+
+
+@pytest.mark.unit
+class TestCollectResults:
+    def test_rows_matched_by_name_and_action(self):
+        kept = _kept(["alpha", "beta", "gamma"])
+        kept[2]["operation"] = "Delete"
+        data = {"resources": [_row("alpha"), _row("Beta"), _row("gamma")]}
+
+        results = collect_results(data, kept, None)
+
+        assert set(results) == {"fp-alpha", "fp-beta"}
+        assert results["fp-beta"]["resource"]["resource_name"] == "Beta"
+
+    def test_shared_names_and_unanalyzed_blocks_are_skipped(self):
+        kept = _kept(["default", "default", "alpha", "beta"])
+        del kept[3]["fingerprint"]  # truncated: the LLM never saw it
+        data = {"resources": [_row("default"), _row("alpha"), _row("beta")]}
+
+        assert set(collect_results(data, kept, None)) == {"fp-alpha"}
+
+    def test_ci_needs_concern_attribution(self):
+        data = {
+            "resources": [_row("alpha")],
+            "risk_assessment": {"drift": {"risk_level": "low", "concerns": []}},
+        }
+
+        assert collect_results(data, _kept(["alpha"]), ["drift"]) == {}
+
+        concern = {"resource_name": "alpha", "concern": "Not in diff", "risk_level": "medium"}
+        data["risk_assessment"]["drift"]["resource_concerns"] = [concern]
+        results = collect_results(data, _kept(["alpha"]), ["drift"])
+
+        assert results["fp-alpha"]["concerns"] == {"drift": [concern]}
+
+
+@pytest.mark.unit
+class TestMergeResults:
+    def test_reused_concerns_raise_the_bucket(self):
+        concern = {"resource_name": "alpha", "concern": "Not in diff", "risk_level": "high"}
+        reused = [{"resource": _row("alpha"), "concerns": {"drift": [concern]}}]
+        data = {
+            "resources": [_row("beta")],
+            "risk_assessment": {
+                "drift": {"risk_level": "low", "concerns": [], "resource_concerns": []}
+            },
+        }
+
+        merge_results(data, reused, ["drift"])
+
+        assert [r["resource_name"] for r in data["resources"]] == ["beta", "alpha"]
+        drift = data["risk_assessment"]["drift"]
+        assert drift["risk_level"] == "high"
+        assert drift["resource_concerns"] == [concern]
+
+    def test_locally_built_response_is_replaced(self):
+        reused = [{"resource": _row("alpha"), "concerns": {"drift": []}}]
+        data = {
+            "resources": [],
+            "overall_summary": "No actionable changes.",
+            "risk_assessment": {"drift": {"risk_level": "low", "reasoning": "Skipped"}},
+            "verdict": {"safe": True, "reasoning": "LLM analysis was skipped."},
+        }
+
+        merge_results(data, reused, ["drift"], analyzed=False)
+
+        assert "reused the results for 1 resource(s)" in data["overall_summary"]
+        assert "Carried over" in data["risk_assessment"]["drift"]["reasoning"]
+        assert "reused" in data["verdict"]["reasoning"]
+
+
+@pytest.mark.unit
+class TestIncrementalRun:
+    def _invoke(self, whatif):
+        try:
+            runner = CliRunner(mix_stderr=False)
+        except TypeError:
+            runner = CliRunner()
+        return runner.invoke(
+            main, ["--incremental", "--no-cache", "--format", "json"], input=whatif
+        )
+
+    def test_only_changed_blocks_are_sent(self, clean_env, mocker):
+        from conftest import MockProvider
+
+        first = MockProvider({"resources": [_row("alpha"), _row("beta")], "overall_summary": "2"})
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=first)
+        assert self._invoke(WHATIF.format(version="2023-01-01")).exit_code == 0
+
+        second = MockProvider({"resources": [_row("beta", summary="New")], "overall_summary": "1"})
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=second)
+        result = self._invoke(WHATIF.format(version="2024-01-01"))
+
+        assert result.exit_code == 0
+        (call,) = second.calls
+        assert "storageAccounts/beta" in call[1]
+        assert "storageAccounts/alpha" not in call[1]
+        rows = json.loads(result.stdout)["high_confidence"]["resources"]
+        assert [(r["resource_name"], r["summary"]) for r in rows] == [
+            ("beta", "New"),
+            ("alpha", "Creates alpha"),
+        ]
+        assert "Reusing earlier results for 1 unchanged resource block(s)" in result.stderr
+
+    def test_unchanged_input_skips_the_llm(self, clean_env, mocker):
+        from conftest import MockProvider
+
+        provider = MockProvider(
+            {"resources": [_row("alpha"), _row("beta")], "overall_summary": "2"}
+        )
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        whatif = WHATIF.format(version="2023-01-01")
+        self._invoke(whatif)
+
+        result = self._invoke(whatif)
+
+        assert result.exit_code == 0
+        assert len(provider.calls) == 1
+        data = json.loads(result.stdout)["high_confidence"]
+        assert {r["resource_name"] for r in data["resources"]} == {"alpha", "beta"}
+        assert "No new or changed resources" in result.stderr
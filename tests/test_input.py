@@ -4,7 +4,15 @@ import io
 
 import pytest
 
-from bicep_whatif_advisor.input import InputError, read_stdin
+from bicep_whatif_advisor.input import (
+    InputError,
+    WhatIfStream,
+    iter_lines,
+    load_bicep_files,
+    open_stdin,
+    read_stdin,
+    truncate_included_whatif,
+)
 
 
 @pytest.mark.unit
@@ -112,3 +120,118 @@ class TestReadStdin:
         mock_stdin.read.return_value = content
         result = read_stdin()
         assert result == content
+
+
+@pytest.mark.unit
+class TestIterLines:
+    """Tests for iter_lines() — chunked line splitting."""
+
+    def test_lines_split_across_chunks(self):
+        text = "first line\nsecond line\nthird"
+        lines = list(iter_lines(io.StringIO(text), chunk_size=4))
+        assert lines == ["first line\n", "second line\n", "third"]
+
+    def test_crlf_split_across_chunks(self):
+        text = "ab\r\ncd\r\n"
+        lines = list(iter_lines(io.StringIO(text), chunk_size=3))
+        assert lines == ["ab\r\n", "cd\r\n"]
+
+    def test_matches_splitlines(self):
+        text = "x" * 100 + "\n\n  ~ y\r\n" + "z" * 7
+        assert list(iter_lines(io.StringIO(text), chunk_size=5)) == text.splitlines(True)
+
+    def test_empty_stream(self):
+        assert list(iter_lines(io.StringIO(""))) == []
+
+
+@pytest.mark.unit
+class TestWhatIfStream:
+    """Tests for WhatIfStream / open_stdin() — streaming input validation."""
+
+    def test_yields_lines_and_counts_chars(self):
+        stream = WhatIfStream(io.StringIO("Resource changes: 1\n+ Create\n"), chunk_size=4)
+        assert list(stream) == ["Resource changes: 1\n", "+ Create\n"]
+        assert stream.chars_read == 29
+        stream.validate()
+
+    def test_empty_input_raises_on_validate(self):
+        stream = WhatIfStream(io.StringIO("  \n\t\n"))
+        list(stream)
+        with pytest.raises(InputError, match="Input is empty"):
+            stream.validate()
+
+    def test_missing_markers_warns(self, mocker):
+        mock_stderr = mocker.patch(
+            "bicep_whatif_advisor.input.sys.stderr", new_callable=io.StringIO
+        )
+        stream = WhatIfStream(io.StringIO("random text\n"))
+        list(stream)
+        stream.validate()
+        assert "may not be Azure What-If output" in mock_stderr.getvalue()
+
+    def test_text_only_kept_when_requested(self):
+        content = "Scope: /subscriptions/x\n"
+        kept = WhatIfStream(io.StringIO(content), keep_text=True)
+        list(kept)
+        assert kept.text == content
+
+        not_kept = WhatIfStream(io.StringIO(content))
+        list(not_kept)
+        assert not_kept.text is None
+
+    def test_kept_text_is_bounded(self):
+        stream = WhatIfStream(io.StringIO("0123456789\n" * 100), keep_text=True, max_kept_chars=30)
+        assert len(list(stream)) == 100
+        assert stream.chars_read == 1100
+        # Runs past the limit, so truncation can tell the text was cut
+        assert stream.text == "0123456789\n" * 3
+
+
+@pytest.mark.unit
+class TestTruncateIncludedWhatif:
+    def test_short_text_unchanged(self):
+        assert truncate_included_whatif("a\nb\n", max_chars=10) == "a\nb\n"
+
+    def test_cut_on_line_boundary_with_note(self):
+        text = truncate_included_whatif("0123456789\n" * 4, max_chars=30)
+        assert text == "0123456789\n" * 2 + "... (truncated to the first 22 characters)\n"
+
+    def test_single_long_line_cut_at_limit(self):
+        assert truncate_included_whatif("x" * 20, max_chars=5).startswith("xxxxx... (truncated")
+
+    def test_open_stdin_tty_raises(self, mocker):
+        mock_stdin = mocker.patch("bicep_whatif_advisor.input.sys.stdin")
+        mock_stdin.isatty.return_value = True
+        with pytest.raises(InputError, match="No input detected"):
+            open_stdin()
+
+
+@pytest.mark.unit
+class TestLoadBicepFiles:
+    def test_loads_bicep_files(self, tmp_path):
+        bicep = tmp_path / "main.bicep"
+        bicep.write_text("param location string")
+        result = load_bicep_files(str(tmp_path))
+        assert "param location string" in result
+
+    def test_returns_none_for_nonexistent_dir(self):
+        result = load_bicep_files("/nonexistent/dir")
+        assert result is None
+
+    def test_returns_none_for_empty_dir(self, tmp_path):
+        result = load_bicep_files(str(tmp_path))
+        assert result is None
+
+    def test_limits_to_five_files(self, tmp_path):
+        for i in range(10):
+            (tmp_path / f"file{i}.bicep").write_text(f"resource r{i}")
+        result = load_bicep_files(str(tmp_path))
+        # Should contain at most 5 files
+        assert result.count("// File:") <= 5
+
+    def test_recursive_discovery(self, tmp_path):
+        subdir = tmp_path / "modules"
+        subdir.mkdir()
+        (subdir / "child.bicep").write_text("module content")
+        result = load_bicep_files(str(tmp_path))
+        assert "module content" in result
@@ -23,12 +23,12 @@ class TestStandardModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_standard_response),
         )
         result = _runner().invoke(main, ["--format", "json"], input=create_only_fixture)
         assert result.exit_code == 0
-        parsed = json.loads(result.output)
+        parsed = json.loads(result.stdout)
         assert "high_confidence" in parsed
 
     def test_mixed_changes_fixture(
@@ -36,7 +36,7 @@ class TestStandardModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_standard_response),
         )
         result = _runner().invoke(main, ["--format", "json"], input=mixed_changes_fixture)
@@ -47,7 +47,7 @@ class TestStandardModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_standard_response),
         )
         result = _runner().invoke(main, ["--format", "markdown"], input=create_only_fixture)
@@ -59,7 +59,7 @@ class TestStandardModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_standard_response),
         )
         result = _runner().invoke(main, ["--format", "table"], input=create_only_fixture)
@@ -73,7 +73,7 @@ class TestCIModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_ci_response_safe),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -89,7 +89,7 @@ class TestCIModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_ci_response_unsafe),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -105,7 +105,7 @@ class TestCIModePipeline:
     ):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(sample_ci_response_with_intent),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
@@ -134,11 +134,10 @@ class TestNoiseFilteringPipeline:
     def test_noise_filtering_with_recalculation(
         self, clean_env, monkeypatch, mocker, create_only_fixture
     ):
-        """CI mode with noise resources triggers recalculation."""
+        """CI mode with noise resources re-derives risk locally from concern attribution."""
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
 
-        # First call returns response with mixed confidence
-        first_response = {
+        response = {
             "resources": [
                 {
                     "resource_name": "real-storage",
@@ -163,7 +162,14 @@ class TestNoiseFilteringPipeline:
             ],
             "overall_summary": "Mixed changes",
             "risk_assessment": {
-                "drift": {"risk_level": "medium", "concerns": ["stale"], "reasoning": ""},
+                "drift": {
+                    "risk_level": "medium",
+                    "concerns": ["stale"],
+                    "reasoning": "",
+                    "resource_concerns": [
+                        {"resource_name": "noise-vnet", "risk_level": "medium", "concern": "stale"}
+                    ],
+                },
             },
             "verdict": {
                 "safe": False,
@@ -172,55 +178,45 @@ class TestNoiseFilteringPipeline:
                 "reasoning": "medium risk",
             },
         }
-
-        # Second call (recalculation) returns safe assessment
-        second_response = {
-            "resources": [
-                {
-                    "resource_name": "real-storage",
-                    "resource_type": "Storage/storageAccounts",
-                    "action": "Create",
-                    "summary": "Creates storage",
-                    "risk_level": "low",
-                    "risk_reason": None,
-                    "confidence_level": "high",
-                    "confidence_reason": "Real creation",
-                },
-            ],
-            "overall_summary": "1 create",
-            "risk_assessment": {
-                "drift": {"risk_level": "low", "concerns": [], "reasoning": "ok"},
-            },
-            "verdict": {
-                "safe": True,
-                "highest_risk_bucket": "none",
-                "overall_risk_level": "low",
-                "reasoning": "ok",
-            },
-        }
-
-        call_count = {"n": 0}
-        responses = [first_response, second_response]
-
-        class MultiResponseProvider(MockProvider):
-            def complete(self, system_prompt, user_prompt):
-                idx = min(call_count["n"], len(responses) - 1)
-                call_count["n"] += 1
-                return json.dumps(responses[idx])
-
-        mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
-            return_value=MultiResponseProvider(),
-        )
+        provider = MockProvider(response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
 
         result = _runner().invoke(
             main,
-            ["--ci", "--format", "json", "--drift-threshold", "high"],
+            ["--ci", "--format", "json"],
             input=create_only_fixture,
         )
         assert result.exit_code == 0
-        assert call_count["n"] == 2  # Two LLM calls: initial + recalculation
+        assert len(provider.calls) == 1  # No second LLM round-trip
+        drift = json.loads(result.stdout)["high_confidence"]["risk_assessment"]["drift"]
+        assert drift["risk_level"] == "low"
+        assert drift["concerns"] == []
+
+    def test_noise_filtering_without_attribution_keeps_original(
+        self, clean_env, monkeypatch, mocker, create_only_fixture, sample_ci_response_unsafe
+    ):
+        """Without resource_concerns the original bucket risk is kept."""
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        response = json.loads(json.dumps(sample_ci_response_unsafe))
+        response["resources"].append(
+            {
+                "resource_name": "noise-vnet",
+                "resource_type": "Network/virtualNetworks",
+                "action": "Modify",
+                "summary": "etag change",
+                "confidence_level": "low",
+                "confidence_reason": "Metadata only",
+            }
+        )
+        provider = MockProvider(response)
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
+
+        result = _runner().invoke(main, ["--ci", "--format", "json"], input=create_only_fixture)
+        assert result.exit_code == 1
+        assert len(provider.calls) == 1
+        assert "No per-resource concern attribution" in result.stderr
 
 
 @pytest.mark.integration
@@ -264,7 +260,7 @@ class TestDriftPreservedWhenNoiseFiltered:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -293,7 +289,7 @@ class TestDriftPreservedWhenNoiseFiltered:
         )
         assert result.exit_code == 0  # safe — all noise
 
-        from bicep_whatif_advisor.cli import extract_json
+        from bicep_whatif_advisor.analysis import extract_json
 
         parsed = extract_json(result.output)
         ra = parsed["high_confidence"]["risk_assessment"]
@@ -334,7 +330,7 @@ class TestDriftPreservedWhenNoiseFiltered:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff content")
@@ -363,7 +359,7 @@ class TestDriftPreservedWhenNoiseFiltered:
         )
         assert result.exit_code == 0  # safe
 
-        from bicep_whatif_advisor.cli import extract_json
+        from bicep_whatif_advisor.analysis import extract_json
 
         parsed = extract_json(result.output)
         ra = parsed["high_confidence"]["risk_assessment"]
@@ -419,7 +415,7 @@ class TestCustomAgentBackfill:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
@@ -440,7 +436,7 @@ class TestCustomAgentBackfill:
         assert result.exit_code == 0
 
         # Extract JSON from output (CliRunner may mix in extra text on some platforms)
-        from bicep_whatif_advisor.cli import extract_json
+        from bicep_whatif_advisor.analysis import extract_json
 
         output = extract_json(result.output)
         ra = output["high_confidence"]["risk_assessment"]
@@ -490,7 +486,7 @@ class TestCustomAgentBackfill:
         }
 
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=MockProvider(response),
         )
         mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
@@ -524,7 +520,7 @@ class TestPlatformAutoDetect:
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         provider = MockProvider(sample_ci_response_safe)
         mocker.patch(
-            "bicep_whatif_advisor.cli.get_provider",
+            "bicep_whatif_advisor.session.get_provider",
             return_value=provider,
         )
         mock_get_diff = mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="diff")
@@ -3,17 +3,22 @@
 import pytest
 
 from bicep_whatif_advisor.noise_filter import (
+    NoiseMatcher,
     ParsedPattern,
+    ResourcePatternIndex,
+    _BlockStream,
     _extract_arm_type,
     _is_property_change_line,
     _is_resource_header,
     _matches_pattern,
     _matches_resource_pattern,
+    _matches_resource_pattern_post_llm,
     _parse_pattern_line,
     _parse_resource_blocks,
     _ResourceBlock,
     calculate_similarity,
     extract_resource_patterns,
+    filter_whatif_lines,
     filter_whatif_text,
     load_builtin_patterns,
     load_user_patterns,
@@ -65,6 +70,11 @@ class TestParsePatternLine:
         p = _parse_pattern_line("resource: diagnosticSettings")
         assert p.raw == "resource: diagnosticSettings"
 
+    def test_path_pattern(self):
+        p = _parse_pattern_line("path: properties.subnets[*].etag")
+        assert p.pattern_type == "path"
+        assert p.value == "properties.subnets[*].etag"
+
 
 # ---------------------------------------------------------------------------
 # Property change line detection
@@ -182,6 +192,130 @@ class TestMatchesPattern:
         line = "      ~ properties.completely.different.thing"
         assert _matches_pattern(line, p, fuzzy_threshold=0.99) is False
 
+    def test_path_exact_match(self):
+        p = ParsedPattern(raw="path: properties.etag", pattern_type="path", value="properties.etag")
+        assert _matches_pattern("      ~ properties.ETag: old => new", p) is True
+        assert _matches_pattern("      ~ properties.etagPolicy: old => new", p) is False
+        assert _matches_pattern('      ~ properties.name: "etag"', p) is False
+
+    def test_path_wildcard_keeps_brackets_literal(self):
+        value = "properties.subnets[*].name"
+        p = ParsedPattern(raw=f"path: {value}", pattern_type="path", value=value)
+        assert _matches_pattern("      ~ properties.subnets[3].name: a => b", p) is True
+        assert _matches_pattern("      ~ properties.subnets3.name: a => b", p) is False
+
+
+# ---------------------------------------------------------------------------
+# Compiled matcher
+# ---------------------------------------------------------------------------
+
+
+def _kw(value):
+    return ParsedPattern(raw=value, pattern_type="keyword", value=value)
+
+
+def _rx(value):
+    return ParsedPattern(raw=f"regex: {value}", pattern_type="regex", value=value)
+
+
+@pytest.mark.unit
+class TestNoiseMatcher:
+    def test_keyword_match_case_insensitive(self):
+        matcher = NoiseMatcher([_kw("etag")])
+        assert matcher.matches("      ~ properties.ETAG: old => new") is True
+        assert matcher.matches("      ~ properties.name: old => new") is False
+
+    def test_reports_hit_keyword(self):
+        etag, guid = _kw("etag"), _kw("resourceGuid")
+        matcher = NoiseMatcher([etag, guid])
+        assert matcher.match("      ~ properties.resourceGuid: a => b") is guid
+
+    def test_keyword_prefix_of_another(self):
+        short, long = _kw("enableIPv6"), _kw("enableIPv6Addressing")
+        matcher = NoiseMatcher([long, short])
+        assert matcher.match("      ~ properties.enableIPv6Addressing: false => true") is short
+        assert matcher.matches("      ~ properties.enableIPv6: false => true") is True
+
+    def test_reports_hit_regex(self):
+        first, second = _rx(r"^\s+~ properties\.foo"), _rx(r"ipv6")
+        matcher = NoiseMatcher([first, second])
+        assert matcher.match("      ~ properties.enableIPv6: false => true") is second
+
+    def test_regex_with_groups_still_fused(self):
+        pattern = _rx(r"(dns|route)Servers")
+        matcher = NoiseMatcher([pattern])
+        assert matcher.match("      ~ properties.appliedDnsServers: [] => []") is pattern
+
+    def test_regex_with_backreference(self):
+        pattern = _rx(r'"(\w+)" => "\1"')
+        matcher = NoiseMatcher([_rx("unrelated"), pattern])
+        assert matcher.match('      ~ properties.sku: "Basic" => "Basic"') is pattern
+        assert matcher.matches('      ~ properties.sku: "Basic" => "Premium"') is False
+
+    def test_regex_with_global_flag_not_fused(self):
+        pattern = _rx(r"(?s)a.b")
+        matcher = NoiseMatcher([_rx("~ zzz$"), pattern])
+        assert matcher.match("      ~ a\nb") is pattern
+        assert matcher.matches("      ~ zzz") is True
+
+    def test_invalid_regex_ignored(self):
+        matcher = NoiseMatcher([_rx("[invalid"), _kw("etag")])
+        assert matcher.matches("      ~ properties.etag: a => b") is True
+        assert matcher.matches("      ~ properties.name: a => b") is False
+
+    def test_fuzzy_pattern(self):
+        pattern = ParsedPattern(
+            raw="fuzzy: provisioningState", pattern_type="fuzzy", value="provisioningState"
+        )
+        line = "      ~ properties.provisioningState: Succeeded => Updating"
+        assert NoiseMatcher([pattern], fuzzy_threshold=0.3).match(line) is pattern
+        assert NoiseMatcher([pattern], fuzzy_threshold=0.99).matches(line) is False
+
+    def test_resource_patterns_ignored(self):
+        resource = ParsedPattern(
+            raw="resource: Microsoft.Network", pattern_type="resource", value="Microsoft.Network"
+        )
+        matcher = NoiseMatcher([resource])
+        assert matcher.patterns == []
+        assert matcher.matches("  ~ Microsoft.Network/virtualNetworks/vnet") is False
+
+    def test_memoizes_repeated_lines(self, mocker):
+        matcher = NoiseMatcher([_kw("etag")])
+        spy = mocker.spy(matcher, "_match_uncached")
+        line = '      ~ properties.etag: "a" => "b"\n'
+        for _ in range(5):
+            assert matcher.matches(line) is True
+        assert spy.call_count == 1
+
+    def test_equivalent_to_per_pattern_matching(self, noisy_changes_fixture):
+        patterns = load_builtin_patterns() + [
+            _rx(r"RetentionInDays"),
+            _rx(r"(?i)DNSSERVERS"),
+            ParsedPattern(raw="fuzzy: x", pattern_type="fuzzy", value="properties.name: a"),
+        ]
+        matcher = NoiseMatcher(patterns, fuzzy_threshold=0.8)
+        for line in noisy_changes_fixture.splitlines(keepends=True):
+            expected = any(_matches_pattern(line, p, 0.8) for p in patterns)
+            assert matcher.matches(line) is expected, line
+
+    def test_filter_whatif_text_accepts_prebuilt_matcher(self):
+        text = (
+            "  ~ Microsoft.Network/test [2022-07-01]\n"
+            "      ~ properties.etag: old => new\n"
+            "      ~ properties.name: real\n"
+        )
+        matcher = NoiseMatcher([_kw("etag")])
+        result, count, _, _ = filter_whatif_text(text, [], matcher=matcher)
+        assert count == 1
+        assert "etag" not in result
+
+    def test_path_pattern_uses_supplied_path(self):
+        pattern = ParsedPattern(raw="path: a.b[0].c", pattern_type="path", value="a.b[0].c")
+        matcher = NoiseMatcher([pattern])
+        # Relative path on the line, exact path supplied by structured input
+        assert matcher.match("          ~ c: 1 => 2", path="a.b[0].c") is pattern
+        assert matcher.match("          ~ c: 1 => 2") is None
+
 
 # ---------------------------------------------------------------------------
 # ARM type extraction
@@ -509,6 +643,109 @@ class TestFilterWhatifText:
         assert "name: real" in result
 
 
+# ---------------------------------------------------------------------------
+# Streaming filter
+# ---------------------------------------------------------------------------
+
+
+_THREE_BLOCKS = (
+    "Resource and property changes are indicated with these symbols:\n"
+    "  ~ Modify\n"
+    "\n"
+    "  ~ Microsoft.Network/virtualNetworks/vnet1 [2022-07-01]\n"
+    "      ~ properties.etag: old => new\n"
+    "      ~ properties.addressSpace: a => b\n"
+    "\n"
+    "  + Microsoft.Storage/storageAccounts/store1 [2023-01-01]\n"
+    "      name: store1\n"
+    "\n"
+    "  - Microsoft.Sql/servers/sql1 [2023-01-01]\n"
+    "      name: sql1\n"
+    "\n"
+    "Resource changes: 1 to create, 1 to modify, 1 to delete.\n"
+)
+
+
+@pytest.mark.unit
+class TestBlockStream:
+    def test_yields_blocks_before_input_is_exhausted(self):
+        def lines():
+            yield "preamble\n"
+            yield "  ~ Microsoft.Network/virtualNetworks/vnet1\n"
+            yield "      ~ properties.a: 1 => 2\n"
+            yield "  + Microsoft.Storage/storageAccounts/store1\n"
+            raise AssertionError("read past the second header")
+
+        stream = _BlockStream(lines())
+        first = next(iter(stream))
+        assert first.resource_type == "Microsoft.Network/virtualNetworks/vnet1"
+        assert first.property_change_indices == [1]
+        assert stream.preamble == ["preamble\n"]
+
+    def test_epilogue_split_at_end(self):
+        stream = _BlockStream(_THREE_BLOCKS.splitlines(keepends=True))
+        blocks = list(stream)
+        assert len(blocks) == 3
+        assert stream.epilogue == ["Resource changes: 1 to create, 1 to modify, 1 to delete.\n"]
+
+
+@pytest.mark.unit
+class TestFilterWhatifLines:
+    def test_matches_filter_whatif_text(self, noisy_changes_fixture):
+        patterns = load_builtin_patterns()
+        text, lines, blocks, removed = filter_whatif_text(noisy_changes_fixture, patterns)
+        result = filter_whatif_lines(iter(noisy_changes_fixture.splitlines(True)), patterns)
+        assert (result.text, result.lines_removed, result.blocks_removed) == (text, lines, blocks)
+        assert result.removed_resources == removed
+        assert result.truncated is False
+
+    def test_no_patterns_passes_through(self):
+        result = filter_whatif_lines(_THREE_BLOCKS.splitlines(True), [])
+        assert result.text == _THREE_BLOCKS
+
+    def test_max_chars_drops_whole_blocks(self):
+        limit = _THREE_BLOCKS.index("  - Microsoft.Sql")
+        result = filter_whatif_lines(_THREE_BLOCKS.splitlines(True), [], max_chars=limit)
+        assert result.truncated is True
+        assert result.blocks_truncated == 1
+        assert result.text == _THREE_BLOCKS[:limit]
+        # Epilogue count would no longer match the blocks shown
+        assert "Resource changes" not in result.text
+
+    def test_max_chars_counts_filtered_size(self):
+        patterns = [ParsedPattern(raw="etag", pattern_type="keyword", value="etag")]
+        filtered = filter_whatif_lines(_THREE_BLOCKS.splitlines(True), patterns)
+        result = filter_whatif_lines(
+            _THREE_BLOCKS.splitlines(True), patterns, max_chars=len(filtered.text)
+        )
+        assert result.truncated is False
+        assert result.text == filtered.text
+
+    def test_removal_counts_cover_input_past_truncation(self):
+        patterns = [ParsedPattern(raw="resource: sql", pattern_type="resource", value="sql")]
+        result = filter_whatif_lines(_THREE_BLOCKS.splitlines(True), patterns, max_chars=150)
+        assert result.truncated is True
+        assert result.blocks_removed == 1
+        assert result.removed_resources[0]["resource_name"] == "sql1"
+
+    def test_max_tokens_drops_whole_blocks(self):
+        # Counting characters as tokens makes the cap match the max_chars case
+        limit = _THREE_BLOCKS.index("  - Microsoft.Sql")
+        result = filter_whatif_lines(
+            _THREE_BLOCKS.splitlines(True), [], max_tokens=limit, count_tokens=len
+        )
+        assert result.truncated is True
+        assert result.blocks_truncated == 1
+        assert result.text == _THREE_BLOCKS[:limit]
+        assert result.tokens == limit
+
+    def test_no_blocks_truncates_at_line_boundary(self):
+        text = "line one\nline two\nline three\n"
+        result = filter_whatif_lines(text.splitlines(True), [], max_chars=20)
+        assert result.text == "line one\nline two\n"
+        assert result.truncated is True
+
+
 # ---------------------------------------------------------------------------
 # Block-level suppression
 # ---------------------------------------------------------------------------
@@ -973,6 +1210,125 @@ class TestExtractResourcePatterns:
         assert len(property_pats) == 2
 
 
+@pytest.mark.unit
+class TestNeedsAnalysis:
+    _NOCHANGE = (
+        "  * Microsoft.Web/serverfarms/plan1 [2022-03-01]\n"
+        "  = Microsoft.Web/sites/app1 [2022-03-01]\n"
+    )
+    _MODIFY = "  ~ Microsoft.Network/nsg/nsg1 [2022-07-01]\n      ~ properties.etag: a => b\n"
+
+    def test_only_non_actionable_blocks(self):
+        result = filter_whatif_lines(self._NOCHANGE.splitlines(True), [])
+        assert [r["operation"] for r in result.kept_resources] == ["NoChange", "Deploy"]
+        assert result.needs_analysis is False
+
+    def test_all_blocks_removed(self):
+        result = filter_whatif_lines(self._MODIFY.splitlines(True), [_kw("etag")])
+        assert result.blocks_removed == 1
+        assert result.needs_analysis is False
+
+    def test_actionable_block_survives(self):
+        text = self._NOCHANGE + self._MODIFY
+        result = filter_whatif_lines(text.splitlines(True), [])
+        assert result.needs_analysis is True
+
+    def test_no_resource_blocks_needs_analysis(self):
+        result = filter_whatif_lines(["Resource changes: 1 to create.\n"], [])
+        assert result.needs_analysis is True
+
+
+# ---------------------------------------------------------------------------
+# Compiled resource pattern index
+# ---------------------------------------------------------------------------
+
+
+def _res(value):
+    return ParsedPattern(raw=f"resource: {value}", pattern_type="resource", value=value)
+
+
+_INDEX_PATTERNS = [
+    _res("diagnosticSettings"),
+    _res("privateDnsZones/virtualNetworkLinks:Modify"),
+    _res("Microsoft.Storage/storageAccounts/blobServices"),
+    _res("Microsoft.Web/sites:delete"),
+    _res("weird:type:NotAnOp"),
+    _res("  :Create"),
+]
+
+_INDEX_TYPES = [
+    "Microsoft.Insights/diagnosticSettings/diag1",
+    "Microsoft.Network/privateDnsZones/zone.net/virtualNetworkLinks/link1",
+    "Microsoft.Storage/storageAccounts/acct/blobServices/default",
+    "Microsoft.Storage/storageAccounts/acct",
+    "Microsoft.Web/sites/app1",
+    "weird:type:NotAnOp/x",
+    "blobServices",
+    "storageAccounts",
+    "sites",
+    "",
+]
+
+_INDEX_OPS = ["Modify", "Create", "Delete", "NoChange", "modify", "DELETE", ""]
+
+
+@pytest.mark.unit
+class TestResourcePatternIndex:
+    def test_block_matches_equivalent_to_per_pattern(self):
+        index = ResourcePatternIndex(_INDEX_PATTERNS)
+        for resource_type in _INDEX_TYPES:
+            for op in ["Modify", "Create", "Delete", "NoChange", "Ignore"]:
+                block = _ResourceBlock(
+                    header_line="", operation=op, resource_type=resource_type, lines=[]
+                )
+                expected = any(_matches_resource_pattern(block, p) for p in _INDEX_PATTERNS)
+                assert index.matches_block(block) is expected, (resource_type, op)
+
+    def test_llm_matches_equivalent_to_per_pattern(self):
+        index = ResourcePatternIndex(_INDEX_PATTERNS)
+        for resource_type in _INDEX_TYPES + [_extract_arm_type(t) for t in _INDEX_TYPES]:
+            for action in _INDEX_OPS:
+                expected = any(
+                    _matches_resource_pattern_post_llm(resource_type, action, p)
+                    for p in _INDEX_PATTERNS
+                )
+                assert index.matches(resource_type, action) is expected, (resource_type, action)
+
+    def test_suffix_reverse_match_only(self):
+        index = ResourcePatternIndex([_res("Microsoft.Storage/storageAccounts/blobServices")])
+        assert index.matches("storageAccounts/blobServices", "Modify") is True
+        # Parent type is a substring but not a suffix of the child pattern
+        assert index.matches("storageAccounts", "Modify") is False
+
+    def test_ignores_property_patterns_and_empty(self):
+        index = ResourcePatternIndex([_kw("etag")])
+        assert not index
+        assert index.matches("Microsoft.Network/etag", "Modify") is False
+
+    def test_reclassify_accepts_index(self):
+        index = ResourcePatternIndex([_res("diagnosticSettings")])
+        resources = [
+            {"resource_type": "Microsoft.Insights/diagnosticSettings", "action": "Create"},
+            {"resource_type": "Microsoft.Web/sites", "action": "Create"},
+        ]
+        assert reclassify_resource_noise(resources, index) == 1
+        assert resources[0]["confidence_level"] == "low"
+        assert "confidence_level" not in resources[1]
+
+    def test_filter_uses_supplied_index(self):
+        text = (
+            "  + Microsoft.Insights/diagnosticSettings/diag1 [2021-05-01]\n"
+            "      name: diag1\n"
+            "  + Microsoft.Web/sites/app1 [2022-03-01]\n"
+            "      name: app1\n"
+        )
+        index = ResourcePatternIndex([_res("diagnosticSettings")])
+        result = filter_whatif_lines(text.splitlines(True), [], resource_index=index)
+        assert result.blocks_removed == 1
+        assert "diag1" not in result.text
+        assert "app1" in result.text
+
+
 # ---------------------------------------------------------------------------
 # Post-LLM resource reclassification
 # ---------------------------------------------------------------------------
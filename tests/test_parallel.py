@@ -0,0 +1,210 @@
+"""Tests for bicep_whatif_advisor.ci.parallel module."""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from bicep_whatif_advisor.ci.parallel import (
+    merge_parallel_responses,
+    run_parallel_analysis,
+    run_parallel_analysis_async,
+)
+from bicep_whatif_advisor.prompt import build_bucket_system_prompt, build_resources_system_prompt
+from bicep_whatif_advisor.providers import Provider, ProviderError, ProviderRateLimitError
+
+
+def _bucket_response(bucket_id, level="low"):
+    return {
+        "risk_assessment": {
+            bucket_id: {
+                "risk_level": level,
+                "concerns": [] if level == "low" else [f"{bucket_id} concern"],
+                "concern_summary": "None" if level == "low" else f"{bucket_id} concern",
+                "reasoning": f"{bucket_id} reasoning",
+                "resource_concerns": [],
+            }
+        }
+    }
+
+
+class RoutingProvider(Provider):
+    """Answers each request according to which bucket its system prompt evaluates."""
+
+    def __init__(self, levels=None, delay=0.0):
+        self.levels = levels or {}
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def complete(self, system_prompt, user_prompt, response_schema=None):
+        with self._lock:
+            self.calls.append((system_prompt, user_prompt))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            marker = '"risk_assessment": {\n    "'
+            if marker in system_prompt:
+                bucket_id = system_prompt.split(marker, 1)[1].split('"', 1)[0]
+                return json.dumps(_bucket_response(bucket_id, self.levels.get(bucket_id, "low")))
+            return json.dumps(
+                {
+                    "resources": [{"resource_name": "vnet", "action": "Modify"}],
+                    "overall_summary": "1 to modify.",
+                }
+            )
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+@pytest.mark.unit
+class TestBucketPrompts:
+    def test_bucket_prompt_contains_only_that_bucket(self):
+        prompt = build_bucket_system_prompt("drift")
+        assert "Infrastructure Drift" in prompt
+        assert "Pull Request Intent Alignment" not in prompt
+        assert '"drift": {' in prompt
+        assert '"verdict"' not in prompt
+        assert '"resources": [' not in prompt
+
+    def test_bucket_prompt_keeps_concern_attribution(self):
+        prompt = build_bucket_system_prompt("drift")
+        assert "resource_concerns" in prompt
+        assert "resources[]" not in prompt
+
+    def test_intent_prompt_mentions_pr_context(self):
+        prompt = build_bucket_system_prompt("intent", pr_title="Add storage")
+        assert "pull request title and description" in prompt
+
+    def test_resources_prompt_has_no_buckets(self):
+        prompt = build_resources_system_prompt()
+        assert '"resources": [' in prompt
+        assert '"risk_assessment"' not in prompt
+        assert "Confidence Assessment" in prompt
+
+
+@pytest.mark.unit
+class TestRunParallelAnalysis:
+    def test_one_request_per_bucket_plus_resources(self):
+        provider = RoutingProvider()
+        resources_text, bucket_texts = run_parallel_analysis(
+            provider, "user prompt", ["drift", "intent"], pr_title="t"
+        )
+        assert len(provider.calls) == 3
+        assert all(user == "user prompt" for _, user in provider.calls)
+        assert "resources" in json.loads(resources_text)
+        assert set(bucket_texts) == {"drift", "intent"}
+        assert "drift" in json.loads(bucket_texts["drift"])["risk_assessment"]
+
+    def test_requests_run_concurrently(self):
+        provider = RoutingProvider(delay=0.1)
+        run_parallel_analysis(provider, "u", ["drift", "intent"], max_concurrency=3)
+        assert provider.max_in_flight == 3
+
+    def test_concurrency_is_bounded(self):
+        provider = RoutingProvider(delay=0.02)
+        run_parallel_analysis(provider, "u", ["drift", "intent"], max_concurrency=1)
+        assert provider.max_in_flight == 1
+        assert len(provider.calls) == 3
+
+    def test_requests_carry_their_response_schema(self):
+        schemas = []
+
+        class SchemaProvider(RoutingProvider):
+            def complete(self, system_prompt, user_prompt, response_schema=None):
+                schemas.append(response_schema)
+                return super().complete(system_prompt, user_prompt)
+
+        run_parallel_analysis(SchemaProvider(), "u", ["drift"], max_concurrency=1)
+        resources, bucket = schemas
+        assert "resources" in resources["properties"]
+        assert list(bucket["properties"]["risk_assessment"]["properties"]) == ["drift"]
+
+        schemas.clear()
+        run_parallel_analysis(SchemaProvider(), "u", ["drift"], structured_output=False)
+        assert schemas == [None, None]
+
+    def test_provider_failure_propagates(self):
+        class FailingProvider(RoutingProvider):
+            def complete(self, system_prompt, user_prompt, response_schema=None):
+                if '"drift": {' in system_prompt:
+                    raise ProviderRateLimitError("rate limited")
+                return super().complete(system_prompt, user_prompt)
+
+        with pytest.raises(ProviderRateLimitError):
+            run_parallel_analysis(FailingProvider(), "u", ["drift", "intent"])
+
+
+@pytest.mark.unit
+class TestRunParallelAnalysisAsync:
+    def test_requests_overlap_on_one_loop(self):
+        class AsyncRoutingProvider(RoutingProvider):
+            async def acomplete(self, system_prompt, user_prompt, response_schema=None):
+                with self._lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(0.05)
+                with self._lock:
+                    self.in_flight -= 1
+                return self.complete(system_prompt, user_prompt)
+
+        provider = AsyncRoutingProvider()
+        resources_text, bucket_texts = asyncio.run(
+            run_parallel_analysis_async(provider, "u", ["drift", "intent"], max_concurrency=2)
+        )
+        assert provider.max_in_flight == 2
+        assert "resources" in json.loads(resources_text)
+        assert set(bucket_texts) == {"drift", "intent"}
+
+    def test_default_acomplete_runs_sync_provider(self):
+        provider = RoutingProvider()
+        _, bucket_texts = asyncio.run(run_parallel_analysis_async(provider, "u", ["drift"]))
+        assert len(provider.calls) == 2
+        assert "drift" in json.loads(bucket_texts["drift"])["risk_assessment"]
+
+    def test_failure_propagates(self):
+        class FailingProvider(RoutingProvider):
+            async def acomplete(self, system_prompt, user_prompt, response_schema=None):
+                raise ProviderError("boom")
+
+        with pytest.raises(ProviderError, match="boom"):
+            asyncio.run(run_parallel_analysis_async(FailingProvider(), "u", ["drift"]))
+
+
+@pytest.mark.unit
+class TestMergeParallelResponses:
+    def test_merges_buckets_into_risk_assessment(self):
+        data = merge_parallel_responses(
+            {"resources": [], "overall_summary": "s"},
+            {"drift": _bucket_response("drift", "high"), "intent": _bucket_response("intent")},
+        )
+        assert data["overall_summary"] == "s"
+        assert data["risk_assessment"]["drift"]["risk_level"] == "high"
+        assert data["risk_assessment"]["intent"]["risk_level"] == "low"
+        assert "Infrastructure Drift (high risk)" in data["verdict"]["reasoning"]
+
+    def test_accepts_bare_bucket_object(self):
+        bare = _bucket_response("drift", "medium")["risk_assessment"]["drift"]
+        data = merge_parallel_responses({"resources": []}, {"drift": bare})
+        assert data["risk_assessment"]["drift"]["risk_level"] == "medium"
+
+    def test_missing_assessment_is_omitted(self):
+        data = merge_parallel_responses({"resources": []}, {"drift": {"unexpected": 1}})
+        assert data["risk_assessment"] == {}
+
+    def test_resources_response_buckets_are_ignored(self):
+        data = merge_parallel_responses(
+            {"resources": [], "risk_assessment": {"drift": {"risk_level": "high"}}},
+            {"drift": _bucket_response("drift")},
+        )
+        assert data["risk_assessment"]["drift"]["risk_level"] == "low"
+
+    def test_all_low_reasoning(self):
+        data = merge_parallel_responses({"resources": []}, {"drift": _bucket_response("drift")})
+        assert "none reported concerns" in data["verdict"]["reasoning"]
@@ -0,0 +1,81 @@
+"""Tests for bicep_whatif_advisor.pipeline module."""
+
+import asyncio
+
+import pytest
+from conftest import MockProvider
+
+from bicep_whatif_advisor.pipeline import analyze, load_ci_context
+from bicep_whatif_advisor.providers import ProviderError
+
+
+@pytest.mark.unit
+class TestLoadCiContext:
+    def test_loads_diff_and_bicep(self, tmp_path):
+        diff_file = tmp_path / "changes.diff"
+        diff_file.write_text("+ resource sa")
+        (tmp_path / "main.bicep").write_text("param location string")
+
+        diff_content, bicep_content = asyncio.run(
+            load_ci_context(diff_path=str(diff_file), bicep_dir=str(tmp_path))
+        )
+        assert diff_content == "+ resource sa"
+        assert "param location string" in bicep_content
+
+    def test_bicep_optional(self, tmp_path):
+        diff_file = tmp_path / "changes.diff"
+        diff_file.write_text("diff")
+        assert asyncio.run(load_ci_context(diff_path=str(diff_file))) == ("diff", None)
+
+
+@pytest.mark.unit
+class TestAnalyze:
+    def test_standard_mode(self, sample_standard_response):
+        provider = MockProvider(sample_standard_response)
+        data = asyncio.run(analyze("+ Microsoft.Storage/test", provider))
+        assert data == sample_standard_response
+        assert "<whatif_output>" in provider.calls[0][1]
+
+    def test_ci_mode_single_request(self, sample_ci_response_safe):
+        provider = MockProvider(sample_ci_response_safe)
+        data = asyncio.run(
+            analyze("+ Microsoft.Storage/test", provider, ci=True, diff_content="diff")
+        )
+        assert len(provider.calls) == 1
+        assert data["risk_assessment"]["drift"]["risk_level"] == "low"
+        assert "<code_diff>\ndiff\n</code_diff>" in provider.calls[0][1]
+
+    def test_ci_mode_parallel_merges_buckets(self, sample_ci_response_unsafe):
+        provider = MockProvider(sample_ci_response_unsafe)
+        data = asyncio.run(
+            analyze(
+                "- Microsoft.Sql/servers/databases/prod-db",
+                provider,
+                ci=True,
+                diff_content="diff",
+                enabled_buckets=["drift"],
+                parallel=True,
+            )
+        )
+        # Resources request + one drift request
+        assert len(provider.calls) == 2
+        assert data["risk_assessment"]["drift"]["risk_level"] == "high"
+        assert data["resources"][0]["resource_name"] == "prod-db"
+
+    def test_ci_mode_loads_diff(self, mocker, sample_ci_response_safe):
+        mocker.patch("bicep_whatif_advisor.ci.diff.get_diff", return_value="loaded diff")
+        provider = MockProvider(sample_ci_response_safe)
+        asyncio.run(analyze("+ Microsoft.Storage/test", provider, ci=True))
+        assert "loaded diff" in provider.calls[0][1]
+
+    def test_invalid_json_raises_value_error(self):
+        with pytest.raises(ValueError):
+            asyncio.run(analyze("+ Microsoft.Storage/test", MockProvider("not json")))
+
+    def test_provider_error_propagates(self):
+        class FailingProvider(MockProvider):
+            def complete(self, system_prompt, user_prompt, response_schema=None):
+                raise ProviderError("unavailable")
+
+        with pytest.raises(ProviderError, match="unavailable"):
+            asyncio.run(analyze("+ Microsoft.Storage/test", FailingProvider()))
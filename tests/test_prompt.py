@@ -2,7 +2,14 @@
 
 import pytest
 
-from bicep_whatif_advisor.prompt import build_system_prompt, build_user_prompt
+from bicep_whatif_advisor.prompt import (
+    build_bucket_response_schema,
+    build_resources_response_schema,
+    build_response_schema,
+    build_system_prompt,
+    build_user_prompt,
+    split_cacheable_prefix,
+)
 
 
 @pytest.mark.unit
@@ -72,6 +79,14 @@ class TestBuildSystemPrompt:
         assert "risk_level" in result
         assert "risk_reason" in result
 
+    def test_ci_mode_schema_has_resource_concerns(self):
+        prompt = build_system_prompt(ci_mode=True)
+        assert '"resource_concerns"' in prompt
+        assert "## Concern Attribution" in prompt
+
+    def test_standard_mode_no_resource_concerns(self):
+        assert "resource_concerns" not in build_system_prompt(ci_mode=False)
+
     def test_confidence_section_always_present(self):
         for mode in [False, True]:
             result = build_system_prompt(ci_mode=mode)
@@ -180,6 +195,86 @@ class TestBuildSystemPrompt:
             del RISK_BUCKETS["cost"]
 
 
+def _objects(schema):
+    """Yield every object schema nested in ``schema``."""
+    if isinstance(schema, dict):
+        if schema.get("type") == "object":
+            yield schema
+        for value in schema.values():
+            yield from _objects(value)
+
+
+@pytest.mark.unit
+class TestBuildResponseSchema:
+    def test_standard_mode_shape(self):
+        schema = build_response_schema()
+        assert schema["required"] == ["resources", "overall_summary"]
+        resource = schema["properties"]["resources"]["items"]
+        assert "risk_level" not in resource["properties"]
+        assert "changes" not in resource["properties"]
+        assert "Modify" in resource["properties"]["action"]["enum"]
+
+    def test_action_enum_covers_every_whatif_operation(self):
+        from bicep_whatif_advisor.noise_filter import _VALID_OPERATIONS
+
+        for ci_mode in (False, True):
+            enabled = ["drift"] if ci_mode else None
+            schema = build_response_schema(ci_mode=ci_mode, enabled_buckets=enabled)
+            action = schema["properties"]["resources"]["items"]["properties"]["action"]
+            assert set(action["enum"]) == _VALID_OPERATIONS
+            assert "Unsupported" in build_system_prompt(ci_mode=ci_mode, enabled_buckets=enabled)
+
+    def test_verbose_adds_changes(self):
+        resource = build_response_schema(verbose=True)["properties"]["resources"]["items"]
+        assert resource["properties"]["changes"]["type"] == "array"
+
+    def test_every_object_is_strict(self):
+        schema = build_response_schema(ci_mode=True, enabled_buckets=["drift", "intent"])
+        for obj in _objects(schema):
+            assert obj["additionalProperties"] is False
+            assert set(obj["required"]) == set(obj["properties"])
+
+    def test_ci_mode_buckets_and_verdict(self):
+        schema = build_response_schema(ci_mode=True, pr_title="Add storage")
+        assert set(schema["properties"]["risk_assessment"]["properties"]) == {
+            "drift",
+            "intent",
+        }
+        verdict = schema["properties"]["verdict"]["properties"]
+        assert verdict["highest_risk_bucket"]["enum"] == ["drift", "intent", "none"]
+        assert verdict["verdict_status"]["enum"] == ["safe", "review", "unsafe"]
+        resource = schema["properties"]["resources"]["items"]["properties"]
+        assert resource["risk_reason"]["type"] == ["string", "null"]
+
+    def test_custom_agent_findings_columns(self):
+        from bicep_whatif_advisor.ci.buckets import RISK_BUCKETS, RiskBucket
+
+        RISK_BUCKETS["naming"] = RiskBucket(
+            id="naming",
+            display_name="Naming Convention",
+            description="Custom agent",
+            prompt_instructions="Check naming.",
+            custom=True,
+            display="table",
+        )
+        try:
+            schema = build_response_schema(ci_mode=True, enabled_buckets=["drift", "naming"])
+            buckets = schema["properties"]["risk_assessment"]["properties"]
+            findings = buckets["naming"]["properties"]["findings"]["items"]
+            assert findings["required"] == ["resource", "issue", "recommendation"]
+            assert "findings" not in buckets["drift"]["properties"]
+        finally:
+            del RISK_BUCKETS["naming"]
+
+    def test_parallel_request_schemas(self):
+        resources = build_resources_response_schema()
+        assert "risk_assessment" not in resources["properties"]
+        assert "risk_level" in resources["properties"]["resources"]["items"]["properties"]
+
+        bucket = build_bucket_response_schema("drift")
+        assert list(bucket["properties"]["risk_assessment"]["properties"]) == ["drift"]
+
+
 @pytest.mark.unit
 class TestBuildUserPrompt:
     def test_standard_mode_wraps_whatif(self):
@@ -231,3 +326,37 @@ class TestBuildUserPrompt:
     def test_standard_mode_no_pr_metadata(self):
         result = build_user_prompt(whatif_content="changes")
         assert "<pull_request_intent>" not in result
+
+    def test_static_content_forms_prefix(self):
+        """Bicep source leads; per-run What-If, diff and PR metadata follow."""
+        result = build_user_prompt(
+            whatif_content="changes",
+            diff_content="diff",
+            bicep_content="param location string",
+            pr_title="Add storage",
+        )
+        assert (
+            result.index("<bicep_source>")
+            < result.index("<whatif_output>")
+            < result.index("<code_diff>")
+            < result.index("<pull_request_intent>")
+        )
+
+
+@pytest.mark.unit
+class TestSplitCacheablePrefix:
+    def test_prefix_identical_across_runs(self):
+        first = build_user_prompt("changes A", diff_content="diff A", bicep_content="param x int")
+        second = build_user_prompt(
+            "changes B", diff_content="diff B", bicep_content="param x int", pr_title="PR"
+        )
+        prefix, remainder = split_cacheable_prefix(first)
+
+        assert prefix.endswith("</bicep_source>")
+        assert prefix + remainder == first
+        assert split_cacheable_prefix(second)[0] == prefix
+        assert "changes A" in remainder
+
+    def test_no_bicep_source_has_no_prefix(self):
+        result = build_user_prompt("changes", diff_content="diff")
+        assert split_cacheable_prefix(result) == ("", result)
@@ -1,8 +1,24 @@
 """Tests for bicep_whatif_advisor.providers module."""
 
+import asyncio
+import json
+import threading
+
 import pytest
 
-from bicep_whatif_advisor.providers import Provider, get_provider
+from bicep_whatif_advisor.providers import (
+    Provider,
+    ProviderConfigError,
+    ProviderConnectionError,
+    ProviderError,
+    ProviderRateLimitError,
+    ProviderTimeoutError,
+    TokenUsage,
+    clear_client_cache,
+    get_cached_client,
+    get_pool_size,
+    get_provider,
+)
 
 
 @pytest.mark.unit
@@ -25,9 +41,9 @@ class TestProviderRegistry:
 
 @pytest.mark.unit
 class TestAnthropicProvider:
-    def test_missing_api_key_exits(self, monkeypatch):
+    def test_missing_api_key_raises(self, monkeypatch):
         monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-        with pytest.raises(SystemExit):
+        with pytest.raises(ProviderConfigError, match="ANTHROPIC_API_KEY"):
             get_provider("anthropic")
 
     def test_default_model(self, monkeypatch):
@@ -67,7 +83,7 @@ class TestAnthropicProvider:
         result = provider.complete("system", "user")
         assert result == '{"resources": []}'
 
-    def test_complete_rate_limit_exits(self, monkeypatch, mocker):
+    def test_complete_rate_limit_raises(self, monkeypatch, mocker):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
         monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
         monkeypatch.delenv("WHATIF_MODEL", raising=False)
@@ -86,9 +102,12 @@ class TestAnthropicProvider:
         )
         mock_client.messages.create.side_effect = err
         mocker.patch("anthropic.Anthropic", return_value=mock_client)
+        mocker.patch("time.sleep")
 
-        with pytest.raises(SystemExit):
+        with pytest.raises(ProviderRateLimitError):
             provider.complete("system", "user")
+        # Rate limits are retried with backoff before giving up
+        assert mock_client.messages.create.call_count == 4
 
     def test_complete_api_error_retries(self, monkeypatch, mocker):
         monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
@@ -108,21 +127,21 @@ class TestAnthropicProvider:
         mocker.patch("anthropic.Anthropic", return_value=mock_client)
         mocker.patch("time.sleep")
 
-        with pytest.raises(SystemExit):
+        with pytest.raises(ProviderConnectionError):
             provider.complete("system", "user")
-        # Should have retried once (2 total calls)
-        assert mock_client.messages.create.call_count == 2
+        # Default policy: 3 retries (4 total calls)
+        assert mock_client.messages.create.call_count == 4
 
 
 @pytest.mark.unit
 class TestAzureOpenAIProvider:
-    def test_missing_env_vars_exits(self, monkeypatch):
+    def test_missing_env_vars_raises(self, monkeypatch):
         monkeypatch.delenv("AZURE_OPENAI_ENDPOINT", raising=False)
         monkeypatch.delenv("AZURE_OPENAI_API_KEY", raising=False)
         monkeypatch.delenv("AZURE_OPENAI_DEPLOYMENT", raising=False)
         monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
         monkeypatch.delenv("WHATIF_MODEL", raising=False)
-        with pytest.raises(SystemExit):
+        with pytest.raises(ProviderConfigError, match="AZURE_OPENAI_ENDPOINT"):
             get_provider("azure-openai")
 
     def test_complete_success(self, monkeypatch, mocker):
@@ -171,34 +190,518 @@ class TestOllamaProvider:
         provider = get_provider("ollama")
 
         mock_response = mocker.Mock()
-        mock_response.json.return_value = {"response": '{"resources": []}'}
+        mock_response.json.return_value = {
+            "message": {"role": "assistant", "content": '{"resources": []}'}
+        }
         mock_response.raise_for_status = mocker.Mock()
-        mocker.patch("requests.post", return_value=mock_response)
+        post = mocker.patch("requests.Session.post", return_value=mock_response)
 
         result = provider.complete("system", "user")
         assert result == '{"resources": []}'
+        assert post.call_args.args[0] == "http://localhost:11434/api/chat"
 
-    def test_connection_error_retries_and_exits(self, monkeypatch, mocker):
+    def test_connection_error_retries_and_raises(self, monkeypatch, mocker):
         monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
         monkeypatch.delenv("WHATIF_MODEL", raising=False)
         provider = get_provider("ollama")
 
         import requests
 
-        mocker.patch("requests.post", side_effect=requests.exceptions.ConnectionError("fail"))
+        mocker.patch(
+            "requests.Session.post", side_effect=requests.exceptions.ConnectionError("fail")
+        )
         mocker.patch("time.sleep")
 
-        with pytest.raises(SystemExit):
+        with pytest.raises(ProviderConnectionError, match="Cannot reach Ollama"):
             provider.complete("system", "user")
 
-    def test_timeout_exits(self, monkeypatch, mocker):
+    def test_timeout_raises(self, monkeypatch, mocker):
         monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
         monkeypatch.delenv("WHATIF_MODEL", raising=False)
         provider = get_provider("ollama")
 
         import requests
 
-        mocker.patch("requests.post", side_effect=requests.exceptions.Timeout("timeout"))
+        mocker.patch("requests.Session.post", side_effect=requests.exceptions.Timeout("timeout"))
 
-        with pytest.raises(SystemExit):
+        with pytest.raises(ProviderTimeoutError):
             provider.complete("system", "user")
+
+    def test_chat_payload(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+        monkeypatch.delenv("WHATIF_OLLAMA_KEEP_ALIVE", raising=False)
+        payload = get_provider("ollama")._payload("system", "user")
+
+        assert payload["messages"] == [
+            {"role": "system", "content": "system"},
+            {"role": "user", "content": "user"},
+        ]
+        assert payload["format"] == "json"
+        assert payload["keep_alive"] == "30m"
+        assert payload["options"] == {"temperature": 0, "num_ctx": 16384}
+
+    def test_num_ctx_fits_prompt_within_context_window(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+        monkeypatch.delenv("WHATIF_OLLAMA_MAX_CTX", raising=False)
+        provider = get_provider("ollama")
+
+        # Powers of two, so similar prompts reuse the loaded model
+        assert provider._num_ctx(7_000) == 16384
+        assert provider._num_ctx(9_000) == 32768
+        # Capped at WHATIF_OLLAMA_MAX_CTX, not the model's 128K window
+        assert provider._num_ctx(1_000_000) == 32768
+
+        monkeypatch.setenv("WHATIF_OLLAMA_MAX_CTX", "131072")
+        assert provider._num_ctx(1_000_000) == 131_072
+
+        monkeypatch.setenv("WHATIF_CONTEXT_WINDOW", "8192")
+        assert provider._num_ctx(1_000) == 8192
+
+    def test_keep_alive_and_timeout_from_env(self, monkeypatch, mocker):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        monkeypatch.setenv("WHATIF_OLLAMA_KEEP_ALIVE", "-1")
+        monkeypatch.setenv("WHATIF_OLLAMA_TIMEOUT", "900")
+        mock_response = mocker.Mock()
+        mock_response.json.return_value = {"message": {"content": "{}"}}
+        post = mocker.patch("requests.Session.post", return_value=mock_response)
+
+        get_provider("ollama").complete("system", "user")
+
+        assert post.call_args.kwargs["json"]["keep_alive"] == -1
+        assert post.call_args.kwargs["timeout"] == 900
+
+    def test_invalid_timeout_uses_default(self, monkeypatch, capsys):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.setenv("WHATIF_OLLAMA_TIMEOUT", "soon")
+        assert get_provider("ollama").timeout == 600
+        assert "Invalid WHATIF_OLLAMA_TIMEOUT" in capsys.readouterr().err
+
+    def test_warm_up_loads_model_in_background(self, monkeypatch, mocker):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+        loaded = threading.Event()
+        post = mocker.patch("requests.Session.post", side_effect=lambda *a, **k: loaded.set())
+
+        get_provider("ollama").warm_up()
+
+        assert loaded.wait(5)
+        body = post.call_args.kwargs["json"]
+        assert body["messages"] == []
+        assert body["options"]["num_ctx"] == 16384
+
+    def test_warm_up_ignores_errors(self, monkeypatch, mocker):
+        import requests
+
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        failed = threading.Event()
+
+        def refuse(*args, **kwargs):
+            failed.set()
+            raise requests.exceptions.ConnectionError("refused")
+
+        mocker.patch("requests.Session.post", side_effect=refuse)
+        get_provider("ollama").warm_up()
+        assert failed.wait(5)
+
+
+@pytest.mark.unit
+class TestClientCache:
+    def test_cached_client_created_once(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return object()
+
+        first = get_cached_client(("test", "a"), factory)
+        assert get_cached_client(("test", "a"), factory) is first
+        assert get_cached_client(("test", "b"), factory) is not first
+        assert len(calls) == 2
+
+    def test_clear_closes_clients(self, mocker):
+        client = mocker.Mock()
+        get_cached_client(("test", "close"), lambda: client)
+        clear_client_cache()
+        client.close.assert_called_once()
+        assert get_cached_client(("test", "close"), object) is not client
+
+    def test_anthropic_client_reused_across_calls(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+
+        mock_client = mocker.Mock()
+        mock_client.messages.create.return_value.content = [mocker.Mock(text="{}")]
+        sdk = mocker.patch("anthropic.Anthropic", return_value=mock_client)
+
+        get_provider("anthropic").complete("system", "user")
+        get_provider("anthropic").complete("system", "user")
+        assert sdk.call_count == 1
+        assert mock_client.messages.create.call_count == 2
+
+    def test_ollama_session_reused_with_pool_size(self, monkeypatch, mocker):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        monkeypatch.setenv("WHATIF_HTTP_POOL_SIZE", "3")
+        mock_response = mocker.Mock()
+        mock_response.json.return_value = {"message": {"content": "{}"}}
+        post = mocker.patch("requests.Session.post", return_value=mock_response)
+
+        provider = get_provider("ollama")
+        provider.complete("system", "user")
+        provider.complete("system", "user")
+
+        assert post.call_count == 2
+        import requests
+
+        from bicep_whatif_advisor.providers import _client_cache
+
+        # One session shared by both calls
+        (session,) = [c for c in _client_cache.values() if isinstance(c, requests.Session)]
+        assert session.get_adapter("http://localhost:11434")._pool_maxsize == 3
+
+    def test_pool_size_env(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_HTTP_POOL_SIZE", raising=False)
+        assert get_pool_size() is None
+        monkeypatch.setenv("WHATIF_HTTP_POOL_SIZE", "25")
+        assert get_pool_size() == 25
+
+    def test_invalid_pool_size_ignored(self, monkeypatch, capsys):
+        monkeypatch.setenv("WHATIF_HTTP_POOL_SIZE", "zero")
+        assert get_pool_size() is None
+        assert "WHATIF_HTTP_POOL_SIZE" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+class TestAsyncProviders:
+    def test_default_acomplete_uses_complete(self):
+        from conftest import MockProvider
+
+        provider = MockProvider(response={"resources": []})
+        assert asyncio.run(provider.acomplete("system", "user")) == '{"resources": []}'
+        assert provider.calls == [("system", "user")]
+
+    def test_anthropic_acomplete_success(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        mock_client = mocker.Mock()
+        mock_client.messages.create = mocker.AsyncMock(
+            return_value=mocker.Mock(content=[mocker.Mock(text='{"resources": []}')])
+        )
+        sdk = mocker.patch("anthropic.AsyncAnthropic", return_value=mock_client)
+        provider = get_provider("anthropic")
+
+        async def run_twice():
+            await provider.acomplete("system", "user")
+            return await provider.acomplete("system", "user")
+
+        assert asyncio.run(run_twice()) == '{"resources": []}'
+        # One async client per event loop
+        assert sdk.call_count == 1
+        asyncio.run(provider.acomplete("system", "user"))
+        assert sdk.call_count == 2
+
+    def test_anthropic_acomplete_rate_limit_raises(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        from anthropic import RateLimitError
+
+        mock_resp = mocker.Mock(status_code=429, headers={})
+        mock_client = mocker.Mock()
+        mock_client.messages.create = mocker.AsyncMock(
+            side_effect=RateLimitError(message="rate limited", response=mock_resp, body=None)
+        )
+        mocker.patch("anthropic.AsyncAnthropic", return_value=mock_client)
+        mocker.patch("asyncio.sleep", mocker.AsyncMock())
+
+        with pytest.raises(ProviderRateLimitError):
+            asyncio.run(get_provider("anthropic").acomplete("system", "user"))
+        assert mock_client.messages.create.call_count == 4
+
+    def test_azure_acomplete_retries_then_raises(self, monkeypatch, mocker):
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        from openai import APIError
+
+        mock_client = mocker.Mock()
+        mock_client.chat.completions.create = mocker.AsyncMock(
+            side_effect=APIError(message="server error", request=mocker.Mock(), body=None)
+        )
+        mocker.patch("openai.AsyncAzureOpenAI", return_value=mock_client)
+        mocker.patch("asyncio.sleep", mocker.AsyncMock())
+
+        with pytest.raises(ProviderConnectionError):
+            asyncio.run(get_provider("azure-openai").acomplete("system", "user"))
+        assert mock_client.chat.completions.create.call_count == 4
+
+    def test_ollama_acomplete_success(self, monkeypatch, mocker):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+        mock_response = mocker.Mock()
+        mock_response.json.return_value = {"message": {"content": '{"resources": []}'}}
+        mocker.patch("requests.Session.post", return_value=mock_response)
+
+        result = asyncio.run(get_provider("ollama").acomplete("system", "user"))
+        assert result == '{"resources": []}'
+
+    def test_provider_errors_share_base_class(self):
+        for error in (ProviderConfigError, ProviderRateLimitError, ProviderTimeoutError):
+            assert issubclass(error, ProviderError)
+
+
+@pytest.mark.unit
+class TestStreamingProviders:
+    @pytest.fixture(autouse=True)
+    def _no_overrides(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+
+    def test_default_stream_yields_complete(self):
+        from conftest import MockProvider
+
+        provider = MockProvider(response={"resources": []})
+        assert list(provider.stream("system", "user")) == ['{"resources": []}']
+
+    def test_anthropic_stream_passes_idle_timeout(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        mock_client = mocker.Mock()
+        manager = mock_client.messages.stream.return_value
+        manager.__enter__ = mocker.Mock(
+            return_value=mocker.Mock(text_stream=iter(['{"a"', ": 1}"]))
+        )
+        manager.__exit__ = mocker.Mock(return_value=False)
+        mocker.patch("anthropic.Anthropic", return_value=mock_client)
+
+        chunks = list(get_provider("anthropic").stream("system", "user", idle_timeout=30))
+        assert chunks == ['{"a"', ": 1}"]
+        assert mock_client.messages.stream.call_args.kwargs["timeout"] == 30
+
+    def test_anthropic_stream_timeout_after_data_not_retried(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        from anthropic import APITimeoutError
+
+        def stalled():
+            yield '{"resources": ['
+            raise APITimeoutError(request=mocker.Mock())
+
+        mock_client = mocker.Mock()
+        manager = mock_client.messages.stream.return_value
+        manager.__enter__ = mocker.Mock(return_value=mocker.Mock(text_stream=stalled()))
+        manager.__exit__ = mocker.Mock(return_value=False)
+        mocker.patch("anthropic.Anthropic", return_value=mock_client)
+
+        chunks = []
+        with pytest.raises(ProviderTimeoutError, match="stalled"):
+            for chunk in get_provider("anthropic").stream("system", "user", idle_timeout=5):
+                chunks.append(chunk)
+        assert chunks == ['{"resources": [']
+        assert mock_client.messages.stream.call_count == 1
+
+    def test_azure_stream_skips_empty_chunks(self, monkeypatch, mocker):
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
+
+        def chunk(content):
+            return mocker.Mock(choices=[mocker.Mock(delta=mocker.Mock(content=content))])
+
+        mock_client = mocker.Mock()
+        mock_client.chat.completions.create.return_value = iter(
+            [mocker.Mock(choices=[]), chunk("{}"), chunk(None)]
+        )
+        mocker.patch("openai.AzureOpenAI", return_value=mock_client)
+
+        assert list(get_provider("azure-openai").stream("system", "user")) == ["{}"]
+        assert mock_client.chat.completions.create.call_args.kwargs["stream"] is True
+
+    def test_ollama_stream_reads_ndjson(self, mocker):
+        mock_response = mocker.Mock()
+        mock_response.iter_lines.return_value = iter(
+            [
+                '{"message": {"content": "{\\"resources\\""}, "done": false}',
+                "",
+                '{"message": {"content": ": []}"}, "done": true}',
+                '{"message": {"content": "ignored"}}',
+            ]
+        )
+        post = mocker.patch("requests.Session.post", return_value=mock_response)
+
+        chunks = list(get_provider("ollama").stream("system", "user", idle_timeout=15))
+        assert "".join(chunks) == '{"resources": []}'
+        assert post.call_args.kwargs["json"]["stream"] is True
+        assert post.call_args.kwargs["timeout"] == 15
+        mock_response.close.assert_called_once()
+
+    def test_ollama_stream_error_line_raises(self, mocker):
+        mock_response = mocker.Mock()
+        mock_response.iter_lines.return_value = iter(['{"error": "model not found"}'])
+        mocker.patch("requests.Session.post", return_value=mock_response)
+
+        with pytest.raises(ProviderError, match="model not found"):
+            list(get_provider("ollama").stream("system", "user"))
+
+
+@pytest.mark.unit
+class TestStructuredOutput:
+    SCHEMA = {
+        "type": "object",
+        "properties": {"resources": {"type": "array"}},
+        "required": ["resources"],
+        "additionalProperties": False,
+    }
+
+    @pytest.fixture(autouse=True)
+    def _no_overrides(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+
+    def test_anthropic_forces_response_tool(self, monkeypatch):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        request = get_provider("anthropic")._request("system", "user", self.SCHEMA)
+
+        (tool,) = request["tools"]
+        assert tool["input_schema"] == self.SCHEMA
+        assert request["tool_choice"] == {"type": "tool", "name": tool["name"]}
+        assert "tools" not in get_provider("anthropic")._request("system", "user")
+
+    def test_anthropic_returns_tool_input_as_json(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        mock_client = mocker.Mock()
+        tool_use = mocker.Mock(type="tool_use", input={"resources": []})
+        mock_client.messages.create.return_value = mocker.Mock(content=[tool_use])
+        mocker.patch("anthropic.Anthropic", return_value=mock_client)
+
+        result = get_provider("anthropic").complete("system", "user", self.SCHEMA)
+        assert json.loads(result) == {"resources": []}
+
+    def test_anthropic_streams_tool_input(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+
+        def delta(partial_json):
+            return mocker.Mock(
+                type="content_block_delta",
+                delta=mocker.Mock(type="input_json_delta", partial_json=partial_json),
+            )
+
+        events = [mocker.Mock(type="content_block_start"), delta('{"resources"'), delta(": []}")]
+        mock_client = mocker.Mock()
+        manager = mock_client.messages.stream.return_value
+        manager.__enter__ = mocker.Mock(
+            return_value=mocker.MagicMock(__iter__=lambda _: iter(events))
+        )
+        manager.__exit__ = mocker.Mock(return_value=False)
+        mocker.patch("anthropic.Anthropic", return_value=mock_client)
+
+        chunks = get_provider("anthropic").stream("system", "user", response_schema=self.SCHEMA)
+        assert "".join(chunks) == '{"resources": []}'
+
+    def test_azure_sends_strict_json_schema(self, monkeypatch):
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
+        provider = get_provider("azure-openai")
+
+        response_format = provider._request("system", "user", self.SCHEMA)["response_format"]
+        assert response_format["type"] == "json_schema"
+        assert response_format["json_schema"]["strict"] is True
+        assert response_format["json_schema"]["schema"] == self.SCHEMA
+        assert "response_format" not in provider._request("system", "user")
+
+    def test_azure_max_tokens_fits_small_context_window(self, monkeypatch):
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-35-turbo")
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+
+        # A quarter of the 16,385-token window leaves room for the prompt
+        assert get_provider("azure-openai")._request("system", "user")["max_tokens"] == 4096
+
+    def test_ollama_sends_schema_as_format(self):
+        payload = get_provider("ollama")._payload("system", "user", self.SCHEMA)
+        assert payload["format"] == self.SCHEMA
+
+
+@pytest.mark.unit
+class TestPromptCaching:
+    @pytest.fixture(autouse=True)
+    def _no_overrides(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_PROVIDER", raising=False)
+        monkeypatch.delenv("WHATIF_MODEL", raising=False)
+
+    def test_anthropic_sends_cache_breakpoints(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        from bicep_whatif_advisor.prompt import build_user_prompt
+
+        user_prompt = build_user_prompt("changes", diff_content="diff", bicep_content="param x int")
+        request = get_provider("anthropic")._request("system", user_prompt)
+
+        assert request["system"][0]["cache_control"] == {"type": "ephemeral"}
+        prefix_block, remainder_block = request["messages"][0]["content"]
+        assert prefix_block["text"].endswith("</bicep_source>")
+        assert prefix_block["cache_control"] == {"type": "ephemeral"}
+        assert "cache_control" not in remainder_block
+        assert prefix_block["text"] + remainder_block["text"] == user_prompt
+
+    def test_anthropic_plain_content_without_prefix(self, monkeypatch):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        request = get_provider("anthropic")._request("system", "user")
+        assert request["messages"][0]["content"] == "user"
+
+    def test_anthropic_records_cached_tokens(self, monkeypatch, mocker):
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+        usage = mocker.Mock(
+            input_tokens=100,
+            output_tokens=50,
+            cache_read_input_tokens=900,
+            cache_creation_input_tokens=0,
+        )
+        mock_client = mocker.Mock()
+        mock_client.messages.create.return_value = mocker.Mock(
+            content=[mocker.Mock(text="{}")], usage=usage
+        )
+        mocker.patch("anthropic.Anthropic", return_value=mock_client)
+        provider = get_provider("anthropic")
+
+        provider.complete("system", "user")
+        assert provider.usage.input_tokens == 1000
+        assert provider.usage.cached_input_tokens == 900
+        assert provider.usage.output_tokens == 50
+        assert provider.usage.requests == 1
+
+    def test_azure_records_cached_tokens(self, monkeypatch, mocker):
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://test.openai.azure.com")
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
+        usage = mocker.Mock(
+            prompt_tokens=2000,
+            completion_tokens=300,
+            prompt_tokens_details=mocker.Mock(cached_tokens=1536),
+        )
+        mock_client = mocker.Mock()
+        mock_client.chat.completions.create.return_value = mocker.Mock(
+            choices=[mocker.Mock(message=mocker.Mock(content="{}"))], usage=usage
+        )
+        mocker.patch("openai.AzureOpenAI", return_value=mock_client)
+        provider = get_provider("azure-openai")
+
+        provider.complete("system", "user")
+        assert provider.usage.input_tokens == 2000
+        assert provider.usage.cached_input_tokens == 1536
+
+    def test_token_usage_describe_and_missing_counts(self):
+        usage = TokenUsage()
+        usage.add(input_tokens=1200, output_tokens=80, cached_input_tokens=1000)
+        usage.add(input_tokens=None, output_tokens="n/a")
+        assert usage.requests == 2
+        assert usage.describe() == "1,200 input (1,000 cached), 80 output"
@@ -0,0 +1,392 @@
+"""Tests for bicep_whatif_advisor.providers.retry module."""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from bicep_whatif_advisor.providers import (
+    ProviderConnectionError,
+    ProviderRateLimitError,
+    ProviderResponseError,
+    ProviderTimeoutError,
+)
+from bicep_whatif_advisor.providers.retry import (
+    AdaptiveConcurrency,
+    Failure,
+    RequestScheduler,
+    RetryPolicy,
+    TokenBucket,
+    acall_with_retry,
+    call_with_retry,
+    classify_sdk_error,
+    estimate_tokens,
+    retry_after_from_headers,
+    stream_with_retry,
+)
+
+
+def _transient(message="connection reset"):
+    return Failure(ProviderConnectionError(message), retryable=True)
+
+
+class FlakyRequest:
+    """Fails with the given exceptions, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.mark.unit
+class TestRetryPolicy:
+    def test_backoff_grows_and_is_capped(self, mocker):
+        mocker.patch("random.uniform", side_effect=lambda low, high: high)
+        policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+        assert [policy.delay(n) for n in range(5)] == [1.0, 2.0, 4.0, 8.0, 10.0]
+
+    def test_retry_after_is_a_floor(self, mocker):
+        mocker.patch("random.uniform", return_value=0.0)
+        assert RetryPolicy().delay(0, retry_after=7.0) == 7.0
+        assert RetryPolicy(max_delay=5.0).delay(0, retry_after=30.0) == 5.0
+
+
+@pytest.mark.unit
+class TestRetryAfterHeaders:
+    def test_retry_after_ms_and_seconds(self):
+        assert retry_after_from_headers({"retry-after-ms": "1500"}) == 1.5
+        assert retry_after_from_headers({"retry-after": "12"}) == 12.0
+
+    def test_retry_after_http_date(self):
+        later = datetime.now(timezone.utc) + timedelta(seconds=30)
+        seconds = retry_after_from_headers({"retry-after": format_datetime(later, usegmt=True)})
+        assert 25 <= seconds <= 30
+
+    def test_exhausted_limit_reset_duration(self):
+        headers = {
+            "x-ratelimit-remaining-requests": "5",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "6m0s",
+        }
+        assert retry_after_from_headers(headers) == 360.0
+
+    def test_anthropic_reset_timestamp(self):
+        later = datetime.now(timezone.utc) + timedelta(seconds=20)
+        headers = {
+            "anthropic-ratelimit-tokens-remaining": "0",
+            "anthropic-ratelimit-tokens-reset": later.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        assert 15 <= retry_after_from_headers(headers) <= 20
+
+    def test_no_hint(self):
+        assert retry_after_from_headers(None) is None
+        assert retry_after_from_headers({"x-ratelimit-remaining-requests": "3"}) is None
+        assert retry_after_from_headers({"retry-after": "soon"}) is None
+
+
+@pytest.mark.unit
+class TestTokenBucket:
+    def test_waits_once_budget_is_spent(self, mocker):
+        clock = mocker.patch("time.monotonic", return_value=100.0)
+        bucket = TokenBucket(per_minute=60)
+        assert bucket.reserve(60) == 0.0
+        # Empty: the next token arrives after one second
+        assert bucket.reserve(1) == pytest.approx(1.0)
+        clock.return_value = 110.0
+        assert bucket.reserve(5) == 0.0
+
+
+@pytest.mark.unit
+class TestAdaptiveConcurrency:
+    def test_rate_limit_halves_observed_concurrency(self):
+        limiter = AdaptiveConcurrency(max_limit=16)
+        for _ in range(8):
+            limiter.acquire()
+        limiter.release(rate_limited=True)
+        assert limiter.limit == 4.0
+
+    def test_grows_additively_while_saturated(self):
+        limiter = AdaptiveConcurrency(max_limit=16)
+        limiter.limit = 2.0
+        limiter.acquire()
+        limiter.acquire()
+        assert not limiter.try_acquire()
+        limiter.release(latency=1.0)
+        assert limiter.limit == 2.5
+
+    def test_latency_spike_with_several_in_flight_shrinks_limit(self):
+        limiter = AdaptiveConcurrency(max_limit=8)
+        limiter.acquire()
+        limiter.release(latency=1.0)  # baseline
+        limiter.acquire()
+        limiter.acquire()
+        limiter.release(latency=5.0)
+        assert limiter.limit == 6.0
+
+    def test_async_waiters_are_admitted_in_arrival_order(self, mocker):
+        # Slots are handed over on release, not discovered by polling
+        mocker.patch("asyncio.sleep", side_effect=AssertionError("polled"))
+        limiter = AdaptiveConcurrency(max_limit=1)
+        limiter.acquire()
+        admitted = []
+
+        async def request(n):
+            await limiter.acquire_async()
+            admitted.append(n)
+
+        async def run():
+            tasks = [asyncio.ensure_future(request(n)) for n in range(4)]
+            await asyncio.wait(tasks, timeout=0.01)
+            assert admitted == []
+            for _ in range(4):
+                limiter.release()
+                await asyncio.wait(tasks, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                tasks = [t for t in tasks if not t.done()]
+
+        asyncio.run(run())
+        assert admitted == [0, 1, 2, 3]
+        assert limiter.in_flight == 1
+
+    def test_queued_waiters_are_not_overtaken(self):
+        limiter = AdaptiveConcurrency(max_limit=1)
+        limiter.acquire()
+
+        async def run():
+            waiter = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+            limiter.limit = 2.0
+            # The spare slot belongs to the queued request, not a newcomer
+            assert not limiter.try_acquire()
+            limiter.release()
+            await waiter
+
+        asyncio.run(run())
+        assert limiter.in_flight == 1
+
+    def test_cancelled_waiter_gives_up_its_slot(self):
+        limiter = AdaptiveConcurrency(max_limit=1)
+        limiter.acquire()
+
+        async def run():
+            first = asyncio.ensure_future(limiter.acquire_async())
+            second = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+            # Admitted and cancelled before it resumed
+            limiter.release()
+            first.cancel()
+            await asyncio.wait_for(second, timeout=1)
+            assert first.cancelled()
+
+        asyncio.run(run())
+        assert limiter.in_flight == 1
+        assert not limiter._waiters
+
+    def test_thread_waiters_are_admitted_in_arrival_order(self):
+        limiter = AdaptiveConcurrency(max_limit=1)
+        limiter.acquire()
+        admitted = []
+
+        def request(n):
+            limiter.acquire()
+            admitted.append(n)
+            limiter.release()
+
+        threads = []
+        for n in range(3):
+            thread = threading.Thread(target=request, args=(n,))
+            thread.start()
+            threads.append(thread)
+            while len(limiter._waiters) <= n:
+                time.sleep(0.001)
+        limiter.release()
+        for thread in threads:
+            thread.join(timeout=1)
+        assert admitted == [0, 1, 2]
+        assert limiter.in_flight == 0
+
+    def test_single_request_latency_does_not_change_limit(self):
+        limiter = AdaptiveConcurrency(max_limit=8)
+        limiter.acquire()
+        limiter.release(latency=1.0)
+        limiter.acquire()
+        limiter.release(latency=10.0)
+        assert limiter.limit == 8.0
+
+
+@pytest.mark.unit
+class TestRequestScheduler:
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("WHATIF_MAX_RETRIES", "1")
+        monkeypatch.setenv("WHATIF_REQUESTS_PER_MINUTE", "30")
+        monkeypatch.setenv("WHATIF_TOKENS_PER_MINUTE", "90000")
+        scheduler = RequestScheduler.from_env("Test API")
+        assert scheduler.policy.max_attempts == 2
+        assert scheduler.requests.capacity == 30
+        assert scheduler.tokens.capacity == 90000
+
+    def test_invalid_env_ignored(self, monkeypatch, capsys):
+        monkeypatch.setenv("WHATIF_REQUESTS_PER_MINUTE", "lots")
+        scheduler = RequestScheduler.from_env("Test API")
+        assert scheduler.requests is None
+        assert "WHATIF_REQUESTS_PER_MINUTE" in capsys.readouterr().err
+
+    def test_retries_transient_failure_then_succeeds(self, mocker, capsys):
+        sleep = mocker.patch("time.sleep")
+        request = FlakyRequest(ConnectionError(), ConnectionError())
+
+        result = call_with_retry(RequestScheduler("Test API"), request, lambda e: _transient())
+
+        assert result == "ok"
+        assert request.calls == 3
+        assert sleep.call_count == 2
+        assert "attempt 3 of 4" in capsys.readouterr().err
+
+    def test_non_retryable_failure_raised_immediately(self, mocker):
+        mocker.patch("time.sleep")
+        request = FlakyRequest(ValueError("bad request"))
+
+        with pytest.raises(ProviderResponseError):
+            call_with_retry(
+                RequestScheduler("Test API"),
+                request,
+                lambda e: Failure(ProviderResponseError("rejected")),
+            )
+        assert request.calls == 1
+
+    def test_rate_limit_retry_after_pauses_other_requests(self, mocker):
+        sleep = mocker.patch("time.sleep")
+        mocker.patch("random.uniform", return_value=0.0)
+        scheduler = RequestScheduler("Test API", policy=RetryPolicy(max_attempts=1))
+        throttled = Failure(
+            ProviderRateLimitError("slow down"), retryable=True, retry_after=5.0, rate_limited=True
+        )
+
+        with pytest.raises(ProviderRateLimitError):
+            call_with_retry(scheduler, FlakyRequest(RuntimeError()), lambda e: throttled)
+        # The next request waits out the server's Retry-After before starting
+        call_with_retry(scheduler, FlakyRequest(), lambda e: throttled)
+        waited = sleep.call_args.args[0]
+        assert 4.0 < waited <= 5.0
+
+    def test_slots_released_after_failures(self, mocker):
+        mocker.patch("time.sleep")
+        scheduler = RequestScheduler("Test API", max_in_flight=1)
+        with pytest.raises(ProviderConnectionError):
+            call_with_retry(scheduler, FlakyRequest(*[OSError()] * 4), lambda e: _transient())
+        assert scheduler.concurrency.in_flight == 0
+
+    def test_async_retry(self, mocker):
+        mocker.patch("asyncio.sleep", mocker.AsyncMock())
+        request = FlakyRequest(ConnectionError())
+
+        async def attempt():
+            return request()
+
+        result = asyncio.run(
+            acall_with_retry(RequestScheduler("Test API"), attempt, lambda e: _transient())
+        )
+        assert result == "ok"
+        assert request.calls == 2
+
+
+@pytest.mark.unit
+class TestStreamWithRetry:
+    def test_retries_before_first_chunk(self, mocker):
+        mocker.patch("time.sleep")
+        attempts = []
+
+        def open_stream():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ConnectionError("refused")
+            yield "a"
+            yield "b"
+
+        chunks = stream_with_retry(
+            RequestScheduler("Test API"), open_stream, lambda e: _transient()
+        )
+        assert list(chunks) == ["a", "b"]
+        assert len(attempts) == 2
+
+    def test_failure_after_first_chunk_not_retried(self, mocker):
+        mocker.patch("time.sleep")
+
+        def open_stream():
+            yield "a"
+            raise ConnectionError("dropped")
+
+        chunks = stream_with_retry(
+            RequestScheduler("Test API"), open_stream, lambda e: _transient()
+        )
+        with pytest.raises(ProviderConnectionError, match="interrupted"):
+            list(chunks)
+
+    def test_timeout_after_first_chunk_reports_stall(self):
+        def open_stream():
+            yield "a"
+            raise OSError("read timed out")
+
+        chunks = stream_with_retry(
+            RequestScheduler("Test API"),
+            open_stream,
+            lambda e: Failure(ProviderTimeoutError("timed out"), retryable=True),
+        )
+        with pytest.raises(ProviderTimeoutError, match="stalled"):
+            list(chunks)
+
+    def test_consumer_stopping_early_releases_slot(self):
+        scheduler = RequestScheduler("Test API")
+        chunks = stream_with_retry(scheduler, lambda: iter(["a", "b"]), lambda e: _transient())
+        assert next(chunks) == "a"
+        chunks.close()
+        assert scheduler.concurrency.in_flight == 0
+
+
+@pytest.mark.unit
+class TestClassifySdkError:
+    def _status_error(self, mocker, status, headers=None):
+        import anthropic
+
+        response = mocker.Mock(status_code=status, headers=headers or {})
+        return anthropic.APIStatusError("error", response=response, body=None)
+
+    def test_server_error_retryable(self, mocker):
+        import anthropic
+
+        failure = classify_sdk_error(
+            self._status_error(mocker, 529, {"retry-after": "3"}), anthropic, "Anthropic API"
+        )
+        assert failure.retryable
+        assert failure.retry_after == 3.0
+        assert isinstance(failure.error, ProviderConnectionError)
+
+    def test_client_error_not_retryable(self, mocker):
+        import anthropic
+
+        failure = classify_sdk_error(self._status_error(mocker, 400), anthropic, "Anthropic API")
+        assert not failure.retryable
+        assert isinstance(failure.error, ProviderResponseError)
+
+    def test_rate_limit_reads_headers(self, mocker):
+        import openai
+
+        response = mocker.Mock(status_code=429, headers={"retry-after-ms": "250"})
+        error = openai.RateLimitError("limited", response=response, body=None)
+        failure = classify_sdk_error(error, openai, "Azure OpenAI API")
+        assert failure.rate_limited
+        assert failure.retry_after == 0.25
+        assert isinstance(failure.error, ProviderRateLimitError)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("abcd" * 10, "xy") == 6
@@ -2,29 +2,32 @@
 
 import pytest
 
+from bicep_whatif_advisor.ci.buckets import RISK_BUCKETS, RiskBucket, use_buckets
 from bicep_whatif_advisor.ci.risk_buckets import (
     _exceeds_threshold,
-    _validate_risk_level,
     evaluate_risk_buckets,
+    merge_risk_assessments,
+    rescore_risk_assessment,
+    validate_risk_level,
 )
 
 
 @pytest.mark.unit
 class TestValidateRiskLevel:
     def test_valid_low(self):
-        assert _validate_risk_level("low") == "low"
+        assert validate_risk_level("low") == "low"
 
     def test_valid_medium(self):
-        assert _validate_risk_level("medium") == "medium"
+        assert validate_risk_level("medium") == "medium"
 
     def test_valid_high(self):
-        assert _validate_risk_level("high") == "high"
+        assert validate_risk_level("high") == "high"
 
     def test_mixed_case(self):
-        assert _validate_risk_level("HIGH") == "high"
+        assert validate_risk_level("HIGH") == "high"
 
     def test_invalid_defaults_to_low(self):
-        assert _validate_risk_level("extreme") == "low"
+        assert validate_risk_level("extreme") == "low"
 
 
 # Parameterized test for all 9 combinations of _exceeds_threshold
@@ -345,3 +348,197 @@ class TestEvaluateRiskBuckets:
         data = {}
         is_safe, failed, review, ra = evaluate_risk_buckets(data, ["drift"], "high", "high")
         assert review == []
+
+
+def _concern(name, level, text="c"):
+    return {"resource_name": name, "risk_level": level, "concern": text}
+
+
+@pytest.mark.unit
+class TestRescoreRiskAssessment:
+    def test_drops_concerns_about_excluded_resources(self):
+        ra = {
+            "drift": {
+                "risk_level": "high",
+                "concerns": ["a", "b"],
+                "reasoning": "r",
+                "resource_concerns": [
+                    _concern("noise-vnet", "high", "a"),
+                    _concern("real-sa", "medium", "b"),
+                ],
+            }
+        }
+        rescored, unattributed = rescore_risk_assessment(
+            ra, [{"resource_name": "noise-vnet"}], [{"resource_name": "real-sa"}]
+        )
+        assert rescored == ["drift"]
+        assert unattributed == []
+        assert ra["drift"]["risk_level"] == "medium"
+        assert ra["drift"]["concerns"] == ["b"]
+        assert ra["drift"]["concern_summary"] == "b"
+
+    def test_all_concerns_dropped_goes_low(self):
+        ra = {"drift": {"risk_level": "medium", "resource_concerns": [_concern("x", "medium")]}}
+        rescore_risk_assessment(ra, [{"resource_name": "X"}], [])
+        assert ra["drift"]["risk_level"] == "low"
+        assert ra["drift"]["concern_summary"] == "None"
+
+    def test_never_raises_above_original(self):
+        ra = {
+            "drift": {
+                "risk_level": "medium",
+                "resource_concerns": [_concern("x", "low"), _concern(None, "high")],
+            }
+        }
+        rescore_risk_assessment(ra, [{"resource_name": "x"}], [])
+        assert ra["drift"]["risk_level"] == "medium"
+
+    def test_unrelated_concerns_leave_bucket_untouched(self):
+        bucket = {
+            "risk_level": "high",
+            "reasoning": "r",
+            "resource_concerns": [_concern("a", "high")],
+        }
+        ra = {"drift": dict(bucket)}
+        rescored, _ = rescore_risk_assessment(ra, [{"resource_name": "b"}], [])
+        assert rescored == []
+        assert ra["drift"] == bucket
+
+    def test_name_shared_with_kept_resource_not_excluded(self):
+        ra = {"drift": {"risk_level": "high", "resource_concerns": [_concern("dup", "high")]}}
+        rescored, _ = rescore_risk_assessment(
+            ra, [{"resource_name": "dup"}], [{"resource_name": "dup"}]
+        )
+        assert rescored == []
+        assert ra["drift"]["risk_level"] == "high"
+
+    def test_missing_attribution_reported_when_above_low(self):
+        ra = {
+            "drift": {"risk_level": "high", "concerns": ["x"]},
+            "intent": {"risk_level": "low", "concerns": []},
+        }
+        rescored, unattributed = rescore_risk_assessment(ra, [{"resource_name": "x"}], [])
+        assert rescored == []
+        assert unattributed == ["drift"]
+        assert ra["drift"]["risk_level"] == "high"
+
+
+def _table_agent(columns=None) -> dict:
+    """A registry with one table-display custom agent, for use_buckets()."""
+    agent = RiskBucket(
+        id="security",
+        display_name="Security",
+        description="d",
+        prompt_instructions="p",
+        custom=True,
+        display="table",
+        columns=columns,
+    )
+    return {**RISK_BUCKETS, "security": agent}
+
+
+@pytest.mark.unit
+class TestRescoreAgentFindings:
+    def _assessment(self, findings):
+        return {
+            "security": {
+                "risk_level": "high",
+                "concerns": ["open"],
+                "resource_concerns": [_concern("noise-vnet", "high", "open")],
+                "findings": findings,
+            }
+        }
+
+    def test_drops_findings_about_excluded_resources(self):
+        from bicep_whatif_advisor.render import _render_agent_detail_sections
+
+        ra = self._assessment(
+            [
+                {"resource": "noise-vnet", "issue": "Open NSG", "recommendation": "Close it"},
+                {"resource": "real-sa", "issue": "No TLS 1.2", "recommendation": "Set it"},
+            ]
+        )
+        with use_buckets(_table_agent()):
+            rescored, unattributed = rescore_risk_assessment(
+                ra, [{"resource_name": "noise-vnet"}], [{"resource_name": "real-sa"}]
+            )
+            lines = _render_agent_detail_sections(
+                {"risk_assessment": ra, "_enabled_buckets": ["security"]}
+            )
+
+        assert (rescored, unattributed) == (["security"], [])
+        assert ra["security"]["risk_level"] == "low"
+        assert [f["resource"] for f in ra["security"]["findings"]] == ["real-sa"]
+        assert "noise-vnet" not in "\n".join(lines)
+        assert "| real-sa | No TLS 1.2 | Set it |" in lines
+
+    def test_custom_resource_column(self):
+        columns = [
+            {"name": "Resource Name", "key": "resource_name", "description": "r"},
+            {"name": "Issue", "key": "issue", "description": "i"},
+        ]
+        ra = self._assessment([{"resource_name": "Noise-VNet", "issue": "Open NSG"}])
+        with use_buckets(_table_agent(columns)):
+            rescore_risk_assessment(ra, [{"resource_name": "noise-vnet"}], [])
+
+        assert ra["security"]["findings"] == []
+
+    def test_findings_without_resource_column_are_unattributed(self):
+        columns = [{"name": "Issue", "key": "issue", "description": "i"}]
+        ra = self._assessment([{"issue": "Open NSG"}])
+        with use_buckets(_table_agent(columns)):
+            rescored, unattributed = rescore_risk_assessment(
+                ra, [{"resource_name": "noise-vnet"}], []
+            )
+
+        assert rescored == ["security"]  # its resource_concerns were still rescored
+        assert unattributed == ["security"]
+        assert ra["security"]["findings"] == [{"issue": "Open NSG"}]
+
+
+@pytest.mark.unit
+class TestMergeRiskAssessments:
+    def test_takes_highest_level_and_unions_concerns(self):
+        merged = merge_risk_assessments(
+            [
+                {
+                    "drift": {
+                        "risk_level": "low",
+                        "concerns": ["a"],
+                        "concern_summary": "a",
+                        "reasoning": "part 1",
+                        "resource_concerns": [_concern("x", "low")],
+                    }
+                },
+                {
+                    "drift": {
+                        "risk_level": "high",
+                        "concerns": ["a", "b"],
+                        "concern_summary": "b",
+                        "reasoning": "part 2",
+                        "resource_concerns": [_concern("y", "high")],
+                    },
+                    "intent": {"risk_level": "medium", "concerns": ["c"]},
+                },
+            ]
+        )
+
+        assert merged["drift"]["risk_level"] == "high"
+        assert merged["drift"]["reasoning"] == "part 2"
+        assert merged["drift"]["concerns"] == ["a", "b"]
+        assert merged["drift"]["concern_summary"] == "a; b"
+        assert merged["drift"]["resource_concerns"] == [_concern("x", "low"), _concern("y", "high")]
+        assert merged["intent"]["risk_level"] == "medium"
+        assert merged["intent"]["concern_summary"] == "None"
+
+    def test_partial_attribution_dropped(self):
+        merged = merge_risk_assessments(
+            [
+                {"drift": {"risk_level": "medium", "resource_concerns": []}},
+                {"drift": {"risk_level": "high", "concerns": ["x"]}},
+            ]
+        )
+        # Rescoring from one part's list would ignore the other part's concerns
+        assert "resource_concerns" not in merged["drift"]
+        rescored, unattributed = rescore_risk_assessment(merged, [{"resource_name": "x"}], [])
+        assert unattributed == ["drift"]
@@ -0,0 +1,211 @@
+"""Tests for bicep_whatif_advisor.server module."""
+
+import threading
+
+import pytest
+import requests
+
+from bicep_whatif_advisor.ci.buckets import RISK_BUCKETS
+from bicep_whatif_advisor.input import InputError
+from bicep_whatif_advisor.server import (
+    AdvisorServer,
+    AdvisorService,
+    ServerError,
+    parse_options,
+    request_analysis,
+)
+
+WHATIF = (
+    "Resource changes: 1 to create.\n  + Microsoft.Storage/storageAccounts/store1 [2023-01-01]\n"
+)
+
+
+@pytest.fixture
+def server_url():
+    server = AdvisorServer(("127.0.0.1", 0), AdvisorService(), workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def provider(mocker, sample_standard_response):
+    from conftest import MockProvider
+
+    provider = MockProvider(sample_standard_response)
+    mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=provider)
+    return provider
+
+
+@pytest.mark.unit
+class TestEndpoints:
+    def test_health(self, server_url):
+        response = requests.get(f"{server_url}/health")
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok"
+
+    def test_unknown_path(self, server_url):
+        assert requests.get(f"{server_url}/missing").status_code == 404
+
+    def test_analyze_shares_provider_and_counts(self, server_url, provider):
+        for _ in range(2):
+            result = request_analysis(server_url, WHATIF, {"no_builtin_patterns": True})
+            assert (result["status"], result["exit_code"]) == ("analyzed", 0)
+            assert result["high_confidence"]["resources"]
+
+        metrics = requests.get(f"{server_url}/metrics").json()
+        assert (metrics["requests"], metrics["errors"], metrics["in_flight"]) == (2, 0, 0)
+        (stats,) = metrics["providers"].values()
+        # The second request is answered from the shared response cache
+        assert (stats["cache_hits"], stats["cache_misses"]) == (1, 1)
+        assert len(provider.calls) == 1
+
+    def test_ci_verdict(self, server_url, mocker, sample_ci_response_unsafe):
+        from conftest import MockProvider
+
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider",
+            return_value=MockProvider(sample_ci_response_unsafe),
+        )
+
+        result = request_analysis(
+            server_url,
+            WHATIF,
+            {"ci": True, "drift_threshold": "medium", "no_cache": True},
+            diff="diff --git a/main.bicep b/main.bicep\n",
+        )
+
+        assert (result["status"], result["exit_code"]) == ("unsafe", 1)
+        assert result["failed_buckets"] == ["drift"]
+
+    def test_invalid_request_is_an_input_error(self, server_url):
+        with pytest.raises(InputError, match="Unknown options: colour"):
+            request_analysis(server_url, WHATIF, {"colour": "red"})
+
+    def test_unreachable_server(self):
+        with pytest.raises(ServerError, match="Could not reach"):
+            request_analysis("http://127.0.0.1:1", WHATIF, {})
+
+
+@pytest.mark.unit
+class TestReload:
+    def test_noise_file_is_reloaded_when_changed(self, tmp_path, provider):
+        noise_file = tmp_path / "noise.txt"
+        noise_file.write_text("# none yet\n")
+        service = AdvisorService()
+        options = {"no_builtin_patterns": True, "noise_file": str(noise_file), "no_cache": True}
+
+        assert service.analyze({"whatif": WHATIF, "options": options})["status"] == "analyzed"
+        assert len(provider.calls) == 1
+
+        noise_file.write_text("resource: Microsoft.Storage/storageAccounts\n")
+        result = service.analyze({"whatif": WHATIF, "options": options})
+
+        assert len(provider.calls) == 1
+        assert result["low_confidence"]["resources"][0]["resource_name"] == "store1"
+        assert service.metrics()["pattern_reloads"] == 1
+
+    def test_unchanged_patterns_are_reused(self, tmp_path):
+        service = AdvisorService()
+
+        first = service.patterns(False, None, 80)
+
+        assert service.patterns(False, None, 80) is first
+
+    def test_agents_are_reloaded_when_changed(self, tmp_path):
+        agent = tmp_path / "security.md"
+        agent.write_text("---\nid: security\ndisplay_name: Security\n---\nCheck it.\n")
+        service = AdvisorService()
+
+        buckets = service.agents(str(tmp_path))
+        assert list(buckets) == ["drift", "intent", "security"]
+        assert service.agents(str(tmp_path)) is buckets
+
+        agent.unlink()
+        (tmp_path / "cost.md").write_text("---\nid: cost\ndisplay_name: Cost Impact\n---\nX\n")
+
+        assert list(service.agents(str(tmp_path))) == ["drift", "intent", "cost"]
+        assert "security" in buckets  # the old registry is left intact
+        assert "security" not in RISK_BUCKETS and "cost" not in RISK_BUCKETS
+        assert service.metrics()["agent_reloads"] == 1
+
+    def test_directories_may_share_agent_ids(self, tmp_path):
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "security.md").write_text(
+                f"---\nid: security\ndisplay_name: Security {name}\n---\nCheck it.\n"
+            )
+        service = AdvisorService()
+
+        assert service.agents(str(tmp_path / "a"))["security"].display_name == "Security a"
+        assert service.agents(str(tmp_path / "b"))["security"].display_name == "Security b"
+
+    def test_reload_during_analysis_keeps_request_buckets(
+        self, tmp_path, mocker, sample_ci_response_safe
+    ):
+        from conftest import MockProvider
+
+        started, release = threading.Event(), threading.Event()
+
+        class BlockingProvider(MockProvider):
+            def complete(self, system_prompt, user_prompt, response_schema=None):
+                started.set()
+                assert release.wait(5)
+                return super().complete(system_prompt, user_prompt, response_schema)
+
+        response = dict(sample_ci_response_safe)
+        response["risk_assessment"] = {
+            **response["risk_assessment"],
+            "security": {"risk_level": "high", "concerns": ["Public access"], "reasoning": "x"},
+        }
+        mocker.patch(
+            "bicep_whatif_advisor.session.get_provider", return_value=BlockingProvider(response)
+        )
+        agent = tmp_path / "security.md"
+        agent.write_text("---\nid: security\ndisplay_name: Security\n---\nCheck it.\n")
+        service = AdvisorService()
+        options = {"ci": True, "agents_dir": str(tmp_path), "no_cache": True}
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(service.analyze({"whatif": WHATIF, "options": options}))
+        )
+        thread.start()
+        assert started.wait(5)
+
+        # The agent is deleted and the directory reloaded while the request runs
+        agent.unlink()
+        (tmp_path / "cost.md").write_text("---\nid: cost\ndisplay_name: Cost Impact\n---\nX\n")
+        assert "security" not in service.agents(str(tmp_path))
+        release.set()
+        thread.join(5)
+
+        (result,) = results
+        assert (result["status"], result["exit_code"]) == ("unsafe", 1)
+        assert result["failed_buckets"] == ["security"]
+
+    def test_missing_agents_dir(self, tmp_path):
+        with pytest.raises(InputError, match="Agents directory not found"):
+            AdvisorService().agents(str(tmp_path / "missing"))
+
+
+@pytest.mark.unit
+class TestParseOptions:
+    def test_defaults_and_normalization(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        options = parse_options({"provider": "Ollama", "agent_threshold": {"cost": "LOW"}})
+
+        assert options["provider"] == "ollama"
+        assert options["agent_threshold"] == {"cost": "low"}
+        assert options["drift_threshold"] == "high"
+        assert parse_options({"noise_file": "noise.txt"})["noise_file"] == str(
+            tmp_path / "noise.txt"
+        )
+
+    def test_invalid_threshold(self):
+        with pytest.raises(InputError, match="drift_threshold must be low, medium, or high"):
+            parse_options({"drift_threshold": "severe"})
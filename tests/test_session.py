@@ -0,0 +1,69 @@
+"""Tests for bicep_whatif_advisor.session module."""
+
+import pytest
+
+from bicep_whatif_advisor.hedging import HedgedProvider
+from bicep_whatif_advisor.input import InputError
+from bicep_whatif_advisor.session import (
+    build_llm_provider,
+    enabled_buckets_for,
+    parse_agent_thresholds,
+    prepare_buckets,
+)
+
+
+@pytest.mark.unit
+class TestEnabledBuckets:
+    def test_none_outside_ci(self):
+        assert enabled_buckets_for(False, [], False, False, [], has_pr_metadata=True) is None
+
+    def test_custom_agents_follow_builtins(self):
+        buckets = enabled_buckets_for(True, ["cost"], False, False, [], has_pr_metadata=True)
+        assert buckets == ["drift", "intent", "cost"]
+
+    def test_all_skipped_is_an_input_error(self):
+        with pytest.raises(InputError, match="At least one risk assessment bucket"):
+            enabled_buckets_for(True, [], True, True, [], has_pr_metadata=True)
+
+    def test_prepare_ignores_ci_only_options_outside_ci(self, tmp_path, capsys):
+        enabled, parallel = prepare_buckets(
+            False, str(tmp_path), True, False, False, (), "Title", None
+        )
+
+        assert (enabled, parallel) == (None, False)
+        err = capsys.readouterr().err
+        assert "--agents-dir is only used in CI mode" in err
+        assert "--parallel is only used in CI mode" in err
+
+
+@pytest.mark.unit
+class TestParseAgentThresholds:
+    def test_invalid_entries_are_skipped(self, capsys):
+        assert parse_agent_thresholds(["cost=HIGH", "bad", "sec=extreme"]) == {"cost": "high"}
+        assert "Invalid --agent-threshold format" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+class TestBuildLlmProvider:
+    def test_wrapping_order(self, mocker, tmp_path):
+        from conftest import MockProvider
+
+        from bicep_whatif_advisor.cache import CachingProvider
+        from bicep_whatif_advisor.coordination import CoalescingProvider
+
+        mocker.patch("bicep_whatif_advisor.session.get_provider", return_value=MockProvider())
+        mocker.patch("bicep_whatif_advisor.session.create_provider", return_value=MockProvider())
+
+        llm_provider, flight, hedged = build_llm_provider(
+            "anthropic",
+            None,
+            fallback_model="backup",
+            coordination_dir=str(tmp_path / "coord"),
+            cache_dir=str(tmp_path / "cache"),
+        )
+
+        assert isinstance(llm_provider, CachingProvider)
+        assert isinstance(llm_provider.provider, CoalescingProvider)
+        assert llm_provider.provider.provider is hedged
+        assert isinstance(hedged, HedgedProvider)
+        assert flight is not None
@@ -0,0 +1,128 @@
+"""Tests for bicep_whatif_advisor.sharding module."""
+
+import json
+import threading
+import time
+
+import pytest
+
+from bicep_whatif_advisor.providers import Provider, ProviderError
+from bicep_whatif_advisor.sharding import (
+    merge_shard_responses,
+    run_sharded_analysis,
+    shard_whatif,
+)
+
+PREAMBLE = "Scope: /subscriptions/0000/resourceGroups/rg\n\n"
+EPILOGUE = "Resource changes: 5 to create.\n"
+
+
+def _whatif(count):
+    blocks = "".join(
+        f"  + Microsoft.Storage/storageAccounts/store{i} [2023-01-01]\n\n" for i in range(count)
+    )
+    return PREAMBLE + blocks + EPILOGUE
+
+
+@pytest.mark.unit
+class TestShardWhatif:
+    def test_splits_on_resource_count(self):
+        shards = shard_whatif(_whatif(5), max_tokens=10_000, max_resources=2)
+
+        assert len(shards) == 3
+        assert all(shard.startswith(PREAMBLE) for shard in shards)
+        assert "store0" in shards[0] and "store1" in shards[0]
+        assert "store4" in shards[2]
+        assert not any("Resource changes" in shard for shard in shards)
+
+    def test_splits_on_tokens_keeping_whole_blocks(self):
+        block_chars = len("  + Microsoft.Storage/storageAccounts/store0 [2023-01-01]\n\n")
+        budget = len(PREAMBLE) + 2 * block_chars
+        shards = shard_whatif(_whatif(5), budget, max_resources=100, count_tokens=len)
+
+        assert len(shards) == 3
+        blocks = _whatif(5)[len(PREAMBLE) : -len(EPILOGUE)]
+        assert "".join(shard[len(PREAMBLE) :] for shard in shards) == blocks
+
+    def test_oversized_block_gets_its_own_shard(self):
+        shards = shard_whatif(_whatif(3), max_tokens=1, max_resources=100, count_tokens=len)
+        assert len(shards) == 3
+
+    def test_text_without_blocks_is_one_shard(self):
+        assert shard_whatif("no resources here\n", max_tokens=1) == ["no resources here\n"]
+
+
+class SlowProvider(Provider):
+    """Echoes the shard number from the user prompt, tracking concurrency."""
+
+    def __init__(self, delay=0.1, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def complete(self, system_prompt, user_prompt, response_schema=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if user_prompt == self.fail_on:
+                raise ProviderError("boom")
+            return json.dumps({"shard": user_prompt})
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+@pytest.mark.unit
+class TestRunShardedAnalysis:
+    def test_results_in_shard_order_with_bounded_concurrency(self):
+        provider = SlowProvider()
+        prompts = [f"shard-{i}" for i in range(6)]
+
+        texts = run_sharded_analysis(provider, "system", prompts, max_concurrency=3)
+
+        assert [json.loads(t)["shard"] for t in texts] == prompts
+        assert provider.max_in_flight == 3
+
+    def test_failure_raises(self):
+        provider = SlowProvider(delay=0, fail_on="shard-1")
+        with pytest.raises(ProviderError):
+            run_sharded_analysis(provider, "system", ["shard-0", "shard-1"])
+
+
+@pytest.mark.unit
+class TestMergeShardResponses:
+    def test_standard_mode(self):
+        merged = merge_shard_responses(
+            [
+                {"resources": [{"resource_name": "a"}], "overall_summary": "First part."},
+                {"resources": [{"resource_name": "b"}], "overall_summary": "Second part."},
+            ]
+        )
+        assert [r["resource_name"] for r in merged["resources"]] == ["a", "b"]
+        assert merged["overall_summary"] == "First part. Second part."
+        assert "risk_assessment" not in merged
+
+    def test_ci_mode_reduces_buckets_and_keeps_riskiest_verdict(self):
+        merged = merge_shard_responses(
+            [
+                {
+                    "resources": [],
+                    "overall_summary": "",
+                    "risk_assessment": {"drift": {"risk_level": "low", "concerns": []}},
+                    "verdict": {"overall_risk_level": "low", "reasoning": "fine"},
+                },
+                {
+                    "resources": [],
+                    "overall_summary": "",
+                    "risk_assessment": {"drift": {"risk_level": "high", "concerns": ["x"]}},
+                    "verdict": {"overall_risk_level": "high", "reasoning": "drift"},
+                },
+            ]
+        )
+        assert merged["risk_assessment"]["drift"]["risk_level"] == "high"
+        assert merged["risk_assessment"]["drift"]["concerns"] == ["x"]
+        assert merged["verdict"]["reasoning"] == "drift"
@@ -0,0 +1,119 @@
+"""Tests for bicep_whatif_advisor.streaming module."""
+
+import json
+
+import pytest
+
+from bicep_whatif_advisor.providers import Provider, ProviderTimeoutError
+from bicep_whatif_advisor.streaming import ResourceStreamParser, stream_completion
+
+RESPONSE = {
+    "resources": [
+        {
+            "resource_name": "myStorage",
+            "resource_type": "Storage Account",
+            "action": "Create",
+            "summary": 'Creates storage with {braces} and "quotes" in text',
+        },
+        {
+            "resource_name": "myVnet",
+            "resource_type": "Virtual Network",
+            "action": "Modify",
+            "summary": "Adds a subnet",
+            "changes": [{"property": "subnets[0]", "nested": {"a": [1, 2]}}],
+        },
+    ],
+    "overall_summary": "1 create, 1 modify",
+}
+
+
+class ChunkedProvider(Provider):
+    """Streams a canned response in fixed-size chunks."""
+
+    def __init__(self, text, size=7):
+        self.text = text
+        self.size = size
+        self.idle_timeout = None
+
+    def complete(self, system_prompt, user_prompt, response_schema=None):
+        return self.text
+
+    def stream(self, system_prompt, user_prompt, idle_timeout=None, response_schema=None):
+        self.idle_timeout = idle_timeout
+        for i in range(0, len(self.text), self.size):
+            yield self.text[i : i + self.size]
+
+
+@pytest.mark.unit
+class TestResourceStreamParser:
+    @pytest.mark.parametrize("size", [1, 3, 16, 10_000])
+    def test_emits_each_resource_regardless_of_chunking(self, size):
+        text = json.dumps(RESPONSE, indent=2)
+        parser = ResourceStreamParser()
+        emitted = []
+        for i in range(0, len(text), size):
+            emitted.extend(parser.feed(text[i : i + size]))
+
+        assert emitted == RESPONSE["resources"]
+        assert parser.resources == RESPONSE["resources"]
+        assert parser.text == text
+
+    def test_resource_emitted_as_soon_as_it_closes(self):
+        text = json.dumps(RESPONSE)
+        first_end = text.index(', {"resource_name": "myVnet"')
+        parser = ResourceStreamParser()
+
+        assert parser.feed(text[: first_end - 1]) == []
+        assert parser.feed(text[first_end - 1 : first_end]) == [RESPONSE["resources"][0]]
+
+    def test_ignores_code_fence_and_other_arrays(self):
+        text = (
+            "```json\n"
+            '{"risk_assessment": {"drift": {"concerns": [{"x": 1}]}},'
+            ' "resources": [{"resource_name": "a"}], "notes": [{"resource_name": "b"}]}\n'
+            "```"
+        )
+        parser = ResourceStreamParser()
+        assert parser.feed(text) == [{"resource_name": "a"}]
+
+    def test_key_named_resources_inside_string_ignored(self):
+        text = '{"overall_summary": "resources", "x": [{"a": 1}], "resources": [{"b": 2}]}'
+        assert ResourceStreamParser().feed(text) == [{"b": 2}]
+
+    def test_escaped_quotes_in_key(self):
+        text = '{"re\\"sources": [{"a": 1}], "resources": [{"b": 2}]}'
+        assert ResourceStreamParser().feed(text) == [{"b": 2}]
+
+
+@pytest.mark.unit
+class TestStreamCompletion:
+    def test_returns_full_text_and_reports_resources(self):
+        text = json.dumps(RESPONSE)
+        provider = ChunkedProvider(text)
+        seen = []
+
+        result = stream_completion(provider, "system", "user", seen.append, idle_timeout=12)
+
+        assert result == text
+        assert seen == RESPONSE["resources"]
+        assert provider.idle_timeout == 12
+
+    def test_provider_without_streaming_still_works(self):
+        from conftest import MockProvider
+
+        seen = []
+        result = stream_completion(MockProvider(RESPONSE), "system", "user", seen.append)
+        assert json.loads(result) == RESPONSE
+        assert seen == RESPONSE["resources"]
+
+    def test_stream_error_propagates(self):
+        class StallingProvider(ChunkedProvider):
+            def stream(self, system_prompt, user_prompt, idle_timeout=None, response_schema=None):
+                yield '{"resources": [{"a": 1}, {"b"'
+                raise ProviderTimeoutError("stalled")
+
+        seen = []
+        with pytest.raises(ProviderTimeoutError):
+            stream_completion(StallingProvider(""), "system", "user", seen.append)
+        # Rows completed before the stall were still shown
+        assert seen == [{"a": 1}]
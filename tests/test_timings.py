@@ -0,0 +1,114 @@
+"""Tests for bicep_whatif_advisor.timings module."""
+
+import json
+
+import pytest
+
+from bicep_whatif_advisor.providers import ProviderConnectionError
+from bicep_whatif_advisor.providers.retry import (
+    Failure,
+    RequestScheduler,
+    RetryPolicy,
+    call_with_retry,
+)
+from bicep_whatif_advisor.timings import (
+    NULL_RECORDER,
+    Recorder,
+    get_recorder,
+    report,
+    set_recorder,
+)
+
+
+@pytest.fixture
+def recorder():
+    recorder = Recorder()
+    set_recorder(recorder)
+    yield recorder
+    set_recorder(None)
+
+
+@pytest.mark.unit
+class TestRecorder:
+    def test_phases_are_laps_and_accumulate(self, mocker):
+        clock = mocker.patch("bicep_whatif_advisor.timings.time.perf_counter")
+        clock.side_effect = [0.0, 0.0, 1.0, 3.0, 3.5, 4.0]
+        recorder = Recorder()
+
+        recorder.phase("read")
+        recorder.phase("llm")
+        recorder.phase("read")
+        recorder.stop()
+
+        assert recorder.phases == {"read": 1.5, "llm": 2.0}
+        assert recorder.to_dict()["total_seconds"] == 4.0
+
+    def test_counters(self):
+        recorder = Recorder()
+        recorder.add("retries")
+        recorder.add("retries")
+        recorder.add("wait_seconds", 0.25)
+        recorder.set("input_tokens", 1200)
+
+        assert recorder.to_dict()["counters"] == {
+            "retries": 2,
+            "wait_seconds": 0.25,
+            "input_tokens": 1200,
+        }
+
+    def test_describe(self):
+        recorder = Recorder()
+        recorder.phase("llm")
+        recorder.set("input_tokens", 1200)
+
+        text = recorder.describe()
+        assert "⏱️ Timings" in text
+        assert "llm " in text
+        assert "input_tokens=1,200" in text
+
+    def test_null_recorder_records_nothing(self):
+        NULL_RECORDER.phase("llm")
+        NULL_RECORDER.add("retries")
+        NULL_RECORDER.set("input_tokens", 1)
+
+        assert get_recorder() is NULL_RECORDER
+        assert NULL_RECORDER.phases == {}
+        assert NULL_RECORDER.counters == {}
+
+
+@pytest.mark.unit
+class TestReport:
+    def test_writes_stats_json_and_deactivates(self, recorder, tmp_path, capsys):
+        recorder.phase("llm")
+        recorder.add("retries")
+        path = tmp_path / "stats.json"
+
+        report(recorder, True, str(path))
+
+        stats = json.loads(path.read_text())
+        assert set(stats["phases"]) == {"llm"}
+        assert stats["counters"] == {"retries": 1}
+        assert "⏱️ Timings" in capsys.readouterr().err
+        assert get_recorder() is NULL_RECORDER
+
+    def test_unwritable_path_warns(self, recorder, tmp_path, capsys):
+        report(recorder, False, str(tmp_path / "missing" / "stats.json"))
+        assert "Could not write stats file" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+class TestSchedulerCounters:
+    def test_requests_and_retries_are_counted(self, recorder, mocker):
+        mocker.patch("time.sleep")
+        scheduler = RequestScheduler("Test API", policy=RetryPolicy(max_attempts=3))
+        request = mocker.Mock(side_effect=[ConnectionError("down"), "ok"])
+
+        def classify(error):
+            return Failure(ProviderConnectionError("down"), retryable=True)
+
+        assert call_with_retry(scheduler, request, classify) == "ok"
+        counters = recorder.counters
+        assert counters["retries"] == 1
+        assert counters["provider_failures"] == 1
+        assert counters["provider_requests"] == 1
+        assert counters["provider_request_seconds"] >= 0
@@ -0,0 +1,150 @@
+"""Tests for bicep_whatif_advisor.tokens module."""
+
+import sys
+import types
+
+import pytest
+
+from bicep_whatif_advisor.tokens import (
+    _load_counter,
+    count_tokens,
+    estimate_output_tokens,
+    fit_section,
+    get_token_counter,
+    heuristic_token_count,
+    model_profile,
+    output_reserve,
+    prompt_budget,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_counter_cache():
+    _load_counter.cache_clear()
+    yield
+    _load_counter.cache_clear()
+
+
+@pytest.mark.unit
+class TestHeuristicTokenCount:
+    def test_empty(self):
+        assert heuristic_token_count("") == 0
+        assert count_tokens(None) == 0
+
+    def test_pieces(self):
+        # name, :, newline+indent, ", eastus, "
+        assert heuristic_token_count('name:\n      "eastus"') == 6
+        # Long words and numbers split into several tokens
+        assert heuristic_token_count("a" * 17) == 3
+        assert heuristic_token_count("2023") == 2
+
+    def test_close_to_a_bpe_ratio_on_whatif_text(self):
+        text = (
+            "  ~ Microsoft.Network/virtualNetworks/vnet-prod [2023-04-01]\n"
+            '      ~ properties.addressSpace.addressPrefixes[0]: "10.0.0.0/16" => "10.1.0.0/16"\n'
+        ) * 50
+        # BPE tokenizers average roughly 2.5-4 characters per token on this text
+        assert len(text) / 4 < heuristic_token_count(text) < len(text) / 2.5
+
+
+@pytest.mark.unit
+class TestTokenCounterSelection:
+    def test_heuristic_selected(self, monkeypatch):
+        monkeypatch.setenv("WHATIF_TOKENIZER", "heuristic")
+        assert get_token_counter() is heuristic_token_count
+
+    def test_custom_module_function(self, monkeypatch):
+        module = types.ModuleType("fake_tokenizer")
+        module.count = lambda text: len(text)
+        monkeypatch.setitem(sys.modules, "fake_tokenizer", module)
+        monkeypatch.setenv("WHATIF_TOKENIZER", "fake_tokenizer:count")
+
+        assert count_tokens("abcdef") == 6
+
+    def test_bad_custom_counter_falls_back(self, monkeypatch, capsys):
+        monkeypatch.setenv("WHATIF_TOKENIZER", "no_such_module_xyz:count")
+
+        assert get_token_counter() is heuristic_token_count
+        assert "using the heuristic token estimate" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+class TestModelProfile:
+    def test_known_model(self):
+        profile = model_profile("anthropic", "claude-sonnet-4-20250514")
+        assert profile.context_window == 200_000
+        assert profile.cost(1_000_000, 0) == pytest.approx(3.0)
+
+    def test_unknown_model_has_default_window_and_no_price(self):
+        profile = model_profile("azure-openai", "my-deployment")
+        assert profile.context_window == 128_000
+        assert profile.cost(1000, 1000) is None
+
+    def test_ollama_is_free(self):
+        assert model_profile("ollama", "llama3.1").cost(10_000, 1000) == 0.0
+
+    def test_context_window_override(self, monkeypatch):
+        monkeypatch.setenv("WHATIF_CONTEXT_WINDOW", "8192")
+        assert model_profile("ollama", "llama3.1").context_window == 8192
+
+    def test_invalid_override_ignored(self, monkeypatch, capsys):
+        monkeypatch.setenv("WHATIF_CONTEXT_WINDOW", "lots")
+        assert model_profile("anthropic", "claude-sonnet-4").context_window == 200_000
+        assert "Ignoring invalid WHATIF_CONTEXT_WINDOW" in capsys.readouterr().err
+
+    def test_ollama_window_capped_at_max_ctx(self, monkeypatch, capsys):
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+        monkeypatch.delenv("WHATIF_OLLAMA_MAX_CTX", raising=False)
+        assert model_profile("ollama", "llama3.1").context_window == 32_768
+
+        monkeypatch.setenv("WHATIF_OLLAMA_MAX_CTX", "131072")
+        assert model_profile("ollama", "llama3.1").context_window == 131_072
+
+        monkeypatch.setenv("WHATIF_OLLAMA_MAX_CTX", "big")
+        assert model_profile("ollama", "llama3.1").context_window == 32_768
+        assert "Ignoring invalid WHATIF_OLLAMA_MAX_CTX" in capsys.readouterr().err
+
+    def test_max_ctx_only_applies_to_ollama(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+        monkeypatch.setenv("WHATIF_OLLAMA_MAX_CTX", "8192")
+        assert model_profile("azure-openai", "gpt-4o").context_window == 128_000
+
+    def test_prompt_budget(self):
+        profile = model_profile("azure-openai", "gpt-4o")
+        # 95% of 128,000 minus the output reservation and fixed prompt
+        assert prompt_budget(profile, 16_384, 1_000) == 121_600 - 17_384
+
+    def test_output_reserve_capped_for_small_windows(self, monkeypatch):
+        monkeypatch.delenv("WHATIF_CONTEXT_WINDOW", raising=False)
+        profile = model_profile("azure-openai", "gpt-35-turbo")
+        # A quarter of the 16,385-token window, not the full 16,384
+        assert output_reserve(profile, 16_384) == 4_096
+        assert prompt_budget(profile, 16_384, 1_000) == 15_565 - 5_096
+        assert output_reserve(model_profile("azure-openai", "gpt-4o"), 16_384) == 16_384
+
+
+@pytest.mark.unit
+class TestFitSection:
+    DIFF = "diff --git a/one\n+a\n\ndiff --git a/two\n+b\n\ndiff --git a/three\n+c\n"
+
+    def test_fits_unchanged(self):
+        assert fit_section(self.DIFF, 10_000, "\ndiff --git ") == (self.DIFF, 0)
+
+    def test_keeps_whole_units(self):
+        kept, omitted = fit_section(self.DIFF, 45, "\ndiff --git ", count=len)
+        assert kept == "diff --git a/one\n+a\n\ndiff --git a/two\n+b\n"
+        assert omitted == 1
+
+    def test_nothing_fits(self):
+        assert fit_section(self.DIFF, 5, "\ndiff --git ", count=len) == ("", 3)
+
+    def test_none_passes_through(self):
+        assert fit_section(None, 0, "\n") == (None, 0)
+
+
+@pytest.mark.unit
+def test_estimate_output_tokens_grows_with_resources_and_buckets():
+    base = estimate_output_tokens(1)
+    assert estimate_output_tokens(10) > base
+    assert estimate_output_tokens(1, buckets=2) > base
+    assert estimate_output_tokens(1, verbose=True) > base
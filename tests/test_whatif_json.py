@@ -0,0 +1,187 @@
+"""Tests for bicep_whatif_advisor.whatif_json module."""
+
+import json
+
+import pytest
+
+from bicep_whatif_advisor.input import InputError
+from bicep_whatif_advisor.noise_filter import (
+    ParsedPattern,
+    filter_whatif_blocks,
+    filter_whatif_lines,
+)
+from bicep_whatif_advisor.whatif_json import (
+    _split_resource_id,
+    detect_json_input,
+    parse_whatif_json,
+)
+
+
+def _path(value):
+    return ParsedPattern(raw=f"path: {value}", pattern_type="path", value=value)
+
+
+@pytest.mark.unit
+class TestDetectJsonInput:
+    def test_json_object_detected_and_replayed(self):
+        lines = ["\n", '{"changes": []}\n']
+        replay, is_json = detect_json_input(iter(lines))
+        assert is_json is True
+        assert list(replay) == lines
+
+    def test_text_not_detected(self):
+        lines = ["Resource and property changes are indicated with these symbols:\n", "x\n"]
+        replay, is_json = detect_json_input(lines)
+        assert is_json is False
+        assert list(replay) == lines
+
+    def test_empty_input(self):
+        replay, is_json = detect_json_input([])
+        assert is_json is False
+        assert list(replay) == []
+
+
+@pytest.mark.unit
+class TestSplitResourceId:
+    def test_resource_group_resource(self):
+        scope, path = _split_resource_id(
+            "/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/app"
+        )
+        assert scope == "/subscriptions/s/resourceGroups/rg"
+        assert path == "Microsoft.Web/sites/app"
+
+    def test_extension_resource_splits_at_last_provider(self):
+        _, path = _split_resource_id(
+            "/subscriptions/s/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/sa"
+            "/providers/Microsoft.Insights/diagnosticSettings/diag"
+        )
+        assert path == "Microsoft.Insights/diagnosticSettings/diag"
+
+    def test_resource_group_itself(self):
+        scope, path = _split_resource_id("/subscriptions/s/resourceGroups/rg")
+        assert scope == "/subscriptions/s"
+        assert path == "Microsoft.Resources/resourceGroups/rg"
+
+
+@pytest.mark.unit
+class TestParseWhatifJson:
+    def test_blocks_match_text_model(self, whatif_json_fixture):
+        source = parse_whatif_json(whatif_json_fixture)
+        blocks = list(source)
+        assert [b.operation for b in blocks] == ["Create", "Modify", "Modify", "NoChange"]
+        assert blocks[0].header_line == (
+            "  + Microsoft.Storage/storageAccounts/stdemo001 [2023-01-01]\n"
+        )
+        assert blocks[1].resource_type == "Microsoft.Network/virtualNetworks/vnet-demo"
+        assert source.preamble[0] == (
+            "Scope: /subscriptions/00000000-0000-0000-0000-000000000001/resourceGroups/rg-demo\n"
+        )
+        assert source.epilogue[-1] == "Resource changes: 1 to create, 2 to modify, 1 no change.\n"
+
+    def test_create_renders_flattened_attributes(self, whatif_json_fixture):
+        create = list(parse_whatif_json(whatif_json_fixture))[0]
+        assert '      properties.minimumTlsVersion: "TLS1_2"\n' in create.lines
+        assert '      sku.name: "Standard_LRS"\n' in create.lines
+        assert create.property_change_indices == []
+
+    def test_delta_paths_are_full_paths(self, whatif_json_fixture):
+        vnet = list(parse_whatif_json(whatif_json_fixture))[1]
+        paths = [vnet.property_paths[i] for i in vnet.property_change_indices]
+        assert paths == [
+            "properties.provisioningState",
+            "properties.subnets[0].properties.privateEndpointNetworkPolicies",
+        ]
+        lines = [vnet.lines[i] for i in vnet.property_change_indices]
+        assert lines[0] == '      - properties.provisioningState: "Succeeded"\n'
+        assert lines[1].endswith(': "Enabled" => "Disabled"\n')
+
+    def test_bare_list_and_rest_shape_accepted(self):
+        change = {
+            "changeType": "Delete",
+            "resourceId": "/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/a",
+            "before": {"name": "a"},
+        }
+        assert len(list(parse_whatif_json(json.dumps([change])))) == 1
+        rest = {"status": "Succeeded", "properties": {"changes": [change]}}
+        assert len(list(parse_whatif_json(json.dumps(rest)))) == 1
+
+    def test_invalid_json_raises_input_error(self):
+        with pytest.raises(InputError, match="Invalid What-If JSON"):
+            parse_whatif_json("{not json")
+
+    def test_missing_changes_raises_input_error(self):
+        with pytest.raises(InputError, match="'changes' list"):
+            parse_whatif_json('{"status": "Succeeded"}')
+
+    def test_failed_operation_raises_input_error(self):
+        content = json.dumps(
+            {"status": "Failed", "error": {"code": "InvalidTemplate", "message": "bad"}}
+        )
+        with pytest.raises(InputError, match="InvalidTemplate: bad"):
+            parse_whatif_json(content)
+
+    def test_rendered_text_lexes_to_same_operations(self):
+        sites = "/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites"
+        changes = [
+            {
+                "changeType": change_type,
+                "resourceId": f"{sites}/app{i}",
+                "unsupportedReason": "Nested template",
+            }
+            for i, change_type in enumerate(["Create", "Unsupported", "Ignore"])
+        ]
+        source = parse_whatif_json(json.dumps(changes))
+
+        relexed = filter_whatif_lines(source.to_text().splitlines(keepends=True), [])
+
+        assert (
+            [r["operation"] for r in relexed.kept_resources]
+            == [b.operation for b in source]
+            == ["Create", "Unsupported", "Ignore"]
+        )
+
+    def test_to_text_is_reiterable(self, whatif_json_fixture):
+        source = parse_whatif_json(whatif_json_fixture)
+        assert source.to_text() == source.to_text()
+        assert "~ Microsoft.Network/virtualNetworks/vnet-demo" in source.to_text()
+
+
+@pytest.mark.unit
+class TestFilterJsonSource:
+    def test_path_pattern_matches_exact_nested_path(self, whatif_json_fixture):
+        source = parse_whatif_json(whatif_json_fixture)
+        result = filter_whatif_blocks(
+            source, [_path("properties.subnets[*].properties.privateEndpointNetworkPolicies")]
+        )
+        assert result.lines_removed == 1
+        assert "privateEndpointNetworkPolicies" not in result.text
+        assert "properties.provisioningState" in result.text
+
+    def test_path_pattern_does_not_match_prefix(self, whatif_json_fixture):
+        source = parse_whatif_json(whatif_json_fixture)
+        result = filter_whatif_blocks(source, [_path("properties.subnets")])
+        assert result.lines_removed == 0
+
+    def test_hollow_modify_block_removed(self, whatif_json_fixture):
+        source = parse_whatif_json(whatif_json_fixture)
+        result = filter_whatif_blocks(source, [_path("properties.etag")])
+        assert result.blocks_removed == 1
+        assert result.removed_resources == [
+            {
+                "resource_type": "Microsoft.Network/networkSecurityGroups",
+                "resource_name": "nsg-demo",
+                "operation": "Modify",
+            }
+        ]
+        assert "nsg-demo" not in result.text
+
+    def test_resource_pattern_removes_block(self, whatif_json_fixture):
+        source = parse_whatif_json(whatif_json_fixture)
+        pattern = ParsedPattern(
+            raw="resource: Microsoft.Web/serverfarms",
+            pattern_type="resource",
+            value="Microsoft.Web/serverfarms",
+        )
+        result = filter_whatif_blocks(source, [pattern])
+        assert result.blocks_removed == 1
+        assert "plan-demo" not in result.text